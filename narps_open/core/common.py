@@ -78,6 +78,21 @@ def clean_list(input_list: list, element = None) -> list:
     """
     return [f for f in input_list if f != element]
 
+def elements_containing(input_list: list, element: str) -> list:
+    """
+    Return the elements of input_list that contain element, as a list.
+    This function is meant to be used in a Nipype Function Node. It can be used inside a
+    nipype.Workflow.connect call as well.
+
+    Parameters:
+    - input_list: list of str
+    - element: str, element to be searched in the elements of input_list
+
+    Returns:
+    - list, the elements of input_list containing element
+    """
+    return [e for e in input_list if element in e]
+
 def list_intersection(list_1: list, list_2: list) -> list:
     """
     Returns the intersection of two lists.
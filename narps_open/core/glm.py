@@ -0,0 +1,501 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" An in-process first level GLM estimator, as a fast alternative to the first level
+    interfaces of SPM and FSL for pipelines using fMRIPrep outputs
+"""
+
+from os import remove
+
+from numpy import (
+    ndarray, memmap, array, arange, zeros, ones, eye, cos, pi, sqrt, log, ceil, floor,
+    convolve, column_stack, clip, round as np_round, unique, sum as np_sum,
+    float32, float64
+    )
+from numpy.linalg import qr, pinv, matrix_rank
+from scipy.linalg import solve_triangular
+from scipy.ndimage import gaussian_filter
+from scipy.stats import gamma
+from pandas import DataFrame, concat
+from nibabel import load
+
+from narps_open.utils.compression import get_decompressed_file_cache
+
+# Ratio between the FWHM and the standard deviation of a gaussian kernel
+FWHM_TO_SIGMA = 1.0 / sqrt(8.0 * log(2.0))
+
+def get_hrf(tr: float, oversampling: int = 16, time_length: float = 32.0) -> ndarray:
+    """ Return the canonical hemodynamic response function of SPM (difference of two
+        gamma functions peaking at 6 s and 16 s), sampled every tr / oversampling seconds,
+        and normalized so that its sum is 1.
+    """
+    times = arange(0, int(ceil(time_length * oversampling / tr)) + 1) * tr / oversampling
+    hrf = gamma.pdf(times, 6.0) - gamma.pdf(times, 16.0) / 6.0
+    return hrf / hrf.sum()
+
+def orthogonalize(matrix: ndarray) -> ndarray:
+    """ Return a copy of matrix whose columns are serially orthogonalized: each column
+        is orthogonalized with respect to the previous ones, as SPM does for
+        parametric modulations.
+    """
+    matrix = array(matrix, dtype = float64)
+    for column in range(1, matrix.shape[1]):
+        previous = matrix[:, :column]
+        matrix[:, column] -= previous @ (pinv(previous) @ matrix[:, column])
+    return matrix
+
+def get_condition_regressors(
+    onsets: ndarray, durations: ndarray, amplitudes: ndarray, tr: float, nb_scans: int,
+    oversampling: int = 16, microtime_onset: float = 0.5) -> ndarray:
+    """ Return regressors convolved with the canonical HRF, for a condition.
+
+        Arguments:
+        - onsets, numpy.ndarray: onsets of the events (in seconds)
+        - durations, numpy.ndarray: durations of the events (in seconds)
+        - amplitudes, numpy.ndarray: amplitudes of the events, of shape
+            (nb_events, nb_regressors) ; a block of amplitude 1 reaches a plateau of 1
+        - tr, float: repetition time (in seconds)
+        - nb_scans, int: number of scans of the run
+        - oversampling, int: number of time bins per scan used to build the regressors
+        - microtime_onset, float: time at which the regressors are sampled in each scan,
+            as a fraction of tr
+
+        Returns:
+        - numpy.ndarray of shape (nb_scans, nb_regressors)
+    """
+    time_step = tr / oversampling
+    nb_bins = nb_scans * oversampling
+    stimuli = zeros((nb_bins, amplitudes.shape[1]))
+    for onset, duration, amplitude in zip(onsets, durations, amplitudes):
+        start = int(np_round(onset / time_step))
+        stop = start + max(1, int(np_round(duration / time_step)))
+        stimuli[max(start, 0):max(min(stop, nb_bins), 0)] += amplitude
+
+    hrf = get_hrf(tr, oversampling)
+    sample_bins = arange(nb_scans) * oversampling + int(floor(microtime_onset * oversampling))
+    return column_stack([
+        convolve(stimuli[:, c], hrf)[:nb_bins][sample_bins]
+        for c in range(stimuli.shape[1])])
+
+def get_drift_regressors(nb_scans: int, tr: float, high_pass_filter_cutoff: float) -> ndarray:
+    """ Return the discrete cosine basis modelling low frequency drifts below
+        1 / high_pass_filter_cutoff Hz, as the high-pass filter of SPM
+        (without the constant term).
+    """
+    if high_pass_filter_cutoff is None or high_pass_filter_cutoff <= 0:
+        return zeros((nb_scans, 0))
+
+    nb_regressors = int(2 * (nb_scans * tr) / high_pass_filter_cutoff + 1)
+    times = arange(nb_scans)
+    return column_stack([
+        sqrt(2.0 / nb_scans) * cos(pi * (2 * times + 1) * order / (2 * nb_scans))
+        for order in range(1, nb_regressors)]) if nb_regressors > 1 \
+        else zeros((nb_scans, 0))
+
+def get_design_matrix(
+    subject_info, tr: float, nb_scans: int, confounds: ndarray = None,
+    high_pass_filter_cutoff: float = 128.0, orthogonalize_modulations: bool = True,
+    oversampling: int = 16, microtime_onset: float = 0.5) -> DataFrame:
+    """ Return the design matrix of a run.
+
+        Arguments:
+        - subject_info, Bunch: the model of the run, as created by
+            narps_open.data.events.create_bunch (conditions, onsets, durations,
+            amplitudes, pmod, regressor_names, regressors)
+        - tr, float: repetition time (in seconds)
+        - nb_scans, int: number of scans of the run
+        - confounds, numpy.ndarray: additional regressors, of shape (nb_scans, nb_confounds)
+        - high_pass_filter_cutoff, float: cutoff of the high-pass filter (in seconds),
+            modelled with cosine regressors (None or 0 for no filter)
+        - orthogonalize_modulations, bool: if True, parametric modulations are serially
+            orthogonalized with respect to the main effect of their condition (as in SPM),
+            otherwise they are only demeaned
+        - oversampling, microtime_onset: see get_condition_regressors
+
+        Returns:
+        - pandas.DataFrame of shape (nb_scans, nb_regressors), with columns named as in SPM
+            for task regressors (e.g.: 'trial', 'trialxgain^1'), then the additional
+            regressors ('R1', ... unless named in subject_info), the drift regressors
+            ('drift_1', ...) and 'constant'.
+    """
+    columns = {}
+    amplitudes_list = getattr(subject_info, 'amplitudes', None)
+    modulations_list = getattr(subject_info, 'pmod', None)
+    for index, condition in enumerate(subject_info.conditions):
+        onsets = array(subject_info.onsets[index], dtype = float64)
+        durations = array(subject_info.durations[index], dtype = float64)
+        if durations.size == 1 and onsets.size > 1:
+            durations = durations.repeat(onsets.size)
+
+        names = [condition]
+        amplitudes = [ones(onsets.size) if not amplitudes_list \
+            else array(amplitudes_list[index], dtype = float64)]
+        modulations = modulations_list[index] if modulations_list else None
+        if modulations is not None:
+            for name, poly, param in zip(modulations.name, modulations.poly, modulations.param):
+                for order in range(1, poly + 1):
+                    names.append(f'{condition}x{name}^{order}')
+                    values = array(param, dtype = float64) ** order
+                    amplitudes.append(values - values.mean())
+
+        amplitudes = column_stack(amplitudes) if onsets.size > 0 \
+            else zeros((0, len(names)))
+        if orthogonalize_modulations and onsets.size > 0:
+            amplitudes = orthogonalize(amplitudes)
+        regressors = get_condition_regressors(
+            onsets, durations, amplitudes, tr, nb_scans, oversampling, microtime_onset)
+        for name, regressor in zip(names, regressors.T):
+            columns[name] = regressor
+
+    other_regressors = []
+    if getattr(subject_info, 'regressors', None):
+        names = subject_info.regressor_names or [
+            f'R{i + 1}' for i in range(len(subject_info.regressors))]
+        other_regressors += list(zip(names, subject_info.regressors))
+    if confounds is not None:
+        confounds = array(confounds, dtype = float64).reshape(nb_scans, -1)
+        other_regressors += [
+            (f'R{len(other_regressors) + i + 1}', c) for i, c in enumerate(confounds.T)]
+    for name, regressor in other_regressors:
+        columns[name] = array(regressor, dtype = float64)
+
+    for index, regressor in enumerate(
+        get_drift_regressors(nb_scans, tr, high_pass_filter_cutoff).T):
+        columns[f'drift_{index + 1}'] = regressor
+    columns['constant'] = ones(nb_scans)
+
+    return DataFrame(columns)
+
+def concatenate_designs(designs: list, shared_columns: list = None) -> DataFrame:
+    """ Return the design matrix of several runs, concatenated in time.
+
+        Arguments:
+        - designs, list of pandas.DataFrame: the design matrices of the runs
+        - shared_columns, list of str: names of the columns estimated with a single
+            parameter for all runs (e.g.: task regressors when runs are concatenated) ;
+            other columns are modelled separately for each run, and renamed
+            '<name>_run<index>' (index starting at 1) when there are several runs
+
+        Returns:
+        - pandas.DataFrame
+    """
+    shared_columns = shared_columns if shared_columns is not None else []
+    if len(designs) == 1:
+        return designs[0].copy()
+
+    run_designs = []
+    for index, design in enumerate(designs):
+        run_designs.append(design.rename(columns = {
+            c: c if c in shared_columns else f'{c}_run{index + 1}' for c in design.columns}))
+
+    return concat(run_designs, axis = 0, ignore_index = True).fillna(0.0)
+
+def get_contrast_weights(contrasts: list, columns: list) -> ndarray:
+    """ Return the weights of t contrasts, as a matrix of shape (nb_contrasts, nb_columns).
+        The weight of a condition applies to the column named after it, and to the
+        columns of this condition for each run ('<condition>_run<index>'), as SPM does
+        with sessions.
+
+        Arguments:
+        - contrasts, list of tuples: (name, 'T', [condition names], [weights]), as for
+            nipype's EstimateContrast interface
+        - columns, list of str: the columns of the design matrix
+
+        Raises AttributeError for non-t contrasts and unknown conditions.
+    """
+    weights = zeros((len(contrasts), len(columns)))
+    for contrast_id, contrast in enumerate(contrasts):
+        if contrast[1] != 'T':
+            raise AttributeError(f'Only T contrasts are supported: {contrast[0]}')
+        for condition, weight in zip(contrast[2], contrast[3]):
+            matching_columns = [i for i, c in enumerate(columns)
+                if c == condition or c.rsplit('_run', 1)[0] == condition]
+            if not matching_columns:
+                raise AttributeError(f'Condition {condition} is not in the design matrix')
+            weights[contrast_id, matching_columns] = weight
+
+    return weights
+
+def fit_ols(data: ndarray, design: ndarray, contrasts: ndarray):
+    """ Fit a GLM with ordinary least squares, for all the voxels of data at once,
+        using a QR decomposition of the design (or its pseudo inverse when it is
+        rank deficient).
+
+        Arguments:
+        - data, numpy.ndarray: time series, of shape (nb_scans, nb_voxels)
+        - design, numpy.ndarray: design matrix, of shape (nb_scans, nb_regressors)
+        - contrasts, numpy.ndarray: contrast weights, of shape (nb_contrasts, nb_regressors)
+
+        Returns:
+        - effects, numpy.ndarray of shape (nb_contrasts, nb_voxels)
+        - variances of the effects, numpy.ndarray of shape (nb_contrasts, nb_voxels)
+        - residuals, numpy.ndarray of shape (nb_scans, nb_voxels)
+        - dof, int: the degrees of freedom of the residuals
+    """
+    rank = matrix_rank(design)
+    if rank == design.shape[1]:
+        q_matrix, r_matrix = qr(design)
+        betas = solve_triangular(r_matrix, q_matrix.T @ data)
+        inverse_r = solve_triangular(r_matrix, eye(r_matrix.shape[0]))
+        covariance = inverse_r @ inverse_r.T
+    else:
+        pseudo_inverse = pinv(design)
+        betas = pseudo_inverse @ data
+        covariance = pseudo_inverse @ pseudo_inverse.T
+
+    residuals = data - design @ betas
+    dof = design.shape[0] - rank
+    variance = np_sum(residuals ** 2, axis = 0) / dof
+    contrast_variances = np_sum((contrasts @ covariance) * contrasts, axis = 1)
+
+    return (contrasts @ betas, contrast_variances[:, None] * variance[None, :],
+        residuals, dof)
+
+def get_ar1_coefficients(residuals: ndarray, run_lengths: list) -> ndarray:
+    """ Return the lag-1 autocorrelation of residuals for each voxel, computed
+        within runs.
+    """
+    numerator = zeros(residuals.shape[1])
+    denominator = zeros(residuals.shape[1])
+    start = 0
+    for length in run_lengths:
+        run_residuals = residuals[start:start + length]
+        numerator += np_sum(run_residuals[1:] * run_residuals[:-1], axis = 0)
+        denominator += np_sum(run_residuals ** 2, axis = 0)
+        start += length
+
+    coefficients = zeros(residuals.shape[1])
+    valid = denominator > 0
+    coefficients[valid] = numerator[valid] / denominator[valid]
+    return coefficients
+
+def prewhiten(values: ndarray, coefficient: float, run_lengths: list) -> ndarray:
+    """ Return values (of shape (nb_scans, ...)) prewhitened with an AR(1) model of
+        coefficient, within runs (Prais-Winsten transformation).
+    """
+    whitened = values.copy()
+    start = 0
+    for length in run_lengths:
+        run_values = values[start:start + length]
+        whitened[start] = sqrt(1.0 - coefficient ** 2) * run_values[0]
+        whitened[start + 1:start + length] = run_values[1:] - coefficient * run_values[:-1]
+        start += length
+    return whitened
+
+def fit_glm(
+    data: ndarray, design: ndarray, contrasts: ndarray, noise_model: str = 'ar1',
+    run_lengths: list = None, nb_ar1_bins: int = 100):
+    """ Fit a GLM for all the voxels of data at once, and estimate contrasts.
+
+        With the 'ar1' noise model, the AR(1) coefficient of each voxel is estimated from
+        the residuals of an OLS fit, and rounded to 1 / nb_ar1_bins ; voxels sharing the
+        same coefficient are prewhitened and fitted together.
+
+        Arguments:
+        - data, numpy.ndarray: time series, of shape (nb_scans, nb_voxels)
+        - design, numpy.ndarray: design matrix, of shape (nb_scans, nb_regressors)
+        - contrasts, numpy.ndarray: contrast weights, of shape (nb_contrasts, nb_regressors)
+        - noise_model, str: 'ols' or 'ar1'
+        - run_lengths, list of int: number of scans of each run, if runs are concatenated
+        - nb_ar1_bins, int: number of bins of AR(1) coefficients between 0 and 1
+
+        Returns:
+        - effects, numpy.ndarray of shape (nb_contrasts, nb_voxels)
+        - variances of the effects, numpy.ndarray of shape (nb_contrasts, nb_voxels)
+        - dof, int: the degrees of freedom of the residuals
+
+        Raises AttributeError for unknown noise models.
+    """
+    if noise_model not in ['ols', 'ar1']:
+        raise AttributeError(f'Unknown noise model: {noise_model}')
+    run_lengths = run_lengths if run_lengths is not None else [data.shape[0]]
+
+    effects, variances, residuals, dof = fit_ols(data, design, contrasts)
+    if noise_model == 'ols' or data.shape[1] == 0:
+        return effects, variances, dof
+
+    coefficients = clip(
+        np_round(get_ar1_coefficients(residuals, run_lengths) * nb_ar1_bins) / nb_ar1_bins,
+        -0.99, 0.99)
+    for coefficient in unique(coefficients):
+        voxels = coefficients == coefficient
+        effects[:, voxels], variances[:, voxels], _, dof = fit_ols(
+            prewhiten(data[:, voxels], coefficient, run_lengths),
+            prewhiten(design, coefficient, run_lengths),
+            contrasts)
+
+    return effects, variances, dof
+
+def read_time_series(func_files: list, out_file: str, fwhm: float = 0.0) -> memmap:
+    """ Return the time series of runs, concatenated in time, as an array of shape
+        (x, y, z, nb_scans) memory-mapped from out_file, so that slabs of slices can then
+        be read without reading the runs again. Each run is decompressed once (through the
+        cache of decompressed files shared by the pipelines), and each volume is read and
+        smoothed with a gaussian kernel of fwhm mm once.
+
+        Arguments:
+        - func_files, list of str: paths to the 4D images of the runs
+        - out_file, str: path to the file storing the (smoothed) time series, as float32
+        - fwhm, float: full width at half maximum of the smoothing kernel, in mm
+    """
+    images = [load(f) for f in func_files]
+    shape = images[0].shape[:3] + (sum(i.shape[3] for i in images),)
+    time_series = memmap(out_file, dtype = float32, mode = 'w+', shape = shape, order = 'F')
+
+    scan = 0
+    for func_file, image in zip(func_files, images):
+        # Read compressed runs from a link to their decompressed file
+        link_file = None
+        if func_file.endswith('.gz'):
+            link_file = get_decompressed_file_cache().link(
+                func_file, f'{out_file}.{scan}.nii')
+            image = load(link_file)
+
+        sigmas = fwhm * FWHM_TO_SIGMA / array(image.header.get_zooms()[:3], dtype = float64)
+        for volume in range(image.shape[3]):
+            values = array(image.dataobj[..., volume], dtype = float64)
+            if fwhm > 0:
+                values = gaussian_filter(values, sigmas, mode = 'constant', truncate = 4.0)
+            time_series[..., scan + volume] = values
+        scan += image.shape[3]
+
+        del image
+        if link_file is not None:
+            remove(link_file)
+
+    time_series.flush()
+    return time_series
+
+def first_level_glm(
+    func_files: list, subject_info: list, contrasts: list, tr: float,
+    confounds_files: list = None, mask_file: str = None, fwhm: float = 0.0,
+    high_pass_filter_cutoff: float = 128.0, noise_model: str = 'ar1',
+    concatenate_runs: bool = False, output_format: str = 'spm', chunk_size: int = 8):
+    """
+    Estimate a first level GLM and its t contrasts, in-process: time series are read
+    (and smoothed) once into a memory-mapped file of the working directory, then all
+    the voxels of a slab of slices are fitted at once. Runs are modelled together,
+    as SPM does with several sessions.
+
+    This function is meant to be used in a Nipype Function Node, as a fast path replacing
+    the first level interfaces of SPM (Level1Design, EstimateModel, EstimateContrast)
+    or FSL (Level1Design, FEATModel, FILMGLS).
+
+    Arguments:
+        func_files: list of str, paths to the 4D images of the runs
+        subject_info: list of Bunch, the models of the runs
+            (see narps_open.data.events.create_bunch)
+        contrasts: list of tuples, t contrasts as for nipype's EstimateContrast
+            (name, 'T', [condition names], [weights])
+        tr: float, repetition time (in seconds)
+        confounds_files: list of str, paths to tsv files without header containing
+            additional regressors for each run (e.g.: realignment parameters)
+        mask_file: str, path to a mask of the voxels to estimate (defaults to the voxels
+            whose time series are not constant)
+        fwhm: float, full width at half maximum of the smoothing kernel in mm (0 for
+            no smoothing)
+        high_pass_filter_cutoff: float, cutoff of the high-pass filter (in seconds)
+        noise_model: str, 'ols' or 'ar1' (see fit_glm)
+        concatenate_runs: bool, if True, task regressors are shared by all runs,
+            otherwise they are estimated for each run and contrasts apply to all runs
+        output_format: str, 'spm' to write con_0001.nii, varcon_0001.nii, spmT_0001.nii
+            (NaN outside the estimated voxels), or 'fsl' to write cope1.nii.gz,
+            varcope1.nii.gz, tstat1.nii.gz (0 outside the estimated voxels)
+        chunk_size: int, number of slices fitted at once
+
+    Returns:
+        con_images: list of str, paths to the contrast maps
+        var_images: list of str, paths to the variance maps of the contrasts
+        t_images: list of str, paths to the t statistic maps
+        dof: int, degrees of freedom of the residuals
+    """
+    # These imports must stay inside the function, as required by Nipype
+    from os import remove
+    from os.path import abspath
+    from numpy import (
+        array, full, loadtxt, asanyarray, sqrt, divide, isnan, float32, float64, nan, ptp
+        )
+    from nibabel import load, Nifti1Image
+
+    from narps_open.core.glm import (
+        get_design_matrix, concatenate_designs, get_contrast_weights, fit_glm,
+        read_time_series
+        )
+
+    if output_format not in ['spm', 'fsl']:
+        raise AttributeError(f'Unknown output format: {output_format}')
+    if not isinstance(func_files, list):
+        func_files = [func_files]
+    if not isinstance(subject_info, list):
+        subject_info = [subject_info]
+    if confounds_files is not None and not isinstance(confounds_files, list):
+        confounds_files = [confounds_files]
+
+    # Build the design matrix
+    reference_image = load(func_files[0])
+    run_lengths = [load(f).shape[3] for f in func_files]
+    designs = [get_design_matrix(
+        info, tr, length,
+        loadtxt(confounds_files[run_id], ndmin = 2) if confounds_files else None,
+        high_pass_filter_cutoff)
+        for run_id, (info, length) in enumerate(zip(subject_info, run_lengths))]
+    task_columns = [c for c in designs[0].columns
+        if any(c == n or c.startswith(f'{n}x') for n in subject_info[0].conditions)]
+    design = concatenate_designs(designs, task_columns if concatenate_runs else [])
+    weights = get_contrast_weights(contrasts, list(design.columns))
+    design = design.to_numpy()
+
+    # Read the time series once, then estimate the model by slabs of slices
+    mask = asanyarray(load(mask_file).dataobj) > 0 if mask_file is not None else None
+    shape = reference_image.shape[:3]
+    effects = full((len(contrasts),) + shape, nan)
+    variances = full((len(contrasts),) + shape, nan)
+    dof = design.shape[0] - 1
+    time_series_file = abspath('time_series.dat')
+    time_series = read_time_series(func_files, time_series_file, fwhm)
+    try:
+        for start in range(0, shape[2], chunk_size):
+            slices = slice(start, min(start + chunk_size, shape[2]))
+            slab = array(time_series[:, :, slices, :], dtype = float64)
+            slab_mask = ptp(slab, axis = 3) > 0
+            if mask is not None:
+                slab_mask &= mask[:, :, slices]
+            if not slab_mask.any():
+                continue
+
+            slab_effects, slab_variances, dof = fit_glm(
+                slab[slab_mask].T, design, weights, noise_model, run_lengths)
+            for contrast_id in range(len(contrasts)):
+                effects[contrast_id][:, :, slices][slab_mask] = slab_effects[contrast_id]
+                variances[contrast_id][:, :, slices][slab_mask] = slab_variances[contrast_id]
+    finally:
+        del time_series
+        remove(time_series_file)
+
+    t_values = divide(effects, sqrt(variances),
+        out = full(effects.shape, nan), where = variances > 0)
+
+    # Write outputs
+    def write_map(values, file_name: str) -> str:
+        values = array(values, dtype = float32)
+        if output_format == 'fsl':
+            values[isnan(values)] = 0.0
+        image = Nifti1Image(values, reference_image.affine)
+        image.set_data_dtype(float32)
+        out_file = abspath(file_name)
+        image.to_filename(out_file)
+        return out_file
+
+    con_images, var_images, t_images = [], [], []
+    for contrast_id in range(len(contrasts)):
+        if output_format == 'spm':
+            index = str(contrast_id + 1).zfill(4)
+            names = [f'con_{index}.nii', f'varcon_{index}.nii', f'spmT_{index}.nii']
+        else:
+            names = [f'cope{contrast_id + 1}.nii.gz', f'varcope{contrast_id + 1}.nii.gz',
+                f'tstat{contrast_id + 1}.nii.gz']
+        con_images.append(write_map(effects[contrast_id], names[0]))
+        var_images.append(write_map(variances[contrast_id], names[1]))
+        t_images.append(write_map(t_values[contrast_id], names[2]))
+
+    return con_images, var_images, t_images, dof
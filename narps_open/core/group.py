@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" An in-process group level estimator running the one sample and two sample t-tests
+    of the NARPS group analyses (equalRange, equalIndifference, groupComp) from a single
+    read of the subject level contrast maps
+"""
+
+from re import search
+
+from numpy import (
+    ndarray, array, asanyarray, empty, zeros, full, prod, sqrt, sign, abs as np_abs,
+    isfinite, isnan, divide, float32, float64, nan
+    )
+from numpy.linalg import pinv, matrix_rank
+from scipy.special import ndtri_exp
+from scipy.stats import t as t_distribution
+from nibabel import load
+
+# Group level analyses of NARPS, with the groups of participants they use
+GROUP_METHODS = {
+    'equalRange': ['equalRange'],
+    'equalIndifference': ['equalIndifference'],
+    'groupComp': ['equalRange', 'equalIndifference']
+    }
+
+def get_subject_id(file_name: str) -> str:
+    """ Return the subject id of a subject level file, found in its path as
+        '_subject_id_<id>' (nipype iterables) or 'sub-<id>'. Return None if not found.
+    """
+    match = search(r'(?:_subject_id_|sub-)([0-9a-zA-Z]+)', file_name)
+    return match.group(1) if match is not None else None
+
+def read_subject_maps(files: list) -> tuple:
+    """ Read subject maps (3D images in the same space) into a (subjects x voxels)
+        matrix. Images are memory-mapped when possible and read once, into a matrix
+        of all the voxels of the volume, from which the voxels defined for at least
+        one subject are then selected.
+
+        Arguments:
+        - files, list of str: paths to the maps
+
+        Returns:
+        - data, numpy.ndarray: matrix of shape (nb_subjects, nb_voxels) of float32 values,
+            NaN where a map is not defined (NaN, or 0 as SPM's implicit mask)
+        - mask, numpy.ndarray: 3D boolean mask of the voxels in data
+        - reference_image, nibabel image: the first map
+    """
+    reference_image = load(files[0])
+    shape = reference_image.shape[:3]
+    data = empty((len(files), prod(shape)), dtype = float32)
+    for row, file in enumerate(files):
+        values = asanyarray(load(file, mmap = True).dataobj)
+        if values.shape[:3] != shape or values.size != data.shape[1]:
+            raise AttributeError(f'{file} has a shape of {values.shape}, expected {shape}')
+        data[row] = values.reshape(-1)
+
+    data[~isfinite(data) | (data == 0)] = nan
+    mask = ~isnan(data).all(axis = 0)
+
+    return data[:, mask], mask.reshape(shape), reference_image
+
+def fit_group_model(data: ndarray, design: ndarray, contrasts: ndarray) -> tuple:
+    """ Fit an OLS model for all the voxels of data at once, and estimate t contrasts.
+        Voxels whose data is not defined (NaN) for all subjects are not estimated.
+
+        Arguments:
+        - data, numpy.ndarray: values of shape (nb_subjects, nb_voxels)
+        - design, numpy.ndarray: design matrix of shape (nb_subjects, nb_regressors)
+        - contrasts, numpy.ndarray: weights of shape (nb_contrasts, nb_regressors)
+
+        Returns:
+        - effects, numpy.ndarray of shape (nb_contrasts, nb_voxels)
+        - t_values, numpy.ndarray of shape (nb_contrasts, nb_voxels)
+        - z_values, numpy.ndarray of shape (nb_contrasts, nb_voxels)
+        - valid, numpy.ndarray: boolean mask of the estimated voxels
+        - dof, int: degrees of freedom of the residuals
+    """
+    data = array(data, dtype = float64)
+    valid = isfinite(data).all(axis = 0)
+    dof = design.shape[0] - matrix_rank(design)
+    effects = full((contrasts.shape[0], data.shape[1]), nan)
+    t_values = full(effects.shape, nan)
+    z_values = full(effects.shape, nan)
+    if dof <= 0 or not valid.any():
+        return effects, t_values, z_values, valid & False, dof
+
+    pseudo_inverse = pinv(design)
+    betas = pseudo_inverse @ data[:, valid]
+    residuals = data[:, valid] - design @ betas
+    variance = (residuals ** 2).sum(axis = 0) / dof
+    contrast_variances = ((contrasts @ pseudo_inverse) ** 2).sum(axis = 1)
+
+    effects[:, valid] = contrasts @ betas
+    standard_errors = sqrt(contrast_variances[:, None] * variance[None, :])
+    t_values[:, valid] = divide(effects[:, valid], standard_errors,
+        out = zeros(standard_errors.shape), where = standard_errors > 0)
+
+    # Z values with the same tail probability as t values (using log probabilities,
+    # so that large t values are not saturated)
+    z_values[:, valid] = -sign(t_values[:, valid]) * ndtri_exp(
+        t_distribution.logsf(np_abs(t_values[:, valid]), dof))
+
+    return effects, t_values, z_values, valid, dof
+
+def group_level_ttests(
+    contrast_files: list, subject_list: list, participants_file,
+    group_comparison_weights: list = None, output_format: str = 'spm'):
+    """
+    Run the one sample t-tests of the equalRange and equalIndifference groups, and the
+    two sample t-test comparing them (groupComp), from a single read of the subject
+    level contrast maps.
+
+    One sample t-tests estimate two contrasts (positive and negative effects),
+    the two sample t-test estimates the contrast of group_comparison_weights.
+    Files of each method are written in a sub-directory of the working directory
+    named after the method. A voxel is estimated for a method if its value is
+    defined (i.e.: neither NaN nor 0) for all the subjects used by the method.
+
+    This function is meant to be used in a Nipype Function Node, as a fast path
+    replacing SPM's OneSampleTTestDesign / TwoSampleTTestDesign, EstimateModel and
+    EstimateContrast, or FSL's MultipleRegressDesign and FLAMEO (OLS mode).
+
+    Arguments:
+        contrast_files: list of str, paths to the subject level contrast maps ;
+            subject ids are found in the paths (see get_subject_id)
+        subject_list: list of str, ids of the subjects to include
+        participants_file: str, path to the participants file of the dataset,
+            or dict, a serialized narps_open.data.participants.ParticipantsIndex
+        group_comparison_weights: list of float, weights of the equalRange and
+            equalIndifference groups in the groupComp contrast (defaults to [1, -1])
+        output_format: str, 'spm' to write con_0001.nii, spmT_0001.nii, spmZ_0001.nii
+            and mask.nii, or 'fsl' to write cope1.nii.gz, tstat1.nii.gz, zstat1.nii.gz
+            and mask.nii.gz
+
+    Returns:
+        equal_range_files: list of str, paths to the maps of the equalRange method
+        equal_indifference_files: list of str, paths to the maps of the
+            equalIndifference method
+        group_comp_files: list of str, paths to the maps of the groupComp method
+    """
+    # These imports must stay inside the function, as required by Nipype
+    from os import makedirs
+    from os.path import abspath, join
+    from numpy import array, ones, zeros, full, isnan, float32, uint8, nan
+    from nibabel import Nifti1Image
+
+    from narps_open.data.participants import ParticipantsIndex, get_participants_index
+    from narps_open.core.group import (
+        GROUP_METHODS, get_subject_id, read_subject_maps, fit_group_model
+        )
+
+    if output_format not in ['spm', 'fsl']:
+        raise AttributeError(f'Unknown output format: {output_format}')
+    group_comparison_weights = group_comparison_weights \
+        if group_comparison_weights is not None else [1, -1]
+
+    if isinstance(participants_file, dict):
+        participants = ParticipantsIndex.from_dict(participants_file)
+    else:
+        participants = get_participants_index(participants_file)
+
+    # Read the maps of the selected subjects, once
+    files = [f for f in contrast_files if get_subject_id(f) in subject_list]
+    subjects = [get_subject_id(f) for f in files]
+    data, mask, reference_image = read_subject_maps(files)
+    extension = '.nii' if output_format == 'spm' else '.nii.gz'
+
+    def write_map(values, file_name: str, dtype = float32, description: str = '') -> str:
+        volume = full(mask.shape, nan if output_format == 'spm' and dtype == float32 else 0,
+            dtype = dtype)
+        volume[mask] = values
+        if output_format == 'fsl':
+            volume[isnan(volume)] = 0
+        image = Nifti1Image(volume, reference_image.affine)
+        image.set_data_dtype(dtype)
+        image.header['descrip'] = description
+        image.to_filename(file_name)
+        return file_name
+
+    # Fit the models of the methods
+    output_files = []
+    for method, groups in GROUP_METHODS.items():
+        group_rows = [[i for i, s in enumerate(subjects) if s in participants.get_group(g)]
+            for g in groups]
+        rows = [r for g in group_rows for r in g]
+
+        if len(groups) == 1:
+            design = ones((len(rows), 1))
+            contrasts = array([[1.0], [-1.0]])
+        else:
+            design = zeros((len(rows), 2))
+            design[:len(group_rows[0]), 0] = 1
+            design[len(group_rows[0]):, 1] = 1
+            contrasts = array([group_comparison_weights], dtype = float32)
+
+        method_files = []
+        effects, t_values, z_values, valid, dof = fit_group_model(
+            data[rows], design, contrasts)
+        if valid.any():
+            directory = abspath(method)
+            makedirs(directory, exist_ok = True)
+            for contrast_id in range(contrasts.shape[0]):
+                if output_format == 'spm':
+                    index = str(contrast_id + 1).zfill(4)
+                    names = [f'con_{index}', f'spmT_{index}', f'spmZ_{index}']
+                else:
+                    names = [f'cope{contrast_id + 1}', f'tstat{contrast_id + 1}',
+                        f'zstat{contrast_id + 1}']
+                # Degrees of freedom are written in the description of t maps, as SPM does
+                for values, name, description in zip(
+                    [effects[contrast_id], t_values[contrast_id], z_values[contrast_id]],
+                    names, ['', f'SPM{{T_[{dof:.1f}]}}', '']):
+                    method_files.append(write_map(
+                        values, join(directory, name + extension), description = description))
+            method_files.append(write_map(valid, join(directory, 'mask' + extension), uint8))
+        output_files.append(method_files)
+
+    return tuple(output_files)
@@ -23,3 +23,207 @@ def get_voxel_dimensions(image: str) -> list:
         float(voxel_dimensions[1]),
         float(voxel_dimensions[2])
         ]
+
+def get_mask_weights(mask_file: str, target_file: str, mask_threshold: float = 0.0):
+    """
+    Return the weights of the voxels of a target image, according to a mask defined in
+    another space: the number of voxels of the mask (above mask_threshold) whose
+    nearest neighbour in the target image is this voxel. This is the mask resampled once
+    into the target space, so that computing a reduction of the target image in the mask
+    space (as resample_to_img(target, mask, interpolation = 'nearest') would do)
+    does not require resampling the target image.
+
+    Arguments:
+        mask_file: str, path to the mask image (3D)
+        target_file: str, path to the target image (3D or 4D)
+        mask_threshold: float, voxels of the mask strictly above this value are in the mask
+
+    Returns:
+        numpy.ndarray, the weights (of the shape of the 3 first dimensions of the target)
+        int, the number of voxels of the mask image
+    """
+    # These imports must stay inside the function, as required by Nipype
+    from nibabel import load
+    from numpy import (
+        allclose, array, asanyarray, argwhere, bincount, c_, floor, all as np_all,
+        ravel_multi_index, zeros
+        )
+    from numpy.linalg import inv
+
+    mask_image = load(mask_file)
+    target_image = load(target_file)
+    target_shape = target_image.shape[:3]
+    mask = asanyarray(mask_image.dataobj) > mask_threshold
+
+    # Same space: the mask is the weight map
+    if mask.shape == target_shape and allclose(mask_image.affine, target_image.affine):
+        return mask.astype('uint32'), mask.size
+
+    # Nearest voxels of the target, for each voxel of the mask. As with nilearn, points
+    # outside of the voxel centres of the target (e.g.: beyond the last one) are ignored
+    voxel_to_voxel = inv(target_image.affine) @ mask_image.affine
+    mask_voxels = argwhere(mask)
+    coordinates = (c_[mask_voxels, [1] * len(mask_voxels)] @ voxel_to_voxel.T)[:, :3]
+    nearest_voxels = floor(coordinates + 0.5).astype(int)
+    inside = np_all(
+        (coordinates >= 0) & (coordinates <= array(target_shape) - 1), axis = 1)
+
+    weights = zeros(target_shape, dtype = 'uint32')
+    if inside.any():
+        weights = bincount(
+            ravel_multi_index(nearest_voxels[inside].T, target_shape),
+            minlength = weights.size).astype('uint32').reshape(target_shape)
+
+    return weights, mask.size
+
+def get_masked_time_series(
+    in_file: str, mask_file: str, reduction: str = 'mean', mask_threshold: float = 0.0,
+    chunk_size: int = 16) -> list:
+    """
+    Compute a reduction of the values inside a mask, for each frame of a 4D image.
+    The mask is resampled once into the space of the image (see get_mask_weights), and
+    the 4D data is read chunk by chunk, so that the whole image is never loaded in memory.
+
+    Arguments:
+        in_file: str, path to the 4D image
+        mask_file: str, path to the mask (3D), possibly in another space than in_file
+        reduction: str, the reduction to compute, among:
+            - 'mean': mean of the values inside the mask
+            - 'sum': sum of the values inside the mask
+            - 'std': standard deviation of the values inside the mask
+            - 'min', 'max': minimum / maximum value inside the mask
+            - 'image_mean': mean of the image multiplied by the mask, over all the voxels
+                of the mask image (i.e.: np.mean(image * (mask > mask_threshold))
+                with the image resampled in the mask space)
+        mask_threshold: float, voxels of the mask strictly above this value are in the mask
+        chunk_size: int, number of frames read at once
+
+    Returns:
+        list of float, the values for each frame
+    """
+    # These imports must stay inside the function, as required by Nipype
+    from nibabel import load
+    from numpy import asanyarray, flatnonzero, float64, sqrt, nan
+
+    from narps_open.core.image import get_mask_weights
+
+    if reduction not in ['mean', 'sum', 'std', 'min', 'max', 'image_mean']:
+        raise AttributeError(f'Unknown reduction: {reduction}')
+
+    image = load(in_file)
+    weights, nb_mask_voxels = get_mask_weights(mask_file, in_file, mask_threshold)
+    weights = weights.reshape(-1)
+    indices = flatnonzero(weights)
+    weights = weights[indices].astype(float64)
+    total_weight = weights.sum()
+
+    values = []
+    for start in range(0, image.shape[3], chunk_size):
+        chunk = asanyarray(image.dataobj[..., start:start + chunk_size], dtype = float64)
+        chunk = chunk.reshape(-1, chunk.shape[-1])[indices]
+
+        if reduction in ['min', 'max']:
+            if len(indices) == 0:
+                values += [nan] * chunk.shape[-1]
+            else:
+                values += list(chunk.min(axis = 0) if reduction == 'min' \
+                    else chunk.max(axis = 0))
+            continue
+
+        sums = weights @ chunk
+        if reduction == 'sum':
+            values += list(sums)
+        elif reduction == 'image_mean':
+            values += list(sums / nb_mask_voxels)
+        elif total_weight == 0:
+            values += [nan] * chunk.shape[-1]
+        elif reduction == 'mean':
+            values += list(sums / total_weight)
+        else:
+            means = sums / total_weight
+            values += list(sqrt(weights @ (chunk - means) ** 2 / total_weight))
+
+    return [float(v) for v in values]
+
+def combine_masks(
+    masks: list, operation: str = 'intersection', min_count: int = 1,
+    mask_threshold: float = 0.0, suffix: str = '_combined') -> str:
+    """
+    Combine masks into one, and write it as a uint8 mask. Masks are read concurrently,
+    in their native data type, and accumulated as packed bits.
+
+    Arguments:
+        masks: list of str, paths to the masks (3D images of the same shape)
+        operation: str, the combination to compute, among:
+            - 'intersection': voxels that are in all the masks
+            - 'union': voxels that are in at least one mask
+            - 'count': voxels that are in at least min_count masks
+        min_count: int, the minimum number of masks a voxel must be in (for 'count' only)
+        mask_threshold: float, voxels of a mask strictly above this value are in the mask
+        suffix: str, the output file is named after the first mask, with this suffix
+
+    Returns:
+        str, path to the combined mask, written in the current directory
+    """
+    # These imports must stay inside the function, as required by Nipype
+    from os import cpu_count
+    from os.path import abspath, basename
+    from concurrent.futures import ThreadPoolExecutor
+
+    from nibabel import load
+    from numpy import (
+        asanyarray, packbits, unpackbits, zeros, uint8, uint16, bitwise_and, bitwise_or, prod
+        )
+
+    if operation not in ['intersection', 'union', 'count']:
+        raise AttributeError(f'Unknown mask operation: {operation}')
+
+    # Handle the case where masks is a single path (str)
+    if isinstance(masks, str):
+        masks = [masks]
+
+    first_image = load(masks[0])
+    shape = first_image.shape[:3]
+    nb_voxels = int(prod(shape))
+
+    def read_mask(mask_file: str):
+        """ Return a mask as packed bits """
+        image = load(mask_file)
+        if image.shape[:3] != shape or prod(image.shape) != nb_voxels:
+            raise AttributeError(f'Shape of {mask_file} differs from shape of {masks[0]}')
+        return packbits(asanyarray(image.dataobj).reshape(shape) > mask_threshold, axis = None)
+
+    # Masks are read (i.e.: mostly decompressed) in parallel, and accumulated in order
+    accumulator = None
+    if operation == 'count':
+        counts = zeros(nb_voxels, dtype = uint8 if len(masks) < 256 else uint16)
+    with ThreadPoolExecutor(max_workers = min(len(masks), cpu_count() or 1)) as executor:
+        for packed_mask in executor.map(read_mask, masks):
+            if operation == 'count':
+                counts += unpackbits(packed_mask, count = nb_voxels)
+            elif accumulator is None:
+                accumulator = packed_mask
+            elif operation == 'intersection':
+                bitwise_and(accumulator, packed_mask, out = accumulator)
+            else:
+                bitwise_or(accumulator, packed_mask, out = accumulator)
+
+    if operation == 'count':
+        combined_mask = (counts >= min_count).astype(uint8).reshape(shape)
+    else:
+        combined_mask = unpackbits(accumulator, count = nb_voxels).reshape(shape)
+
+    # Write the combined mask, with the header of the first mask
+    header = first_image.header.copy()
+    header.set_data_dtype(uint8)
+    header.set_slope_inter(1.0, 0.0)
+    out_image = first_image.__class__(combined_mask, first_image.affine, header)
+
+    stem = basename(masks[0])
+    for extension in ['.nii.gz', '.nii']:
+        if stem.endswith(extension):
+            stem = stem[:-len(extension)]
+    out_file = abspath(f'{stem}{suffix}.nii.gz')
+    out_image.to_filename(out_file)
+
+    return out_file
@@ -4,11 +4,32 @@
 """ Generate useful and recurrent interfaces to write pipelines """
 
 from abc import ABC, abstractmethod
+from os import sep
+from os.path import abspath, join
+from glob import glob
+from warnings import warn
 
+from nipype.algorithms.misc import Gzip, GzipInputSpec, Gunzip, GunzipInputSpec
+from nipype.interfaces.base import isdefined, traits, Directory, File
 from nipype.interfaces.base.core import Interface
+from nipype.interfaces.fsl import Randomise
+from nipype.interfaces.io import SelectFiles, SelectFilesInputSpec
 from nipype.interfaces.utility import Function
+from nipype.utils.filemanip import simplify_list
+from nipype.utils.misc import human_order_sorted
 
 from narps_open.core.common import remove_directory, remove_parent_directory, remove_file
+from narps_open.core.image import get_masked_time_series, combine_masks
+from narps_open.core.permutation import randomise
+from narps_open.core.glm import first_level_glm
+from narps_open.core.group import group_level_ttests
+from narps_open.core.thresholding import threshold_maps
+from narps_open.data.dataset import get_dataset_index
+from narps_open.data.participants import serialize_participants_index
+from narps_open.utils.configuration import Configuration
+from narps_open.utils.compression import (
+    DecompressedFileCache, get_decompressed_file_cache, compress_file, decompress_file
+    )
 
 class InterfaceCreator(ABC):
     """ An abstract class to shape what interface creators must provide """
@@ -53,6 +74,121 @@ class RemoveFileInterfaceCreator(InterfaceCreator):
             output_names = []
             )
 
+class MaskedTimeSeriesInterfaceCreator(InterfaceCreator):
+    """ An interface creator that provides an interface computing a reduction
+        (e.g.: the mean) of the values inside a mask, for each frame of a 4D image
+    """
+
+    @staticmethod
+    def create_interface() -> Function:
+        return Function(
+            function = get_masked_time_series,
+            input_names = ['in_file', 'mask_file', 'reduction', 'mask_threshold'],
+            output_names = ['values']
+            )
+
+class CombineMasksInterfaceCreator(InterfaceCreator):
+    """ An interface creator that provides an interface computing the intersection,
+        the union, or a minimum count of a list of masks
+    """
+
+    @staticmethod
+    def create_interface() -> Function:
+        return Function(
+            function = combine_masks,
+            input_names = ['masks', 'operation', 'min_count', 'mask_threshold', 'suffix'],
+            output_names = ['out_file']
+            )
+
+class RandomiseInterfaceCreator(InterfaceCreator):
+    """ An interface creator that provides an interface for permutation inference:
+        FSL's Randomise, or the narps_open.core.permutation engine with the same inputs
+        and outputs, depending on the pipelines.permutation_engine setting of the
+        configuration ('fsl' or 'native').
+        The native engine runs pipelines.permutation_nb_procs processes (its num_threads
+        input, hence the n_procs of its node) within pipelines.permutation_memory_gb.
+    """
+
+    @staticmethod
+    def create_interface() -> Interface:
+        configuration = Configuration()['pipelines']
+        engine = configuration.get('permutation_engine', 'fsl')
+        if engine == 'fsl':
+            return Randomise()
+        if engine == 'native':
+            interface = Function(
+                function = randomise,
+                input_names = [
+                    'in_file', 'mask', 'design_mat', 'tcon', 'base_name',
+                    'one_sample_group_mean', 'num_perm', 'seed', 'tfce', 'tfce_H', 'tfce_E',
+                    'tfce_C', 'vox_p_values', 'c_thresh', 'num_threads', 'memory_gb'],
+                output_names = ['tstat_files', 't_corrected_p_files', 't_p_files']
+                )
+            interface.inputs.num_threads = configuration.get('permutation_nb_procs', 1)
+            interface.inputs.memory_gb = configuration.get('permutation_memory_gb', 1.0)
+            return interface
+        raise AttributeError(f'Unknown permutation engine: {engine}')
+
+class FirstLevelGLMInterfaceCreator(InterfaceCreator):
+    """ An interface creator that provides an interface estimating a first level GLM
+        and its t contrasts in-process (see narps_open.core.glm)
+    """
+
+    @staticmethod
+    def create_interface() -> Function:
+        return Function(
+            function = first_level_glm,
+            input_names = [
+                'func_files', 'subject_info', 'contrasts', 'tr', 'confounds_files',
+                'mask_file', 'fwhm', 'high_pass_filter_cutoff', 'noise_model',
+                'concatenate_runs', 'output_format', 'chunk_size'],
+            output_names = ['con_images', 'var_images', 't_images', 'dof']
+            )
+
+class GroupLevelTTestsInterfaceCreator(InterfaceCreator):
+    """ An interface creator that provides an interface running the t-tests of the
+        equalRange, equalIndifference and groupComp group level analyses in-process
+        (see narps_open.core.group)
+    """
+
+    @staticmethod
+    def create_interface() -> Function:
+        return Function(
+            function = group_level_ttests,
+            input_names = [
+                'contrast_files', 'subject_list', 'participants_file',
+                'group_comparison_weights', 'output_format'],
+            output_names = [
+                'equalRange_files', 'equalIndifference_files', 'groupComp_files']
+            )
+
+class ThresholdMapsInterfaceCreator(InterfaceCreator):
+    """ An interface creator that provides an interface applying height and cluster
+        extent thresholds to statistic maps in-process (see narps_open.core.thresholding)
+    """
+
+    @staticmethod
+    def create_interface() -> Function:
+        return Function(
+            function = threshold_maps,
+            input_names = ['stat_files', 'thresholds', 'dof'],
+            output_names = ['thresholded_maps']
+            )
+
+class ParticipantsIndexInterfaceCreator(InterfaceCreator):
+    """ An interface creator that provides an interface parsing a participants file once,
+        and serializing its index (see narps_open.data.participants.ParticipantsIndex)
+        to be passed to group level nodes
+    """
+
+    @staticmethod
+    def create_interface() -> Function:
+        return Function(
+            function = serialize_participants_index,
+            input_names = ['participants_file'],
+            output_names = ['participants_index']
+            )
+
 class InterfaceFactory():
     """ A class to generate interfaces from narps_open.core functions """
 
@@ -60,7 +196,14 @@ class InterfaceFactory():
     creators = {
         'remove_directory' : RemoveDirectoryInterfaceCreator,
         'remove_parent_directory' : RemoveParentDirectoryInterfaceCreator,
-        'remove_file' : RemoveFileInterfaceCreator
+        'remove_file' : RemoveFileInterfaceCreator,
+        'get_masked_time_series' : MaskedTimeSeriesInterfaceCreator,
+        'combine_masks' : CombineMasksInterfaceCreator,
+        'randomise' : RandomiseInterfaceCreator,
+        'first_level_glm' : FirstLevelGLMInterfaceCreator,
+        'group_level_ttests' : GroupLevelTTestsInterfaceCreator,
+        'threshold_maps' : ThresholdMapsInterfaceCreator,
+        'participants_index' : ParticipantsIndexInterfaceCreator
     }
 
     @classmethod
@@ -72,3 +215,134 @@ class InterfaceFactory():
         # Actually create the interface, using a creator
         creator = cls.creators[creator_name]
         return creator.create_interface()
+
+class IndexedSelectFilesInputSpec(SelectFilesInputSpec):
+    """ Inputs of the IndexedSelectFiles interface """
+    dataset_dir = Directory(
+        desc = 'The indexed dataset (defaults to base_directory).')
+    index_file = File(
+        desc = 'The file storing the index of the dataset (defaults to a file in the cache).')
+
+class IndexedSelectFiles(SelectFiles):
+    """ A SelectFiles interface answering template lookups from a
+        narps_open.data.dataset.DatasetIndex instead of globbing the file system.
+        Templates that are not covered by the index (e.g.: anatomical files) are globbed
+        as SelectFiles does.
+    """
+
+    input_spec = IndexedSelectFilesInputSpec
+
+    def _glob(self, pattern: str) -> list:
+        """ Return the files matching pattern, using the dataset index when possible """
+        dataset_dir = self.inputs.dataset_dir if isdefined(self.inputs.dataset_dir) \
+            else self.inputs.base_directory
+        if isdefined(dataset_dir):
+            index_file = self.inputs.index_file if isdefined(self.inputs.index_file) else None
+            file_list = get_dataset_index(dataset_dir, index_file).glob(pattern)
+            if file_list is not None:
+                return file_list
+
+        return glob(pattern)
+
+    def _list_outputs(self):
+        """ Find the files and expose them as interface outputs """
+        outputs = {}
+        info = {k: v for k, v in self.inputs.__dict__.items() if k in self._infields}
+
+        force_lists = self.inputs.force_lists
+        if isinstance(force_lists, bool):
+            force_lists = self._outfields if force_lists else []
+        bad_fields = set(force_lists) - set(self._outfields)
+        if bad_fields:
+            raise ValueError(
+                f'Fields {", ".join(bad_fields)} set in force_lists and not in templates.')
+
+        for field, template in self._templates.items():
+            find_dirs = template[-1] == sep
+
+            # Build the full template path
+            if isdefined(self.inputs.base_directory):
+                template = abspath(join(self.inputs.base_directory, template))
+            else:
+                template = abspath(template)
+            if find_dirs:
+                template += sep
+
+            # Fill in the template and look for files
+            filled_template = template.format(**info)
+            file_list = self._glob(filled_template)
+
+            if not file_list:
+                message = f'No files were found matching {field} template: {filled_template}'
+                if self.inputs.raise_on_empty:
+                    raise IOError(message)
+                warn(message)
+
+            if self.inputs.sort_filelist:
+                file_list = human_order_sorted(file_list)
+            if field not in force_lists:
+                file_list = simplify_list(file_list)
+
+            outputs[field] = file_list
+
+        return outputs
+
+class CachedGunzipInputSpec(GunzipInputSpec):
+    """ Inputs of the CachedGunzip interface """
+    cache_directory = traits.Str(
+        desc = 'The directory of the cache (defaults to the shared cache of the pipelines).')
+    max_size = traits.Int(
+        desc = 'The maximum size of the cache in bytes (defaults to the configured one).')
+
+class CachedGunzip(Gunzip):
+    """ A Gunzip interface decompressing files through a
+        narps_open.utils.compression.DecompressedFileCache, shared by all pipelines.
+        The output file is a read-only hard link to the decompressed file in the cache:
+        it must not be modified, and removing it releases the entry of the cache.
+    """
+
+    input_spec = CachedGunzipInputSpec
+
+    def _run_interface(self, runtime):
+        if isdefined(self.inputs.cache_directory):
+            cache = DecompressedFileCache(self.inputs.cache_directory,
+                self.inputs.max_size if isdefined(self.inputs.max_size) else None)
+        else:
+            cache = get_decompressed_file_cache()
+
+        cache.link(self.inputs.in_file, self._gen_output_file_name())
+        return runtime
+
+class ParallelGzipInputSpec(GzipInputSpec):
+    """ Inputs of the ParallelGzip interface """
+    num_threads = traits.Int(1, usedefault = True,
+        desc = 'The number of compression threads (set by the n_procs of the node).')
+    compression_level = traits.Range(low = 1, high = 9, value = 6, usedefault = True,
+        desc = 'The compression level.')
+
+class ParallelGzip(Gzip):
+    """ A Gzip interface compressing with several threads, and decompressing while
+        reading and writing in separate threads
+        (see narps_open.utils.compression.compress_file and decompress_file).
+        Compressed files are standard gzip files.
+        Note that no pipeline compresses its outputs yet: only ParallelGunzip is used.
+    """
+
+    input_spec = ParallelGzipInputSpec
+
+    def _run_interface(self, runtime):
+        if self.inputs.mode == 'compress':
+            compress_file(self.inputs.in_file, self._gen_output_file_name(),
+                self.inputs.num_threads, self.inputs.compression_level)
+        else:
+            decompress_file(self.inputs.in_file, self._gen_output_file_name())
+        return runtime
+
+class ParallelGunzipInputSpec(ParallelGzipInputSpec):
+    """ Inputs of the ParallelGunzip interface """
+    mode = traits.Enum('decompress', usedefault = True, desc = 'decompress or compress')
+
+class ParallelGunzip(ParallelGzip):
+    """ A drop-in replacement for nipype's Gunzip interface, see ParallelGzip """
+
+    input_spec = ParallelGunzipInputSpec
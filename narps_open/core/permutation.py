@@ -0,0 +1,419 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" A permutation inference engine for group level analyses, as an in-process
+    alternative to FSL randomise
+"""
+
+from itertools import product
+
+from numpy import (
+    ndarray, array, arange, zeros, sqrt, einsum, bincount, maximum, where, concatenate,
+    searchsorted, sort, divide, float64, int64, all as np_all, isclose
+    )
+from numpy.linalg import pinv, matrix_rank
+from numpy.random import default_rng
+from scipy.ndimage import label, generate_binary_structure
+
+# Number of float64 arrays of shape (nb_permutations, nb_regressors, nb_voxels) and
+# (nb_permutations, nb_contrasts, nb_voxels) allocated at once by get_t_statistics
+# and run_permutations, for a block of permutations
+REGRESSOR_ARRAYS = 3
+CONTRAST_ARRAYS = 5
+
+def read_vest_file(vest_file: str) -> ndarray:
+    """ Return the matrix of a FSL VEST file (e.g.: design.mat, design.con),
+        as a 2D numpy.ndarray.
+    """
+    rows = []
+    with open(vest_file, 'r', encoding = 'utf-8') as file:
+        in_matrix = False
+        for line in file:
+            if line.startswith('/Matrix'):
+                in_matrix = True
+            elif in_matrix and line.strip():
+                rows.append([float(v) for v in line.split()])
+
+    return array(rows, dtype = float64)
+
+def is_one_sample_design(design: ndarray) -> bool:
+    """ Return True if the design is a single column of ones (one sample t-test),
+        in which case sign-flipping is used instead of label permutations.
+    """
+    return design.shape[1] == 1 and bool(np_all(isclose(design, 1.0)))
+
+def get_permutations(
+    nb_subjects: int, nb_permutations: int, sign_flipping: bool, seed: int = 0) -> ndarray:
+    """ Return the permutations to run, the first one being the identity.
+
+        Arguments:
+        - nb_subjects, int: number of subjects (rows of the design)
+        - nb_permutations, int: number of permutations to run ; if all the sign-flips
+            can be run within this number, they are all run (exhaustive permutations)
+        - sign_flipping, bool: True for sign-flips, False for label permutations
+        - seed, int: seed of the random number generator
+
+        Returns:
+        - numpy.ndarray of shape (nb_permutations, nb_subjects), containing signs (1 or -1)
+            for sign-flips, or indices of rows for label permutations
+    """
+    generator = default_rng(seed)
+
+    if sign_flipping:
+        if 2 ** nb_subjects <= nb_permutations:
+            return array(list(product([1, -1], repeat = nb_subjects)), dtype = float64)
+        permutations = generator.choice([1.0, -1.0], size = (nb_permutations, nb_subjects))
+        permutations[0] = 1.0
+        return permutations
+
+    permutations = zeros((nb_permutations, nb_subjects), dtype = int64)
+    permutations[0] = arange(nb_subjects)
+    for index in range(1, nb_permutations):
+        permutations[index] = generator.permutation(nb_subjects)
+    return permutations
+
+def get_t_statistics(
+    data: ndarray, design: ndarray, contrasts: ndarray, permutations: ndarray,
+    sign_flipping: bool) -> ndarray:
+    """ Return the t statistics of a block of permutations, fitting the GLM for all the
+        permutations at once. Permuting (or sign-flipping) the rows of the design does
+        not change X'X, so that only X'Y has to be computed for each permutation.
+
+        Arguments:
+        - data, numpy.ndarray: the data, of shape (nb_subjects, nb_voxels)
+        - design, numpy.ndarray: the design matrix, of shape (nb_subjects, nb_regressors)
+        - contrasts, numpy.ndarray: the t contrasts, of shape (nb_contrasts, nb_regressors)
+        - permutations, numpy.ndarray: see get_permutations
+        - sign_flipping, bool: True if permutations are sign-flips
+
+        Returns:
+        - numpy.ndarray of shape (nb_permutations, nb_contrasts, nb_voxels)
+    """
+    if sign_flipping:
+        designs = permutations[:, :, None] * design[None, :, :]
+    else:
+        designs = design[permutations]
+
+    inverse_xtx = pinv(design.T @ design)
+    xty = designs.transpose(0, 2, 1) @ data # (permutations, regressors, voxels)
+    betas = inverse_xtx @ xty
+    residual_sum_squares = (data ** 2).sum(axis = 0) - (betas * xty).sum(axis = 1)
+    variance = maximum(residual_sum_squares, 0.0) / (design.shape[0] - matrix_rank(design))
+
+    effects = contrasts @ betas # (permutations, contrasts, voxels)
+    contrast_variances = einsum('ck,kl,cl->c', contrasts, inverse_xtx, contrasts)
+    standard_errors = sqrt(variance[:, None, :] * contrast_variances[None, :, None])
+
+    return divide(effects, standard_errors,
+        out = zeros(effects.shape), where = standard_errors > 0)
+
+def get_block_size(
+    nb_voxels: int, nb_regressors: int, nb_contrasts: int, memory_gb: float) -> int:
+    """ Return the number of permutations whose statistics are computed at once, so that
+        the arrays allocated for a block of permutations fit in memory_gb.
+
+        Arguments:
+        - nb_voxels, int: number of voxels in the mask
+        - nb_regressors, int: number of columns of the design
+        - nb_contrasts, int: number of t contrasts
+        - memory_gb, float: memory budget of a block, in GB
+    """
+    bytes_per_permutation = 8 * nb_voxels * (
+        REGRESSOR_ARRAYS * nb_regressors + CONTRAST_ARRAYS * nb_contrasts + 2)
+    return max(1, int(memory_gb * 1024 ** 3) // bytes_per_permutation)
+
+def get_structure(connectivity: int) -> ndarray:
+    """ Return the structuring element of a 3D connectivity (6, 18 or 26) """
+    if connectivity not in [6, 18, 26]:
+        raise AttributeError(f'Unknown connectivity: {connectivity}')
+    return generate_binary_structure(3, {6: 1, 18: 2, 26: 3}[connectivity])
+
+def get_tfce(
+    stat_map: ndarray, delta: float, height_power: float = 2.0,
+    extent_power: float = 0.5, connectivity: int = 6) -> ndarray:
+    """ Return the Threshold-Free Cluster Enhancement of a 3D statistic map
+        (positive values only), as computed by FSL randomise: the sum over thresholds
+        h = delta, 2 * delta, ... of extent(h) ^ E * h ^ H * delta.
+
+        Arguments:
+        - stat_map, numpy.ndarray: the 3D statistic map
+        - delta, float: the step between thresholds
+        - height_power, float: H, the power of the height
+        - extent_power, float: E, the power of the cluster extent
+        - connectivity, int: 6, 18 or 26
+    """
+    tfce = zeros(stat_map.shape)
+    if delta <= 0:
+        return tfce
+
+    # Restrict computations to the bounding box of the values above the first threshold
+    above = argwhere_bounds(stat_map >= delta)
+    if above is None:
+        return tfce
+    box = tuple(slice(start, stop) for start, stop in above)
+    box_map = stat_map[box]
+    box_tfce = tfce[box]
+
+    structure = get_structure(connectivity)
+    nb_thresholds = int(box_map.max() / delta)
+    for index in range(1, nb_thresholds + 1):
+        threshold = index * delta
+        labels, nb_clusters = label(box_map >= threshold, structure)
+        if nb_clusters == 0:
+            break
+        extents = bincount(labels.ravel()).astype(float64) ** extent_power
+        extents[0] = 0.0
+        box_tfce += extents[labels] * (threshold ** height_power) * delta
+
+    return tfce
+
+def argwhere_bounds(mask: ndarray):
+    """ Return the bounds ((start, stop) for each axis) of the True values of a mask,
+        None if there is no True value
+    """
+    bounds = []
+    for axis in range(mask.ndim):
+        other_axes = tuple(a for a in range(mask.ndim) if a != axis)
+        indices = where(mask.any(axis = other_axes))[0]
+        if len(indices) == 0:
+            return None
+        bounds.append((indices[0], indices[-1] + 1))
+    return bounds
+
+def get_cluster_extents(
+    stat_map: ndarray, threshold: float, connectivity: int = 26) -> ndarray:
+    """ Return a map of the extent (number of voxels) of the cluster each voxel belongs
+        to, clusters being formed by voxels strictly above threshold.
+    """
+    labels, _ = label(stat_map > threshold, get_structure(connectivity))
+    extents = bincount(labels.ravel())
+    extents[0] = 0
+    return extents[labels]
+
+def to_volume(values: ndarray, mask: ndarray) -> ndarray:
+    """ Return a 3D volume of the shape of mask, filled with values inside the mask """
+    volume = zeros(mask.shape)
+    volume[mask] = values
+    return volume
+
+def run_permutations(
+    data: ndarray, design: ndarray, contrasts: ndarray, permutations: ndarray,
+    sign_flipping: bool, mask: ndarray, observed: ndarray, options: dict) -> dict:
+    """ Run a shard of permutations, and return the statistics accumulated over them.
+
+        Arguments:
+        - data, design, contrasts, permutations, sign_flipping: see get_t_statistics
+        - mask, numpy.ndarray: the 3D boolean mask of the voxels in data
+        - observed, dict: the unpermuted statistics, with keys 'tstat' and
+            (if options['tfce']) 'tfce', of shape (nb_contrasts, nb_voxels)
+        - options, dict: with keys tfce, tfce_delta (list, per contrast), tfce_H, tfce_E,
+            tfce_C, c_thresh (None for no cluster inference), memory_gb (memory budget
+            of the blocks of permutations, see get_block_size)
+
+        Returns:
+        - dict, with keys:
+            - 'max_tstat', 'max_tfce', 'max_cluster': numpy.ndarray of shape
+                (nb_permutations, nb_contrasts), the maximum statistics of each permutation
+            - 'count_tstat', 'count_tfce': numpy.ndarray of shape (nb_contrasts, nb_voxels),
+                the number of permutations in which the statistic was greater or equal
+                to the observed one
+    """
+    nb_contrasts = contrasts.shape[0]
+    nb_permutations = permutations.shape[0]
+    results = {
+        'max_tstat': zeros((nb_permutations, nb_contrasts)),
+        'max_tfce': zeros((nb_permutations, nb_contrasts)),
+        'max_cluster': zeros((nb_permutations, nb_contrasts)),
+        'count_tstat': zeros(observed['tstat'].shape, dtype = int64),
+        'count_tfce': zeros(observed['tstat'].shape, dtype = int64)
+    }
+
+    block_size = get_block_size(
+        data.shape[1], design.shape[1], nb_contrasts, options['memory_gb'])
+    for start in range(0, nb_permutations, block_size):
+        stop = min(start + block_size, nb_permutations)
+        tstats = get_t_statistics(
+            data, design, contrasts, permutations[start:stop], sign_flipping)
+
+        results['max_tstat'][start:stop] = tstats.max(axis = 2)
+        results['count_tstat'] += (tstats >= observed['tstat'][None]).sum(axis = 0)
+
+        if not options['tfce'] and options['c_thresh'] is None:
+            continue
+
+        for permutation_id, contrast_id in product(range(stop - start), range(nb_contrasts)):
+            volume = to_volume(tstats[permutation_id, contrast_id], mask)
+            if options['tfce']:
+                tfce = get_tfce(volume, options['tfce_delta'][contrast_id],
+                    options['tfce_H'], options['tfce_E'], options['tfce_C'])[mask]
+                results['max_tfce'][start + permutation_id, contrast_id] = tfce.max()
+                results['count_tfce'][contrast_id] += tfce >= observed['tfce'][contrast_id]
+            if options['c_thresh'] is not None:
+                results['max_cluster'][start + permutation_id, contrast_id] = \
+                    get_cluster_extents(volume, options['c_thresh']).max()
+
+    return results
+
+def merge_results(results: list) -> dict:
+    """ Merge the results of several shards of permutations (see run_permutations),
+        in the order of the shards.
+    """
+    return {key: concatenate([r[key] for r in results], axis = 0) if key.startswith('max')
+        else sum(r[key] for r in results) for key in results[0]}
+
+def get_corrected_p_values(observed: ndarray, max_distribution: ndarray) -> ndarray:
+    """ Return the FWE-corrected p-values of observed statistics, i.e.: the proportion of
+        permutations whose maximum statistic is greater or equal to the observed one.
+
+        Arguments:
+        - observed, numpy.ndarray: the observed statistics
+        - max_distribution, numpy.ndarray: the maximum statistic of each permutation
+    """
+    sorted_distribution = sort(max_distribution)
+    nb_greater = len(sorted_distribution) - searchsorted(
+        sorted_distribution, observed, side = 'left')
+    return nb_greater / len(sorted_distribution)
+
+def randomise(
+    in_file: str, mask: str, design_mat: str = None, tcon: str = None,
+    base_name: str = 'randomise', one_sample_group_mean: bool = False,
+    num_perm: int = 5000, seed: int = 0, tfce: bool = False, tfce_H: float = 2.0,
+    tfce_E: float = 0.5, tfce_C: int = 6, vox_p_values: bool = False,
+    c_thresh: float = None, num_threads: int = 1, memory_gb: float = 1.0):
+    """
+    Permutation inference for t contrasts of a group level design, writing the same
+    files as FSL randomise. One sample designs (a single column of ones) use
+    sign-flipping, other designs use permutations of the rows of the design. Output
+    p-value maps contain 1 - p, as in randomise.
+
+    This function is meant to be used in a Nipype Function Node, with the same inputs
+    and outputs as nipype.interfaces.fsl.Randomise.
+
+    Arguments:
+        in_file: str, path to the 4D image of the subjects data
+        mask: str, path to the mask image
+        design_mat: str, path to the design matrix (VEST format)
+        tcon: str, path to the t contrasts file (VEST format)
+        base_name: str, prefix of the output files
+        one_sample_group_mean: bool, if True, perform a one sample group-mean test
+            instead of using design_mat and tcon
+        num_perm: int, number of permutations
+        seed: int, seed of the random number generator
+        tfce: bool, if True, compute TFCE statistics and their corrected p-values
+        tfce_H: float, TFCE height power
+        tfce_E: float, TFCE extent power
+        tfce_C: int, TFCE connectivity (6, 18 or 26)
+        vox_p_values: bool, if True, write uncorrected and FWE-corrected voxelwise p-values
+        c_thresh: float, if set, the cluster-forming threshold of cluster extent inference
+        num_threads: int, number of processes running permutations (nipype sets it
+            from the n_procs of the node)
+        memory_gb: float, memory budget of the blocks of permutations, in GB, shared by
+            the processes
+
+    Returns:
+        tstat_files: list of str, paths to the t statistic maps
+        t_corrected_p_files: list of str, paths to the FWE-corrected p-value maps
+        t_p_files: list of str, paths to the uncorrected p-value maps
+        (p-value maps are those of TFCE if tfce, else of voxelwise inference if
+        vox_p_values, else of cluster extent inference, as in nipype)
+    """
+    # These imports must stay inside the function, as required by Nipype
+    from os.path import abspath
+    from concurrent.futures import ProcessPoolExecutor
+    from numpy import array, asanyarray, array_split, ones, where, float32, float64
+    from nibabel import load, Nifti1Image
+
+    from narps_open.core.permutation import (
+        read_vest_file, is_one_sample_design, get_permutations, get_t_statistics,
+        get_tfce, get_cluster_extents, to_volume, run_permutations, merge_results,
+        get_corrected_p_values
+        )
+
+    # Read inputs
+    mask_image = load(mask)
+    mask_data = asanyarray(mask_image.dataobj) > 0
+    data = asanyarray(load(in_file).dataobj, dtype = float64)[mask_data].T
+
+    if one_sample_group_mean:
+        design = ones((data.shape[0], 1))
+        contrasts = ones((1, 1))
+    else:
+        design = read_vest_file(design_mat)
+        contrasts = read_vest_file(tcon)
+    if design.shape[0] != data.shape[0]:
+        raise AttributeError(
+            f'The design has {design.shape[0]} rows, but there are {data.shape[0]} volumes')
+    sign_flipping = is_one_sample_design(design)
+
+    # Observed statistics
+    permutations = get_permutations(data.shape[0], num_perm, sign_flipping, seed)
+    observed = {'tstat': get_t_statistics(
+        data, design, contrasts, permutations[:1], sign_flipping)[0]}
+    options = {
+        'tfce': tfce, 'tfce_H': tfce_H, 'tfce_E': tfce_E, 'tfce_C': tfce_C,
+        'c_thresh': c_thresh, 'memory_gb': memory_gb / max(num_threads, 1),
+        'tfce_delta': [max(t.max(), 0.0) / 100.0 for t in observed['tstat']]
+        }
+    if tfce:
+        observed['tfce'] = array([get_tfce(
+            to_volume(t, mask_data), delta, tfce_H, tfce_E, tfce_C)[mask_data]
+            for t, delta in zip(observed['tstat'], options['tfce_delta'])])
+
+    # Run permutations, sharded between processes
+    shards = [s for s in array_split(permutations, max(num_threads, 1)) if len(s) > 0]
+    if len(shards) > 1:
+        with ProcessPoolExecutor(max_workers = len(shards)) as executor:
+            results = list(executor.map(run_permutations,
+                *zip(*[(data, design, contrasts, s, sign_flipping, mask_data, observed, options)
+                for s in shards])))
+    else:
+        results = [run_permutations(data, design, contrasts, permutations,
+            sign_flipping, mask_data, observed, options)]
+    results = merge_results(results)
+
+    # Write outputs
+    def write_map(values, name: str) -> str:
+        out_file = abspath(f'{base_name}_{name}.nii.gz')
+        image = Nifti1Image(
+            to_volume(values, mask_data).astype(float32), mask_image.affine, mask_image.header)
+        image.set_data_dtype(float32)
+        image.to_filename(out_file)
+        return out_file
+
+    nb_permutations = permutations.shape[0]
+    tstat_files = []
+    corrected_p_files = {'tfce': [], 'vox': [], 'clustere': []}
+    p_files = {'tfce': [], 'vox': [], 'clustere': []}
+    for contrast_id, tstat in enumerate(observed['tstat']):
+        name = f'tstat{contrast_id + 1}'
+        tstat_files.append(write_map(tstat, name))
+
+        if vox_p_values:
+            p_files['vox'].append(write_map(
+                1.0 - results['count_tstat'][contrast_id] / nb_permutations,
+                f'vox_p_{name}'))
+            corrected_p_files['vox'].append(write_map(1.0 - get_corrected_p_values(
+                tstat, results['max_tstat'][:, contrast_id]), f'vox_corrp_{name}'))
+
+        if tfce:
+            corrected_p_files['tfce'].append(write_map(1.0 - get_corrected_p_values(
+                observed['tfce'][contrast_id], results['max_tfce'][:, contrast_id]),
+                f'tfce_corrp_{name}'))
+            if vox_p_values:
+                p_files['tfce'].append(write_map(
+                    1.0 - results['count_tfce'][contrast_id] / nb_permutations,
+                    f'tfce_p_{name}'))
+
+        if c_thresh is not None:
+            extents = get_cluster_extents(to_volume(tstat, mask_data), c_thresh)[mask_data]
+            corrected_p_values = 1.0 - get_corrected_p_values(
+                extents, results['max_cluster'][:, contrast_id])
+            corrected_p_files['clustere'].append(write_map(
+                where(extents > 0, corrected_p_values, 0.0), f'clustere_corrp_{name}'))
+
+    # As nipype.interfaces.fsl.Randomise, only list the p-values of one kind of inference,
+    # all files being written nonetheless
+    prefix = 'tfce' if tfce else 'vox' if vox_p_values else 'clustere' if c_thresh else None
+    if prefix is None:
+        return tstat_files, [], []
+    return tstat_files, corrected_p_files[prefix], p_files[prefix]
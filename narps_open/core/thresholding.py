@@ -0,0 +1,225 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" In-process thresholding of statistic maps (height and cluster extent thresholds,
+    voxelwise FDR and Bonferroni corrections), applying several threshold
+    configurations to a map from a single read
+"""
+
+from re import search
+
+from numpy import (
+    ndarray, asanyarray, zeros, isfinite, arange, bincount, sort, inf, float32, float64
+    )
+from scipy.ndimage import label, generate_binary_structure
+from scipy.stats import norm, t as t_distribution
+
+# Default threshold configuration, as used by SPM's Threshold interface in the pipelines
+DEFAULT_THRESHOLD = {
+    'height_threshold': 0.001,
+    'height_threshold_type': 'p-value',
+    'correction': None,
+    'extent_threshold': 0,
+    'connectivity': 18
+    }
+
+def get_degrees_of_freedom(image) -> float:
+    """ Return the degrees of freedom of a t map, as written by SPM in the description
+        field of the header (e.g.: 'SPM{T_[45.0]} - contrast 1: gain'), or None if not found.
+
+        Arguments:
+        - image, nibabel image: the t map
+    """
+    try:
+        description = image.header['descrip'].tobytes().decode('utf-8', 'ignore')
+    except (KeyError, AttributeError):
+        return None
+    match = search(r'SPM\{T_\[([0-9.]+)\]\}', description)
+    return float(match.group(1)) if match is not None else None
+
+def get_p_values(stat_values: ndarray, dof: float = None) -> ndarray:
+    """ Return the one-sided (positive) p-values of statistic values.
+
+        Arguments:
+        - stat_values, numpy.ndarray: t values, or z values if dof is None
+        - dof, float: degrees of freedom of the t distribution
+    """
+    if dof is None:
+        return norm.sf(stat_values)
+    return t_distribution.sf(stat_values, dof)
+
+def get_stat_threshold(p_value: float, dof: float = None) -> float:
+    """ Return the statistic value corresponding to a one-sided p-value.
+
+        Arguments:
+        - p_value, float: the p-value
+        - dof, float: degrees of freedom of the t distribution, or None for z values
+    """
+    if dof is None:
+        return float(norm.isf(p_value))
+    return float(t_distribution.isf(p_value, dof))
+
+def get_fdr_threshold(p_values: ndarray, q_value: float) -> float:
+    """ Return the p-value threshold controlling the false discovery rate at q_value
+        (Benjamini-Hochberg procedure), or 0.0 if no p-value survives.
+
+        Arguments:
+        - p_values, numpy.ndarray: p-values of all the tested voxels
+        - q_value, float: the false discovery rate
+    """
+    sorted_p_values = sort(asanyarray(p_values, dtype = float64).ravel())
+    if sorted_p_values.size == 0:
+        return 0.0
+    surviving = sorted_p_values <= q_value * arange(1, sorted_p_values.size + 1) \
+        / sorted_p_values.size
+    if not surviving.any():
+        return 0.0
+    return float(sorted_p_values[surviving.nonzero()[0][-1]])
+
+def get_clusters(supra_threshold: ndarray, connectivity: int = 18) -> tuple:
+    """ Label the connected components of a 3D boolean map.
+
+        Arguments:
+        - supra_threshold, numpy.ndarray: 3D boolean map
+        - connectivity, int: 6 (faces), 18 (faces and edges, as SPM) or 26 (faces, edges
+            and corners, as FSL's cluster) neighbourhood
+
+        Returns:
+        - labels, numpy.ndarray: 3D map of cluster labels, 0 outside clusters
+        - sizes, numpy.ndarray: size of each cluster, indexed by label (sizes[0] is 0)
+    """
+    ranks = {6: 1, 18: 2, 26: 3}
+    if connectivity not in ranks:
+        raise AttributeError(f'Unknown connectivity: {connectivity}, expected 6, 18 or 26')
+    labels, nb_clusters = label(
+        supra_threshold, generate_binary_structure(3, ranks[connectivity]))
+    sizes = bincount(labels.ravel(), minlength = nb_clusters + 1)
+    sizes[0] = 0
+    return labels, sizes
+
+def threshold_stat_map(stat_map: ndarray, configurations: list, dof: float = None) -> list:
+    """ Apply threshold configurations to a statistic map. Only positive effects are kept,
+        as with SPM's Threshold (force_activation) ; voxels outside the map (0 or NaN)
+        are not tested. Connected components are labelled once per distinct height
+        threshold and connectivity, so that sweeping extent thresholds is cheap.
+
+        Arguments:
+        - stat_map, numpy.ndarray: 3D map of t values, or z values if dof is None
+        - configurations, list of dict: threshold configurations, with keys (see
+            DEFAULT_THRESHOLD for default values) :
+            - height_threshold, float: p-value, or statistic value
+            - height_threshold_type, str: 'p-value' or 'stat'
+            - correction, str: None, 'fdr' (voxelwise false discovery rate,
+                height_threshold being the q-value) or 'bonferroni' (family-wise error
+                rate, height_threshold being the corrected p-value) ;
+                only available for p-value thresholds
+            - extent_threshold, int: minimum size of clusters, in voxels
+            - connectivity, int: 6, 18 or 26
+        - dof, float: degrees of freedom of the t distribution
+
+        Returns:
+        - list of numpy.ndarray, the thresholded maps (0 outside surviving voxels)
+    """
+    stat_map = asanyarray(stat_map, dtype = float64)
+    in_map = isfinite(stat_map) & (stat_map != 0)
+    tested_values = stat_map[in_map]
+    p_values = None
+    clusters = {}
+
+    thresholded_maps = []
+    for configuration in configurations:
+        unknown_keys = set(configuration) - set(DEFAULT_THRESHOLD)
+        if unknown_keys:
+            raise AttributeError(f'Unknown threshold parameters: {sorted(unknown_keys)}')
+        parameters = {**DEFAULT_THRESHOLD, **configuration}
+
+        # Height threshold, as a statistic value
+        height = parameters['height_threshold']
+        if parameters['height_threshold_type'] == 'stat':
+            if parameters['correction'] is not None:
+                raise AttributeError('Corrections are only available for p-value thresholds')
+            stat_threshold = height
+        elif parameters['height_threshold_type'] == 'p-value':
+            if parameters['correction'] == 'fdr':
+                if p_values is None:
+                    p_values = get_p_values(tested_values, dof)
+                p_threshold = get_fdr_threshold(p_values, height)
+                stat_threshold = tested_values[p_values <= p_threshold].min() \
+                    if p_threshold > 0 else inf
+            elif parameters['correction'] == 'bonferroni':
+                stat_threshold = get_stat_threshold(height / max(tested_values.size, 1), dof)
+            elif parameters['correction'] is None:
+                stat_threshold = get_stat_threshold(height, dof)
+            else:
+                raise AttributeError(f'Unknown correction: {parameters["correction"]}')
+        else:
+            raise AttributeError(
+                f'Unknown height threshold type: {parameters["height_threshold_type"]}')
+
+        # Extent threshold
+        key = (stat_threshold, parameters['connectivity'])
+        if key not in clusters:
+            clusters[key] = get_clusters(
+                in_map & (stat_map >= stat_threshold), parameters['connectivity'])
+        labels, sizes = clusters[key]
+        surviving = (sizes >= max(parameters['extent_threshold'], 1))[labels]
+
+        thresholded_map = zeros(stat_map.shape, dtype = float32)
+        thresholded_map[surviving] = stat_map[surviving]
+        thresholded_maps.append(thresholded_map)
+
+    return thresholded_maps
+
+def threshold_maps(stat_files: list, thresholds: dict = None, dof: float = None) -> list:
+    """
+    Threshold statistic maps, applying every threshold configuration to each map
+    from a single read of the map.
+
+    The map thresholded with configuration <suffix> of the i-th file <name>.nii[.gz]
+    is written as _threshold<i>/<name>_<suffix>.nii[.gz] in the working directory,
+    as SPM's Threshold interface does when used in a MapNode.
+
+    This function is meant to be used in a Nipype Function Node, as a fast path
+    replacing SPM's Threshold or FSL's cluster.
+
+    Arguments:
+        stat_files: list of str, paths to t maps (or z maps)
+        thresholds: dict, threshold configurations (see threshold_stat_map) indexed
+            by the suffix of the output files ; defaults to {'thr': DEFAULT_THRESHOLD}
+        dof: float, degrees of freedom of the t maps ; if None, they are read from the
+            header of each map as written by SPM, and maps without degrees of freedom
+            are considered as z maps
+
+    Returns:
+        thresholded_maps: list of str, paths to the thresholded maps, grouped by stat file
+    """
+    # These imports must stay inside the function, as required by Nipype
+    from os import makedirs
+    from os.path import abspath, basename, join
+    from numpy import asanyarray, float32
+    from nibabel import load, Nifti1Image
+
+    from narps_open.core.thresholding import get_degrees_of_freedom, threshold_stat_map
+
+    thresholds = thresholds if thresholds is not None else {'thr': {}}
+    if not isinstance(stat_files, list):
+        stat_files = [stat_files]
+
+    thresholded_maps = []
+    for file_id, stat_file in enumerate(stat_files):
+        image = load(stat_file)
+        stat_dof = dof if dof is not None else get_degrees_of_freedom(image)
+        results = threshold_stat_map(
+            asanyarray(image.dataobj), list(thresholds.values()), stat_dof)
+
+        directory = abspath(f'_threshold{file_id}')
+        makedirs(directory, exist_ok = True)
+        name, extension = basename(stat_file).split('.', 1)
+        for suffix, thresholded_map in zip(thresholds, results):
+            out_file = join(directory, f'{name}_{suffix}.{extension}')
+            out_image = Nifti1Image(thresholded_map, image.affine, image.header)
+            out_image.set_data_dtype(float32)
+            out_image.to_filename(out_file)
+            thresholded_maps.append(out_file)
+
+    return thresholded_maps
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" A service extracting confounds from the fMRIPrep confounds files of the dataset,
+    through a cache of parsed columns shared by all pipelines
+"""
+
+from os import makedirs, stat, replace
+from os.path import join, isfile, abspath, dirname
+from hashlib import sha256
+from json import dumps
+from tempfile import mkstemp
+
+from numpy import load, save, insert, diff, float64
+from pandas import DataFrame, read_csv
+
+from narps_open.utils.configuration import Configuration
+
+# Head motion parameters, as named in the fMRIPrep confounds files
+MOTION_COLUMNS = ['X', 'Y', 'Z', 'RotX', 'RotY', 'RotZ']
+
+# Columns parsed whenever a confounds file is read, because most pipelines use some of them:
+# this way, the variants of the pipelines (motion parameters, tissue signals,
+# framewise displacement, ...) all use the same parse of a file
+DEFAULT_COLUMNS = MOTION_COLUMNS + [
+    'CSF', 'WhiteMatter', 'GlobalSignal', 'FramewiseDisplacement']
+
+def get_confounds_header(confounds_file: str) -> list:
+    """ Return the list of columns of a confounds file, without parsing its values """
+    with open(confounds_file, 'rt', encoding = 'utf-8') as file:
+        return file.readline().rstrip('\r\n').split('\t')
+
+class ConfoundsCache():
+    """ A cache of the columns of confounds files. Only the requested columns of a file
+        (plus DEFAULT_COLUMNS) are parsed, once. Parsed columns are kept in memory, and
+        stored as .npy files inside a directory per confounds file, so that other
+        processes reuse them as well. Entries are keyed by the path, size and
+        modification time of the confounds files.
+
+        Arguments:
+        - directory, str: path to the directory where the cache is stored
+            (None for a cache kept in memory only)
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory
+
+        # Parsed columns, as dicts of numpy arrays, by key
+        self.entries = {}
+
+    @staticmethod
+    def get_key(confounds_file: str) -> str:
+        """ Return the key of the cache for a confounds file: a hash of its absolute path,
+            size and modification time.
+        """
+        file_stat = stat(confounds_file)
+        key_contents = {
+            'source': abspath(confounds_file),
+            'size': file_stat.st_size,
+            'mtime': file_stat.st_mtime_ns
+        }
+
+        return sha256(dumps(key_contents, sort_keys = True).encode('utf-8')).hexdigest()
+
+    def get_column_path(self, key: str, column: str) -> str:
+        """ Return the path to the .npy file storing a column of the entry under key """
+        return join(self.directory, key, f'{column}.npy')
+
+    def load_columns(self, key: str, columns: list) -> None:
+        """ Load the columns stored on the disk for an entry, into memory """
+        if self.directory is None:
+            return
+
+        entry = self.entries.setdefault(key, {})
+        for column in columns:
+            column_path = self.get_column_path(key, column)
+            if column not in entry and isfile(column_path):
+                values = load(column_path, allow_pickle = False)
+                values.flags.writeable = False
+                entry[column] = values
+
+    def save_column(self, key: str, column: str) -> None:
+        """ Store a column of an entry on the disk, atomically """
+        if self.directory is None:
+            return
+
+        column_path = self.get_column_path(key, column)
+        makedirs(dirname(column_path), exist_ok = True)
+        file_descriptor, temporary_file = mkstemp(dir = dirname(column_path), prefix = '.')
+        with open(file_descriptor, 'wb') as file:
+            save(file, self.entries[key][column], allow_pickle = False)
+        replace(temporary_file, column_path)
+
+    def get_columns(self, confounds_file: str, columns: list) -> dict:
+        """ Return columns of a confounds file, as a dict with column names as keys and
+            read-only numpy arrays as values. Columns are only parsed if they are not
+            in the cache yet.
+
+            Arguments:
+            - confounds_file, str: path to the confounds file (tsv)
+            - columns, list of str: names of the columns
+
+            Raises AttributeError if a column does not exist in the file.
+        """
+        key = self.get_key(confounds_file)
+        entry = self.entries.setdefault(key, {})
+
+        missing_columns = [c for c in columns if c not in entry]
+        self.load_columns(key, missing_columns)
+        missing_columns = [c for c in missing_columns if c not in entry]
+
+        if missing_columns:
+            header = get_confounds_header(confounds_file)
+            unknown_columns = [c for c in missing_columns if c not in header]
+            if unknown_columns:
+                raise AttributeError(
+                    f'Columns {unknown_columns} do not exist in {confounds_file}')
+
+            # Parse the requested columns, and the default ones at the same time
+            self.load_columns(key, DEFAULT_COLUMNS)
+            parsed_columns = list(dict.fromkeys(missing_columns + [
+                c for c in DEFAULT_COLUMNS if c in header and c not in entry]))
+            data_frame = read_csv(
+                confounds_file, sep = '\t', header = 0, usecols = parsed_columns)
+
+            for column in parsed_columns:
+                values = data_frame[column].to_numpy(copy = True)
+                values.flags.writeable = False
+                entry[column] = values
+                self.save_column(key, column)
+
+        return {c: entry[c] for c in columns}
+
+# Caches of confounds, by directory
+_confounds_caches = {}
+
+def get_confounds_cache() -> ConfoundsCache:
+    """ Return the cache of confounds shared by all pipelines, created once per process
+        and stored inside the cache directory (see directories.cache)
+    """
+    directory = join(Configuration()['directories']['cache'], 'confounds')
+    if directory not in _confounds_caches:
+        _confounds_caches[directory] = ConfoundsCache(directory)
+
+    return _confounds_caches[directory]
+
+def get_confounds(confounds_file: str, columns: list, derivatives: list = None) -> DataFrame:
+    """ Return confounds of a run, as a pandas.DataFrame.
+
+        Arguments:
+        - confounds_file, str: path to the fMRIPrep confounds file of the run
+        - columns, list of str: names of the columns to select
+        - derivatives, list of str: names of columns whose first temporal derivative is
+            added after the selected columns (the derivative being 0 for the first frame)
+    """
+    derivatives = derivatives if derivatives is not None else []
+    values = get_confounds_cache().get_columns(
+        confounds_file, list(dict.fromkeys(columns + derivatives)))
+
+    confounds = {c: values[c] for c in columns}
+    for column in derivatives:
+        confounds[f'{column}_derivative1'] = insert(diff(values[column]), 0, 0)
+
+    return DataFrame(confounds)
+
+def write_confounds_file(
+    confounds_file: str, out_file: str, columns: list, derivatives: list = None) -> str:
+    """ Write confounds of a run into a tsv file without header, as expected by the
+        design specification interfaces. Values are written as floats (integer columns,
+        e.g. NonSteadyStateOutlier00, included) and missing values as 0.0 .
+        Return out_file.
+
+        Arguments:
+        - confounds_file, str: path to the fMRIPrep confounds file of the run
+        - out_file, str: path to the file to write
+        - columns, list of str: names of the columns to select
+        - derivatives, list of str: names of columns whose first temporal derivative is
+            added after the selected columns (see get_confounds)
+    """
+    makedirs(dirname(abspath(out_file)), exist_ok = True)
+
+    with open(out_file, 'w', encoding = 'utf-8') as writer:
+        writer.write(get_confounds(confounds_file, columns, derivatives).astype(float64).to_csv(
+            sep = '\t', index = False, header = False, na_rep = '0.0'))
+
+    return out_file
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" An index of the files of the NARPS dataset, to avoid globbing the dataset repeatedly """
+
+from os import makedirs, listdir, stat, replace
+from os.path import join, isdir, isfile, abspath, dirname, relpath, sep, isabs
+from re import compile as compile_regex
+from json import load, dump
+from hashlib import sha256
+from fnmatch import fnmatchcase
+from tempfile import mkstemp
+
+from pandas import DataFrame
+
+from narps_open.utils.configuration import Configuration
+
+class DatasetIndex():
+    """ An index of the functional files of a BIDS dataset: the files inside the
+        sub-*/func and derivatives/fmriprep/sub-*/func directories.
+
+        The list of files of each directory is stored with the modification time
+        of the directory, so that it is listed again only when files were added to
+        or removed from the directory. The index can be persisted into a JSON file.
+
+        Arguments:
+        - dataset_dir, str: path to the dataset
+        - index_file, str: path to the JSON file storing the index (None for an index
+            kept in memory only)
+    """
+
+    # Directories containing the subject directories, relative to the dataset
+    roots = ['', join('derivatives', 'fmriprep')]
+
+    # Directories of each subject, containing indexed files
+    sub_directory = 'func'
+
+    # Patterns of the directories covered by the index, relative to the dataset
+    directory_pattern = compile_regex(r'^(derivatives/fmriprep/)?sub-[^/]+/func$')
+
+    def __init__(self, dataset_dir: str, index_file: str = None):
+        self.dataset_dir = abspath(dataset_dir)
+        self.index_file = index_file
+        self.modified = False
+
+        # Modification times of the roots, and lists of their subject directories
+        self.root_entries = {}
+        # Modification times and lists of files of the indexed directories
+        self.directory_entries = {}
+
+        if index_file is not None and isfile(index_file):
+            with open(index_file, 'r', encoding = 'utf-8') as file:
+                contents = load(file)
+            if contents.get('dataset_dir') == self.dataset_dir:
+                self.root_entries = contents['roots']
+                self.directory_entries = contents['directories']
+
+    @staticmethod
+    def get_mtime(path: str) -> int:
+        """ Return the modification time of a directory in ns, None if it does not exist """
+        try:
+            return stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def update_root(self, root: str) -> None:
+        """ List the subject directories of a root again, if it was modified """
+        mtime = self.get_mtime(join(self.dataset_dir, root))
+        entry = self.root_entries.get(root)
+        if entry is not None and entry['mtime'] == mtime:
+            return
+
+        subjects = []
+        if mtime is not None:
+            subjects = sorted(d for d in listdir(join(self.dataset_dir, root))
+                if d.startswith('sub-') and isdir(join(self.dataset_dir, root, d)))
+        self.root_entries[root] = {'mtime': mtime, 'subjects': subjects}
+        self.modified = True
+
+    def update_directory(self, directory: str) -> None:
+        """ List the files of an indexed directory again, if it was modified """
+        mtime = self.get_mtime(join(self.dataset_dir, directory))
+        entry = self.directory_entries.get(directory)
+        if entry is not None and entry['mtime'] == mtime:
+            return
+
+        files = sorted(listdir(join(self.dataset_dir, directory))) if mtime is not None else []
+        self.directory_entries[directory] = {'mtime': mtime, 'files': files}
+        self.modified = True
+
+    def get_directories(self, pattern: str = '*') -> list:
+        """ Return the indexed directories matching a pattern, relative to the dataset.
+            Roots are updated first, so that new subject directories are taken into account.
+
+            Arguments:
+            - pattern, str: glob pattern of the directories, relative to the dataset
+        """
+        directories = []
+        for root in self.roots:
+            self.update_root(root)
+            for subject in self.root_entries[root]['subjects']:
+                directory = join(root, subject, self.sub_directory)
+                if fnmatchcase(directory, pattern):
+                    directories.append(directory)
+
+        return directories
+
+    def is_covered(self, pattern: str) -> bool:
+        """ Return True if the index can answer a glob pattern (absolute or relative
+            to the dataset), i.e.: the pattern only targets files of indexed directories.
+        """
+        if isabs(pattern):
+            pattern = relpath(pattern, self.dataset_dir)
+        return self.directory_pattern.match(dirname(pattern).replace(sep, '/')) is not None
+
+    def glob(self, pattern: str) -> list:
+        """ Return the paths matching a glob pattern, as glob.glob would do.
+            Return None if the pattern cannot be answered using the index
+            (see is_covered).
+
+            Arguments:
+            - pattern, str: glob pattern, absolute or relative to the dataset ;
+                paths returned are absolute if the pattern is absolute
+        """
+        if not self.is_covered(pattern):
+            return None
+
+        relative_pattern = relpath(pattern, self.dataset_dir) if isabs(pattern) else pattern
+        directory_pattern = dirname(relative_pattern)
+        file_pattern = relative_pattern[len(directory_pattern) + 1:]
+        prefix = self.dataset_dir if isabs(pattern) else ''
+
+        paths = []
+        for directory in self.get_directories(directory_pattern):
+            self.update_directory(directory)
+            paths += [join(prefix, directory, f)
+                for f in self.directory_entries[directory]['files']
+                if fnmatchcase(f, file_pattern)
+                and (not f.startswith('.') or file_pattern.startswith('.'))]
+
+        self.save()
+        return sorted(paths)
+
+    @staticmethod
+    def get_entities(file_name: str) -> dict:
+        """ Return the BIDS entities of a file name, e.g.: for
+            sub-001_task-MGT_run-01_bold_space-MNI152NLin2009cAsym_preproc.nii.gz:
+            {'sub': '001', 'task': 'MGT', 'run': '01', 'space': 'MNI152NLin2009cAsym',
+            'suffix': 'preproc', 'extension': '.nii.gz'}
+        """
+        stem, _, extension = file_name.partition('.')
+        entities = {}
+        for part in stem.split('_'):
+            key, separator, value = part.partition('-')
+            if separator:
+                entities[key] = value
+            else:
+                entities['suffix'] = part
+        entities['extension'] = '.' + extension if extension else ''
+
+        return entities
+
+    def get_table(self) -> DataFrame:
+        """ Return a pandas.DataFrame of all the indexed files, with columns
+            'derivatives' (True for fmriprep derivatives), 'path' (relative to the dataset),
+            and one column per BIDS entity (e.g.: 'sub', 'run', 'suffix').
+        """
+        directories = self.get_directories()
+        for directory in directories:
+            self.update_directory(directory)
+        self.save()
+
+        rows = []
+        for directory in directories:
+            for file in self.directory_entries[directory]['files']:
+                row = self.get_entities(file)
+                row['derivatives'] = directory.startswith('derivatives')
+                row['path'] = join(directory, file)
+                rows.append(row)
+
+        return DataFrame(rows)
+
+    def get_files(self, derivatives: bool = None, **entities) -> list:
+        """ Return the absolute paths of the indexed files matching BIDS entities, e.g.:
+            get_files(derivatives = True, sub = '001', suffix = 'preproc')
+
+            Arguments:
+            - derivatives, bool: True to only get derivatives, False to only get raw data
+                (None for both)
+            - entities: values of the BIDS entities (e.g.: sub, run, suffix, extension)
+        """
+        table = self.get_table()
+        if table.empty:
+            return []
+
+        mask = table['derivatives'] == derivatives if derivatives is not None \
+            else table['derivatives'].notna()
+        for key, value in entities.items():
+            if key not in table.columns:
+                return []
+            mask &= table[key] == value
+
+        return [join(self.dataset_dir, p) for p in table.loc[mask, 'path']]
+
+    def save(self) -> None:
+        """ Write the index into index_file atomically, if it was modified """
+        if self.index_file is None or not self.modified:
+            return
+
+        makedirs(dirname(abspath(self.index_file)), exist_ok = True)
+        file_descriptor, temporary_file = mkstemp(dir = dirname(abspath(self.index_file)))
+        with open(file_descriptor, 'w', encoding = 'utf-8') as file:
+            dump({
+                'dataset_dir': self.dataset_dir,
+                'roots': self.root_entries,
+                'directories': self.directory_entries
+                }, file)
+        replace(temporary_file, self.index_file)
+        self.modified = False
+
+def get_index_file(dataset_dir: str) -> str:
+    """ Return the default path to the index file of a dataset, inside the cache directory """
+    dataset_hash = sha256(abspath(dataset_dir).encode('utf-8')).hexdigest()[:16]
+    return join(Configuration()['directories']['cache'], f'dataset_index_{dataset_hash}.json')
+
+# Indexes of datasets, by path
+_dataset_indexes = {}
+
+def get_dataset_index(dataset_dir: str = None, index_file: str = None) -> DatasetIndex:
+    """ Return the DatasetIndex of a dataset, created once per process.
+
+        Arguments:
+        - dataset_dir, str: path to the dataset (defaults to the NARPS dataset)
+        - index_file, str: path to the file storing the index (defaults to a file
+            inside the cache directory, see get_index_file)
+    """
+    if dataset_dir is None:
+        dataset_dir = Configuration()['directories']['dataset']
+    dataset_dir = abspath(dataset_dir)
+    if index_file is None:
+        index_file = get_index_file(dataset_dir)
+
+    key = (dataset_dir, abspath(index_file))
+    if key not in _dataset_indexes:
+        _dataset_indexes[key] = DatasetIndex(dataset_dir, index_file)
+
+    return _dataset_indexes[key]
@@ -3,11 +3,19 @@
 
 """ Accessing textual descriptions of the pipelines """
 
-from os.path import join
+from os import replace, getpid
+from os.path import join, isfile, getsize, getmtime
 from csv import DictReader
 from json import dumps
+from pickle import load as pickle_load, dump as pickle_dump, UnpicklingError
+from re import compile as compile_regex
 from importlib_resources import files
 
+from pandas import DataFrame, Series, to_numeric
+from pandas.api.types import is_numeric_dtype
+
+from narps_open.utils.singleton import SingletonMeta
+
 class TeamDescription(dict):
     """ This class allows to access information about a NARPS team
         Arguments:
@@ -104,14 +112,238 @@ class TeamDescription(dict):
                 'general.teamID' becomes 'teamID'
                 'analysis.multiple_testing_correction' becomes 'multiple_testing_correction'
                 'categorized_for_analysis.smoothing_coef' becomes 'smoothing_coef'
+            Sub-dictionaries are precomputed by TeamDescriptionIndex.
+        """
+        return dict(
+            TeamDescriptionIndex().get_sub_dicts(self.team_id)[key_first_part])
+
+    def _load(self):
+        """ Load the contents of TeamDescription from the index of all descriptions
+            (see TeamDescriptionIndex), that parses the csv files only once per process.
+        """
+        index = TeamDescriptionIndex()
+        if self.team_id not in index['description']:
+            raise AttributeError(f'Team {self.team_id} was not found in the description.')
+        if self.team_id not in index['derived']:
+            raise AttributeError(f'Team {self.team_id}\
+                was not found in the derived description.')
+        if self.team_id not in index['comments']:
+            raise AttributeError(f'Team {self.team_id}\
+                was not found in the comments description.')
+
+        self.update(index['description'][self.team_id])
+        self.update(index['derived'][self.team_id])
+        self.update(index['comments'][self.team_id])
+
+class TeamDescriptionIndex(dict, metaclass=SingletonMeta):
+    """ This class indexes the descriptions of all NARPS teams, by team ID.
+        The csv files are parsed once per process, and the index is kept in a pickle file
+        next to them (if the directory is writable), until one of the files changes.
+
+        The index has keys 'description', 'derived' and 'comments' (one per csv file),
+        whose values are dicts with team IDs as keys and the key/value pairs of the team
+        as values.
+    """
+
+    description_file = TeamDescription.description_file
+    derived_description_file = TeamDescription.derived_description_file
+    comments_description_file = TeamDescription.comments_description_file
+    cache_file = join(files('narps_open.data.description'), 'descriptions_index.pickle')
+
+    # The sub dictionaries of a description
+    sub_dicts = [
+        'general',
+        'exclusions',
+        'preprocessing',
+        'analysis',
+        'categorized_for_analysis',
+        'derived',
+        'comments'
+        ]
+
+    # Operators allowed in the filters of the query method
+    filter_pattern = compile_regex(r'^([^=!~<>]+)(!=|<=|>=|=|~|<|>)(.*)$')
+
+    # Values considered as missing when typing columns
+    missing_values = ['', 'n/a', 'N/A', 'NA']
+
+    def __init__(self):
+        super().__init__()
+        if not self._load_cache():
+            self._load()
+            self._save_cache()
+        self._sub_dicts = {}
+        self._data_frame = None
+
+    def get_sub_dicts(self, team_id: str) -> dict:
+        """ Return the sub dictionaries (see TeamDescription) of a team, computed once.
+            Keys are the names of the sub dictionaries in TeamDescriptionIndex.sub_dicts.
+        """
+        if team_id not in self._sub_dicts:
+            description = {}
+            for key in ['description', 'derived', 'comments']:
+                description.update(self[key][team_id])
+
+            self._sub_dicts[team_id] = {
+                sub_dict: {
+                    key.replace(sub_dict+'.',''):value
+                    for key, value in description.items() if key.startswith(sub_dict)
+                    }
+                for sub_dict in self.sub_dicts
+                }
+
+        return self._sub_dicts[team_id]
+
+    @property
+    def data_frame(self) -> DataFrame:
+        """ Getter for property data_frame, a pandas.DataFrame containing the descriptions
+            of all teams (one row per team ID, one column per key of the descriptions).
+            Columns whose values are all numbers (apart from missing values) have a numeric
+            dtype, with missing values as NA ; other columns contain strings.
+        """
+        if self._data_frame is None:
+            data_frame = DataFrame.from_dict(self['description'], orient = 'index')
+            for key in ['derived', 'comments']:
+                data_frame = data_frame.join(
+                    DataFrame.from_dict(self[key], orient = 'index'), how = 'inner')
+            data_frame.index.name = 'teamID'
+
+            for column in data_frame.columns:
+                values = data_frame[column].where(
+                    ~data_frame[column].str.strip().isin(self.missing_values))
+                try:
+                    values = to_numeric(values)
+                except ValueError:
+                    continue
+                if values.isna().all():
+                    continue
+                if (values.dropna() % 1 == 0).all():
+                    data_frame[column] = values.astype('Int64')
+                else:
+                    data_frame[column] = values.astype('Float64')
+
+            self._data_frame = data_frame
+
+        return self._data_frame
+
+    def get_columns(self, keys: list) -> list:
+        """ Return the list of columns of data_frame corresponding to keys.
+            A key is either a column name (e.g.: 'general.softwares')
+            or the name of a sub dictionary (e.g.: 'derived').
+        """
+        columns = []
+        for key in keys:
+            if key in self.sub_dicts:
+                columns += [c for c in self.data_frame.columns if c.startswith(key + '.')]
+            elif key in self.data_frame.columns:
+                columns.append(key)
+            else:
+                raise AttributeError(f'Unknown key in team descriptions: {key}')
+
+        return columns
+
+    def query(self, filters: list = None, columns: list = None) -> DataFrame:
+        """ Return the descriptions of teams matching all the filters.
+
+            Arguments:
+            - filters, list of str: filters in the form '<column><operator><value>', e.g.:
+                'categorized_for_analysis.analysis_SW=FSL', with operators:
+                = and != (equality of numbers, or of strings ignoring case and
+                    surrounding spaces)
+                ~ (the string contains the value, ignoring case)
+                <, <=, >, >= (comparison of numbers, only for numeric columns)
+            - columns, list of str: the columns to return, either column names or names
+                of sub dictionaries (all columns by default)
+
+            Returns:
+            - pandas.DataFrame, one row per team matching the filters
+        """
+        data_frame = self.data_frame
+        mask = Series(True, index = data_frame.index)
+
+        for query_filter in filters if filters is not None else []:
+            match = self.filter_pattern.match(query_filter)
+            if match is None:
+                raise AttributeError(f'Wrong filter for team descriptions: {query_filter}')
+            column = self.get_columns([match.group(1).strip()])[0]
+            operator = match.group(2)
+            value = match.group(3).strip()
+            values = data_frame[column]
+            numeric = is_numeric_dtype(values)
+            if numeric and operator != '~':
+                try:
+                    value = float(value)
+                except ValueError as error:
+                    raise AttributeError(
+                        f'Wrong value for numeric column {column}: {query_filter}') from error
+
+            if operator == '~':
+                if numeric:
+                    values = values.dropna().astype(str)
+                result = values.str.contains(value, case = False, regex = False, na = False)
+                mask &= result.reindex(data_frame.index, fill_value = False)
+            elif operator in ['=', '!=']:
+                if numeric:
+                    result = values == value
+                else:
+                    result = values.str.strip().str.lower() == value.lower()
+                mask &= result.fillna(False) if operator == '=' else ~result.fillna(False)
+            elif not numeric:
+                raise AttributeError(f'Column {column} is not numeric: {query_filter}')
+            else:
+                result = {
+                    '<': values < value, '<=': values <= value,
+                    '>': values > value, '>=': values >= value
+                    }[operator]
+                mask &= result.fillna(False)
+
+        data_frame = data_frame[mask.astype(bool)]
+        if columns is not None:
+            data_frame = data_frame[self.get_columns(columns)]
+
+        return data_frame
+
+    def get_signature(self) -> list:
+        """ Return the sizes and modification times of the csv files """
+        return [
+            (getsize(f), getmtime(f)) for f in [
+                self.description_file,
+                self.derived_description_file,
+                self.comments_description_file
+                ]
+            ]
+
+    def _load_cache(self) -> bool:
+        """ Load the index from the cache file.
+            Return False if the cache file does not exist or is outdated.
         """
-        return {
-            key.replace(key_first_part+'.',''):value
-            for key, value in self.items() if key.startswith(key_first_part)
-            }
+        if not isfile(self.cache_file):
+            return False
+
+        try:
+            with open(self.cache_file, 'rb') as file:
+                contents = pickle_load(file)
+        except (OSError, UnpicklingError, EOFError):
+            return False
+
+        if contents.get('signature') != self.get_signature():
+            return False
+
+        self.update(contents['index'])
+        return True
+
+    def _save_cache(self) -> None:
+        """ Write the index into the cache file, if possible """
+        try:
+            temporary_file = f'{self.cache_file}.{getpid()}.tmp'
+            with open(temporary_file, 'wb') as file:
+                pickle_dump({'signature': self.get_signature(), 'index': dict(self)}, file)
+            replace(temporary_file, self.cache_file)
+        except OSError:
+            pass # The package directory may not be writable
 
     def _load(self):
-        """ Load the contents of TeamDescription from the csv files.
+        """ Load the index from the csv files.
             In this method, we parse the first two line of the csv description_file.
             These lines are the identifiers for each column of the file.
             NB: first line is the identifier of a group of columns.
@@ -148,66 +380,30 @@ class TeamDescription(dict):
                 delimiter = '\t'
                 )
 
-            # Update self with the key/value pairs from the corresponding line of the file
-            found = False
-            for row in reader:
-                if row['general.teamID'] == self.team_id:
-                    found = True
-                    self.update(row)
-                    break
-
-            # If team id was not found in the file
-            if not found:
-                raise AttributeError(f'Team {self.team_id} was not found in the description.')
-
-        # Parsing second file : self.derived_description_file
-        with open(self.derived_description_file, newline='', encoding='utf-8') as csv_file:
-            # Prepare first line (whose elements are second part of the keys)
-            first_line = csv_file.readline().replace('\n','').split('\t')
-
-            # Read the rest of the file as a dict
-            reader = DictReader(
-                csv_file,
-                fieldnames = ['derived.' + k2 for k2 in first_line],
-                delimiter = '\t'
-                )
-
-            # Update self with the key/value pairs from the file
-            found = False
-            for row in reader:
-                if row['derived.teamID'] == self.team_id:
-                    found = True
-                    row.pop('derived.teamID', None) # Remove useless 'derived.teamID' key
-                    self.update(row)
-                    break
-
-            # If team id was not found in the file
-            if not found:
-                raise AttributeError(f'Team {self.team_id}\
-                    was not found in the derived description.')
-
-        # Parsing third file : self.comments_description_file
-        with open(self.comments_description_file, newline='', encoding='utf-8') as csv_file:
-            # Prepare first line (whose elements are second part of the keys)
-            first_line = csv_file.readline().replace('\n','').split('\t')
-
-            # Read the rest of the file as a dict
-            reader = DictReader(
-                csv_file,
-                fieldnames = ['comments.' + k2 for k2 in first_line],
-                delimiter = '\t'
-                )
-
-            # Update self with the key/value pairs from the file
-            found = False
+            # Index the rows of the file by team ID (the first row for a team ID is kept)
+            self['description'] = {}
             for row in reader:
-                if row['comments.teamID'] == self.team_id:
-                    found = True
-                    row.pop('comments.teamID', None) # Remove useless 'comments.teamID' key
-                    self.update(row)
-                    break
-
-            # If team id was not found in the file
-            if not found:
-                raise AttributeError(f'Team {self.team_id}\
-                    was not found in the comments description.')
+                self['description'].setdefault(row['general.teamID'], row)
+
+        # Parsing second and third files : self.derived_description_file
+        # and self.comments_description_file
+        for key, file_name in [
+            ('derived', self.derived_description_file),
+            ('comments', self.comments_description_file)
+            ]:
+            with open(file_name, newline='', encoding='utf-8') as csv_file:
+                # Prepare first line (whose elements are second part of the keys)
+                first_line = csv_file.readline().replace('\n','').split('\t')
+
+                # Read the rest of the file as a dict
+                reader = DictReader(
+                    csv_file,
+                    fieldnames = [key + '.' + k2 for k2 in first_line],
+                    delimiter = '\t'
+                    )
+
+                # Index the rows of the file by team ID, without the useless teamID key
+                self[key] = {}
+                for row in reader:
+                    team_id = row.pop(key + '.teamID', None)
+                    self[key].setdefault(team_id, row)
@@ -6,7 +6,7 @@
 from argparse import ArgumentParser
 from json import dumps
 
-from narps_open.data.description import TeamDescription
+from narps_open.data.description import TeamDescription, TeamDescriptionIndex
 from narps_open.pipelines import implemented_pipelines
 
 def main():
@@ -14,24 +14,41 @@ def main():
 
     # Parse arguments
     parser = ArgumentParser(description='Get description of a NARPS pipeline.')
-    parser.add_argument('-t', '--team', type=str, required=True,
+    teams = parser.add_mutually_exclusive_group(required = True)
+    teams.add_argument('-t', '--team', type=str,
         help='the team ID', choices=implemented_pipelines.keys())
+    teams.add_argument('-q', '--query', type=str, nargs='*', metavar='FILTER',
+        help='query the descriptions of all teams, using filters such as '
+            '"categorized_for_analysis.analysis_SW=FSL" (operators: = != ~ < <= > >=)')
     parser.add_argument('-d', '--dictionary', type=str, required=False,
-        choices=[
-            'general',
-            'exclusions',
-            'preprocessing',
-            'analysis',
-            'categorized_for_analysis',
-            'derived',
-            'comments'
-            ],
+        choices=TeamDescriptionIndex.sub_dicts,
         help='the sub dictionary of team description')
+    parser.add_argument('-c', '--columns', type=str, nargs='+', action='extend',
+        help='with --query, the columns (or sub dictionaries) to output')
     formats = parser.add_mutually_exclusive_group(required = False)
     formats.add_argument('--json', action='store_true', help='output team description as JSON')
     formats.add_argument('--md', action='store_true', help='output team description as Markdown')
     arguments = parser.parse_args()
 
+    # Query the descriptions of all teams
+    if arguments.query is not None:
+        columns = arguments.columns
+        if arguments.dictionary is not None:
+            columns = (columns if columns is not None else []) + [arguments.dictionary]
+        try:
+            results = TeamDescriptionIndex().query(arguments.query, columns)
+        except AttributeError as error:
+            parser.error(str(error))
+
+        if arguments.md:
+            print('Query results cannot be exported as Markdown yet.')
+            print('Print them as TSV instead.')
+        elif arguments.json:
+            print(results.to_json(orient = 'index', indent = 4))
+        else:
+            print(results.to_csv(sep = '\t'), end = '')
+        return
+
     # Initialize a TeamDescription
     information = TeamDescription(team_id = arguments.team)
 
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" A module to read the events files of NARPS into NumPy arrays, and build models from them """
+
+from os import stat
+from os.path import abspath
+
+from numpy import array, loadtxt, float64, where, char
+from nipype.interfaces.base import Bunch
+
+# The columns of the events files, with their types
+EVENTS_COLUMNS = {
+    'onset': float64,
+    'duration': float64,
+    'gain': float64,
+    'loss': float64,
+    'RT': float64,
+    'participant_response': str
+    }
+
+class RunEvents(dict):
+    """ The events of a run: a dict with the columns of the events file as keys
+        (see EVENTS_COLUMNS), and read-only NumPy arrays as values.
+
+        Arguments:
+        - columns, dict: a NumPy array for each column
+    """
+
+    def __init__(self, columns: dict):
+        super().__init__()
+        for column, values in columns.items():
+            values = array(values, dtype = EVENTS_COLUMNS.get(column))
+            values.flags.writeable = False
+            self[column] = values
+
+    @property
+    def nb_events(self) -> int:
+        """ Getter for property nb_events, the number of events of the run """
+        return len(self['onset']) if 'onset' in self else 0
+
+    def select(self, mask) -> 'RunEvents':
+        """ Return the events corresponding to a boolean mask (or an array of indices) """
+        return RunEvents({c: v[mask] for c, v in self.items()})
+
+    def get_response_mask(self, response: str):
+        """ Return the boolean mask of events whose participant response contains response,
+            e.g.: 'accept' for 'weakly_accept' and 'strongly_accept' trials,
+            or 'NoResp' for trials without response.
+        """
+        return char.find(self['participant_response'], response) >= 0
+
+# Events of the runs, by path
+_run_events = {}
+
+def read_events(events_file: str) -> RunEvents:
+    """ Return the events of a run, parsed once per process
+        (and parsed again only if the file was modified).
+
+        Arguments:
+        - events_file, str: path to the events file (tsv)
+    """
+    events_file = abspath(events_file)
+    file_stat = stat(events_file)
+    signature = (file_stat.st_size, file_stat.st_mtime_ns)
+    cached_events = _run_events.get(events_file)
+
+    if cached_events is None or cached_events[0] != signature:
+        with open(events_file, 'rt', encoding = 'utf-8') as file:
+            header = file.readline().split()
+            rows = loadtxt(file, dtype = str, ndmin = 2)
+        cached_events = (signature, RunEvents({
+            c: rows[:, i] if len(rows) > 0 else [] for i, c in enumerate(header)}))
+        _run_events[events_file] = cached_events
+
+    return cached_events[1]
+
+def demean(values):
+    """ Return values minus their mean (an empty array stays empty) """
+    values = array(values, dtype = float64)
+    return values - values.mean() if values.size > 0 else values
+
+def binarize(mask, true_value: float = 1.0, false_value: float = 0.0):
+    """ Return an array of floats containing true_value where mask is True,
+        and false_value elsewhere.
+    """
+    return where(mask, true_value, false_value).astype(float64)
+
+def to_list(values) -> list:
+    """ Return values as a list of Python floats (as expected in nipype Bunches) """
+    return array(values, dtype = float64).tolist()
+
+def create_bunch(
+    conditions: list, onsets: list, durations: list, modulations: list = None,
+    regressor_names: list = None, regressors: list = None) -> Bunch:
+    """ Return the Bunch describing a run, for nipype's SpecifyModel interfaces.
+        Arrays are converted into lists of floats.
+
+        Arguments:
+        - conditions, list of str: names of the conditions
+        - onsets, list of arrays: onsets of the events, for each condition
+        - durations, list of arrays: durations of the events, for each condition
+        - modulations, list of dict: for each condition, a dict with names of parametric
+            modulators as keys and arrays of values as values (None or an empty dict
+            for a condition without modulation ; None if no condition is modulated)
+        - regressor_names, list of str: names of additional regressors
+        - regressors, list of arrays: values of the additional regressors
+
+        Returns:
+        - nipype.interfaces.base.Bunch
+    """
+    parametric_modulations = None
+    if modulations is not None:
+        parametric_modulations = [
+            Bunch(
+                name = list(m.keys()),
+                poly = [1] * len(m),
+                param = [to_list(v) for v in m.values()]
+                ) if m else None
+            for m in modulations]
+
+    return Bunch(
+        conditions = conditions,
+        onsets = [to_list(o) for o in onsets],
+        durations = [to_list(d) for d in durations],
+        amplitudes = None,
+        tmod = None,
+        pmod = parametric_modulations,
+        regressor_names = regressor_names,
+        regressors = [to_list(r) for r in regressors] if regressors is not None else None
+        )
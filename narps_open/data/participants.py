@@ -3,16 +3,101 @@
 
 """ A set of functions to get the participants data for the narps_open package """
 
-from os.path import join
+from os import stat
+from os.path import join, abspath
+from types import MappingProxyType
 
-from pandas import read_csv
+from pandas import read_csv, DataFrame
 
 from narps_open.data.description import TeamDescription
 from narps_open.utils.configuration import Configuration
 
+class ParticipantsIndex():
+    """ An immutable index of the participants of a dataset, with the group of each
+        participant and the participants of each group precomputed.
+        Participant labels do not contain the 'sub-' prefix.
+
+        The index can be serialized into a dict of builtin types (e.g.: to be passed
+        as an input of a nipype Function node), then rebuilt using from_dict.
+
+        Arguments:
+        - information, pandas.DataFrame: the contents of the participants.tsv file
+    """
+
+    def __init__(self, information: DataFrame):
+        self._information = information.copy()
+
+        subject_groups = {}
+        groups = {}
+        for participant_id, group in zip(information['participant_id'], information['group']):
+            subject = participant_id.replace('sub-', '')
+            subject_groups[subject] = group
+            groups.setdefault(group, []).append(subject)
+
+        self.subject_groups = MappingProxyType(subject_groups)
+        self.groups = MappingProxyType({g: tuple(s) for g, s in groups.items()})
+
+    @property
+    def information(self) -> DataFrame:
+        """ Getter for property information, a copy of the participants table """
+        return self._information.copy()
+
+    def get_group(self, group_name: str) -> list:
+        """ Return a list containing all the participants inside the group_name group """
+        return list(self.groups.get(group_name, ()))
+
+    def to_dict(self) -> dict:
+        """ Return the index serialized as a dict of lists of str """
+        return {
+            'participant_id': [f'sub-{s}' for s in self.subject_groups],
+            'group': list(self.subject_groups.values())
+            }
+
+    @classmethod
+    def from_dict(cls, index: dict):
+        """ Return a ParticipantsIndex from the output of its to_dict method """
+        return cls(DataFrame(index))
+
+# Indexes of participants files, by path
+_participants_indexes = {}
+
+def get_participants_index(participants_file: str = None) -> ParticipantsIndex:
+    """ Return the ParticipantsIndex of a participants.tsv file.
+        The file is parsed once per process, and parsed again only if it was modified.
+
+        Arguments:
+        - participants_file, str: path to the participants file (defaults to the
+            participants.tsv file of the dataset)
+    """
+    if participants_file is None:
+        participants_file = join(Configuration()['directories']['dataset'], 'participants.tsv')
+    participants_file = abspath(participants_file)
+
+    file_stat = stat(participants_file)
+    signature = (file_stat.st_size, file_stat.st_mtime_ns)
+    cached_index = _participants_indexes.get(participants_file)
+    if cached_index is None or cached_index[0] != signature:
+        cached_index = (signature, ParticipantsIndex(read_csv(participants_file, sep='\t')))
+        _participants_indexes[participants_file] = cached_index
+
+    return cached_index[1]
+
+def serialize_participants_index(participants_file: str) -> dict:
+    """ Return the ParticipantsIndex of a participants.tsv file, serialized as a dict.
+        This function is meant to be used in a Nipype Function node, whose output is
+        passed to group level nodes so that they do not parse the file again.
+
+        Arguments:
+        - participants_file, str: path to the participants file
+    """
+    # These imports must stay inside the function, as required by Nipype
+    from narps_open.data.participants import get_participants_index
+
+    return get_participants_index(participants_file).to_dict()
+
 def get_participants_information():
     """ Get a list of participants information from the tsv file from NARPS """
-    return read_csv(join(Configuration()['directories']['dataset'], 'participants.tsv'), sep='\t')
+    return get_participants_index().information
 
 def get_all_participants() -> list:
     """ Return a list of all participants included in NARPS.
@@ -53,7 +138,4 @@ def get_participants_subset(nb_participants: int = 108) -> list:
 def get_group(group_name: str) -> list:
     """ Return a list containing all the participants inside the group_name group """
 
-    participants = get_participants_information()
-    group = participants.loc[participants['group'] == group_name]['participant_id'].values.tolist()
-
-    return [p.replace('sub-', '') for p in group]
+    return get_participants_index().get_group(group_name)
@@ -5,15 +5,18 @@
     to results from teams involved in NARPS
 """
 
-from os import makedirs
-from os.path import join
+from os import makedirs, replace
+from os.path import join, isfile, getsize, getmtime, dirname, basename
 from importlib import import_module
-from json import loads
-from urllib.request import urlretrieve, urlopen
+from json import load, dump
+from time import time
+
+from requests.exceptions import RequestException
 
 from narps_open.utils.configuration import Configuration
 from narps_open.data.description import TeamDescription
-from narps_open.utils import show_download_progress
+from narps_open.utils.cache import hash_file
+from narps_open.utils.download import Downloader, DownloadError
 
 class ResultsCollectionFactory():
     """ A factory class to instantiate ResultsCollection objects """
@@ -39,6 +42,9 @@ class ResultsCollection():
         to results from teams involved in NARPS.
     """
 
+    # Url of the Neurovault API listing the images of a collection
+    api_url = 'https://neurovault.org/api/collections/{uid}/images/'
+
     def __init__(self, team_id: str):
         # Initialize attributes
         self.team_id = team_id
@@ -48,45 +54,150 @@ class ResultsCollection():
             'orig',
             self.uid + '_' + self.team_id
             )
-        self.files = self.get_file_urls()
+        self._files = None
+
+    @property
+    def files(self) -> dict:
+        """ Getter for property files, the download url for each file of the collection.
+            Metadata of the collection are fetched on first access only.
+        """
+        if self._files is None:
+            self._files = self.get_file_urls()
+        return self._files
+
+    @files.setter
+    def files(self, value: dict):
+        """ Setter for property files """
+        self._files = value
 
     def get_uid(self):
         """ Return the uid of the collection by browsing the team description """
         return TeamDescription(team_id = self.team_id).general['NV_collection_link'].split('/')[-2]
 
-    def get_file_urls(self):
+    @property
+    def metadata_file(self) -> str:
+        """ Getter for property metadata_file, the local cache of the collection metadata """
+        return join(Configuration()['directories']['cache'], 'neurovault', f'{self.uid}.json')
+
+    def get_file_urls(self, downloader: Downloader = None):
         """ Return a dict containing the download url for each file of the collection.
         * dict key is the file base name (with extension)
         * dict value is the download url for the file on Neurovault
-        """
-
-        # Get the images data from Neurovault's API
-        collection_url = 'https://neurovault.org/api/collections/' + self.uid + '/images/'
 
-        with urlopen(collection_url) as response:
-            json = loads(response.read())
+        The dict is read from a local cache (see metadata_file), if it is younger than
+        the results.metadata_ttl_days configuration value, or if the results.offline
+        configuration value is true. Otherwise, it is fetched from Neurovault's API,
+        then written into the cache. Stale cache is used if Neurovault is not reachable.
 
-            file_urls = {}
-            for result in json['results']:
-                # Get data for a file in the collection
-                file_urls[result['name']+'.nii.gz'] = result['file']
+        Arguments:
+        - downloader, narps_open.utils.download.Downloader: the object whose session
+            (with timeout and retries) is used to query the API
+        """
+        cached_urls = None
+        if isfile(self.metadata_file):
+            with open(self.metadata_file, 'r', encoding = 'utf-8') as file:
+                cached_urls = load(file)
+
+            age = time() - getmtime(self.metadata_file)
+            if Configuration()['results']['offline'] \
+                or age < Configuration()['results']['metadata_ttl_days'] * 86400:
+                return cached_urls
+
+        if Configuration()['results']['offline']:
+            raise FileNotFoundError(
+                f'No metadata available offline for collection {self.uid}: {self.metadata_file}')
+
+        # Get the images data from Neurovault's API, page by page
+        if downloader is None:
+            downloader = Downloader()
+        file_urls = {}
+        collection_url = self.api_url.format(uid = self.uid)
+        try:
+            while collection_url is not None:
+                json = downloader.get_json(collection_url)
+
+                for result in json['results']:
+                    # Get data for a file in the collection
+                    file_urls[result['name']+'.nii.gz'] = result['file']
+
+                collection_url = json.get('next')
+
+        except RequestException as error:
+            if cached_urls is None:
+                raise
+            print(f'Using cached metadata for collection {self.uid}, as an error occurred: {error}')
+            return cached_urls
+
+        # Write the cache
+        makedirs(dirname(self.metadata_file), exist_ok = True)
+        with open(self.metadata_file + '.tmp', 'w', encoding = 'utf-8') as file:
+            dump(file_urls, file, indent = 4)
+        replace(self.metadata_file + '.tmp', self.metadata_file)
 
         return file_urls
 
-    def download(self):
-        """ Download the collection, file by file. """
+    @property
+    def manifest_file(self) -> str:
+        """ Getter for property manifest_file, the file storing the url, size and checksum
+            of each downloaded file of the collection. It is kept outside the directory
+            of the collection.
+        """
+        return join(dirname(self.directory), f'.{basename(self.directory)}.json')
+
+    def download(self, downloader: Downloader = None):
+        """ Download the collection, files being fetched concurrently.
+            Files that were already downloaded (same url, size and checksum) are skipped,
+            and interrupted downloads are resumed.
+
+            Arguments:
+            - downloader, narps_open.utils.download.Downloader: the object downloading files,
+                that can be shared by several collections
+        """
 
         # Create download directory if not existing
         makedirs(self.directory, exist_ok = True)
+        if downloader is None:
+            downloader = Downloader()
+        if self._files is None:
+            self._files = self.get_file_urls(downloader)
+
+        # Read the information about previously downloaded files
+        manifest = {}
+        if isfile(self.manifest_file):
+            with open(self.manifest_file, 'r', encoding = 'utf-8') as file:
+                manifest = load(file)
+
+        downloads = []
+        for file_name, file_url in self.files.items():
+            download = {'url': file_url, 'destination': join(self.directory, file_name)}
+            if file_name in manifest and manifest[file_name]['url'] == file_url:
+                download['size'] = manifest[file_name]['size']
+                download['checksum'] = manifest[file_name]['checksum']
+            downloads.append(download)
 
         # Download dataset
         print('Collecting results for team', self.team_id)
+        results = downloader.download_all(downloads)
+
+        # Update the information about downloaded files
+        errors = []
         for file_name, file_url in self.files.items():
-            urlretrieve(
-                file_url,
-                join(self.directory, file_name),
-                show_download_progress
-                )
+            destination = join(self.directory, file_name)
+            if isinstance(results[destination], DownloadError):
+                errors.append(str(results[destination]))
+            elif results[destination] or file_name not in manifest:
+                manifest[file_name] = {
+                    'url': file_url,
+                    'size': getsize(destination),
+                    'checksum': hash_file(destination)
+                    }
+
+        with open(self.manifest_file + '.tmp', 'w', encoding = 'utf-8') as file:
+            dump(manifest, file, indent = 4)
+        replace(self.manifest_file + '.tmp', self.manifest_file)
+
+        if errors:
+            raise DownloadError(f'Collection of team {self.team_id}: ' + ' '.join(errors))
 
     def rectify(self):
         """ Rectify files in the collection, if needed.
@@ -4,9 +4,11 @@
 """ Provide a command-line interface for the package narps_open.data.results """
 
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 
 from narps_open.data.results import ResultsCollectionFactory
 from narps_open.pipelines import implemented_pipelines
+from narps_open.utils.download import Downloader
 
 def main():
     """ Entry-point for the command line tool narps_results """
@@ -19,22 +21,24 @@ def main():
     group.add_argument('-a', '--all', action='store_true', help='download results from all teams')
     parser.add_argument('-r', '--rectify', action='store_true', default = False, required = False,
         help='rectify the results')
+    parser.add_argument('-w', '--workers', type = int, default = 8, required = False,
+        help='the maximum number of files downloaded at the same time')
     arguments = parser.parse_args()
 
     factory = ResultsCollectionFactory()
-
-    if arguments.all:
-        for team_id, _ in implemented_pipelines.items():
-            collection = factory.get_collection(team_id)
-            collection.download()
-            if arguments.rectify:
-                collection.rectify()
-    else:
-        for team in arguments.teams:
-            collection = factory.get_collection(team)
-            collection.download()
-            if arguments.rectify:
-                collection.rectify()
+    downloader = Downloader(arguments.workers)
+
+    def collect(team_id):
+        """ Download (and rectify) the collection of a team """
+        collection = factory.get_collection(team_id)
+        collection.download(downloader)
+        if arguments.rectify:
+            collection.rectify()
+
+    # Collections are handled concurrently, the downloader bounds the number of transfers
+    teams = implemented_pipelines.keys() if arguments.all else arguments.teams
+    with ThreadPoolExecutor(max_workers = arguments.workers) as executor:
+        list(executor.map(collect, teams))
 
 if __name__ == '__main__':
     main()
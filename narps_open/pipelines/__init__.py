@@ -6,6 +6,8 @@
 from os.path import join
 from abc import ABC, abstractmethod
 
+from narps_open.utils.configuration import Configuration
+
 # List all the available pipelines and the corresponding class for each
 implemented_pipelines = {
     '08MQ': 'PipelineTeam08MQ',
@@ -185,6 +187,10 @@ class Pipeline(ABC):
             - fwhm: float, Full width at half maximum (in mm) for the Gaussian smoothing kernel
             - tr: float, time repetition (in s) used during acquisition. This value is the same
             for all pipelines as they use the same dataset.
+            - fast_path: bool, True to use in-process implementations of the analyses
+            (e.g.: narps_open.core.glm) instead of the neuroimaging software, for pipelines
+            providing such a fast path. Defaults to the pipelines.fast_path setting of
+            the configuration.
         """
         # Directories
         self._directories = PipelineDirectories()
@@ -198,6 +204,7 @@ class Pipeline(ABC):
         self._team_id = ''
         self._fwhm = 0.0
         self._tr = 1.0
+        self._fast_path = Configuration()['pipelines'].get('fast_path', False)
 
     @property
     def directories(self):
@@ -264,6 +271,16 @@ class Pipeline(ABC):
         """ Setter for property fwhm """
         self._fwhm = value
 
+    @property
+    def fast_path(self):
+        """ Getter for property fast_path """
+        return self._fast_path
+
+    @fast_path.setter
+    def fast_path(self, value: bool):
+        """ Setter for property fast_path """
+        self._fast_path = value
+
     @abstractmethod
     def get_preprocessing(self):
         """ Return a Nipype workflow describing the prerpocessing part of the pipeline """
@@ -17,10 +17,9 @@ from nipype.interfaces.fsl import (
     Threshold, Info, SUSAN, FLIRT, ApplyXFM, ConvertXFM,
     # Analyses
     Level1Design, FEATModel, L2Model, FILMGLS,
-    FLAMEO, Randomise, MultipleRegressDesign
+    FLAMEO, MultipleRegressDesign
     )
 from nipype.interfaces.fsl.utils import Merge as MergeImages
-from nipype.interfaces.fsl.maths import MultiImageMaths
 from nipype.algorithms.confounds import CompCor
 from nipype.algorithms.modelgen import SpecifyModel
 from nipype.interfaces.ants import Registration, WarpTimeSeriesImageMultiTransform
@@ -31,6 +30,7 @@ from narps_open.data.participants import get_group
 from narps_open.core.common import (
     remove_file, list_intersection, elements_in_string, clean_list, list_to_file
     )
+from narps_open.core.interfaces import InterfaceFactory
 
 # Setup FSL
 FSLCommand.set_default_output_type('NIFTI_GZ')
@@ -645,15 +645,12 @@ class PipelineTeam08MQ(Pipeline):
         merge_varcopes = Node(MergeImages(), name = 'merge_varcopes')
         merge_varcopes.inputs.dimension = 't'
 
-        # Split Node - Split mask list to serve them as inputs of the MultiImageMaths node.
-        split_masks = Node(Split(), name = 'split_masks')
-        split_masks.inputs.splits = [1, len(self.run_list) - 1]
-        split_masks.inputs.squeeze = True # Unfold one-element splits removing the list
-
-        # MultiImageMaths Node - Create a subject mask by
+        # Function Node combine_masks - Create a subject mask by
         #   computing the intersection of all run masks.
-        mask_intersection = Node(MultiImageMaths(), name = 'mask_intersection')
-        mask_intersection.inputs.op_string = '-mul %s ' * (len(self.run_list) - 1)
+        mask_intersection = Node(
+            InterfaceFactory.create('combine_masks'), name = 'mask_intersection')
+        mask_intersection.inputs.operation = 'intersection'
+        mask_intersection.inputs.suffix = '_maths'
 
         # FLAMEO Node - Estimate model
         estimate_model = Node(FLAMEO(), name = 'estimate_model')
@@ -669,9 +666,7 @@ class PipelineTeam08MQ(Pipeline):
                 ('contrast_id', 'contrast_id')]),
             (select_files, merge_copes, [('copes', 'in_files')]),
             (select_files, merge_varcopes, [('varcopes', 'in_files')]),
-            (select_files, split_masks, [('masks', 'inlist')]),
-            (split_masks, mask_intersection, [('out1', 'in_file')]),
-            (split_masks, mask_intersection, [('out2', 'operand_files')]),
+            (select_files, mask_intersection, [('masks', 'masks')]),
             (merge_copes, estimate_model, [('merged_file', 'cope_file')]),
             (merge_varcopes, estimate_model, [('merged_file', 'var_cope_file')]),
             (mask_intersection, estimate_model, [('out_file', 'mask_file')]),
@@ -830,15 +825,12 @@ class PipelineTeam08MQ(Pipeline):
         merge_varcopes = Node(MergeImages(), name = 'merge_varcopes')
         merge_varcopes.inputs.dimension = 't'
 
-        # Split Node - Split mask list to serve them as inputs of the MultiImageMaths node.
-        split_masks = Node(Split(), name = 'split_masks')
-        split_masks.inputs.splits = [1, len(self.subject_list) - 1]
-        split_masks.inputs.squeeze = True
-
-        # MultiImageMaths Node - Create a group mask by
+        # Function Node combine_masks - Create a group mask by
         #   computing the intersection of all subject masks.
-        mask_intersection = Node(MultiImageMaths(), name = 'mask_intersection')
-        mask_intersection.inputs.op_string = '-mul %s ' * (len(self.subject_list) - 1)
+        mask_intersection = Node(
+            InterfaceFactory.create('combine_masks'), name = 'mask_intersection')
+        mask_intersection.inputs.operation = 'intersection'
+        mask_intersection.inputs.suffix = '_maths'
 
         # MultipleRegressDesign Node - Specify model
         specify_model = Node(MultipleRegressDesign(), name = 'specify_model')
@@ -848,7 +840,7 @@ class PipelineTeam08MQ(Pipeline):
         estimate_model.inputs.run_mode = 'ols' # Ordinary least squares
 
         # Randomise Node -
-        randomise = Node(Randomise(), name = 'randomise')
+        randomise = Node(InterfaceFactory.create('randomise'), name = 'randomise')
         randomise.inputs.num_perm = 10000
         randomise.inputs.tfce = True
         randomise.inputs.vox_p_values = True
@@ -867,9 +859,7 @@ class PipelineTeam08MQ(Pipeline):
             (information_source, select_files, [('contrast_id', 'contrast_id')]),
             (select_files, get_copes, [('copes', 'input_str')]),
             (select_files, get_varcopes, [('varcopes', 'input_str')]),
-            (select_files, split_masks, [('masks', 'inlist')]),
-            (split_masks, mask_intersection, [('out1', 'in_file')]),
-            (split_masks, mask_intersection, [('out2', 'operand_files')]),
+            (select_files, mask_intersection, [('masks', 'masks')]),
             (get_copes, merge_copes, [(('out_list', clean_list), 'in_files')]),
             (get_varcopes, merge_varcopes,[(('out_list', clean_list), 'in_files')]),
             (merge_copes, estimate_model, [('merged_file', 'cope_file')]),
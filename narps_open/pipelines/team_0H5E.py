@@ -9,7 +9,6 @@ from itertools import product
 from nipype import Node, Workflow, MapNode
 from nipype.interfaces.utility import IdentityInterface, Function, Merge
 from nipype.interfaces.io import SelectFiles, DataSink
-from nipype.algorithms.misc import Gunzip
 from nipype.algorithms.modelgen import SpecifySPMModel
 from nipype.interfaces.spm import (
    Realign, Coregister, Normalize, Smooth,
@@ -22,6 +21,7 @@ from nipype.interfaces.fsl import (
     )
 
 from narps_open.pipelines import Pipeline
+from narps_open.core.interfaces import ParallelGunzip
 from narps_open.data.task import TaskInformation
 from narps_open.data.participants import get_group
 from narps_open.core.common import (
@@ -86,8 +86,8 @@ class PipelineTeam0H5E(Pipeline):
         preprocessing.connect(information_source_runs, 'run_id', select_run_files, 'run_id')
 
         # GUNZIP input files
-        gunzip_func = Node(Gunzip(), name = 'gunzip_func')
-        gunzip_anat = Node(Gunzip(), name = 'gunzip_anat')
+        gunzip_func = Node(ParallelGunzip(), name = 'gunzip_func')
+        gunzip_anat = Node(ParallelGunzip(), name = 'gunzip_anat')
         preprocessing.connect(select_run_files, 'func', gunzip_func, 'in_file')
         preprocessing.connect(select_subject_files, 'anat', gunzip_anat, 'in_file')
 
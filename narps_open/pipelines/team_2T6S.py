@@ -15,9 +15,10 @@ from nipype.interfaces.spm import (
     EstimateModel, EstimateContrast, Threshold
     )
 from nipype.algorithms.modelgen import SpecifySPMModel
-from nipype.algorithms.misc import Gunzip
 
 from narps_open.pipelines import Pipeline
+from narps_open.core.common import elements_containing
+from narps_open.core.interfaces import IndexedSelectFiles, CachedGunzip, InterfaceFactory
 
 class PipelineTeam2T6S(Pipeline):
     """ A class that defines the pipeline of team 2T6S. """
@@ -48,66 +49,22 @@ class PipelineTeam2T6S(Pipeline):
         Returns :
         - subject_info : list of Bunch for 1st level analysis.
         """
-        from nipype.interfaces.base import Bunch
+        from numpy import where
+        from narps_open.data.events import read_events, create_bunch
 
-        condition_names = ['trial']
-        onset = {}
-        duration = {}
-        weights_gain = {}
-        weights_loss = {}
-
-        for run_id in range(len(runs)):
-            # Create dictionary items with empty lists
-            onset.update({c + '_run' + str(run_id + 1) : [] for c in condition_names})
-            duration.update({c + '_run' + str(run_id + 1) : [] for c in condition_names})
-            weights_gain.update({'gain_run' + str(run_id + 1) : []})
-            weights_loss.update({'loss_run' + str(run_id + 1) : []})
-
-            with open(event_files[run_id], 'rt') as event_file:
-                next(event_file)  # skip the header
-
-                for line in event_file:
-                    info = line.strip().split()
-
-                    for condition in condition_names:
-                        val = condition + '_run' + str(run_id + 1) # trial_run1
-                        val_gain = 'gain_run' + str(run_id + 1) # gain_run1
-                        val_loss = 'loss_run' + str(run_id + 1) # loss_run1
-                        onset[val].append(float(info[0])) # onsets for trial_run1
-                        if float(info[4]) != 0: # If RT different from 0 -> trial with response
-                            duration[val].append(float(info[4])) # durations for trial (rpz by RT)
-                        else: # trial with no response : duration of 4 s
-                            duration[val].append(float(4))
-                        # weights gain for trial_run1
-                        weights_gain[val_gain].append(float(info[2]))
-                        # weights loss for trial_run1
-                        weights_loss[val_loss].append(-1.0 * float(info[3]))
-
-        # Bunching is done per run, i.e. trial_run1, trial_run2, etc.
-        # But names must not have '_run1' etc because we concatenate runs
+        # Bunching is done per run, with the same condition names for all runs,
+        # because runs are concatenated
         subject_info = []
         for run_id in range(len(runs)):
+            events = read_events(event_files[run_id])
 
-            conditions = [c + '_run' + str(run_id + 1) for c in condition_names]
-            gain = 'gain_run' + str(run_id + 1)
-            loss = 'loss_run' + str(run_id + 1)
-
-            subject_info.insert(
-                run_id,
-                Bunch(
-                    conditions = condition_names,
-                    onsets = [onset[c] for c in conditions],
-                    durations = [duration[c] for c in conditions],
-                    amplitudes = None,
-                    tmod = None,
-                    pmod = [Bunch(
-                        name = ['gain', 'loss'],
-                        poly = [1, 1],
-                        param = [weights_gain[gain], weights_loss[loss]])
-                    ],
-                    regressor_names = None,
-                    regressors = None)
-                )
+            subject_info.append(create_bunch(
+                conditions = ['trial'],
+                onsets = [events['onset']],
+                # Durations are the reaction times, or 4 s for trials without response
+                durations = [where(events['RT'] != 0.0, events['RT'], 4.0)],
+                modulations = [{'gain': events['gain'], 'loss': -1.0 * events['loss']}]
+                ))
 
         return subject_info
 
@@ -143,39 +100,23 @@ class PipelineTeam2T6S(Pipeline):
         Return :
         - parameters_file : paths to new files containing only desired parameters.
         """
-        from os import makedirs
-        from os.path import join, isdir
+        from os.path import join
 
-        from pandas import read_csv, DataFrame
-        from numpy import array, transpose
+        from narps_open.data.confounds import write_confounds_file, MOTION_COLUMNS
 
         # Handle the case where filepaths is a single path (str)
         if not isinstance(filepaths, list):
             filepaths = [filepaths]
 
-        # Create the parameters files
+        # Create the parameters files, with the parameters we want to use for the model
         parameters_file = []
         for file_id, file in enumerate(filepaths):
-            data_frame = read_csv(file, sep = '\t', header=0)
-
-            # Extract parameters we want to use for the model
-            temp_list = array([
-                data_frame['X'], data_frame['Y'], data_frame['Z'],
-                data_frame['RotX'], data_frame['RotY'], data_frame['RotZ']])
-            retained_parameters = DataFrame(transpose(temp_list))
-
-            # Write parameters to a parameters file
             # TODO : warning !!! filepaths must be ordered (1,2,3,4) for the following code to work
-            new_path = join(working_dir, 'parameters_file',
-                f'parameters_file_sub-{subject_id}_run-{str(file_id + 1).zfill(2)}.tsv')
-
-            makedirs(join(working_dir, 'parameters_file'), exist_ok = True)
-
-            with open(new_path, 'w') as writer:
-                writer.write(retained_parameters.to_csv(
-                    sep = '\t', index = False, header = False, na_rep = '0.0'))
-
-            parameters_file.append(new_path)
+            parameters_file.append(write_confounds_file(
+                file,
+                join(working_dir, 'parameters_file',
+                    f'parameters_file_sub-{subject_id}_run-{str(file_id + 1).zfill(2)}.tsv'),
+                MOTION_COLUMNS))
 
         return parameters_file
 
@@ -230,6 +171,9 @@ class PipelineTeam2T6S(Pipeline):
         Returns:
             - l1_analysis : nipype.WorkFlow
         """
+        if self.fast_path:
+            return self.get_subject_level_analysis_fast_path()
+
         # Infosource Node - To iterate on subjects
         infosource = Node(IdentityInterface(
             fields = ['subject_id']),
@@ -250,7 +194,8 @@ class PipelineTeam2T6S(Pipeline):
         }
 
         # SelectFiles - to select necessary files
-        selectfiles = Node(SelectFiles(template, base_directory = self.directories.dataset_dir),
+        selectfiles = Node(IndexedSelectFiles(
+            template, base_directory = self.directories.dataset_dir),
             name = 'selectfiles')
 
         # DataSink - store the wanted results in the wanted repository
@@ -258,7 +203,7 @@ class PipelineTeam2T6S(Pipeline):
             name = 'datasink')
 
         # Gunzip - gunzip files because SPM do not use .nii.gz files
-        gunzip_func = MapNode(Gunzip(),
+        gunzip_func = MapNode(CachedGunzip(),
             name = 'gunzip_func',
             iterfield = ['in_file'])
 
@@ -357,6 +302,95 @@ class PipelineTeam2T6S(Pipeline):
 
         return l1_analysis
 
+    def get_subject_level_analysis_fast_path(self):
+        """
+        Create the subject level analysis workflow, estimating the same model as
+        get_subject_level_analysis in-process (see narps_open.core.glm): runs are read
+        compressed and smoothed on the fly, and no SPM.mat file is written.
+
+        Returns:
+            - l1_analysis : nipype.WorkFlow
+        """
+        # Infosource Node - To iterate on subjects
+        infosource = Node(IdentityInterface(
+            fields = ['subject_id']),
+            name = 'infosource')
+        infosource.iterables = [('subject_id', self.subject_list)]
+
+        # Templates to select files node
+        template = {
+            # Parameter file
+            'param' : join('derivatives', 'fmriprep', 'sub-{subject_id}', 'func',
+                'sub-{subject_id}_task-MGT_run-*_bold_confounds.tsv'),
+            # Functional MRI
+            'func' : join('derivatives', 'fmriprep', 'sub-{subject_id}', 'func',
+                'sub-{subject_id}_task-MGT_run-*_bold_space-MNI152NLin2009cAsym_preproc.nii.gz'),
+            # Event file
+            'event' : join('sub-{subject_id}', 'func',
+                'sub-{subject_id}_task-MGT_run-*_events.tsv')
+        }
+
+        # SelectFiles - to select necessary files
+        selectfiles = Node(IndexedSelectFiles(
+            template, base_directory = self.directories.dataset_dir),
+            name = 'selectfiles')
+
+        # DataSink - store the wanted results in the wanted repository
+        datasink = Node(DataSink(base_directory = self.directories.output_dir),
+            name = 'datasink')
+
+        # Function node get_subject_infos - get subject specific condition information
+        subject_infos = Node(Function(
+            function = self.get_subject_infos,
+            input_names = ['event_files', 'runs'],
+            output_names = ['subject_info']),
+            name = 'subject_infos')
+        subject_infos.inputs.runs = self.run_list
+
+        # Function node get_parameters_file - get parameters files
+        parameters = Node(Function(
+            function = self.get_parameters_file,
+            input_names = ['filepaths', 'subject_id', 'working_dir'],
+            output_names = ['parameters_file']),
+            name = 'parameters')
+        parameters.inputs.working_dir = self.directories.working_dir
+
+        # Function node get_contrasts - get the contrasts
+        contrasts = Node(Function(
+            function = self.get_contrasts,
+            input_names = [],
+            output_names = ['contrasts']),
+            name = 'contrasts')
+
+        # First level GLM - smooth, estimate the model and its contrasts
+        contrast_estimate = Node(InterfaceFactory.create('first_level_glm'),
+            name = 'contrast_estimate')
+        contrast_estimate.inputs.tr = self.tr
+        contrast_estimate.inputs.fwhm = self.fwhm
+        contrast_estimate.inputs.high_pass_filter_cutoff = 128
+        contrast_estimate.inputs.noise_model = 'ar1'
+        contrast_estimate.inputs.concatenate_runs = True
+        contrast_estimate.inputs.output_format = 'spm'
+
+        # Create l1 analysis workflow and connect its nodes
+        l1_analysis = Workflow(base_dir = self.directories.working_dir, name = 'l1_analysis')
+        l1_analysis.connect([
+            (infosource, selectfiles, [('subject_id', 'subject_id')]),
+            (infosource, parameters, [('subject_id', 'subject_id')]),
+            (contrasts, contrast_estimate, [('contrasts', 'contrasts')]),
+            (selectfiles, parameters, [('param', 'filepaths')]),
+            (selectfiles, subject_infos, [('event', 'event_files')]),
+            (selectfiles, contrast_estimate, [('func', 'func_files')]),
+            (subject_infos, contrast_estimate, [('subject_info', 'subject_info')]),
+            (parameters, contrast_estimate, [('parameters_file', 'confounds_files')]),
+            (contrast_estimate, datasink, [
+                ('con_images', 'l1_analysis.@con_images'),
+                ('var_images', 'l1_analysis.@var_images'),
+                ('t_images', 'l1_analysis.@spmT_images')])
+            ])
+
+        return l1_analysis
+
     def get_subject_level_outputs(self):
         """ Return the names of the files the subject level analysis is supposed to generate. """
 
@@ -366,10 +400,17 @@ class PipelineTeam2T6S(Pipeline):
             'l1_analysis', '_subject_id_{subject_id}', f'con_{contrast_id}.nii')\
             for contrast_id in self.contrast_list]
 
-        # SPM.mat file
-        templates += [join(
-            self.directories.output_dir,
-            'l1_analysis', '_subject_id_{subject_id}', 'SPM.mat')]
+        if self.fast_path:
+            # Variance maps of the contrasts
+            templates += [join(
+                self.directories.output_dir,
+                'l1_analysis', '_subject_id_{subject_id}', f'varcon_{contrast_id}.nii')\
+                for contrast_id in self.contrast_list]
+        else:
+            # SPM.mat file
+            templates += [join(
+                self.directories.output_dir,
+                'l1_analysis', '_subject_id_{subject_id}', 'SPM.mat')]
 
         # spmT maps
         templates += [join(
@@ -391,7 +432,9 @@ class PipelineTeam2T6S(Pipeline):
         Parameters :
         - file_list : original file list selected by selectfiles node
         - subject_list : list of subject IDs that are in the wanted group for the analysis
-        - participants_file: str, file containing participants characteristics
+        - participants_file: dict, a serialized narps_open.data.participants.ParticipantsIndex
+            (see narps_open.data.participants.serialize_participants_index),
+            or str, file containing participants characteristics
 
         Returns :
         - equal_indifference_id : a list of subject ids in the equalIndifference group
@@ -401,20 +444,19 @@ class PipelineTeam2T6S(Pipeline):
         - equal_range_files : a subset of file_list corresponding to
             subjects in the equalRange group
         """
-        equal_indifference_id = []
-        equal_range_id = []
+        from narps_open.data.participants import ParticipantsIndex, get_participants_index
+
+        if isinstance(participants_file, dict):
+            participants = ParticipantsIndex.from_dict(participants_file)
+        else:
+            participants = get_participants_index(participants_file)
+
+        equal_indifference_id = [
+            s for s in participants.get_group('equalIndifference') if s in subject_list]
+        equal_range_id = [s for s in participants.get_group('equalRange') if s in subject_list]
         equal_indifference_files = []
         equal_range_files = []
 
-        with open(participants_file, 'rt') as file:
-            next(file)  # skip the header
-            for line in file:
-                info = line.strip().split()
-                if info[0][-3:] in subject_list and info[1] == 'equalIndifference':
-                    equal_indifference_id.append(info[0][-3:])
-                elif info[0][-3:] in subject_list and info[1] == 'equalRange':
-                    equal_range_id.append(info[0][-3:])
-
         for file in file_list:
             sub_id = file.split('/')
             if sub_id[-2][-3:] in equal_indifference_id:
@@ -432,9 +474,92 @@ class PipelineTeam2T6S(Pipeline):
             - a list of nipype.WorkFlow
         """
 
+        if self.fast_path:
+            return [self.get_group_level_analysis_fast_path()]
+
         methods = ['equalRange', 'equalIndifference', 'groupComp']
         return [self.get_group_level_analysis_sub_workflow(method) for method in methods]
 
+    def get_group_level_analysis_fast_path(self):
+        """
+        Return a workflow running the group level analyses of all methods in-process
+        (see narps_open.core.group), from a single read of the contrast maps of the
+        subjects. Outputs are stored as with get_group_level_analysis_sub_workflow,
+        with Z maps instead of SPM.mat files.
+
+        Returns:
+            - l2_analysis: nipype.WorkFlow
+        """
+        # Compute the number of participants used to do the analysis
+        nb_subjects = len(self.subject_list)
+
+        # Infosource - iterate over the list of contrasts
+        infosource_groupanalysis = Node(
+            IdentityInterface(
+                fields = ['contrast_id']),
+                name = 'infosource_groupanalysis')
+        infosource_groupanalysis.iterables = [('contrast_id', self.contrast_list)]
+
+        # SelectFiles
+        templates = {
+            # Contrast for all participants
+            'contrast' : join(self.directories.output_dir,
+                'l1_analysis', '_subject_id_*', 'con_{contrast_id}.nii')
+            }
+
+        selectfiles_groupanalysis = Node(SelectFiles(
+            templates, base_directory = self.directories.results_dir, force_list = ['contrast']),
+            name = 'selectfiles_groupanalysis')
+
+        # Datasink - save important files
+        datasink_groupanalysis = Node(DataSink(
+            base_directory = str(self.directories.output_dir)
+            ),
+            name = 'datasink_groupanalysis')
+
+        # Participants index - parse the participants file once for all contrasts
+        participants_index = Node(InterfaceFactory.create('participants_index'),
+            name = 'participants_index')
+        participants_index.inputs.participants_file = join(
+            self.directories.dataset_dir, 'participants.tsv')
+
+        # Group level t-tests - equalRange, equalIndifference and groupComp at once
+        group_level_ttests = Node(InterfaceFactory.create('group_level_ttests'),
+            name = 'group_level_ttests')
+        group_level_ttests.inputs.subject_list = self.subject_list
+        group_level_ttests.inputs.group_comparison_weights = [-1, 1]
+        group_level_ttests.inputs.output_format = 'spm'
+
+        l2_analysis = Workflow(
+            base_dir = self.directories.working_dir,
+            name = f'l2_analysis_nsub_{nb_subjects}')
+        l2_analysis.connect([
+            (infosource_groupanalysis, selectfiles_groupanalysis, [
+                ('contrast_id', 'contrast_id')]),
+            (selectfiles_groupanalysis, group_level_ttests, [('contrast', 'contrast_files')]),
+            (participants_index, group_level_ttests, [
+                ('participants_index', 'participants_file')])
+            ])
+
+        for method in ['equalRange', 'equalIndifference', 'groupComp']:
+            # Create thresholded maps - same thresholds as the SPM Threshold interface
+            threshold = Node(InterfaceFactory.create('threshold_maps'),
+                name = f'threshold_{method}')
+            threshold.inputs.thresholds = {'thr': {
+                'height_threshold': 0.001, 'height_threshold_type': 'p-value',
+                'extent_threshold': 10}}
+
+            l2_analysis.connect([
+                (group_level_ttests, threshold, [
+                    ((f'{method}_files', elements_containing, 'spmT_'), 'stat_files')]),
+                (group_level_ttests, datasink_groupanalysis, [
+                    (f'{method}_files', f'l2_analysis_{method}_nsub_{nb_subjects}.@results')]),
+                (threshold, datasink_groupanalysis, [
+                    ('thresholded_maps', f'l2_analysis_{method}_nsub_{nb_subjects}.@thresh')])
+                ])
+
+        return l2_analysis
+
     def get_group_level_analysis_sub_workflow(self, method):
         """
         Return a workflow for the group level analysis.
@@ -459,9 +584,7 @@ class PipelineTeam2T6S(Pipeline):
         templates = {
             # Contrast for all participants
             'contrast' : join(self.directories.output_dir,
-                'l1_analysis', '_subject_id_*', 'con_{contrast_id}.nii'),
-            # Participants file
-            'participants' : join(self.directories.dataset_dir, 'participants.tsv')
+                'l1_analysis', '_subject_id_*', 'con_{contrast_id}.nii')
             }
 
         selectfiles_groupanalysis = Node(SelectFiles(
@@ -474,6 +597,12 @@ class PipelineTeam2T6S(Pipeline):
             ),
             name = 'datasink_groupanalysis')
 
+        # Participants index - parse the participants file once for all contrasts
+        participants_index = Node(InterfaceFactory.create('participants_index'),
+            name = 'participants_index')
+        participants_index.inputs.participants_file = join(
+            self.directories.dataset_dir, 'participants.tsv')
+
         # Function node get_subset_contrasts - select subset of contrasts
         sub_contrasts = Node(Function(
             function = self.get_subset_contrasts,
@@ -510,9 +639,8 @@ class PipelineTeam2T6S(Pipeline):
         l2_analysis.connect([
             (infosource_groupanalysis, selectfiles_groupanalysis, [
                 ('contrast_id', 'contrast_id')]),
-            (selectfiles_groupanalysis, sub_contrasts, [
-                ('contrast', 'file_list'),
-                ('participants', 'participants_file')]),
+            (selectfiles_groupanalysis, sub_contrasts, [('contrast', 'file_list')]),
+            (participants_index, sub_contrasts, [('participants_index', 'participants_file')]),
             (estimate_model, estimate_contrast, [
                 ('spm_mat_file', 'spm_mat_file'),
                 ('residual_image', 'residual_image'),
@@ -569,6 +697,10 @@ class PipelineTeam2T6S(Pipeline):
             'contrast_id': self.contrast_list,
             'method': ['equalRange', 'equalIndifference'],
             'file': [
+                'con_0001.nii', 'con_0002.nii', 'mask.nii',
+                'spmT_0001.nii', 'spmT_0002.nii', 'spmZ_0001.nii', 'spmZ_0002.nii',
+                join('_threshold0', 'spmT_0001_thr.nii'), join('_threshold1', 'spmT_0002_thr.nii')
+                ] if self.fast_path else [
                 'con_0001.nii', 'con_0002.nii', 'mask.nii', 'SPM.mat',
                 'spmT_0001.nii', 'spmT_0002.nii',
                 join('_threshold0', 'spmT_0001_thr.nii'), join('_threshold1', 'spmT_0002_thr.nii')
@@ -591,6 +723,9 @@ class PipelineTeam2T6S(Pipeline):
             'contrast_id': self.contrast_list,
             'method': ['groupComp'],
             'file': [
+                'con_0001.nii', 'mask.nii', 'spmT_0001.nii', 'spmZ_0001.nii',
+                join('_threshold0', 'spmT_0001_thr.nii')
+                ] if self.fast_path else [
                 'con_0001.nii', 'mask.nii', 'SPM.mat', 'spmT_0001.nii',
                 join('_threshold0', 'spmT_0001_thr.nii')
                 ],
@@ -15,12 +15,11 @@ from nipype.interfaces.spm import (
     Level1Design, TwoSampleTTestDesign, Threshold
     )
 from nipype.algorithms.modelgen import SpecifySPMModel
-from nipype.algorithms.misc import Gunzip
 
 from narps_open.pipelines import Pipeline
 from narps_open.data.task import TaskInformation
 from narps_open.data.participants import get_group
-from narps_open.core.interfaces import InterfaceFactory
+from narps_open.core.interfaces import InterfaceFactory, CachedGunzip
 from narps_open.core.common import list_intersection, elements_in_string, clean_list
 from narps_open.utils.configuration import Configuration
 
@@ -122,32 +121,16 @@ class PipelineTeam3TR7(Pipeline):
         Return :
         - confounds_file : path to new file containing only desired confounds
         """
-        from os import makedirs
         from os.path import join
 
-        from pandas import DataFrame, read_csv
-        from numpy import array, transpose
+        from narps_open.data.confounds import write_confounds_file, MOTION_COLUMNS
 
-        # Open original confounds file
-        data_frame = read_csv(filepath, sep = '\t', header=0)
-
-        # Extract confounds we want to use for the model
-        retained_parameters = DataFrame(transpose(array([
-            data_frame['X'], data_frame['Y'], data_frame['Z'],
-            data_frame['RotX'], data_frame['RotY'], data_frame['RotZ']
-            ])))
-
-        # Write confounds to a file
-        confounds_file = join(working_dir, 'confounds_files',
-            f'confounds_file_sub-{subject_id}_run-{run_id}.tsv')
-
-        makedirs(join(working_dir, 'confounds_files'), exist_ok = True)
-
-        with open(confounds_file, 'w', encoding = 'utf-8') as writer:
-            writer.write(retained_parameters.to_csv(
-                sep = '\t', index = False, header = False, na_rep = '0.0'))
-
-        return confounds_file
+        # Write the confounds we want to use for the model to a file
+        return write_confounds_file(
+            filepath,
+            join(working_dir, 'confounds_files',
+                f'confounds_file_sub-{subject_id}_run-{run_id}.tsv'),
+            MOTION_COLUMNS)
 
     def get_subject_level_analysis(self):
         """
@@ -182,7 +165,7 @@ class PipelineTeam3TR7(Pipeline):
         subject_level.connect(info_source, 'subject_id', select_files, 'subject_id')
 
         # Gunzip - gunzip files because SPM do not use .nii.gz files
-        gunzip = MapNode(Gunzip(), name = 'gunzip', iterfield=['in_file'])
+        gunzip = MapNode(CachedGunzip(), name = 'gunzip', iterfield=['in_file'])
         subject_level.connect(select_files, 'func', gunzip, 'in_file')
 
         # Function node get_subject_info - get subject specific condition information
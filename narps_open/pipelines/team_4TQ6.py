@@ -7,15 +7,14 @@ from os.path import join
 from itertools import product
 
 from nipype import Workflow, Node, MapNode
-from nipype.interfaces.utility import IdentityInterface, Function, Split
+from nipype.interfaces.utility import IdentityInterface, Function
 from nipype.interfaces.io import SelectFiles, DataSink
 from nipype.interfaces.fsl import (
     IsotropicSmooth, Level1Design, FEATModel,
     L2Model, Merge, FLAMEO, FILMGLS, MultipleRegressDesign,
-    FSLCommand, Randomise
+    FSLCommand
     )
 from nipype.algorithms.modelgen import SpecifyModel
-from nipype.interfaces.fsl.maths import MultiImageMaths
 
 from narps_open.utils.configuration import Configuration
 from narps_open.pipelines import Pipeline
@@ -243,18 +242,13 @@ class PipelineTeam4TQ6(Pipeline):
         merge_varcopes.inputs.dimension = 't'
         subject_level.connect(select_files, 'varcope', merge_varcopes, 'in_files')
 
-        # Split Node - Split mask list to serve them as inputs of the MultiImageMaths node.
-        split_masks = Node(Split(), name = 'split_masks')
-        split_masks.inputs.splits = [1, len(self.run_list) - 1]
-        split_masks.inputs.squeeze = True # Unfold one-element splits removing the list
-        subject_level.connect(select_files, 'masks', split_masks, 'inlist')
-
-        # MultiImageMaths Node - Create a subject mask by
+        # Function Node combine_masks - Create a subject mask by
         #   computing the intersection of all run masks.
-        mask_intersection = Node(MultiImageMaths(), name = 'mask_intersection')
-        mask_intersection.inputs.op_string = '-mul %s ' * (len(self.run_list) - 1)
-        subject_level.connect(split_masks, 'out1', mask_intersection, 'in_file')
-        subject_level.connect(split_masks, 'out2', mask_intersection, 'operand_files')
+        mask_intersection = Node(
+            InterfaceFactory.create('combine_masks'), name = 'mask_intersection')
+        mask_intersection.inputs.operation = 'intersection'
+        mask_intersection.inputs.suffix = '_maths'
+        subject_level.connect(select_files, 'masks', mask_intersection, 'masks')
 
         # L2Model Node - Generate subject specific second level model
         generate_model = Node(L2Model(), name = 'generate_model')
@@ -452,18 +446,13 @@ class PipelineTeam4TQ6(Pipeline):
         merge_varcopes.inputs.dimension = 't'
         group_level.connect(get_varcopes, ('out_list', clean_list), merge_varcopes, 'in_files')
 
-        # Split Node - Split mask list to serve them as inputs of the MultiImageMaths node.
-        split_masks = Node(Split(), name = 'split_masks')
-        split_masks.inputs.splits = [1, len(self.subject_list) - 1]
-        split_masks.inputs.squeeze = True # Unfold one-element splits removing the list
-        group_level.connect(select_files, 'masks', split_masks, 'inlist')
-
-        # MultiImageMaths Node - Create a subject mask by
+        # Function Node combine_masks - Create a subject mask by
         #   computing the intersection of all run masks.
-        mask_intersection = Node(MultiImageMaths(), name = 'mask_intersection')
-        mask_intersection.inputs.op_string = '-mul %s ' * (len(self.subject_list) - 1)
-        group_level.connect(split_masks, 'out1', mask_intersection, 'in_file')
-        group_level.connect(split_masks, 'out2', mask_intersection, 'operand_files')
+        mask_intersection = Node(
+            InterfaceFactory.create('combine_masks'), name = 'mask_intersection')
+        mask_intersection.inputs.operation = 'intersection'
+        mask_intersection.inputs.suffix = '_maths'
+        group_level.connect(select_files, 'masks', mask_intersection, 'masks')
 
         # MultipleRegressDesign Node - Specify model
         specify_model = Node(MultipleRegressDesign(), name = 'specify_model')
@@ -479,7 +468,7 @@ class PipelineTeam4TQ6(Pipeline):
         group_level.connect(specify_model, 'design_grp', estimate_model, 'cov_split_file')
 
         # Randomise Node - Perform clustering on statistical output
-        randomise = Node(Randomise(), name = 'randomise')
+        randomise = Node(InterfaceFactory.create('randomise'), name = 'randomise')
         randomise.inputs.tfce = True
         randomise.inputs.vox_p_values = True
         randomise.inputs.num_perm = 5000
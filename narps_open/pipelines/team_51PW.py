@@ -7,7 +7,7 @@ from os.path import join
 from itertools import product
 
 from nipype import Node, Workflow, MapNode
-from nipype.interfaces.utility import IdentityInterface, Function, Split
+from nipype.interfaces.utility import IdentityInterface, Function
 from nipype.interfaces.io import SelectFiles, DataSink
 from nipype.interfaces.fsl import (
     # General usage
@@ -16,10 +16,10 @@ from nipype.interfaces.fsl import (
     SUSAN,
     # Analyses
     Level1Design, FEATModel, L2Model, FILMGLS,
-    FLAMEO, Randomise, MultipleRegressDesign
+    FLAMEO, MultipleRegressDesign
     )
 from nipype.interfaces.fsl.utils import ExtractROI, Merge as MergeImages
-from nipype.interfaces.fsl.maths import MathsCommand, MultiImageMaths
+from nipype.interfaces.fsl.maths import MathsCommand
 from nipype.algorithms.modelgen import SpecifyModel
 
 from narps_open.pipelines import Pipeline
@@ -474,15 +474,12 @@ class PipelineTeam51PW(Pipeline):
         merge_varcopes = Node(MergeImages(), name = 'merge_varcopes')
         merge_varcopes.inputs.dimension = 't'
 
-        # Split Node - Split mask list to serve them as inputs of the MultiImageMaths node.
-        split_masks = Node(Split(), name = 'split_masks')
-        split_masks.inputs.splits = [1, len(self.run_list) - 1]
-        split_masks.inputs.squeeze = True # Unfold one-element splits removing the list
-
-        # MultiImageMaths Node - Create a subject mask by
+        # Function Node combine_masks - Create a subject mask by
         #   computing the intersection of all run masks.
-        mask_intersection = Node(MultiImageMaths(), name = 'mask_intersection')
-        mask_intersection.inputs.op_string = '-mul %s ' * (len(self.run_list) - 1)
+        mask_intersection = Node(
+            InterfaceFactory.create('combine_masks'), name = 'mask_intersection')
+        mask_intersection.inputs.operation = 'intersection'
+        mask_intersection.inputs.suffix = '_maths'
 
         # FLAMEO Node - Estimate model
         estimate_model = Node(FLAMEO(), name = 'estimate_model')
@@ -498,9 +495,7 @@ class PipelineTeam51PW(Pipeline):
                 ('contrast_id', 'contrast_id')]),
             (select_files, merge_copes, [('copes', 'in_files')]),
             (select_files, merge_varcopes, [('varcopes', 'in_files')]),
-            (select_files, split_masks, [('masks', 'inlist')]),
-            (split_masks, mask_intersection, [('out1', 'in_file')]),
-            (split_masks, mask_intersection, [('out2', 'operand_files')]),
+            (select_files, mask_intersection, [('masks', 'masks')]),
             (merge_copes, estimate_model, [('merged_file', 'cope_file')]),
             (merge_varcopes, estimate_model, [('merged_file', 'var_cope_file')]),
             (mask_intersection, estimate_model, [('out_file', 'mask_file')]),
@@ -672,15 +667,12 @@ class PipelineTeam51PW(Pipeline):
         merge_varcopes = Node(MergeImages(), name = 'merge_varcopes')
         merge_varcopes.inputs.dimension = 't'
 
-        # Split Node - Split mask list to serve them as inputs of the MultiImageMaths node.
-        split_masks = Node(Split(), name = 'split_masks')
-        split_masks.inputs.splits = [1, len(self.subject_list) - 1]
-        split_masks.inputs.squeeze = True
-
-        # MultiImageMaths Node - Create a group mask by
+        # Function Node combine_masks - Create a group mask by
         #   computing the intersection of all subject masks.
-        mask_intersection = Node(MultiImageMaths(), name = 'mask_intersection')
-        mask_intersection.inputs.op_string = '-mul %s ' * (len(self.subject_list) - 1)
+        mask_intersection = Node(
+            InterfaceFactory.create('combine_masks'), name = 'mask_intersection')
+        mask_intersection.inputs.operation = 'intersection'
+        mask_intersection.inputs.suffix = '_maths'
 
         # MultipleRegressDesign Node - Specify model
         specify_model = Node(MultipleRegressDesign(), name = 'specify_model')
@@ -690,7 +682,7 @@ class PipelineTeam51PW(Pipeline):
         estimate_model.inputs.run_mode = 'ols' # Ordinary least squares
 
         # Randomise Node -
-        randomise = Node(Randomise(), name = 'randomise')
+        randomise = Node(InterfaceFactory.create('randomise'), name = 'randomise')
         randomise.inputs.num_perm = 10000
         randomise.inputs.tfce = True
         randomise.inputs.vox_p_values = True
@@ -709,9 +701,7 @@ class PipelineTeam51PW(Pipeline):
             (information_source, select_files, [('contrast_id', 'contrast_id')]),
             (select_files, get_copes, [('copes', 'input_str')]),
             (select_files, get_varcopes, [('varcopes', 'input_str')]),
-            (select_files, split_masks, [('masks', 'inlist')]),
-            (split_masks, mask_intersection, [('out1', 'in_file')]),
-            (split_masks, mask_intersection, [('out2', 'operand_files')]),
+            (select_files, mask_intersection, [('masks', 'masks')]),
             (get_copes, merge_copes, [(('out_list', clean_list), 'in_files')]),
             (get_varcopes, merge_varcopes,[(('out_list', clean_list), 'in_files')]),
             (merge_copes, estimate_model, [('merged_file', 'cope_file')]),
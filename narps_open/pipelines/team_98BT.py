@@ -8,7 +8,6 @@ from itertools import product
 from nipype import Workflow, Node, MapNode, JoinNode
 from nipype.interfaces.utility import IdentityInterface, Function, Rename, Merge
 from nipype.interfaces.io import SelectFiles, DataSink
-from nipype.algorithms.misc import Gunzip
 from nipype.interfaces.spm import (
     Coregister, OneSampleTTestDesign,
     EstimateModel, EstimateContrast, Level1Design,
@@ -21,6 +20,7 @@ from nipype.algorithms.modelgen import SpecifySPMModel
 from niflow.nipype1.workflows.fmri.spm import create_DARTEL_template
 
 from narps_open.pipelines import Pipeline
+from narps_open.core.interfaces import ParallelGunzip
 from narps_open.data.task import TaskInformation
 from narps_open.data.participants import get_group
 from narps_open.core.common import (
@@ -78,7 +78,7 @@ class PipelineTeam98BT(Pipeline):
         dartel_workflow.connect(information_source, 'subject_id', select_files, 'subject_id')
 
         # GUNZIP - SPM do not use .nii.gz files
-        gunzip_anat = Node(Gunzip(), name = 'gunzip_anat')
+        gunzip_anat = Node(ParallelGunzip(), name = 'gunzip_anat')
         dartel_workflow.connect(select_files, 'anat', gunzip_anat, 'in_file')
 
         # IDENTITY INTERFACE - Join all gunziped files
@@ -202,10 +202,10 @@ class PipelineTeam98BT(Pipeline):
         preprocessing.connect(information_source_runs, 'run_id', select_run_files, 'run_id')
 
         # GUNZIP - gunzip files because SPM do not use .nii.gz files
-        gunzip_anat = Node(Gunzip(), name = 'gunzip_anat')
-        gunzip_func = Node(Gunzip(), name = 'gunzip_func')
-        gunzip_magnitude = Node(Gunzip(), name = 'gunzip_magnitude')
-        gunzip_phasediff = Node(Gunzip(), name = 'gunzip_phasediff')
+        gunzip_anat = Node(ParallelGunzip(), name = 'gunzip_anat')
+        gunzip_func = Node(ParallelGunzip(), name = 'gunzip_func')
+        gunzip_magnitude = Node(ParallelGunzip(), name = 'gunzip_magnitude')
+        gunzip_phasediff = Node(ParallelGunzip(), name = 'gunzip_phasediff')
         preprocessing.connect(select_subject_files, 'anat', gunzip_anat, 'in_file'),
         preprocessing.connect(select_run_files, 'func', gunzip_func, 'in_file')
         preprocessing.connect(select_subject_files, 'phasediff', gunzip_phasediff, 'in_file')
@@ -420,10 +420,9 @@ class PipelineTeam98BT(Pipeline):
         """
         from os import makedirs
         from os.path import join
-        from nibabel import load
-        from numpy import mean
         from pandas import read_table
-        from nilearn.image import iter_img, resample_to_img
+
+        from narps_open.core.image import get_masked_time_series
 
         # Ignore all future warnings
         from warnings import simplefilter
@@ -431,18 +430,9 @@ class PipelineTeam98BT(Pipeline):
         simplefilter(action = 'ignore', category = UserWarning)
         simplefilter(action = 'ignore', category = RuntimeWarning)
 
-        # Load wc2 file and create a mask out of it
-        wc2 = load(wc2_file)
-        wc2_mask = wc2.get_fdata() > 0.6
-        wc2_mask = wc2_mask.astype(int)
-
-        # Compute the mean signal in white matter, for each slice of the functional data
-        mean_wm = []
-        for current_slice in iter_img(load(func_file)):
-            slice_data = resample_to_img(
-                current_slice, wc2, interpolation = 'nearest', clip = True).get_fdata()
-            # Append mean value of masked data
-            mean_wm.append(mean(slice_data * wc2_mask))
+        # Compute the mean signal in white matter (wc2 file thresholded at 0.6),
+        # for each slice of the functional data resampled into the space of the wc2 file
+        mean_wm = get_masked_time_series(func_file, wc2_file, 'image_mean', 0.6)
 
         # Create new parameters file
         data_frame = read_table(parameters_file, sep = '  ', header = None)
@@ -15,12 +15,11 @@ from nipype.interfaces.spm import (
     Level1Design, TwoSampleTTestDesign
     )
 from nipype.algorithms.modelgen import SpecifySPMModel
-from nipype.algorithms.misc import Gunzip
 
 from narps_open.pipelines import Pipeline
 from narps_open.data.task import TaskInformation
 from narps_open.data.participants import get_group
-from narps_open.core.interfaces import InterfaceFactory
+from narps_open.core.interfaces import InterfaceFactory, CachedGunzip
 from narps_open.core.common import list_intersection, elements_in_string, clean_list
 from narps_open.utils.configuration import Configuration
 
@@ -68,78 +67,38 @@ class PipelineTeam9T8E(Pipeline):
         Returns :
         - subject_info : list of Bunch for 1st level analysis.
         """
-        from nipype.interfaces.base import Bunch
+        from narps_open.data.events import read_events, create_bunch
 
         subject_info = []
 
         for run_id, event_file in enumerate(event_files):
 
-            onsets_accept = []
-            onsets_reject = []
-            onsets_noresp = []
-            durations_accept = []
-            durations_reject = []
-            durations_noresp = []
-            reaction_time_accept = []
-            reaction_time_reject = []
-            gain_value_accept = []
-            gain_value_reject = []
-            loss_value_accept = []
-            loss_value_reject = []
-
-            # Parse the events file
-            with open(event_file, 'rt') as file:
-                next(file)  # skip the header
-
-                for line in file:
-                    info = line.strip().split()
-                    if 'accept' in info[5]:
-                        onsets_accept.append(float(info[0]))
-                        durations_accept.append(float(info[1]))
-                        gain_value_accept.append(float(info[2]))
-                        loss_value_accept.append(float(info[3]))
-                        reaction_time_accept.append(float(info[4]))
-                    elif 'reject' in info[5]:
-                        onsets_reject.append(float(info[0]))
-                        durations_reject.append(float(info[1]))
-                        gain_value_reject.append(float(info[2]))
-                        loss_value_reject.append(float(info[3]))
-                        reaction_time_reject.append(float(info[4]))
-                    else:
-                        onsets_noresp.append(float(info[0]))
-                        durations_noresp.append(float(info[1]))
+            # Split the events of the run by participant response
+            events = read_events(event_file)
+            accept_mask = events.get_response_mask('accept')
+            reject_mask = events.get_response_mask('reject') & ~accept_mask
+            accept = events.select(accept_mask)
+            reject = events.select(reject_mask)
+            noresp = events.select(~accept_mask & ~reject_mask)
 
             # Create a Bunch for the run
             conditions = [f'accept_run{run_id + 1}', f'reject_run{run_id + 1}']
-            onsets = [onsets_accept, onsets_reject]
-            durations = [durations_accept, durations_reject]
+            onsets = [accept['onset'], reject['onset']]
+            durations = [accept['duration'], reject['duration']]
 
-            if onsets_noresp:
+            if noresp.nb_events > 0:
                 conditions.append(f'noresp_run{run_id + 1}')
-                onsets.append(onsets_noresp)
-                durations.append(durations_noresp)
-
-            subject_info.append(
-                Bunch(
-                    conditions = conditions,
-                    onsets = onsets,
-                    durations = durations,
-                    amplitudes = None,
-                    tmod = None,
-                    pmod = [
-                        Bunch(
-                            name = ['gain', 'loss', 'reaction_time'],
-                            poly = [1, 1, 1],
-                            param = [gain_value_accept, loss_value_accept, reaction_time_accept]
-                        ),
-                        Bunch(
-                            name = ['gain', 'loss', 'reaction_time'],
-                            poly = [1, 1, 1],
-                            param = [gain_value_reject, loss_value_reject, reaction_time_reject]
-                        )
-                    ],
-                    regressor_names = None,
-                    regressors = None
+                onsets.append(noresp['onset'])
+                durations.append(noresp['duration'])
+
+            subject_info.append(create_bunch(
+                conditions = conditions,
+                onsets = onsets,
+                durations = durations,
+                modulations = [
+                    {'gain': e['gain'], 'loss': e['loss'], 'reaction_time': e['RT']}
+                    for e in [accept, reject]
+                    ]
                 ))
 
         return subject_info
@@ -160,33 +119,16 @@ class PipelineTeam9T8E(Pipeline):
         Return :
         - confounds_file : path to new file containing only desired confounds
         """
-        from os import makedirs
         from os.path import join
 
-        from pandas import DataFrame, read_csv
-        from numpy import array, transpose
+        from narps_open.data.confounds import write_confounds_file, MOTION_COLUMNS
 
-        # Open original confounds file
-        data_frame = read_csv(filepath, sep = '\t', header=0)
-
-        # Extract confounds we want to use for the model
-        retained_parameters = DataFrame(transpose(array([
-            data_frame['X'], data_frame['Y'], data_frame['Z'],
-            data_frame['RotX'], data_frame['RotY'], data_frame['RotZ'],
-            data_frame['FramewiseDisplacement']
-            ])))
-
-        # Write confounds to a file
-        confounds_file = join(working_dir, 'confounds_files',
-            f'confounds_file_sub-{subject_id}_run-{run_id}.tsv')
-
-        makedirs(join(working_dir, 'confounds_files'), exist_ok = True)
-
-        with open(confounds_file, 'w', encoding = 'utf-8') as writer:
-            writer.write(retained_parameters.to_csv(
-                sep = '\t', index = False, header = False, na_rep = '0.0'))
-
-        return confounds_file
+        # Write the confounds we want to use for the model to a file
+        return write_confounds_file(
+            filepath,
+            join(working_dir, 'confounds_files',
+                f'confounds_file_sub-{subject_id}_run-{run_id}.tsv'),
+            MOTION_COLUMNS + ['FramewiseDisplacement'])
 
     def get_subject_level_analysis(self):
         """
@@ -221,7 +163,7 @@ class PipelineTeam9T8E(Pipeline):
         subject_level.connect(info_source, 'subject_id', select_files, 'subject_id')
 
         # Gunzip - gunzip files because SPM do not use .nii.gz files
-        gunzip = MapNode(Gunzip(), name = 'gunzip', iterfield=['in_file'])
+        gunzip = MapNode(CachedGunzip(), name = 'gunzip', iterfield=['in_file'])
         subject_level.connect(select_files, 'func', gunzip, 'in_file')
 
         # Smoothing - smooth the func data
@@ -12,7 +12,7 @@ from nipype.interfaces.io import SelectFiles, DataSink
 from nipype.interfaces.fsl import (
     Level1Design, FEATModel, FilterRegressor,
     L2Model, Merge, FLAMEO, FILMGLS, MultipleRegressDesign,
-    FSLCommand, Randomise
+    FSLCommand
     )
 from nipype.algorithms.modelgen import SpecifyModel
 from nipype.interfaces.fsl.maths import MathsCommand
@@ -21,6 +21,7 @@ from narps_open.pipelines import Pipeline
 from narps_open.data.task import TaskInformation
 from narps_open.data.participants import get_group
 from narps_open.core.common import list_intersection, elements_in_string, clean_list
+from narps_open.core.interfaces import InterfaceFactory
 
 # Setup FSL
 FSLCommand.set_default_output_type('NIFTI_GZ')
@@ -99,20 +100,17 @@ class PipelineTeamB23O(Pipeline):
         """
         from os.path import abspath
 
-        from pandas import read_csv, DataFrame
-        from numpy import array, transpose
+        from narps_open.data.confounds import write_confounds_file, get_confounds_header
 
         # Remove 1-based columns (4, 5, 6, 7) from original confounds file
-        data_frame = read_csv(filepath, sep = '\t', header=0).drop(columns = [
-            'stdDVARS', 'non-stdDVARS', 'vx-wisestdDVARS', 'FramewiseDisplacement'])
+        excluded_columns = [
+            'stdDVARS', 'non-stdDVARS', 'vx-wisestdDVARS', 'FramewiseDisplacement']
 
         # Write confounds to a file
-        confounds_file = abspath(f'confounds_file_sub-{subject_id}_run-{run_id}.tsv')
-        with open(confounds_file, 'w', encoding = 'utf-8') as writer:
-            writer.write(data_frame.to_csv(
-                sep = '\t', index = False, header = False, na_rep = '0.0'))
-
-        return confounds_file
+        return write_confounds_file(
+            filepath,
+            abspath(f'confounds_file_sub-{subject_id}_run-{run_id}.tsv'),
+            [c for c in get_confounds_header(filepath) if c not in excluded_columns])
 
     def get_run_level_analysis(self):
         """
@@ -511,7 +509,7 @@ class PipelineTeamB23O(Pipeline):
         group_level.connect(specify_model, 'design_grp', estimate_model, 'cov_split_file')
 
         # Randomise Node - Perform clustering on statistical output
-        randomise = Node(Randomise(), name = 'randomise')
+        randomise = Node(InterfaceFactory.create('randomise'), name = 'randomise')
         randomise.inputs.tfce = True
         randomise.inputs.num_perm = 5000
         randomise.inputs.c_thresh = 0.05
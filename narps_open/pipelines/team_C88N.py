@@ -15,9 +15,9 @@ from nipype.interfaces.spm import (
     Level1Design, TwoSampleTTestDesign, Threshold
     )
 from nipype.algorithms.modelgen import SpecifySPMModel
-from nipype.algorithms.misc import Gunzip
 
 from narps_open.pipelines import Pipeline
+from narps_open.core.interfaces import CachedGunzip
 from narps_open.data.task import TaskInformation
 from narps_open.data.participants import get_group
 from narps_open.core.common import remove_file, list_intersection, elements_in_string, clean_list
@@ -58,58 +58,33 @@ class PipelineTeamC88N(Pipeline):
         Returns :
         - subject_information : list of Bunch for 1st level analysis.
         """
-        from nipype.interfaces.base import Bunch
+        from numpy import zeros
+        from narps_open.data.events import read_events, create_bunch
+
+        if model not in ['gain', 'loss']:
+            raise AttributeError
 
         subject_information = []
 
         # Create on Bunch per run
         for event_file in event_files:
 
-            # Create empty lists
-            onsets = []
-            durations = []
-            weights_gain = []
-            weights_loss = []
-
-            # Parse event file
-            with open(event_file, 'rt') as file:
-                next(file)  # skip the header
-
-                for line in file:
-                    info = line.strip().split()
-                    if 'NoResp' not in info[5]:
-                        onsets.append(float(info[0]))
-                        durations.append(0.0)
-                        weights_gain.append(float(info[2]))
-                        weights_loss.append(float(info[3]))
-
-            # Create Bunch
+            # Keep trials with a response
+            events = read_events(event_file)
+            events = events.select(~events.get_response_mask('NoResp'))
+
+            # Create Bunch, the modulator of interest being the last one
             if model == 'gain':
-                parametric_modulation_bunch = Bunch(
-                    name = ['loss', 'gain'],
-                    poly = [1, 1],
-                    param = [weights_loss, weights_gain]
-                    )
-            elif model == 'loss':
-                parametric_modulation_bunch = Bunch(
-                    name = ['gain', 'loss'],
-                    poly = [1, 1],
-                    param = [weights_gain, weights_loss]
-                    )
+                modulations = {'loss': events['loss'], 'gain': events['gain']}
             else:
-                raise AttributeError
-
-            subject_information.append(
-                Bunch(
-                    conditions = ['trial'],
-                    onsets = [onsets],
-                    durations = [durations],
-                    amplitudes = None,
-                    tmod = None,
-                    pmod = [parametric_modulation_bunch],
-                    regressor_names = None,
-                    regressors = None)
-                )
+                modulations = {'gain': events['gain'], 'loss': events['loss']}
+
+            subject_information.append(create_bunch(
+                conditions = ['trial'],
+                onsets = [events['onset']],
+                durations = [zeros(events.nb_events)],
+                modulations = [modulations]
+                ))
 
         return subject_information
 
@@ -146,7 +121,7 @@ class PipelineTeamC88N(Pipeline):
         data_sink.inputs.base_directory = self.directories.output_dir
 
         # Gunzip - gunzip files because SPM do not use .nii.gz files
-        gunzip_func = MapNode(Gunzip(),
+        gunzip_func = MapNode(CachedGunzip(),
             name = 'gunzip_func',
             iterfield = ['in_file'])
 
@@ -15,9 +15,9 @@ from nipype.interfaces.spm import (
     EstimateModel, EstimateContrast, Threshold
     )
 from nipype.algorithms.modelgen import SpecifySPMModel
-from nipype.algorithms.misc import Gunzip
 
 from narps_open.pipelines import Pipeline
+from narps_open.core.interfaces import CachedGunzip, InterfaceFactory
 
 class PipelineTeamQ6O0(Pipeline):
     """ A class that defines the pipeline of team Q6O0. """
@@ -289,7 +289,7 @@ class PipelineTeamQ6O0(Pipeline):
             name='datasink')
 
         # Gunzip - gunzip files because SPM do not use .nii.gz files
-        gunzip_func = MapNode(Gunzip(), name = 'gunzip_func', iterfield = ['in_file'])
+        gunzip_func = MapNode(CachedGunzip(), name = 'gunzip_func', iterfield = ['in_file'])
 
         # Smooth - smoothing node
         smooth = Node(Smooth(fwhm = self.fwhm),
@@ -485,25 +485,26 @@ class PipelineTeamQ6O0(Pipeline):
         Parameters :
         - file_list : original file list selected by selectfiles node
         - subject_list : list of subject IDs that are in the wanted group for the analysis
-        - participants_file: str, file containing participants characteristics
+        - participants_file: dict, a serialized narps_open.data.participants.ParticipantsIndex
+            (see narps_open.data.participants.serialize_participants_index),
+            or str, file containing participants characteristics
 
         Returns:
         - The file list containing only the files belonging to subject in the wanted group.
         """
-        equal_indifference_id = []
-        equal_range_id = []
+        from narps_open.data.participants import ParticipantsIndex, get_participants_index
+
+        if isinstance(participants_file, dict):
+            participants = ParticipantsIndex.from_dict(participants_file)
+        else:
+            participants = get_participants_index(participants_file)
+
+        equal_indifference_id = [
+            s for s in participants.get_group('equalIndifference') if s in subject_list]
+        equal_range_id = [s for s in participants.get_group('equalRange') if s in subject_list]
         equal_indifference_files = []
         equal_range_files = []
 
-        with open(participants_file, 'rt') as file:
-            next(file)  # skip the header
-            for line in file:
-                info = line.strip().split()
-                if info[0][-3:] in subject_list and info[1] == "equalIndifference":
-                    equal_indifference_id.append(info[0][-3:])
-                elif info[0][-3:] in subject_list and info[1] == "equalRange":
-                    equal_range_id.append(info[0][-3:])
-
         for file in file_list:
             sub_id = file.split('/')
             if sub_id[-2][-3:] in equal_indifference_id:
@@ -548,8 +549,7 @@ class PipelineTeamQ6O0(Pipeline):
         # SelectFiles
         templates = {
             'contrast' : join(self.directories.output_dir,
-                'l1_analysis_{model_type}', '_subject_id_*', 'con_0001.nii'),
-                'participants' : join(self.directories.dataset_dir, 'participants.tsv')
+                'l1_analysis_{model_type}', '_subject_id_*', 'con_0001.nii')
             }
 
         selectfiles_groupanalysis = Node(SelectFiles(
@@ -564,6 +564,12 @@ class PipelineTeamQ6O0(Pipeline):
             ),
             name = 'datasink_groupanalysis')
 
+        # Participants index - parse the participants file once for all models
+        participants_index = Node(InterfaceFactory.create('participants_index'),
+            name = 'participants_index')
+        participants_index.inputs.participants_file = join(
+            self.directories.dataset_dir, 'participants.tsv')
+
         # Function node get_subset_contrasts - select subset of contrasts
         sub_contrasts = Node(Function(
             function = self.get_subset_contrasts,
@@ -601,9 +607,8 @@ class PipelineTeamQ6O0(Pipeline):
                 ('model_type', 'model_type')]),
             (infosource_groupanalysis, sub_contrasts, [
                 ('subjects', 'subject_list')]),
-            (selectfiles_groupanalysis, sub_contrasts, [
-                ('contrast', 'file_list'),
-                ('participants', 'participants_file')]),
+            (selectfiles_groupanalysis, sub_contrasts, [('contrast', 'file_list')]),
+            (participants_index, sub_contrasts, [('participants_index', 'participants_file')]),
             (estimate_model, estimate_contrast, [
                 ('spm_mat_file', 'spm_mat_file'),
                 ('residual_image', 'residual_image'),
@@ -15,12 +15,11 @@ from nipype.interfaces.spm import (
     EstimateModel, EstimateContrast, Threshold
     )
 from nipype.algorithms.modelgen import SpecifySPMModel
-from nipype.algorithms.misc import Gunzip
 
 from narps_open.pipelines import Pipeline
 from narps_open.data.task import TaskInformation
 from narps_open.data.participants import get_group
-from narps_open.core.interfaces import InterfaceFactory
+from narps_open.core.interfaces import InterfaceFactory, CachedGunzip
 from narps_open.core.common import (
     list_intersection, elements_in_string, clean_list
     )
@@ -68,7 +67,7 @@ class PipelineTeamR9K3(Pipeline):
         preprocessing.connect(information_source, 'subject_id', select_files, 'subject_id')
 
         # GUNZIP - gunzip files because SPM do not use .nii.gz files
-        gunzip_func = MapNode(Gunzip(), name = 'gunzip_func', iterfield = ['in_file'])
+        gunzip_func = MapNode(CachedGunzip(), name = 'gunzip_func', iterfield = ['in_file'])
         preprocessing.connect(select_files, 'func', gunzip_func, 'in_file')
 
         # SMOOTH - Spatial smoothing of fMRI data.
@@ -186,24 +185,13 @@ class PipelineTeamR9K3(Pipeline):
         """
         from os.path import abspath
 
-        from pandas import read_csv, DataFrame
-        from numpy import array, transpose
+        from narps_open.data.confounds import write_confounds_file, MOTION_COLUMNS
 
-        # Get the dataframe containing the 6 head motion parameter regressors
-        data_frame = read_csv(confounds_file, sep = '\t', header=0)
-
-        # Extract parameters we want to use for the model
-        retained_parameters = DataFrame(transpose(array([
-            data_frame['X'], data_frame['Y'], data_frame['Z'],
-            data_frame['RotX'], data_frame['RotY'], data_frame['RotZ']])))
-
-        # Write confounds to a file
-        out_file = abspath(f'confounds_file_sub-{subject_id}_run-{run_id}.tsv')
-        with open(out_file, 'w', encoding = 'utf-8') as writer:
-            writer.write(retained_parameters.to_csv(
-                sep = '\t', index = False, header = False, na_rep = '0.0'))
-
-        return out_file
+        # Write the 6 head motion parameter regressors to a file
+        return write_confounds_file(
+            confounds_file,
+            abspath(f'confounds_file_sub-{subject_id}_run-{run_id}.tsv'),
+            MOTION_COLUMNS)
 
     def get_subject_level_analysis(self):
         """
@@ -7,14 +7,13 @@ from os.path import join
 from itertools import product
 
 from nipype import Workflow, Node, MapNode
-from nipype.interfaces.utility import IdentityInterface, Function, Split
+from nipype.interfaces.utility import IdentityInterface, Function
 from nipype.interfaces.io import SelectFiles, DataSink
 from nipype.interfaces.fsl import (
     BET, IsotropicSmooth, Level1Design, FEATModel, L2Model, Merge, FLAMEO,
-    FILMGLS, Randomise, MultipleRegressDesign, FSLCommand
+    FILMGLS, MultipleRegressDesign, FSLCommand
     )
 from nipype.algorithms.modelgen import SpecifyModel
-from nipype.interfaces.fsl.maths import MultiImageMaths
 
 from narps_open.utils.configuration import Configuration
 from narps_open.pipelines import Pipeline
@@ -122,34 +121,21 @@ class PipelineTeamT54A(Pipeline):
         Return :
         - parameters_file : paths to new files containing only desired parameters.
         """
-        from os import makedirs
         from os.path import join
 
-        from pandas import read_csv, DataFrame
-        from numpy import array, transpose
-
-        data_frame = read_csv(filepath, sep = '\t', header=0)
-        if 'NonSteadyStateOutlier00' in data_frame.columns:
-            temp_list = array([
-                data_frame['X'], data_frame['Y'], data_frame['Z'],
-                data_frame['RotX'], data_frame['RotY'], data_frame['RotZ'],
-                data_frame['NonSteadyStateOutlier00']])
-        else:
-            temp_list = array([
-                data_frame['X'], data_frame['Y'], data_frame['Z'],
-                data_frame['RotX'], data_frame['RotY'], data_frame['RotZ']])
-        retained_parameters = DataFrame(transpose(temp_list))
-
-        parameters_file = join(working_dir, 'parameters_file',
-            f'parameters_file_sub-{subject_id}_run-{run_id}.tsv')
-
-        makedirs(join(working_dir, 'parameters_file'), exist_ok = True)
+        from narps_open.data.confounds import (
+            write_confounds_file, get_confounds_header, MOTION_COLUMNS
+            )
 
-        with open(parameters_file, 'w') as writer:
-            writer.write(retained_parameters.to_csv(
-                sep = '\t', index = False, header = False, na_rep = '0.0'))
+        columns = MOTION_COLUMNS
+        if 'NonSteadyStateOutlier00' in get_confounds_header(filepath):
+            columns = MOTION_COLUMNS + ['NonSteadyStateOutlier00']
 
-        return parameters_file
+        return write_confounds_file(
+            filepath,
+            join(working_dir, 'parameters_file',
+                f'parameters_file_sub-{subject_id}_run-{run_id}.tsv'),
+            columns)
 
     def get_run_level_analysis(self):
         """
@@ -372,15 +358,12 @@ class PipelineTeamT54A(Pipeline):
         merge_varcopes = Node(Merge(), name = 'merge_varcopes')
         merge_varcopes.inputs.dimension = 't'
 
-        # Split Node - Split mask list to serve them as inputs of the MultiImageMaths node.
-        split_masks = Node(Split(), name = 'split_masks')
-        split_masks.inputs.splits = [1, len(self.run_list) - 1]
-        split_masks.inputs.squeeze = True # Unfold one-element splits removing the list
-
-        # MultiImageMaths Node - Create a subject mask by
+        # Function Node combine_masks - Create a subject mask by
         #   computing the intersection of all run masks.
-        mask_intersection = Node(MultiImageMaths(), name = 'mask_intersection')
-        mask_intersection.inputs.op_string = '-mul %s ' * (len(self.run_list) - 1)
+        mask_intersection = Node(
+            InterfaceFactory.create('combine_masks'), name = 'mask_intersection')
+        mask_intersection.inputs.operation = 'intersection'
+        mask_intersection.inputs.suffix = '_maths'
 
         # FLAMEO Node - Estimate model
         estimate_model = Node(FLAMEO(), name = 'estimate_model')
@@ -396,9 +379,7 @@ class PipelineTeamT54A(Pipeline):
                 ('contrast_id', 'contrast_id')]),
             (select_files, merge_copes, [('cope', 'in_files')]),
             (select_files, merge_varcopes, [('varcope', 'in_files')]),
-            (select_files, split_masks, [('masks', 'inlist')]),
-            (split_masks, mask_intersection, [('out1', 'in_file')]),
-            (split_masks, mask_intersection, [('out2', 'operand_files')]),
+            (select_files, mask_intersection, [('masks', 'masks')]),
             (mask_intersection, estimate_model, [('out_file', 'mask_file')]),
             (merge_copes, estimate_model, [('merged_file', 'cope_file')]),
             (merge_varcopes, estimate_model, [('merged_file', 'var_cope_file')]),
@@ -564,15 +545,12 @@ class PipelineTeamT54A(Pipeline):
         merge_varcopes = Node(Merge(), name = 'merge_varcopes')
         merge_varcopes.inputs.dimension = 't'
 
-        # Split Node - Split mask list to serve them as inputs of the MultiImageMaths node.
-        split_masks = Node(Split(), name = 'split_masks')
-        split_masks.inputs.splits = [1, len(self.subject_list) - 1]
-        split_masks.inputs.squeeze = True # Unfold one-element splits removing the list
-
-        # MultiImageMaths Node - Create a subject mask by
+        # Function Node combine_masks - Create a subject mask by
         #   computing the intersection of all run masks.
-        mask_intersection = Node(MultiImageMaths(), name = 'mask_intersection')
-        mask_intersection.inputs.op_string = '-mul %s ' * (len(self.subject_list) - 1)
+        mask_intersection = Node(
+            InterfaceFactory.create('combine_masks'), name = 'mask_intersection')
+        mask_intersection.inputs.operation = 'intersection'
+        mask_intersection.inputs.suffix = '_maths'
 
         # MultipleRegressDesign Node - Specify model
         specify_model = Node(MultipleRegressDesign(), name = 'specify_model')
@@ -582,7 +560,7 @@ class PipelineTeamT54A(Pipeline):
         estimate_model.inputs.run_mode = 'flame1'
 
         # Randomise Node -
-        randomise = Node(Randomise(), name = 'randomise')
+        randomise = Node(InterfaceFactory.create('randomise'), name = 'randomise')
         randomise.inputs.num_perm = 10000
         randomise.inputs.tfce = True
         randomise.inputs.vox_p_values = True
@@ -602,9 +580,7 @@ class PipelineTeamT54A(Pipeline):
             (select_files, get_varcopes, [('varcope', 'input_str')]),
             (get_copes, merge_copes, [(('out_list', clean_list), 'in_files')]),
             (get_varcopes, merge_varcopes,[(('out_list', clean_list), 'in_files')]),
-            (select_files, split_masks, [('masks', 'inlist')]),
-            (split_masks, mask_intersection, [('out1', 'in_file')]),
-            (split_masks, mask_intersection, [('out2', 'operand_files')]),
+            (select_files, mask_intersection, [('masks', 'masks')]),
             (mask_intersection, estimate_model, [('out_file', 'mask_file')]),
             (mask_intersection, randomise, [('out_file', 'mask')]),
             (merge_copes, estimate_model, [('merged_file', 'cope_file')]),
@@ -17,9 +17,10 @@ from nipype.interfaces.spm import (
     )
 from nipype.algorithms.confounds import FramewiseDisplacement
 from nipype.algorithms.modelgen import SpecifySPMModel
-from nipype.algorithms.misc import Gunzip, SimpleThreshold
+from nipype.algorithms.misc import SimpleThreshold
 
 from narps_open.pipelines import Pipeline
+from narps_open.core.interfaces import ParallelGunzip
 from narps_open.data.task import TaskInformation
 from narps_open.data.participants import get_group
 from narps_open.core.common import (
@@ -66,25 +67,14 @@ class PipelineTeamUK24(Pipeline):
         Returns:
             - preprocessing : nipype.WorkFlow
         """
-        from os import makedirs
-        from os.path import join, abspath
-
-        from nilearn.image import load_img, math_img, index_img, get_data
-
-        # Load input images
-        mask_img = load_img(mask)
-        in_file_img = load_img(in_file)
-
-        # Loop through time points
-        average_values = []
-        for frame_index in range(in_file_img.shape[3]):
-            average_values.append(
-                get_data(math_img(
-                    'np.mean(image * (mask > 0.0))',
-                    image = index_img(in_file_img, frame_index),
-                    mask = mask_img
-                ))
-            )
+        from os.path import abspath
+
+        from numpy import float32
+
+        from narps_open.core.image import get_masked_time_series
+
+        # Compute np.mean(image * (mask > 0.0)) for all time points at once
+        average_values = get_masked_time_series(in_file, mask, 'image_mean', 0.0)
 
         # Write confounds to a file
         out_file_name = abspath(f'sub-{subject_id}_run-{run_id}_' + out_file_suffix)
@@ -92,7 +82,8 @@ class PipelineTeamUK24(Pipeline):
         # Write output file
         with open(out_file_name, 'w', encoding = 'utf-8') as writer:
             for value in average_values:
-                writer.write(f'{value}\n')
+                # Values are written in single precision, as the input images
+                writer.write(f'{float(float32(value))}\n')
 
         return out_file_name
 
@@ -127,9 +118,9 @@ class PipelineTeamUK24(Pipeline):
         preprocessing.connect(information_source, 'subject_id', select_files, 'subject_id')
 
         # GUNZIP - gunzip files because SPM do not use .nii.gz files
-        gunzip_anat = Node(Gunzip(), name = 'gunzip_anat')
-        gunzip_func = MapNode(Gunzip(), name = 'gunzip_func', iterfield = ['in_file'])
-        gunzip_sbref = MapNode(Gunzip(), name = 'gunzip_sbref', iterfield = ['in_file'])
+        gunzip_anat = Node(ParallelGunzip(), name = 'gunzip_anat')
+        gunzip_func = MapNode(ParallelGunzip(), name = 'gunzip_func', iterfield = ['in_file'])
+        gunzip_sbref = MapNode(ParallelGunzip(), name = 'gunzip_sbref', iterfield = ['in_file'])
         preprocessing.connect(select_files, 'anat', gunzip_anat, 'in_file')
         preprocessing.connect(select_files, 'func', gunzip_func, 'in_file')
         preprocessing.connect(select_files, 'sbref', gunzip_sbref, 'in_file')
@@ -8,7 +8,6 @@ from itertools import product
 from nipype import Workflow, Node, MapNode
 from nipype.interfaces.utility import IdentityInterface, Function, Merge
 from nipype.interfaces.io import SelectFiles, DataSink
-from nipype.algorithms.misc import Gunzip
 
 from nipype.interfaces.spm import (
     Coregister, Smooth, OneSampleTTestDesign, EstimateModel, EstimateContrast,
@@ -19,6 +18,7 @@ from nipype.algorithms.modelgen import SpecifySPMModel
 from nipype.interfaces.spm.base import Info as SPMInfo
 
 from narps_open.pipelines import Pipeline
+from narps_open.core.interfaces import ParallelGunzip
 from narps_open.data.task import TaskInformation
 from narps_open.data.participants import get_group
 from narps_open.core.common import (
@@ -89,10 +89,10 @@ class PipelineTeamV55J(Pipeline):
         preprocessing.connect(information_source_runs, 'run_id', select_run_files, 'run_id')
 
         # GUNZIP input files
-        gunzip_func = Node(Gunzip(), name = 'gunzip_func')
-        gunzip_anat = Node(Gunzip(), name = 'gunzip_anat')
-        gunzip_magnitude = Node(Gunzip(), name = 'gunzip_magnitude')
-        gunzip_phasediff = Node(Gunzip(), name = 'gunzip_phasediff')
+        gunzip_func = Node(ParallelGunzip(), name = 'gunzip_func')
+        gunzip_anat = Node(ParallelGunzip(), name = 'gunzip_anat')
+        gunzip_magnitude = Node(ParallelGunzip(), name = 'gunzip_magnitude')
+        gunzip_phasediff = Node(ParallelGunzip(), name = 'gunzip_phasediff')
         preprocessing.connect(select_subject_files, 'anat', gunzip_anat, 'in_file')
         preprocessing.connect(select_subject_files, 'magnitude', gunzip_magnitude, 'in_file')
         preprocessing.connect(select_subject_files, 'phasediff', gunzip_phasediff, 'in_file')
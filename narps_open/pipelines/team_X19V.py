@@ -7,7 +7,7 @@ from os.path import join
 from itertools import product
 
 from nipype import Workflow, Node, MapNode
-from nipype.interfaces.utility import IdentityInterface, Function, Split
+from nipype.interfaces.utility import IdentityInterface, Function
 from nipype.interfaces.io import SelectFiles, DataSink
 from nipype.interfaces.fsl import (
     IsotropicSmooth, Level1Design, FEATModel,
@@ -15,7 +15,6 @@ from nipype.interfaces.fsl import (
     Cluster, BET, SmoothEstimate, FSLCommand
     )
 from nipype.algorithms.modelgen import SpecifyModel
-from nipype.interfaces.fsl.maths import MultiImageMaths
 
 from narps_open.utils.configuration import Configuration
 from narps_open.pipelines import Pipeline
@@ -112,28 +111,16 @@ class PipelineTeamX19V(Pipeline):
         Return :
         - confounds_file : paths to new files containing only desired confounds.
         """
-        from os import makedirs
         from os.path import join
 
-        from pandas import read_csv, DataFrame
-        from numpy import array, transpose
+        from narps_open.data.confounds import write_confounds_file, MOTION_COLUMNS
 
-        data_frame = read_csv(filepath, sep = '\t', header=0)
-        temp_list = array([
-            data_frame['X'], data_frame['Y'], data_frame['Z'],
-            data_frame['RotX'], data_frame['RotY'], data_frame['RotZ']])
-        retained_confounds = DataFrame(transpose(temp_list))
-
-        confounds_file = join(working_dir, 'confounds_files',
-            f'confounds_file_sub-{subject_id}_run-{run_id}.tsv')
-
-        makedirs(join(working_dir, 'confounds_files'), exist_ok = True)
-
-        with open(confounds_file, 'w') as writer:
-            writer.write(retained_confounds.to_csv(
-                sep = '\t', index = False, header = False, na_rep = '0.0'))
-
-        return confounds_file
+        # Write the confounds we want to use for the model to a file
+        return write_confounds_file(
+            filepath,
+            join(working_dir, 'confounds_files',
+                f'confounds_file_sub-{subject_id}_run-{run_id}.tsv'),
+            MOTION_COLUMNS)
 
     def get_run_level_analysis(self):
         """
@@ -351,15 +338,12 @@ class PipelineTeamX19V(Pipeline):
         merge_varcopes = Node(Merge(), name = 'merge_varcopes')
         merge_varcopes.inputs.dimension = 't'
 
-        # Split Node - Split mask list to serve them as inputs of the MultiImageMaths node.
-        split_masks = Node(Split(), name = 'split_masks')
-        split_masks.inputs.splits = [1, len(self.run_list) - 1]
-        split_masks.inputs.squeeze = True # Unfold one-element splits removing the list
-
-        # MultiImageMaths Node - Create a subject mask by
+        # Function Node combine_masks - Create a subject mask by
         #   computing the intersection of all run masks.
-        mask_intersection = Node(MultiImageMaths(), name = 'mask_intersection')
-        mask_intersection.inputs.op_string = '-mul %s ' * (len(self.run_list) - 1)
+        mask_intersection = Node(
+            InterfaceFactory.create('combine_masks'), name = 'mask_intersection')
+        mask_intersection.inputs.operation = 'intersection'
+        mask_intersection.inputs.suffix = '_maths'
 
         # FLAMEO Node - Estimate model
         estimate_model = Node(FLAMEO(), name = 'estimate_model')
@@ -375,9 +359,7 @@ class PipelineTeamX19V(Pipeline):
                 ('contrast_id', 'contrast_id')]),
             (select_files, merge_copes, [('cope', 'in_files')]),
             (select_files, merge_varcopes, [('varcope', 'in_files')]),
-            (select_files, split_masks, [('masks', 'inlist')]),
-            (split_masks, mask_intersection, [('out1', 'in_file')]),
-            (split_masks, mask_intersection, [('out2', 'operand_files')]),
+            (select_files, mask_intersection, [('masks', 'masks')]),
             (mask_intersection, estimate_model, [('out_file', 'mask_file')]),
             (merge_copes, estimate_model, [('merged_file', 'cope_file')]),
             (merge_varcopes, estimate_model, [('merged_file', 'var_cope_file')]),
@@ -553,15 +535,12 @@ class PipelineTeamX19V(Pipeline):
         merge_varcopes = Node(Merge(), name = 'merge_varcopes')
         merge_varcopes.inputs.dimension = 't'
 
-        # Split Node - Split mask list to serve them as inputs of the MultiImageMaths node.
-        split_masks = Node(Split(), name = 'split_masks')
-        split_masks.inputs.splits = [1, len(self.subject_list) - 1]
-        split_masks.inputs.squeeze = True # Unfold one-element splits removing the list
-
-        # MultiImageMaths Node - Create a subject mask by
+        # Function Node combine_masks - Create a subject mask by
         #   computing the intersection of all run masks.
-        mask_intersection = Node(MultiImageMaths(), name = 'mask_intersection')
-        mask_intersection.inputs.op_string = '-mul %s ' * (len(self.subject_list) - 1)
+        mask_intersection = Node(
+            InterfaceFactory.create('combine_masks'), name = 'mask_intersection')
+        mask_intersection.inputs.operation = 'intersection'
+        mask_intersection.inputs.suffix = '_maths'
 
         # MultipleRegressDesign Node - Specify model
         specify_model = Node(MultipleRegressDesign(), name = 'specify_model')
@@ -598,9 +577,7 @@ class PipelineTeamX19V(Pipeline):
             (select_files, get_varcopes, [('varcope', 'input_str')]),
             (get_copes, merge_copes, [(('out_list', clean_list), 'in_files')]),
             (get_varcopes, merge_varcopes,[(('out_list', clean_list), 'in_files')]),
-            (select_files, split_masks, [('masks', 'inlist')]),
-            (split_masks, mask_intersection, [('out1', 'in_file')]),
-            (split_masks, mask_intersection, [('out2', 'operand_files')]),
+            (select_files, mask_intersection, [('masks', 'masks')]),
             (mask_intersection, estimate_model, [('out_file', 'mask_file')]),
             (mask_intersection, smoothness_estimate, [('out_file', 'mask_file')]),
             (merge_copes, estimate_model, [('merged_file', 'cope_file')]),
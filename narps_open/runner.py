@@ -3,13 +3,20 @@
 
 """ This module allows to run pipelines from NARPS open. """
 
-from os.path import isfile
+from os.path import isfile, getsize
 from importlib import import_module
 from random import choices
 from argparse import ArgumentParser
 from enum import Flag, auto
+from copy import deepcopy
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from numpy import prod
+from nibabel import load
 from nipype import Workflow, config
+from nipype.pipeline.plugins import MultiProcPlugin
+from nipype.utils.profiler import get_system_total_memory_gb
 
 from narps_open.pipelines import Pipeline, implemented_pipelines
 from narps_open.data.participants import (
@@ -18,6 +25,7 @@ from narps_open.data.participants import (
     get_participants_subset
     )
 from narps_open.utils.configuration import Configuration
+from narps_open.utils.cache import FirstLevelOutputsCache
 from narps_open.pipelines import get_implemented_pipelines
 
 class PipelineRunnerLevel(Flag):
@@ -31,11 +39,118 @@ class PipelineRunnerLevel(Flag):
     FIRST = PREPROCESSING | RUN | SUBJECT
     SECOND = GROUP
 
+class ResourcesBudget():
+    """ A thread-safe account of the processors and memory shared by
+        all the workflows running at the same time.
+    """
+
+    def __init__(self, nb_procs: int, memory_gb: float) -> None:
+        """ Attributes of class ResourcesBudget are:
+            - nb_procs: int, total number of processors available
+            - memory_gb: float, total amount of memory (in GB) available
+        """
+        self.nb_procs = nb_procs
+        self.memory_gb = memory_gb
+        self._allocations = {}
+        self._allocations_lock = Lock()
+
+    def _get_free_resources(self) -> tuple:
+        """ Return a tuple (free memory in GB, free processors), allocations lock held """
+        free_memory_gb = self.memory_gb - sum(m for m, _ in self._allocations.values())
+        free_procs = self.nb_procs - sum(p for _, p in self._allocations.values())
+        return free_memory_gb, free_procs
+
+    def get_free_resources(self) -> tuple:
+        """ Return a tuple (free memory in GB, free processors) """
+        with self._allocations_lock:
+            free_memory_gb, free_procs = self._get_free_resources()
+
+        return max(free_memory_gb, 0.0), max(free_procs, 0)
+
+    def allocate(self, key, memory_gb: float, nb_procs: int) -> None:
+        """ Book resources for a task identified by key """
+        with self._allocations_lock:
+            self._allocations[key] = (memory_gb, nb_procs)
+
+    def try_allocate(self, key, memory_gb: float, nb_procs: int) -> bool:
+        """ Book resources for a task identified by key, only if they are free.
+            Checking and booking are atomic, so that concurrent workflows cannot
+            book the same resources.
+
+            Returns:
+                - bool, True if the resources were booked
+        """
+        with self._allocations_lock:
+            free_memory_gb, free_procs = self._get_free_resources()
+            if memory_gb > free_memory_gb or nb_procs > free_procs:
+                return False
+            self._allocations[key] = (memory_gb, nb_procs)
+            return True
+
+    def release(self, key) -> None:
+        """ Free the resources booked for the task identified by key """
+        with self._allocations_lock:
+            self._allocations.pop(key, None)
+
+class SharedMultiProcPlugin(MultiProcPlugin):
+    """ A nipype MultiProc plugin that draws processors and memory from a ResourcesBudget,
+        so that several workflows can run concurrently without exceeding the budget.
+    """
+
+    def __init__(self, budget: ResourcesBudget, plugin_args: dict = None) -> None:
+        plugin_args = dict(plugin_args or {})
+        plugin_args['n_procs'] = budget.nb_procs
+        plugin_args['memory_gb'] = budget.memory_gb
+        super().__init__(plugin_args = plugin_args)
+        self._budget = budget
+        self._bookings = {}
+
+    def _check_resources(self, running_tasks):
+        """ Return resources left in the shared budget """
+        return self._budget.get_free_resources()
+
+    def _submit_job(self, node, updatehash = False):
+        """ Book the resources of a job in the shared budget, then submit it.
+            If another workflow booked these resources in the meantime, the job is
+            not submitted (None is returned) and will be submitted later.
+        """
+        booking = (id(self), object())
+        if not self._budget.try_allocate(
+            booking, min(node.mem_gb, self.memory_gb), min(node.n_procs, self.processors)):
+            return None
+
+        try:
+            taskid = super()._submit_job(node, updatehash = updatehash)
+        except BaseException:
+            self._budget.release(booking)
+            raise
+        self._bookings[taskid] = booking
+        return taskid
+
+    def _clear_task(self, taskid):
+        """ Clear a finished job and release its resources """
+        super()._clear_task(taskid)
+        self._budget.release(self._bookings.pop(taskid, None))
+
+    def run(self, graph, config, updatehash = False):
+        """ Run the workflow graph, and release all the resources booked by this plugin
+            when it stops, including when a node crashes (with stop_on_first_crash,
+            nipype stops without clearing the crashed and the running tasks).
+        """
+        try:
+            return super().run(graph, config, updatehash = updatehash)
+        finally:
+            for booking in self._bookings.values():
+                self._budget.release(booking)
+            self._bookings.clear()
+
 class PipelineRunner():
     """ A class that allows to run a NARPS pipeline. """
 
     def __init__(self, team_id: str = '') -> None:
         self._pipeline = None
+        self._budget = None
+        self._cache = None
 
         # Set team_id. It's important to use the property setter here,
         # so that the code inside it is executed. That would not be the
@@ -76,6 +191,31 @@ class PipelineRunner():
         # Get a subset of participants
         self._pipeline.subject_list = get_participants_subset(value)
 
+    @property
+    def budget(self) -> ResourcesBudget:
+        """ Getter for property budget """
+        return self._budget
+
+    @budget.setter
+    def budget(self, value: ResourcesBudget) -> None:
+        """ Setter for property budget.
+            If set, workflows are run using resources shared with other runners.
+        """
+        self._budget = value
+
+    @property
+    def cache(self) -> FirstLevelOutputsCache:
+        """ Getter for property cache """
+        return self._cache
+
+    @cache.setter
+    def cache(self, value: FirstLevelOutputsCache) -> None:
+        """ Setter for property cache.
+            If set, first level outputs are restored from / stored in the cache
+            when starting the runner.
+        """
+        self._cache = value
+
     @property
     def team_id(self) -> str:
         """ Getter for property team_id """
@@ -125,75 +265,353 @@ all elements must be of type nipype.Workflow')
             return input_workflow
         raise AttributeError('Workflow must be of type list or nipype.Workflow')
 
-    def start(self, level: PipelineRunnerLevel = PipelineRunnerLevel.ALL) -> None:
+    @staticmethod
+    def get_level_workflows(pipeline: Pipeline, level: PipelineRunnerLevel) -> tuple:
         """
-        Start the pipeline
+        Return the workflows of a pipeline corresponding to the level(s)
 
         Arguments:
-            - level: PipelineRunnerLevel, indicates which workflow(s) to run
-        """
-        # Set global nipype config for pipeline execution
-        config.update_config(dict(execution = {'stop_on_first_crash': 'True'}))
-
-        # Disclaimer
-        print('Starting pipeline for team: '+
-            f'{self.team_id}, with {len(self.subjects)} subjects: {self.subjects}')
-        print(f'\tThe following levels will be run: {level}')
+            - pipeline: Pipeline, the pipeline to get workflows from
+            - level: PipelineRunnerLevel, indicates which workflow(s) to get
 
-        # Generate workflow list & level list
+        Returns:
+            - a list of nipype.Workflow, in the order they must be run
+            - a list of PipelineRunnerLevel, the same length as the list of workflows:
+                the level completed after each workflow ran,
+                or PipelineRunnerLevel.NONE if the level is not completed yet
+        """
         workflows = []
         levels = []
 
         if bool(level & PipelineRunnerLevel.PREPROCESSING):
-            new_workflows = self.get_workflows(self._pipeline.get_preprocessing())
+            new_workflows = PipelineRunner.get_workflows(pipeline.get_preprocessing())
             workflows += new_workflows
             levels += [PipelineRunnerLevel.NONE for w in new_workflows[:-1]]
             levels += [PipelineRunnerLevel.PREPROCESSING for w in new_workflows[-1:]]
         if bool(level & PipelineRunnerLevel.RUN):
-            new_workflows = self.get_workflows(self._pipeline.get_run_level_analysis())
+            new_workflows = PipelineRunner.get_workflows(pipeline.get_run_level_analysis())
             workflows += new_workflows
             levels += [PipelineRunnerLevel.NONE for w in new_workflows[:-1]]
             levels += [PipelineRunnerLevel.RUN for w in new_workflows[-1:]]
         if bool(level & PipelineRunnerLevel.SUBJECT):
-            new_workflows = self.get_workflows(self._pipeline.get_subject_level_analysis())
+            new_workflows = PipelineRunner.get_workflows(pipeline.get_subject_level_analysis())
             workflows += new_workflows
             levels += [PipelineRunnerLevel.NONE for w in new_workflows[:-1]]
             levels += [PipelineRunnerLevel.SUBJECT for w in new_workflows[-1:]]
         if bool(level & PipelineRunnerLevel.GROUP):
-            new_workflows = self.get_workflows(self._pipeline.get_group_level_analysis())
+            new_workflows = PipelineRunner.get_workflows(pipeline.get_group_level_analysis())
             workflows += new_workflows
             levels += [PipelineRunnerLevel.NONE for w in new_workflows[:-1]]
             levels += [PipelineRunnerLevel.GROUP for w in new_workflows[-1:]]
 
-        # Launch workflows
-        for workflow, current_level in zip(workflows, levels):
-            nb_procs = Configuration()['runner']['nb_procs']
-            if nb_procs > 1:
-                workflow.run('MultiProc', plugin_args = {'n_procs': nb_procs})
+        return workflows, levels
+
+    def start(
+        self,
+        level: PipelineRunnerLevel = PipelineRunnerLevel.ALL,
+        pipelining: bool = False,
+        resume: bool = False
+        ) -> None:
+        """
+        Start the pipeline
+
+        Arguments:
+            - level: PipelineRunnerLevel, indicates which workflow(s) to run
+            - pipelining: bool, if True each subject goes through the first levels
+                (preprocessing, run, subject) independently from the other subjects,
+                and the group level starts once all the subject level outputs are available.
+                If False, each level is run for all subjects before starting the next one.
+            - resume: bool, if True only run the workflows needed to generate missing
+                (or invalid) outputs, see PipelineRunner.get_first_levels_to_run
+        """
+        # Set global nipype config for pipeline execution
+        config.update_config(dict(execution = {'stop_on_first_crash': 'True'}))
+
+        # Disclaimer
+        print('Starting pipeline for team: '+
+            f'{self.team_id}, with {len(self.subjects)} subjects: {self.subjects}')
+        print(f'\tThe following levels will be run: {level}')
+
+        # Restore first level outputs from the cache, then only run what is still missing
+        use_cache = self._cache is not None and bool(level & PipelineRunnerLevel.FIRST)
+        if use_cache:
+            restored = self.restore_from_cache()
+            print(f'\tFirst level outputs restored from the cache for subjects: {restored}')
+            resume = True
+
+        try:
+            if pipelining:
+                self.start_pipelining(level, resume)
+            elif resume:
+                self.start_resume(level)
             else:
-                workflow.run()
-            self.get_missing_outputs(current_level)
+                # Launch workflows
+                for workflow, current_level in zip(
+                    *self.get_level_workflows(self._pipeline, level)):
+                    self.run_workflow(workflow)
+                    self.get_missing_outputs(current_level)
+        finally:
+            if use_cache:
+                self.store_in_cache(restored)
+
+    def restore_from_cache(self) -> list:
+        """
+        Restore the first level outputs of the subjects from the cache,
+        for subjects whose outputs are missing.
 
-    def get_missing_outputs(self, level: PipelineRunnerLevel = PipelineRunnerLevel.ALL):
+        Returns:
+            - list, the subjects for which outputs were restored
+        """
+        restored = []
+        for subject_id in self.subjects:
+            pipeline = deepcopy(self._pipeline)
+            pipeline.subject_list = [subject_id]
+            if self.get_invalid_outputs(pipeline, PipelineRunnerLevel.FIRST) \
+                and self._cache.restore(self._pipeline, subject_id):
+                restored.append(subject_id)
+
+        return restored
+
+    def store_in_cache(self, skipped_subjects: list = None) -> list:
+        """
+        Store the first level outputs of the subjects in the cache.
+
+        Arguments:
+            - skipped_subjects: list, subjects not to store (e.g.: because their outputs
+                were just restored from the cache)
+
+        Returns:
+            - list, the subjects for which outputs were stored
+        """
+        skipped_subjects = skipped_subjects or []
+        return [s for s in self.subjects
+            if s not in skipped_subjects and self._cache.store(self._pipeline, s)]
+
+    def start_resume(self, level: PipelineRunnerLevel = PipelineRunnerLevel.ALL) -> None:
+        """
+        Start the pipeline, only for the subjects and levels whose outputs are missing.
+
+        Arguments:
+            - level: PipelineRunnerLevel, indicates which workflow(s) to run
+        """
+        # Gather subjects that need the same levels to be run
+        subjects_per_level = {}
+        for subject_id, subject_level in self.get_first_levels_to_run(level).items():
+            subjects_per_level.setdefault(subject_level, []).append(subject_id)
+
+        # Run first levels, for each group of subjects
+        for subject_level, subjects in subjects_per_level.items():
+            print(f'\tResuming levels {subject_level} for subjects: {subjects}')
+            pipeline = deepcopy(self._pipeline)
+            pipeline.subject_list = subjects
+            for workflow in self.get_level_workflows(pipeline, subject_level)[0]:
+                self.run_workflow(workflow)
+
+        if bool(level & PipelineRunnerLevel.FIRST):
+            self.get_missing_outputs(level & PipelineRunnerLevel.FIRST)
+
+        # Run group level if its outputs are missing
+        if bool(level & PipelineRunnerLevel.GROUP) \
+            and self.get_missing_outputs(PipelineRunnerLevel.GROUP):
+            for workflow, current_level in zip(
+                *self.get_level_workflows(self._pipeline, PipelineRunnerLevel.GROUP)):
+                self.run_workflow(workflow)
+                self.get_missing_outputs(current_level)
+
+    def get_first_levels_to_run(self, level: PipelineRunnerLevel = PipelineRunnerLevel.ALL) -> dict:
+        """
+        Return the first levels (preprocessing, run, subject) that must be run for each subject,
+        so that all the outputs of these levels are generated. Once a level has missing or
+        invalid outputs for a subject, this level and all the following ones must be run.
+
+        Arguments:
+            - level: PipelineRunnerLevel, the levels to check
+
+        Returns:
+            - dict, with subject ids as keys and PipelineRunnerLevel as values.
+                Subjects with all the outputs already generated are not part of the dict.
+        """
+        first_levels = [
+            l for l in [
+                PipelineRunnerLevel.PREPROCESSING,
+                PipelineRunnerLevel.RUN,
+                PipelineRunnerLevel.SUBJECT
+                ]
+            if bool(level & l)
+            ]
+
+        levels_to_run = {}
+        for subject_id in self.subjects:
+            pipeline = deepcopy(self._pipeline)
+            pipeline.subject_list = [subject_id]
+
+            subject_level = PipelineRunnerLevel.NONE
+            for first_level in first_levels:
+                if subject_level or self.get_invalid_outputs(pipeline, first_level):
+                    subject_level |= first_level
+
+            if subject_level:
+                levels_to_run[subject_id] = subject_level
+
+        return levels_to_run
+
+    def start_pipelining(
+        self,
+        level: PipelineRunnerLevel = PipelineRunnerLevel.ALL,
+        resume: bool = False
+        ) -> None:
+        """
+        Start the pipeline, running the first levels subject by subject, concurrently.
+        The workflows of all subjects share the resources budget of the runner, or a budget
+        created from the configuration if not set.
+
+        Arguments:
+            - level: PipelineRunnerLevel, indicates which workflow(s) to run
+            - resume: bool, if True only run the workflows needed to generate missing outputs
+        """
+        budget = self._budget
+        if budget is None:
+            budget = ResourcesBudget(
+                Configuration()['runner']['nb_procs'],
+                Configuration()['runner'].get('memory_gb', 0) or get_system_total_memory_gb() * 0.9
+                )
+
+        # Levels to run for each subject
+        if resume:
+            levels_to_run = self.get_first_levels_to_run(level)
+        else:
+            levels_to_run = {s: level & PipelineRunnerLevel.FIRST for s in self.subjects}
+
+        # Run first levels, one chain of workflows per subject
+        if bool(level & PipelineRunnerLevel.FIRST):
+            errors = {}
+            with ThreadPoolExecutor(max_workers = max(budget.nb_procs, 1)) as executor:
+                futures = {
+                    executor.submit(
+                        self.run_subject, subject_id, subject_level, budget
+                        ): subject_id
+                    for subject_id, subject_level in levels_to_run.items()
+                }
+                for future in as_completed(futures):
+                    if future.exception() is not None:
+                        errors[futures[future]] = future.exception()
+                        print(f'Pipeline for team {self.team_id} failed for subject '
+                            f'{futures[future]}: {future.exception()}')
+
+            self.get_missing_outputs(level & PipelineRunnerLevel.FIRST)
+            if errors:
+                raise RuntimeError(f'Pipeline for team {self.team_id} failed for subjects: '
+                    f'{sorted(errors.keys())}')
+
+        # Run group level once the subject level outputs it needs are available
+        if bool(level & PipelineRunnerLevel.GROUP):
+            if resume and not self.get_invalid_outputs(self._pipeline, PipelineRunnerLevel.GROUP):
+                return
+            if self.get_missing_outputs(PipelineRunnerLevel.SUBJECT):
+                raise RuntimeError('Subject level outputs are missing, '
+                    f'cannot start group level for team {self.team_id}')
+
+            for workflow, current_level in zip(
+                *self.get_level_workflows(self._pipeline, PipelineRunnerLevel.GROUP)):
+                self.run_workflow(workflow, budget)
+                self.get_missing_outputs(current_level)
+
+    def run_subject(
+        self, subject_id: str, level: PipelineRunnerLevel, budget: ResourcesBudget = None
+        ) -> None:
         """
-        Return the list of missing files after computations of the level(s)
+        Run the workflows of the pipeline for one subject only
 
         Arguments:
+            - subject_id: str, the subject to run the workflows for
+            - level: PipelineRunnerLevel, indicates which workflow(s) to run
+            - budget: ResourcesBudget, the resources to run the workflows with (if any)
+        """
+        pipeline = deepcopy(self._pipeline)
+        pipeline.subject_list = [subject_id]
+
+        for workflow in self.get_level_workflows(pipeline, level)[0]:
+            self.run_workflow(workflow, budget)
+
+    def run_workflow(self, workflow: Workflow, budget: ResourcesBudget = None) -> None:
+        """
+        Run a workflow, using a resources budget if set,
+        or the number of processors from the configuration otherwise.
+
+        Arguments:
+            - workflow: nipype.Workflow, the workflow to run
+            - budget: ResourcesBudget, the resources to run the workflow with.
+                Defaults to the budget of the runner.
+        """
+        if budget is None:
+            budget = self._budget
+
+        if budget is not None:
+            workflow.run(plugin = SharedMultiProcPlugin(budget))
+            return
+
+        nb_procs = Configuration()['runner']['nb_procs']
+        if nb_procs > 1:
+            workflow.run('MultiProc', plugin_args = {'n_procs': nb_procs})
+        else:
+            workflow.run()
+
+    @staticmethod
+    def is_valid_output(file_name: str) -> bool:
+        """
+        Return True if the file exists and, in case it is a Nifti image, if its header can be read
+        and its size is consistent with the header (for uncompressed images only).
+
+        Arguments:
+            - file_name: str, path to the file to check
+        """
+        if not isfile(file_name):
+            return False
+
+        if file_name.endswith('.nii') or file_name.endswith('.nii.gz'):
+            try:
+                header = load(file_name).header
+            except Exception: # pylint: disable=broad-exception-caught
+                return False
+
+            if file_name.endswith('.nii'):
+                expected_size = header.get_data_offset() \
+                    + int(prod(header.get_data_shape())) * header.get_data_dtype().itemsize
+                return getsize(file_name) >= expected_size
+
+        return True
+
+    @staticmethod
+    def get_invalid_outputs(pipeline: Pipeline, level: PipelineRunnerLevel) -> list:
+        """
+        Return the list of missing or invalid output files of a pipeline, for the level(s)
+
+        Arguments:
+            - pipeline: Pipeline, the pipeline to check outputs of
             - level: PipelineRunnerLevel, indicates for which workflow(s) to search output files
         """
         # Generate files list
         files = []
         if bool(level & PipelineRunnerLevel.PREPROCESSING):
-            files += self._pipeline.get_preprocessing_outputs()
+            files += pipeline.get_preprocessing_outputs()
         if bool(level & PipelineRunnerLevel.RUN):
-            files += self._pipeline.get_run_level_outputs()
+            files += pipeline.get_run_level_outputs()
         if bool(level & PipelineRunnerLevel.SUBJECT):
-            files += self._pipeline.get_subject_level_outputs()
+            files += pipeline.get_subject_level_outputs()
         if bool(level & PipelineRunnerLevel.GROUP):
-            files += self._pipeline.get_group_level_outputs()
+            files += pipeline.get_group_level_outputs()
+
+        # Get non existing or invalid files
+        return [f for f in files if not PipelineRunner.is_valid_output(f)]
+
+    def get_missing_outputs(self, level: PipelineRunnerLevel = PipelineRunnerLevel.ALL):
+        """
+        Return the list of missing (or invalid) files after computations of the level(s)
 
-        # Get non existing files
-        missing = [f for f in files if not isfile(f)]
+        Arguments:
+            - level: PipelineRunnerLevel, indicates for which workflow(s) to search output files
+        """
+        missing = self.get_invalid_outputs(self._pipeline, level)
 
         # Disclaimer
         if missing:
@@ -204,13 +622,87 @@ all elements must be of type nipype.Workflow')
         # Return non existing files
         return missing
 
+class PipelineBatchRunner():
+    """ A class that allows to run several NARPS pipelines concurrently,
+        sharing a global budget of processors and memory.
+    """
+
+    def __init__(self, team_ids: list, nb_procs: int = None, memory_gb: float = None) -> None:
+        """ Attributes of class PipelineBatchRunner are:
+            - runners: dict, a PipelineRunner for each team ID
+            - budget: ResourcesBudget, processors and memory shared by all runners. Default values
+                are read from the configuration ('runner' section), or from the system if missing.
+            - report: dict, completion status of each team after calling start()
+        """
+        if nb_procs is None:
+            nb_procs = Configuration()['runner']['nb_procs']
+        if memory_gb is None:
+            memory_gb = Configuration()['runner'].get('memory_gb', 0)
+        if not memory_gb:
+            memory_gb = get_system_total_memory_gb() * 0.9
+
+        self.budget = ResourcesBudget(nb_procs, memory_gb)
+        self.runners = {}
+        for team_id in dict.fromkeys(team_ids): # remove duplicates
+            runner = PipelineRunner(team_id)
+            runner.budget = self.budget
+            self.runners[team_id] = runner
+        self.report = {}
+
+    def start(
+        self,
+        level: PipelineRunnerLevel = PipelineRunnerLevel.ALL,
+        pipelining: bool = False,
+        resume: bool = False
+        ) -> dict:
+        """
+        Start all the pipelines concurrently, and wait for them to complete.
+
+        Arguments:
+            - level: PipelineRunnerLevel, indicates which workflow(s) to run for each team
+            - pipelining: bool, whether to run the first levels subject by subject
+                (see PipelineRunner.start)
+            - resume: bool, whether to only run the workflows needed to generate missing outputs
+                (see PipelineRunner.start)
+
+        Returns:
+            - dict, the completion report: for each team ID, a dict with keys
+                - 'status': str, 'success' if all outputs were generated, 'failure' otherwise
+                - 'error': str, the error raised by the pipeline (if any)
+                - 'missing_outputs': list, the missing output files
+        """
+        self.report = {}
+        with ThreadPoolExecutor(max_workers = max(len(self.runners), 1)) as executor:
+            futures = {
+                executor.submit(runner.start, level, pipelining, resume): team_id
+                for team_id, runner in self.runners.items()
+            }
+            for future in as_completed(futures):
+                team_id = futures[future]
+                error = future.exception()
+                missing = self.runners[team_id].get_missing_outputs(level)
+                self.report[team_id] = {
+                    'status': 'failure' if error is not None or missing else 'success',
+                    'error': '' if error is None else str(error),
+                    'missing_outputs': missing
+                }
+                print(f'Pipeline for team {team_id} completed with status: '
+                    f'{self.report[team_id]["status"]} '
+                    f'({len(self.report)}/{len(self.runners)} teams completed)')
+
+        return self.report
+
 def main():
     """ Entry-point for the command line tool narps_open_runner """
 
     # Parse arguments
     parser = ArgumentParser(description='Run the pipelines from NARPS.')
-    parser.add_argument('-t', '--team', type=str, required=True,
+    teams = parser.add_mutually_exclusive_group(required=True)
+    teams.add_argument('-t', '--team', type=str,
         help='the team ID', choices=get_implemented_pipelines())
+    teams.add_argument('-T', '--teams', nargs='+', type=str, action='extend',
+        help='a list of team IDs, whose pipelines are run concurrently',
+        choices=get_implemented_pipelines())
     subjects = parser.add_mutually_exclusive_group(required=True)
     subjects.add_argument('-s', '--subjects', nargs='+', type=str, action='extend',
         help='a list of subjects to be selected')
@@ -226,6 +718,12 @@ def main():
         help='check pipeline outputs (runner is not launched)')
     parser.add_argument('-e', '--exclusions', action='store_true', required=False,
         help='run the analyses without the excluded subjects')
+    parser.add_argument('--pipelining', action='store_true', required=False,
+        help='run the first levels subject by subject, without waiting for the other subjects')
+    parser.add_argument('--resume', action='store_true', required=False,
+        help='only run the workflows needed to generate missing outputs')
+    parser.add_argument('--cache', action='store_true', required=False,
+        help='restore / store first level outputs from / in the cache directory')
     arguments = parser.parse_args()
 
     # Check arguments
@@ -233,27 +731,36 @@ def main():
         print('Argument -e/--exclusions only works with -n/--nsubjects')
         return
 
-    # Initialize a PipelineRunner
-    runner = PipelineRunner(team_id = arguments.team)
-    runner.pipeline.directories.dataset_dir = Configuration()['directories']['dataset']
-    runner.pipeline.directories.results_dir = Configuration()['directories']['reproduced_results']
-    runner.pipeline.directories.set_output_dir_with_team_id(arguments.team)
-    runner.pipeline.directories.set_working_dir_with_team_id(arguments.team)
-
-    # Handle subjects
-    if arguments.subjects is not None:
-        runner.subjects = arguments.subjects
-    elif arguments.rsubjects is not None:
-        runner.random_nb_subjects = int(arguments.rsubjects)
+    # Initialize PipelineRunners
+    if arguments.teams is not None:
+        batch_runner = PipelineBatchRunner(arguments.teams)
+        runners = list(batch_runner.runners.values())
     else:
-        if arguments.exclusions:
-            # Intersection between the requested subset and the list of not excluded subjects
-            runner.subjects = list(
-                set(get_participants_subset(int(arguments.nsubjects)))
-              & set(get_participants(arguments.team))
-            )
+        runners = [PipelineRunner(team_id = arguments.team)]
+
+    for runner in runners:
+        runner.pipeline.directories.dataset_dir = Configuration()['directories']['dataset']
+        runner.pipeline.directories.results_dir = \
+            Configuration()['directories']['reproduced_results']
+        runner.pipeline.directories.set_output_dir_with_team_id(runner.team_id)
+        runner.pipeline.directories.set_working_dir_with_team_id(runner.team_id)
+        if arguments.cache:
+            runner.cache = FirstLevelOutputsCache(Configuration()['directories']['cache'])
+
+        # Handle subjects
+        if arguments.subjects is not None:
+            runner.subjects = arguments.subjects
+        elif arguments.rsubjects is not None:
+            runner.random_nb_subjects = int(arguments.rsubjects)
         else:
-            runner.nb_subjects = int(arguments.nsubjects)
+            if arguments.exclusions:
+                # Intersection between the requested subset and the list of not excluded subjects
+                runner.subjects = list(
+                    set(get_participants_subset(int(arguments.nsubjects)))
+                  & set(get_participants(runner.team_id))
+                )
+            else:
+                runner.nb_subjects = int(arguments.nsubjects)
 
     # Build pipeline runner level
     if arguments.levels is None:
@@ -271,11 +778,14 @@ def main():
 
     # Check data
     if arguments.check:
-        runner.get_missing_outputs(level)
+        for runner in runners:
+            runner.get_missing_outputs(level)
 
-    # Start the runner
+    # Start the runner(s)
+    elif arguments.teams is not None:
+        batch_runner.start(level, arguments.pipelining, arguments.resume)
     else:
-        runner.start(level)
+        runners[0].start(level, arguments.pipelining, arguments.resume)
 
 if __name__ == '__main__':
     main()
@@ -5,8 +5,11 @@
 
 from os import listdir
 from os.path import isfile, join, abspath, dirname, realpath, splitext
+from json import dumps
 
 from nibabel import load
+from nibabel.openers import ImageOpener
+from numpy import ascontiguousarray, asanyarray, frombuffer, float64, prod
 from hashlib import sha256
 
 def show_download_progress(count, block_size, total_size):
@@ -29,41 +32,100 @@ def show_download_progress(count, block_size, total_size):
     # Showing download progress
     print('Downloading', display_value, end='\r')
 
-def hash_image(path_img: str) -> str:
+def hash_image(path_img: str, canonical: bool = False, chunk_size: int = 1024 * 1024) -> str:
     """ Return the sha256 hash of a nifti image
         Arguments:
         - path_img, str: path to the nifti image
+        - canonical, bool: if True, hash the canonical form of the image (see below)
+            instead of the legacy form
+        - chunk_size, int: approximate size in bytes of the chunks of data passed to the hasher
+
+        The legacy form is the concatenation of: the affine (float64 values, native byte
+        order), the names of the header fields, and the data as float64 values
+        (native byte order, C order). It is computed chunk by chunk, without a float64
+        copy of the whole image.
+
+        The canonical form does not depend on the machine nor on the compression of
+        the file, it is the concatenation of:
+        - the string 'narps_open.hash_image.v1\n';
+        - a JSON string (with sorted keys) containing the shape of the data, the dtype
+            of the stored data (little-endian numpy notation, e.g.: '<f4'), the affine,
+            the scaling slope and intercept, and the order of the data ('F');
+        - the stored (unscaled) data, in little-endian byte order and Fortran order.
+        In this form, data are read from the file by chunks, without being loaded at once.
     """
 
     # Load image
     image = load(path_img)
-
-    # Hash data
     hasher = sha256()
-    for element in image.affine.ravel():
-        hasher.update(element)
-    for element in image.header:
-        hasher.update(element.encode(encoding='utf-8'))
-    for element in image.get_fdata().ravel():
-        hasher.update(element)
+
+    if not canonical:
+        # Hash affine and header
+        hasher.update(ascontiguousarray(image.affine, dtype = float64).tobytes())
+        hasher.update(''.join(image.header).encode(encoding='utf-8'))
+
+        # Hash data, chunk by chunk along the first axis. Data with scaling
+        # parameters are scaled as float64, the same way get_fdata does.
+        data = image.get_fdata() if image.dataobj.slope != 1.0 or image.dataobj.inter != 0.0 \
+            else asanyarray(image.dataobj)
+        nb_rows = max(1, chunk_size // max(1, 8 * data[0].size))
+        for index in range(0, data.shape[0], nb_rows):
+            hasher.update(ascontiguousarray(data[index:index+nb_rows], dtype = float64).data)
+
+        return hasher.hexdigest()
+
+    # Hash the description of the data
+    proxy = image.dataobj
+    dtype = proxy.dtype.newbyteorder('<')
+    hasher.update(b'narps_open.hash_image.v1\n')
+    hasher.update(dumps({
+        'shape': [int(s) for s in proxy.shape],
+        'dtype': dtype.str,
+        'affine': image.affine.tolist(),
+        'slope': float(proxy.slope),
+        'inter': float(proxy.inter),
+        'order': 'F'
+        }, sort_keys = True).encode(encoding = 'utf-8'))
+
+    # Hash data, reading the file by chunks
+    nb_bytes = int(prod(proxy.shape)) * dtype.itemsize
+    chunk_size = max(dtype.itemsize, chunk_size - chunk_size % dtype.itemsize)
+    with ImageOpener(proxy.file_like) as file:
+        file.seek(proxy.offset)
+        while nb_bytes > 0:
+            chunk = file.read(min(chunk_size, nb_bytes))
+            if not chunk:
+                raise ValueError(f'Data of {path_img} are truncated.')
+            nb_bytes -= len(chunk)
+            if proxy.dtype != dtype: # Data are not stored in little-endian byte order
+                chunk = frombuffer(chunk, dtype = proxy.dtype).astype(dtype).tobytes()
+            hasher.update(chunk)
 
     return hasher.hexdigest()
 
-def hash_dir_images(path: str) -> str:
+def hash_dir_images(path: str, nb_workers: int = 1, index_file: str = None) -> str:
     """ Return the sha256 hash of hashes of nifti images inside a directory
         Arguments:
         - path, str: path to the directory
+        - nb_workers, int: number of processes computing the hashes of images
+        - index_file, str: path to a file storing hashes of images already computed,
+            see narps_open.utils.hash.ImageHashIndex
     """
+    # This import stays here, to avoid a circular import
+    from narps_open.utils.hash import hash_images, ImageHashIndex
+
     # Create the list of images
     image_list = []
     for file in listdir(path):
         if isfile(join(path, file)) and file.endswith('.nii.gz'):
             image_list.append(join(path, file))
+    image_list = sorted(image_list)
 
     # Hash data
+    hashes = hash_images(image_list, nb_workers, ImageHashIndex(index_file))
     hasher = sha256()
-    for image in sorted(image_list):
-        hasher.update(hash_image(image).encode(encoding = 'utf-8'))
+    for image in image_list:
+        hasher.update(hashes[image].encode(encoding = 'utf-8'))
 
     return hasher.hexdigest()
 
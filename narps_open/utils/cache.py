@@ -0,0 +1,272 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" A content-addressed cache for the first level outputs of the pipelines """
+
+from os import makedirs, walk, replace, remove, chmod
+from os.path import join, isfile, isdir, relpath, dirname, basename
+from stat import S_IRUSR, S_IRGRP, S_IROTH
+from shutil import copyfile
+from inspect import getsourcefile
+from importlib.metadata import version, PackageNotFoundError
+from hashlib import sha256
+from json import dumps, load, dump
+from tempfile import mkstemp
+from copy import deepcopy
+
+from narps_open.pipelines import Pipeline
+from narps_open.data.description import TeamDescription
+from narps_open.utils.hash import ImageHashIndex
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """ Return the sha256 hash of the contents of a file
+        Arguments:
+        - path, str: path to the file
+        - chunk_size, int: size in bytes of the chunks read from the file
+    """
+    hasher = sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+def get_software_versions(software: str = None) -> dict:
+    """ Return the versions of the tools used to compute the outputs of a pipeline
+
+        Arguments:
+        - software, str: the neuroimaging software used by the pipeline ('SPM', 'FSL', 'AFNI')
+
+        Returns:
+        - dict, with tool names as keys and versions as values
+    """
+    versions = {}
+    for package in ['narps_open', 'nipype', 'nibabel', 'nilearn', 'numpy', 'scipy']:
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+
+    # These imports stay here, as they are only needed for the given software
+    if software == 'SPM':
+        from nipype.interfaces.spm import Info
+        versions['SPM'] = str(Info.getinfo())
+    elif software == 'FSL':
+        from nipype.interfaces.fsl import Info
+        versions['FSL'] = str(Info.version())
+    elif software == 'AFNI':
+        from nipype.interfaces.afni import Info
+        versions['AFNI'] = str(Info.version())
+
+    return versions
+
+class FirstLevelOutputsCache():
+    """ A cache storing the first level outputs (preprocessing, run level and subject level)
+        of a pipeline, for each subject.
+
+        The key of the cache for a subject is a hash of:
+        - the team ID;
+        - the parameters of the pipeline (e.g.: fwhm, contrast_list, ...) and the source code
+            of the pipeline module (which holds the model settings);
+        - the contents of the input files of the subject, in the dataset;
+        - the versions of the tools used.
+
+        Output files are copied once into the cache, as read-only files named after the
+        hash of their contents. They are then copied into the output directories of later
+        runs, so that modifying a restored file never alters the cached object.
+
+        Hashes of input and output files are kept in a persistent index inside the cache
+        directory (see narps_open.utils.hash.ImageHashIndex), so that a file is hashed
+        again only if its size or modification time changed.
+
+        Arguments:
+        - directory, str: path to the directory where the cache is stored
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._file_hashes = ImageHashIndex(join(directory, 'file_hashes.json'))
+        self._file_hashes_changed = False
+        self._software_versions = {}
+
+    @property
+    def objects_directory(self) -> str:
+        """ Getter for property objects_directory, where output files are stored """
+        return join(self.directory, 'objects')
+
+    @property
+    def entries_directory(self) -> str:
+        """ Getter for property entries_directory, where manifests for each key are stored """
+        return join(self.directory, 'entries')
+
+    def get_file_hash(self, path: str) -> str:
+        """ Return the hash of a file, computed once per file version """
+        file_hash = self._file_hashes.get(path)
+        if file_hash is None:
+            file_hash = hash_file(path)
+            self._file_hashes.set(path, file_hash)
+            self._file_hashes_changed = True
+
+        return file_hash
+
+    def save_file_hashes(self) -> None:
+        """ Write the index of file hashes, if new hashes were computed """
+        if self._file_hashes_changed:
+            self._file_hashes.save()
+            self._file_hashes_changed = False
+
+    @staticmethod
+    def get_input_files(dataset_dir: str, subject_id: str) -> list:
+        """ Return the sorted list of input files of a subject inside the dataset:
+            raw data (sub-*) and fMRIprep derivatives (derivatives/fmriprep/sub-*)
+        """
+        input_files = []
+        for directory in [
+            join(dataset_dir, f'sub-{subject_id}'),
+            join(dataset_dir, 'derivatives', 'fmriprep', f'sub-{subject_id}')
+            ]:
+            for root, _, files in walk(directory):
+                input_files += [join(root, f) for f in files]
+
+        return sorted(input_files)
+
+    @staticmethod
+    def get_parameters(pipeline: Pipeline) -> dict:
+        """ Return the parameters of a pipeline, that are independent from the subjects
+            and directories.
+        """
+        return {
+            key.lstrip('_'): value for key, value in vars(pipeline).items()
+            if key.lstrip('_') not in ['directories', 'subject_list']
+        }
+
+    def get_software_versions(self, team_id: str) -> dict:
+        """ Return the versions of the tools used by a team """
+        if team_id not in self._software_versions:
+            try:
+                software = TeamDescription(team_id).categorized_for_analysis['analysis_SW']
+            except AttributeError:
+                software = None
+            self._software_versions[team_id] = get_software_versions(software)
+
+        return self._software_versions[team_id]
+
+    def get_key(self, pipeline: Pipeline, subject_id: str) -> str:
+        """ Return the key of the cache for a subject and a pipeline """
+        source_file = getsourcefile(type(pipeline))
+        dataset_dir = pipeline.directories.dataset_dir
+
+        key_contents = {
+            'team_id': pipeline.team_id,
+            'parameters': self.get_parameters(pipeline),
+            'source': self.get_file_hash(source_file) if source_file else None,
+            'inputs': {
+                relpath(f, dataset_dir): self.get_file_hash(f)
+                for f in self.get_input_files(dataset_dir, subject_id)
+                },
+            'versions': self.get_software_versions(pipeline.team_id)
+        }
+
+        return sha256(
+            dumps(key_contents, sort_keys = True, default = str).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def get_outputs(pipeline: Pipeline, subject_id: str) -> list:
+        """ Return the list of first level outputs of a pipeline, for a subject """
+        subject_pipeline = deepcopy(pipeline)
+        subject_pipeline.subject_list = [subject_id]
+
+        return subject_pipeline.get_preprocessing_outputs() \
+            + subject_pipeline.get_run_level_outputs() \
+            + subject_pipeline.get_subject_level_outputs()
+
+    def get_object_path(self, file_hash: str) -> str:
+        """ Return the path to the stored file whose contents have the hash file_hash """
+        return join(self.objects_directory, file_hash[:2], file_hash[2:])
+
+    def get_entry_path(self, key: str) -> str:
+        """ Return the path to the manifest file of an entry of the cache """
+        return join(self.entries_directory, f'{key}.json')
+
+    @staticmethod
+    def copy_file(source: str, destination: str, read_only: bool = False) -> None:
+        """ Copy source at destination, atomically.
+            Arguments:
+            - source, str: path to the file to copy
+            - destination, str: path to the copy
+            - read_only, bool: whether to make the copy read-only
+        """
+        makedirs(dirname(destination), exist_ok = True)
+        temporary_file = join(dirname(destination), f'.{basename(destination)}.tmp')
+        if isfile(temporary_file):
+            remove(temporary_file)
+        copyfile(source, temporary_file)
+        if read_only:
+            chmod(temporary_file, S_IRUSR | S_IRGRP | S_IROTH)
+        replace(temporary_file, destination)
+
+    def store(self, pipeline: Pipeline, subject_id: str) -> bool:
+        """ Store the first level outputs of a pipeline for a subject.
+            Return False if some outputs are missing (nothing is stored), True otherwise.
+            Nothing is stored either if the cache already has an entry for the subject.
+        """
+        outputs = self.get_outputs(pipeline, subject_id)
+        if not outputs or not all(isfile(f) for f in outputs):
+            return False
+
+        key = self.get_key(pipeline, subject_id)
+        if isfile(self.get_entry_path(key)):
+            self.save_file_hashes()
+            return True
+
+        manifest = []
+        for output in outputs:
+            file_hash = self.get_file_hash(output)
+            object_path = self.get_object_path(file_hash)
+            if not isfile(object_path):
+                self.copy_file(output, object_path, read_only = True)
+            manifest.append({
+                'path': relpath(output, pipeline.directories.results_dir),
+                'hash': file_hash
+                })
+
+        # Write the manifest atomically
+        makedirs(self.entries_directory, exist_ok = True)
+        file_descriptor, temporary_file = mkstemp(dir = self.entries_directory)
+        with open(file_descriptor, 'w', encoding = 'utf-8') as file:
+            dump({'subject_id': subject_id, 'outputs': manifest}, file, indent = 4)
+        replace(temporary_file, self.get_entry_path(key))
+        self.save_file_hashes()
+
+        return True
+
+    def restore(self, pipeline: Pipeline, subject_id: str) -> bool:
+        """ Link the cached first level outputs of a pipeline for a subject,
+            into the output directories of the pipeline.
+            Return True if the outputs were restored, False if they are not in the cache.
+        """
+        if not isdir(self.entries_directory):
+            return False
+
+        entry_path = self.get_entry_path(self.get_key(pipeline, subject_id))
+        self.save_file_hashes()
+        if not isfile(entry_path):
+            return False
+
+        with open(entry_path, 'r', encoding = 'utf-8') as file:
+            manifest = load(file)['outputs']
+
+        # Check the manifest matches the expected outputs and all stored files exist
+        outputs = self.get_outputs(pipeline, subject_id)
+        if len(manifest) != len(outputs) or not all(
+            isfile(self.get_object_path(e['hash'])) for e in manifest):
+            return False
+
+        for output, entry in zip(outputs, manifest):
+            if basename(output) != basename(entry['path']):
+                return False
+
+        for output, entry in zip(outputs, manifest):
+            self.copy_file(self.get_object_path(entry['hash']), output)
+
+        return True
@@ -0,0 +1,427 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Decompression of gzipped files, through a cache shared by all pipelines """
+
+from os import makedirs, listdir, remove, link, stat, chmod, utime, close, cpu_count
+from os.path import join, isdir, isfile, abspath, getsize, getmtime
+from stat import S_IRUSR, S_IRGRP, S_IROTH
+from shutil import copyfileobj, copyfile, rmtree
+from hashlib import sha256
+from json import dumps
+from tempfile import mkstemp, mkdtemp
+from gzip import open as gzip_open
+from zlib import (
+    compressobj, decompressobj, crc32, DEFLATED, MAX_WBITS, Z_SYNC_FLUSH, Z_FINISH
+    )
+from struct import pack
+from threading import Thread
+from queue import Queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from argparse import ArgumentParser
+
+from narps_open.utils.configuration import Configuration
+
+# Size of the blocks of uncompressed data compressed in parallel
+BLOCK_SIZE = 1024 * 1024
+
+# Size of the deflate window, i.e.: the size of the dictionary shared between blocks
+WINDOW_SIZE = 32 * 1024
+
+def _compress_block(block: bytes, dictionary: bytes, level: int, last: bool) -> bytes:
+    """ Return a block of data compressed as raw deflate data, using the end of the
+        previous block as dictionary. The deflate stream is only terminated for the last
+        block ; others end on a byte boundary, so that compressed blocks can be concatenated.
+    """
+    if dictionary:
+        compressor = compressobj(level, DEFLATED, -MAX_WBITS, zdict = dictionary)
+    else:
+        compressor = compressobj(level, DEFLATED, -MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(Z_FINISH if last else Z_SYNC_FLUSH)
+
+def compress_file(
+    in_file: str, out_file: str, nb_threads: int = 1, level: int = 6,
+    block_size: int = BLOCK_SIZE) -> str:
+    """ Compress a file into a gzip file, using several threads (the same way pigz does).
+        The file is split into blocks compressed in parallel, each block using the last
+        32KB of the previous one as dictionary. The output is a single standard gzip
+        member, readable by any gzip tool. It does not depend on nb_threads, and its
+        header contains no time stamp, so that compressing a file is reproducible.
+
+        Arguments:
+        - in_file, str: path to the file to compress
+        - out_file, str: path to the gzip file to write
+        - nb_threads, int: number of threads compressing blocks (defaults to 1, so that
+            a nipype node does not use more CPUs than it booked)
+        - level, int: compression level, from 1 (fastest) to 9 (smallest)
+        - block_size, int: size in bytes of the blocks compressed in parallel
+
+        Returns:
+        - str, out_file
+    """
+    crc = 0
+    size = 0
+
+    with open(in_file, 'rb') as input_file, open(out_file, 'wb') as output_file, \
+        ThreadPoolExecutor(max_workers = nb_threads) as executor:
+
+        # Header: deflate method, no flags, no time stamp, unknown OS
+        output_file.write(b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff')
+
+        pending_blocks = deque()
+        dictionary = b''
+        block = input_file.read(block_size)
+        while True:
+            next_block = input_file.read(block_size) if block else b''
+            pending_blocks.append(executor.submit(
+                _compress_block, block, dictionary, level, not next_block))
+            crc = crc32(block, crc)
+            size += len(block)
+            dictionary = block[-WINDOW_SIZE:]
+
+            # Write compressed blocks in order, keeping a bounded number of blocks in memory
+            while len(pending_blocks) > 2 * nb_threads:
+                output_file.write(pending_blocks.popleft().result())
+
+            if not next_block:
+                break
+            block = next_block
+
+        while pending_blocks:
+            output_file.write(pending_blocks.popleft().result())
+
+        # Trailer: CRC32 and size modulo 2^32 of the uncompressed data
+        output_file.write(pack('<II', crc, size & 0xffffffff))
+
+    return out_file
+
+def _read_chunks(file, chunk_size: int, chunks: Queue) -> None:
+    """ Read a file chunk by chunk into a queue, ending with an empty chunk
+        (or the exception raised while reading)
+    """
+    try:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            chunks.put(chunk)
+        chunks.put(b'')
+    except OSError as error:
+        chunks.put(error)
+
+def _write_chunks(file, chunks: Queue, errors: list) -> None:
+    """ Write the chunks of a queue into a file, until an empty chunk.
+        The exception raised while writing is added to errors.
+    """
+    for chunk in iter(chunks.get, b''):
+        if errors:
+            continue # Consume the queue, so that the producer does not block
+        try:
+            file.write(chunk)
+        except OSError as error:
+            errors.append(error)
+
+def decompress_file(in_file: str, out_file: str, chunk_size: int = BLOCK_SIZE) -> str:
+    """ Decompress a gzip file (possibly containing several members). Reading, inflating
+        and writing run in three threads, so that file system accesses overlap with the
+        decompression. The checksums of the members are verified.
+
+        Arguments:
+        - in_file, str: path to the gzip file
+        - out_file, str: path to the file to write
+        - chunk_size, int: size in bytes of the chunks read from in_file
+
+        Returns:
+        - str, out_file
+    """
+    compressed_chunks = Queue(maxsize = 8)
+    decompressed_chunks = Queue(maxsize = 8)
+    write_errors = []
+
+    with open(in_file, 'rb') as input_file, open(out_file, 'wb') as output_file:
+        reader = Thread(target = _read_chunks,
+            args = (input_file, chunk_size, compressed_chunks), daemon = True)
+        writer = Thread(target = _write_chunks,
+            args = (output_file, decompressed_chunks, write_errors), daemon = True)
+        reader.start()
+        writer.start()
+
+        decompressor = None
+        try:
+            for chunk in iter(compressed_chunks.get, b''):
+                if isinstance(chunk, OSError):
+                    raise chunk
+                while chunk:
+                    # Start of a member, unless only padding is left
+                    if decompressor is None:
+                        chunk = chunk.lstrip(b'\x00')
+                        if not chunk:
+                            break
+                        decompressor = decompressobj(16 + MAX_WBITS)
+
+                    # Bound the size of decompressed chunks
+                    data = decompressor.decompress(chunk, 16 * chunk_size)
+                    if data:
+                        decompressed_chunks.put(data)
+                    chunk = decompressor.unconsumed_tail
+
+                    if decompressor.eof:
+                        chunk = decompressor.unused_data
+                        decompressor = None
+        except BaseException:
+            # Let the reader end
+            while reader.is_alive():
+                if not compressed_chunks.empty():
+                    compressed_chunks.get()
+                reader.join(0.01)
+            raise
+        finally:
+            decompressed_chunks.put(b'')
+            writer.join()
+
+    if write_errors:
+        raise write_errors[0]
+    if decompressor is not None:
+        raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+
+    return out_file
+
+class DecompressedFileCache():
+    """ A cache storing decompressed versions of gzipped files (e.g.: the preprocessed
+        fMRIPrep runs of the dataset), so that a file is decompressed once, whatever
+        the number of pipelines using it.
+
+        Entries are handed out as read-only hard links: the number of links to an entry
+        is its reference count. When the total size of the cache exceeds max_size,
+        the least recently used entries that are not referenced anymore (i.e.: all the
+        links handed out were removed) are removed.
+        The cache directory must be on the same file system as the links; otherwise
+        entries are copied.
+
+        Arguments:
+        - directory, str: path to the directory where the cache is stored
+        - max_size, int: maximum size of the cache in bytes (None for no limit)
+    """
+
+    def __init__(self, directory: str, max_size: int = None):
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def get_key(source_file: str) -> str:
+        """ Return the key of the cache for a gzipped file: a hash of its absolute path,
+            size and modification time.
+        """
+        file_stat = stat(source_file)
+        key_contents = {
+            'source': abspath(source_file),
+            'size': file_stat.st_size,
+            'mtime': file_stat.st_mtime_ns
+        }
+
+        return sha256(dumps(key_contents, sort_keys = True).encode('utf-8')).hexdigest()
+
+    def get_entry_path(self, key: str) -> str:
+        """ Return the path to the decompressed file stored under key """
+        return join(self.directory, key)
+
+    def get_entries(self) -> list:
+        """ Return the list of paths to the entries of the cache,
+            from the least to the most recently used.
+        """
+        if not isdir(self.directory):
+            return []
+
+        # Temporary files being written start with a dot
+        entries = [join(self.directory, f) for f in listdir(self.directory)
+            if not f.startswith('.')]
+        return sorted(entries, key = getmtime)
+
+    @staticmethod
+    def get_reference_count(entry: str) -> int:
+        """ Return the number of links to an entry handed out by the cache """
+        return stat(entry).st_nlink - 1
+
+    def get_size(self) -> int:
+        """ Return the total size of the cache entries, in bytes """
+        return sum(getsize(f) for f in self.get_entries())
+
+    def evict(self, keep: str = None) -> list:
+        """ Remove the least recently used, unreferenced entries until the cache
+            fits into max_size. Return the list of removed entries.
+
+            Arguments:
+            - keep, str: path to an entry that must not be removed
+        """
+        if self.max_size is None:
+            return []
+
+        entries = self.get_entries()
+        sizes = {f: getsize(f) for f in entries}
+        total_size = sum(sizes.values())
+        removed_entries = []
+        for entry in entries:
+            if total_size <= self.max_size:
+                break
+            if entry == keep or self.get_reference_count(entry) > 0:
+                continue
+            remove(entry)
+            total_size -= sizes[entry]
+            removed_entries.append(entry)
+
+        return removed_entries
+
+    def get_decompressed_file(self, source_file: str) -> str:
+        """ Return the path to the entry containing source_file decompressed.
+            The file is only decompressed if it is not in the cache yet.
+        """
+        entry_path = self.get_entry_path(self.get_key(source_file))
+
+        # The entry exists: mark it as recently used
+        if isfile(entry_path):
+            utime(entry_path)
+            return entry_path
+
+        # Decompress into a temporary file, then publish it. If another process
+        # published the same entry in the meantime, its entry is kept.
+        makedirs(self.directory, exist_ok = True)
+        file_descriptor, temporary_file = mkstemp(dir = self.directory, prefix = '.')
+        close(file_descriptor)
+        try:
+            decompress_file(source_file, temporary_file)
+            chmod(temporary_file, S_IRUSR | S_IRGRP | S_IROTH)
+            try:
+                link(temporary_file, entry_path)
+            except FileExistsError:
+                pass
+        finally:
+            remove(temporary_file)
+
+        self.evict(keep = entry_path)
+
+        return entry_path
+
+    def link(self, source_file: str, destination: str) -> str:
+        """ Create destination, a read-only link to source_file decompressed.
+            Return destination.
+
+            Arguments:
+            - source_file, str: path to the gzipped file
+            - destination, str: path to the link to create (an existing file is replaced)
+        """
+        entry_path = self.get_decompressed_file(source_file)
+
+        if isfile(destination):
+            remove(destination)
+
+        try:
+            link(entry_path, destination)
+        except FileNotFoundError:
+            if isfile(entry_path):
+                raise
+            return self.link(source_file, destination) # The entry was evicted meanwhile
+        except OSError: # The cache is on another file system
+            copyfile(entry_path, destination)
+            chmod(destination, S_IRUSR | S_IRGRP | S_IROTH)
+
+        return destination
+
+def get_decompressed_file_cache() -> DecompressedFileCache:
+    """ Return the cache of decompressed files shared by all pipelines, as configured in
+        the cache directory (see directories.cache and pipelines.decompressed_cache_size_gb)
+    """
+    max_size = Configuration()['pipelines']['decompressed_cache_size_gb']
+    return DecompressedFileCache(
+        join(Configuration()['directories']['cache'], 'decompressed'),
+        int(max_size * 1024 ** 3) if max_size > 0 else None
+        )
+
+def benchmark(in_file: str, nb_threads: int = None, level: int = 6, nb_repetitions: int = 3):
+    """ Compare the durations of compression and decompression of a file, using the
+        gzip module (as nipype's Gzip and Gunzip interfaces do) and using compress_file
+        and decompress_file.
+
+        Arguments:
+        - in_file, str: path to the (uncompressed) file to use
+        - nb_threads, int: number of threads used by compress_file (defaults to the number
+            of CPUs)
+        - level, int: compression level
+        - nb_repetitions, int: number of times each operation is timed (the best time is kept)
+
+        Returns:
+        - dict, with operations as keys and dicts with keys 'time' (in seconds) and
+            'size' (of the output file, in bytes) as values
+    """
+    nb_threads = nb_threads if nb_threads is not None else (cpu_count() or 1)
+    directory = mkdtemp()
+    gzip_file = join(directory, 'gzip.gz')
+    parallel_file = join(directory, 'parallel.gz')
+    decompressed_file = join(directory, 'decompressed')
+
+    def gzip_compress():
+        with open(in_file, 'rb') as input_file, \
+            gzip_open(gzip_file, 'wb', compresslevel = level) as output_file:
+            copyfileobj(input_file, output_file)
+
+    def gzip_decompress():
+        with gzip_open(gzip_file, 'rb') as input_file, \
+            open(decompressed_file, 'wb') as output_file:
+            copyfileobj(input_file, output_file)
+
+    operations = {
+        'gzip_compress': (gzip_compress, gzip_file),
+        'parallel_compress': (
+            lambda: compress_file(in_file, parallel_file, nb_threads, level), parallel_file),
+        'gzip_decompress': (gzip_decompress, decompressed_file),
+        'parallel_decompress': (
+            lambda: decompress_file(parallel_file, decompressed_file), decompressed_file)
+        }
+
+    results = {}
+    try:
+        for name, (operation, output_file) in operations.items():
+            times = []
+            for _ in range(nb_repetitions):
+                start_time = perf_counter()
+                operation()
+                times.append(perf_counter() - start_time)
+            results[name] = {'time': min(times), 'size': getsize(output_file)}
+    finally:
+        rmtree(directory)
+
+    return results
+
+def main():
+    """ Entry-point for the command line tool narps_open_gzip_benchmark """
+
+    # Parse arguments
+    parser = ArgumentParser(
+        description = 'Compare the gzip module with the parallel compression of narps_open.')
+    parser.add_argument('-f', '--file', type = str, required = True,
+        help = 'the file to use for the benchmark (uncompressed, or gzipped)')
+    parser.add_argument('-t', '--threads', type = int, default = None,
+        help = 'the number of compression threads (defaults to the number of CPUs)')
+    parser.add_argument('-l', '--level', type = int, default = 6, choices = range(1, 10),
+        help = 'the compression level')
+    parser.add_argument('-r', '--repetitions', type = int, default = 3,
+        help = 'the number of times each operation is timed')
+    arguments = parser.parse_args()
+
+    in_file = arguments.file
+    if in_file.endswith('.gz'):
+        file_descriptor, in_file = mkstemp()
+        close(file_descriptor)
+        decompress_file(arguments.file, in_file)
+
+    try:
+        size = getsize(in_file)
+        results = benchmark(in_file, arguments.threads, arguments.level, arguments.repetitions)
+    finally:
+        if in_file != arguments.file:
+            remove(in_file)
+
+    print(f'Input file: {arguments.file} ({size} bytes uncompressed)')
+    for name, result in results.items():
+        print(f'{name:<20} {result["time"]:>8.3f} s {result["size"]:>14d} bytes')
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,13 @@
 
 """ Utils functions to perform correlation analyses """
 
-from numpy import corrcoef, reshape, nan, isnan
+from numpy import (
+    reshape, nan, isnan, array, asarray, float64, mgrid, floor, ceil, maximum, minimum,
+    zeros, dot, sqrt, allclose, clip, bincount, cumsum, nanmin, nanmax, inf
+    )
+from numpy.linalg import inv
 from scipy.stats import spearmanr
+from scipy.ndimage import map_coordinates
 from nibabel import load, Nifti1Image
 from nibabel.processing import resample_from_to
 
@@ -46,22 +51,217 @@ def mask_using_zeros(data_image: Nifti1Image) -> Nifti1Image:
     # Return data as an image
     return Nifti1Image(data, data_image.affine)
 
+class PearsonAccumulator():
+    """ Accumulate the sufficient statistics of the Pearson correlation coefficient,
+        chunk by chunk, using a numerically stable pairwise update (Chan et al.).
+    """
+
+    def __init__(self):
+        self.nb_values = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.sum_squares_x = 0.0
+        self.sum_squares_y = 0.0
+        self.sum_products = 0.0
+
+    def update(self, data_x, data_y) -> None:
+        """ Add a chunk of paired values to the statistics
+
+            Arguments:
+                - data_x, numpy.ndarray - 1D array of values
+                - data_y, numpy.ndarray - 1D array of values, the same size as data_x
+        """
+        nb_values = data_x.size
+        if nb_values == 0:
+            return
+
+        # Statistics of the chunk
+        mean_x = data_x.mean()
+        mean_y = data_y.mean()
+        centered_x = data_x - mean_x
+        centered_y = data_y - mean_y
+
+        # Merge with the statistics of the previous chunks
+        total = self.nb_values + nb_values
+        delta_x = mean_x - self.mean_x
+        delta_y = mean_y - self.mean_y
+        weight = self.nb_values * nb_values / total
+        self.sum_squares_x += dot(centered_x, centered_x) + delta_x * delta_x * weight
+        self.sum_squares_y += dot(centered_y, centered_y) + delta_y * delta_y * weight
+        self.sum_products += dot(centered_x, centered_y) + delta_x * delta_y * weight
+        self.mean_x += delta_x * nb_values / total
+        self.mean_y += delta_y * nb_values / total
+        self.nb_values = total
+
+    @property
+    def correlation(self) -> float:
+        """ Getter for property correlation, the Pearson correlation coefficient """
+        denominator = sqrt(self.sum_squares_x * self.sum_squares_y)
+        if denominator == 0.0:
+            return nan
+        return self.sum_products / denominator
+
+def iter_slabs(file_1: str, file_2: str, slab_size: int = 8):
+    """ Generate the data of two images, slab by slab along the z axis of the first image.
+        The second image is resampled on the first one using nearest neighbours,
+        reading only the part of the second image needed for each slab.
+        NaNs are replaced by zeros in both images.
+
+        Arguments :
+            - file_1, str - path to the first image
+            - file_2, str - path to the second image ; file_2 will be resampled on file_1
+            - slab_size, int - number of slices (along z) per slab
+
+        Yields :
+            - tuple of two 1D numpy.ndarray (float64), the data of both images for a slab
+    """
+    image_1 = load(file_1, keep_file_open = True)
+    image_2 = load(file_2, keep_file_open = True)
+    shape_1 = image_1.shape[:3]
+    shape_2 = asarray(image_2.shape[:3])
+    same_grid = tuple(shape_1) == tuple(shape_2) and allclose(image_1.affine, image_2.affine)
+    transform = inv(image_2.affine).dot(image_1.affine)
+
+    for z_start in range(0, shape_1[2], slab_size):
+        z_stop = min(z_start + slab_size, shape_1[2])
+
+        # Read a slab of the first image
+        data_1 = array(image_1.dataobj[:, :, z_start:z_stop], dtype = float64)
+        data_1[isnan(data_1)] = 0.0
+
+        # Read the corresponding part of the second image
+        if same_grid:
+            data_2 = array(image_2.dataobj[:, :, z_start:z_stop], dtype = float64)
+            data_2[isnan(data_2)] = 0.0
+            yield data_1.ravel(order = 'F'), data_2.ravel(order = 'F')
+            continue
+
+        # Voxel coordinates of the slab in the second image
+        grid = mgrid[0:shape_1[0], 0:shape_1[1], z_start:z_stop].reshape(3, -1, order = 'F')
+        coordinates = transform[:3, :3].dot(grid) + transform[:3, 3:]
+
+        # Bounding box of the voxels needed, with a margin so that nearest neighbour
+        # interpolation is the same as if the whole image was loaded
+        lower = maximum(floor(coordinates.min(axis = 1)).astype(int) - 1, 0)
+        upper = minimum(ceil(coordinates.max(axis = 1)).astype(int) + 2, shape_2)
+        if (upper <= lower).any():
+            data_2 = zeros(data_1.size)
+        else:
+            block = array(image_2.dataobj[
+                lower[0]:upper[0], lower[1]:upper[1], lower[2]:upper[2]], dtype = float64)
+            block[isnan(block)] = 0.0
+            data_2 = map_coordinates(
+                block, coordinates - lower[:, None], order = 0, mode = 'constant', cval = 0.0)
+
+        yield data_1.ravel(order = 'F'), data_2
+
+def get_approximate_ranks(values, minimum_value: float, maximum_value: float, midranks):
+    """ Return the approximate ranks of values, using the midranks of histogram bins.
+
+        Arguments :
+            - values, numpy.ndarray - the values to rank
+            - minimum_value, float - minimum of all the values
+            - maximum_value, float - maximum of all the values
+            - midranks, numpy.ndarray - the mean rank of the values inside each bin
+    """
+    return midranks[get_bin_indices(values, minimum_value, maximum_value, midranks.size)]
+
+def get_bin_indices(values, minimum_value: float, maximum_value: float, nb_bins: int):
+    """ Return the index of the histogram bin of each value
+
+        Arguments :
+            - values, numpy.ndarray - the values to put in bins
+            - minimum_value, float - lower bound of the histogram
+            - maximum_value, float - upper bound of the histogram
+            - nb_bins, int - number of bins of the histogram
+    """
+    if maximum_value <= minimum_value:
+        return zeros(values.size, dtype = int)
+
+    indices = ((values - minimum_value) / (maximum_value - minimum_value) * nb_bins).astype(int)
+    return clip(indices, 0, nb_bins - 1)
+
+def get_streaming_correlation_coefficient(
+    file_1: str, file_2: str, method: str = 'pearson',
+    slab_size: int = 8, nb_bins: int = 65536) -> float:
+    """ Return the correlation coefficient of two images, with a bounded memory usage:
+        images are read slab by slab, and only the statistics needed to compute the
+        coefficient are kept in memory.
+
+        Arguments :
+            - file_1, str - path to the first image
+            - file_2, str - path to the second image ; file_2 will be resampled on file_1
+            - method, str - either 'pearson', or 'spearman': the correlation method to use
+            - slab_size, int - number of slices (along z) read at once
+            - nb_bins, int - for the spearman method only, the number of histogram bins used
+                to approximate ranks. Ranks are exact when each bin holds at most one
+                distinct value.
+
+        Returns :
+            - _, float - the correlation coefficient of the two input images,
+            using the passed method
+    """
+    if method == 'pearson':
+        accumulator = PearsonAccumulator()
+        for data_1, data_2 in iter_slabs(file_1, file_2, slab_size):
+            accumulator.update(data_1, data_2)
+        return accumulator.correlation
+
+    if method == 'spearman':
+        # First pass: get the range of values
+        bounds = [inf, -inf, inf, -inf]
+        for data_1, data_2 in iter_slabs(file_1, file_2, slab_size):
+            bounds = [
+                min(bounds[0], nanmin(data_1)), max(bounds[1], nanmax(data_1)),
+                min(bounds[2], nanmin(data_2)), max(bounds[3], nanmax(data_2))
+                ]
+
+        # Second pass: build histograms, then get the mean rank of values in each bin
+        counts_1 = zeros(nb_bins)
+        counts_2 = zeros(nb_bins)
+        for data_1, data_2 in iter_slabs(file_1, file_2, slab_size):
+            counts_1 += bincount(
+                get_bin_indices(data_1, bounds[0], bounds[1], nb_bins), minlength = nb_bins)
+            counts_2 += bincount(
+                get_bin_indices(data_2, bounds[2], bounds[3], nb_bins), minlength = nb_bins)
+        midranks_1 = cumsum(counts_1) - counts_1 + (counts_1 + 1.0) / 2.0
+        midranks_2 = cumsum(counts_2) - counts_2 + (counts_2 + 1.0) / 2.0
+
+        # Third pass: Pearson correlation coefficient of the ranks
+        accumulator = PearsonAccumulator()
+        for data_1, data_2 in iter_slabs(file_1, file_2, slab_size):
+            accumulator.update(
+                get_approximate_ranks(data_1, bounds[0], bounds[1], midranks_1),
+                get_approximate_ranks(data_2, bounds[2], bounds[3], midranks_2)
+                )
+        return accumulator.correlation
+
+    raise AttributeError(f'Wrong correlation method provided: {method}.')
+
 def get_correlation_coefficient(
-    file_1: str, file_2: str, method: str = 'pearson') -> float:
+    file_1: str, file_2: str, method: str = 'pearson', cache = None) -> float:
     """ Return the correlation coefficient of two images.
 
         Arguments :
             - file_1, str - path to the first image
             - file_2, str - path to the second image ; file_2 will be resampled on file_1
             - method, str - either 'pearson', or 'spearman': the correlation method to use
-            - reslice_on_file_2, bool - set to :
-                - True if you wish to reslice file_1 on file_2
-                - False otherwise
+            - cache, narps_open.utils.correlation.cache.ResampledImageCache - if set,
+                file_2 resampled on file_1 is read from (or stored into) this cache
 
         Returns :
             - _, float - the correlation coefficient of the two input images,
             using the passed method
+
+        The pearson coefficient is computed by streaming the images
+        (see get_streaming_correlation_coefficient), the spearman coefficient is computed
+        with exact ranks, using the whole images.
     """
+    if cache is not None:
+        file_2 = cache.get_resampled_file(file_2, file_1)
+
+    if method == 'pearson':
+        return get_streaming_correlation_coefficient(file_1, file_2, method)
 
     # Load images
     image_1 = load(file_1)
@@ -72,15 +272,14 @@ def get_correlation_coefficient(
     image_2 = mask_using_zeros(image_2)
 
     # Resample using nearest nneighbours
-    image_2 = resample_from_to(image_2, image_1, order = 0)
+    if image_2.shape[:3] != image_1.shape[:3] or not allclose(image_2.affine, image_1.affine):
+        image_2 = resample_from_to(image_2, image_1, order = 0)
 
     # Make 1D vectors from the images data
     data_1 = reshape(image_1.get_fdata(), -1)
     data_2 = reshape(image_2.get_fdata(), -1)
 
     # Compute the correlation coefficient
-    if method == 'pearson':
-        return corrcoef(data_1, data_2)[0][1]
     if method == 'spearman':
         return spearmanr(data_1, data_2).correlation
 
@@ -9,6 +9,7 @@ from argparse import ArgumentParser
 from narps_open.data.results import ResultsCollection
 from narps_open.utils.configuration import Configuration
 from narps_open.utils.correlation import get_correlation_coefficient
+from narps_open.utils.correlation.cache import ResampledImageCache
 from narps_open.pipelines import get_implemented_pipelines
 from narps_open.runner import PipelineRunner
 
@@ -43,9 +44,13 @@ def main():
     file_keys = [f'hypo{h}_unthresh.nii.gz' for h in range(1,10)]
     results_files = [join(collection.directory, k) for k in file_keys]
 
-    # Compute the correlation coefficients
+    # Compute the correlation coefficients, caching the resampled results files
+    cache = ResampledImageCache(
+        join(Configuration()['directories']['cache'], 'resampled'),
+        int(Configuration()['correlation']['resampled_cache_size_gb'] * 1024 ** 3)
+        )
     print([
-        get_correlation_coefficient(reproduced_file, results_file)
+        get_correlation_coefficient(reproduced_file, results_file, cache = cache)
         for reproduced_file, results_file in zip(reproduced_files, results_files)
         ])
 
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" An on-disk cache of images resampled on the grid of other images """
+
+from os import makedirs, listdir, remove, replace, utime, close
+from os.path import join, isdir, isfile, getsize, getmtime
+from hashlib import sha256
+from json import dumps
+from tempfile import mkstemp
+
+from numpy import allclose
+from nibabel import load, save
+from nibabel.processing import resample_from_to
+
+from narps_open.utils.cache import hash_file
+from narps_open.utils.correlation import mask_using_zeros
+
+class ResampledImageCache():
+    """ A cache storing images (e.g.: original results from NeuroVault) resampled
+        with nearest neighbours onto the grid of other images (e.g.: reproduced results).
+
+        The key of an entry is a hash of the contents of the source image and of
+        the shape and affine of the target grid.
+        When the total size of the cache exceeds max_size, the least recently used
+        entries are removed.
+
+        Arguments:
+        - directory, str: path to the directory where the cache is stored
+        - max_size, int: maximum size of the cache in bytes (None for no limit)
+    """
+
+    def __init__(self, directory: str, max_size: int = None):
+        self.directory = directory
+        self.max_size = max_size
+        self._file_hashes = {}
+
+    def get_file_hash(self, path: str) -> str:
+        """ Return the hash of a file, computed once per file version for the cache object """
+        file_key = (path, getsize(path), getmtime(path))
+        if file_key not in self._file_hashes:
+            self._file_hashes[file_key] = hash_file(path)
+
+        return self._file_hashes[file_key]
+
+    def get_key(self, source_file: str, target_shape: tuple, target_affine) -> str:
+        """ Return the key of the cache for a source image and a target grid """
+        key_contents = {
+            'source': self.get_file_hash(source_file),
+            'shape': [int(s) for s in target_shape],
+            'affine': [[round(float(v), 6) for v in row] for row in target_affine],
+            'order': 0
+        }
+
+        return sha256(dumps(key_contents, sort_keys = True).encode('utf-8')).hexdigest()
+
+    def get_entry_path(self, key: str) -> str:
+        """ Return the path to the resampled image stored under key """
+        return join(self.directory, f'{key}.nii')
+
+    def get_entries(self) -> list:
+        """ Return the list of paths to the entries of the cache,
+            from the least to the most recently used.
+        """
+        if not isdir(self.directory):
+            return []
+
+        # Temporary files being written start with a dot
+        entries = [join(self.directory, f) for f in listdir(self.directory)
+            if f.endswith('.nii') and not f.startswith('.')]
+        return sorted(entries, key = getmtime)
+
+    def get_size(self) -> int:
+        """ Return the total size of the cache entries, in bytes """
+        return sum(getsize(f) for f in self.get_entries())
+
+    def evict(self, keep: str = None) -> list:
+        """ Remove the least recently used entries until the cache fits into max_size.
+            Return the list of removed entries.
+
+            Arguments:
+            - keep, str: path to an entry that must not be removed
+        """
+        if self.max_size is None:
+            return []
+
+        entries = self.get_entries()
+        sizes = {f: getsize(f) for f in entries}
+        total_size = sum(sizes.values())
+        removed_entries = []
+        for entry in entries:
+            if total_size <= self.max_size:
+                break
+            if entry == keep:
+                continue
+            remove(entry)
+            total_size -= sizes[entry]
+            removed_entries.append(entry)
+
+        return removed_entries
+
+    def get_resampled_file(self, source_file: str, target_file: str) -> str:
+        """ Return the path to an image containing source_file resampled onto the grid
+            of target_file, using nearest neighbours (NaNs are replaced by zeros).
+            The resampling is only performed if the image is not in the cache yet.
+            Return source_file if both images already have the same grid.
+        """
+        source = load(source_file)
+        target = load(target_file)
+        target_shape = target.shape[:3]
+        if source.shape[:3] == target_shape and allclose(source.affine, target.affine):
+            return source_file
+
+        entry_path = self.get_entry_path(
+            self.get_key(source_file, target_shape, target.affine))
+
+        # The entry exists: mark it as recently used
+        if isfile(entry_path):
+            utime(entry_path)
+            return entry_path
+
+        # Resample and write the entry atomically
+        image = resample_from_to(
+            mask_using_zeros(source), (target_shape, target.affine), order = 0)
+        makedirs(self.directory, exist_ok = True)
+        file_descriptor, temporary_file = mkstemp(
+            dir = self.directory, prefix = '.', suffix = '.nii')
+        close(file_descriptor)
+        save(image, temporary_file)
+        replace(temporary_file, entry_path)
+
+        self.evict(keep = entry_path)
+
+        return entry_path
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Compute correlation matrices between the results of several teams """
+
+from os import makedirs, remove
+from os.path import join, isfile
+from argparse import ArgumentParser
+
+from numpy import empty, float64, dot, sqrt, nan, isnan, clip, allclose, save, fill_diagonal
+from numpy.lib.format import open_memmap
+from scipy.stats import rankdata
+from nibabel import load
+from nibabel.processing import resample_from_to
+from pandas import DataFrame
+
+from narps_open.utils.configuration import Configuration
+from narps_open.utils.correlation import mask_using_zeros
+from narps_open.data.description import TeamDescription
+from narps_open.pipelines import implemented_pipelines
+
+def get_team_results_file(team_id: str, hypothesis: int) -> str:
+    """ Return the path to the original unthresholded map of a team for a hypothesis,
+        as downloaded by narps_open.data.results.ResultsCollection.
+
+        Arguments :
+            - team_id, str - the ID of the team
+            - hypothesis, int - the number of the hypothesis (from 1 to 9)
+    """
+    uid = TeamDescription(team_id).general['NV_collection_link'].split('/')[-2]
+    return join(
+        Configuration()['directories']['narps_results'],
+        'orig',
+        f'{uid}_{team_id}',
+        f'hypo{hypothesis}_unthresh.nii.gz'
+        )
+
+def get_standardized_data(
+    files: list, reference_file: str = None, method: str = 'pearson',
+    memmap_file: str = None):
+    """ Return a (files × voxels) matrix containing the data of the images, resampled
+        on a common grid. Each row is centered and scaled to a unit norm, so that the
+        dot product of two rows is the correlation coefficient of the images.
+
+        Arguments :
+            - files, list of str - paths to the images
+            - reference_file, str - path to the image giving the common grid
+                (defaults to the first image of files)
+            - method, str - either 'pearson', or 'spearman' (rows then contain ranks)
+            - memmap_file, str - if set, the matrix is memory-mapped into this .npy file
+
+        Returns :
+            - numpy.ndarray (or numpy.memmap) of float64 ; rows of constant images are NaNs
+    """
+    if method not in ['pearson', 'spearman']:
+        raise AttributeError(f'Wrong correlation method provided: {method}.')
+
+    # Common grid
+    reference = load(reference_file if reference_file is not None else files[0])
+    grid = (reference.shape[:3], reference.affine)
+    shape = (len(files), int(reference.shape[0] * reference.shape[1] * reference.shape[2]))
+
+    if memmap_file is not None:
+        matrix = open_memmap(memmap_file, mode = 'w+', dtype = float64, shape = shape)
+    else:
+        matrix = empty(shape, dtype = float64)
+
+    # Load, resample and standardize each image once
+    for index, file in enumerate(files):
+        image = mask_using_zeros(load(file))
+        if image.shape[:3] != grid[0] or not allclose(image.affine, grid[1]):
+            image = resample_from_to(image, grid, order = 0)
+
+        data = image.get_fdata().ravel()
+        if method == 'spearman':
+            data = rankdata(data)
+
+        data = data - data.mean()
+        norm = sqrt(dot(data, data))
+        matrix[index] = data / norm if norm > 0.0 else nan
+
+    return matrix
+
+def get_correlation_matrix(
+    files: list, reference_file: str = None, method: str = 'pearson',
+    memmap_file: str = None):
+    """ Return the matrix of correlation coefficients between all pairs of images.
+
+        Each image is loaded and resampled (using nearest neighbours) once onto the grid
+        of reference_file. The whole matrix is then computed with one matrix product.
+
+        Arguments :
+            - files, list of str - paths to the images
+            - reference_file, str - path to the image giving the common grid
+                (defaults to the first image of files)
+            - method, str - either 'pearson', or 'spearman': the correlation method to use
+            - memmap_file, str - if set, the (files × voxels) data matrix is memory-mapped
+                into this .npy file instead of being held in memory
+
+        Returns :
+            - numpy.ndarray, a (files × files) symmetric matrix of correlation coefficients
+    """
+    data = get_standardized_data(files, reference_file, method, memmap_file)
+    correlations = clip(dot(data, data.T), -1.0, 1.0)
+    del data
+
+    # Remove rounding errors on the diagonal, keeping NaNs of constant images
+    diagonal = correlations.diagonal().copy()
+    diagonal[~isnan(diagonal)] = 1.0
+    fill_diagonal(correlations, diagonal)
+
+    return correlations
+
+def write_correlation_matrix(matrix, labels: list, output_file: str) -> None:
+    """ Write a correlation matrix into a file.
+
+        Arguments :
+            - matrix, numpy.ndarray - the correlation matrix
+            - labels, list of str - labels of the rows (and columns) of the matrix
+            - output_file, str - path to the output file, either a .tsv file (with labels)
+                or a .npy file (the matrix only, rows ordered as labels)
+    """
+    if output_file.endswith('.tsv'):
+        DataFrame(matrix, index = labels, columns = labels).to_csv(output_file, sep = '\t')
+    elif output_file.endswith('.npy'):
+        save(output_file, matrix)
+    else:
+        raise AttributeError(f'Wrong output file format: {output_file}.')
+
+def main():
+    """ Entry-point for the command line tool narps_open_correlation_matrix """
+
+    # Parse arguments
+    parser = ArgumentParser(
+        description = 'Compute team × team correlation matrices of the original results.')
+    group = parser.add_mutually_exclusive_group(required = True)
+    group.add_argument('-t', '--teams', nargs = '+', type = str, action = 'extend',
+        help = 'a list of team IDs', choices = implemented_pipelines.keys(), metavar = 'TEAMS')
+    group.add_argument('-a', '--all', action = 'store_true', help = 'use results from all teams')
+    parser.add_argument('-H', '--hypotheses', nargs = '+', type = int, action = 'extend',
+        choices = range(1, 10), metavar = 'HYPOTHESES',
+        help = 'a list of hypotheses (all by default)')
+    parser.add_argument('-m', '--method', type = str, default = 'pearson',
+        choices = ['pearson', 'spearman'], help = 'the correlation method')
+    parser.add_argument('-o', '--output', type = str, required = True,
+        help = 'the directory where to write the matrices')
+    parser.add_argument('-f', '--format', type = str, default = 'tsv',
+        choices = ['tsv', 'npy'], help = 'the format of the output files')
+    parser.add_argument('--memmap', action = 'store_true', default = False,
+        help = 'memory-map the data of the images into the output directory')
+    arguments = parser.parse_args()
+
+    teams = list(implemented_pipelines.keys()) if arguments.all else arguments.teams
+    hypotheses = arguments.hypotheses if arguments.hypotheses else list(range(1, 10))
+    makedirs(arguments.output, exist_ok = True)
+
+    for hypothesis in hypotheses:
+        # Keep teams whose results were downloaded
+        files = {}
+        for team_id in teams:
+            file = get_team_results_file(team_id, hypothesis)
+            if isfile(file):
+                files[team_id] = file
+            else:
+                print(f'Missing results for team {team_id}, hypothesis {hypothesis}: {file}')
+
+        if not files:
+            continue
+
+        memmap_file = join(arguments.output, f'.data_hypo{hypothesis}.npy') \
+            if arguments.memmap else None
+        matrix = get_correlation_matrix(
+            list(files.values()), method = arguments.method, memmap_file = memmap_file)
+        if memmap_file is not None:
+            remove(memmap_file)
+
+        output_file = join(arguments.output,
+            f'correlation_matrix_{arguments.method}_hypo{hypothesis}.{arguments.format}')
+        write_correlation_matrix(matrix, list(files.keys()), output_file)
+        print(output_file)
+
+if __name__ == '__main__':
+    main()
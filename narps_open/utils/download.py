@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" A download engine fetching files concurrently, with resumable and atomic downloads """
+
+from os import makedirs, remove, replace
+from os.path import isfile, getsize, dirname, abspath
+from threading import local, BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException, HTTPError
+
+from narps_open.utils.cache import hash_file
+
+class DownloadError(Exception):
+    """ An error raised when a file could not be downloaded """
+
+class Downloader():
+    """ Download files concurrently, with a bounded pool of threads.
+
+        - at most nb_workers files are transferred at the same time, even when the same
+            Downloader is used by several threads (e.g.: one per collection of results);
+        - HTTP connections are reused: each thread owns a requests.Session;
+        - files are first written into a '<destination>.part' file, which is renamed
+            once the download is complete and checked;
+        - partial downloads (from a previous interrupted download) are resumed
+            using HTTP Range requests;
+        - files whose size and checksum (sha256) match the expected ones are not
+            downloaded again.
+
+        Arguments:
+        - nb_workers, int: number of files downloaded at the same time
+        - nb_retries, int: number of times the download of a file is resumed after an error
+        - timeout, float: timeout of the HTTP requests, in seconds
+        - chunk_size, int: size in bytes of the chunks written to the disk
+    """
+
+    def __init__(
+        self, nb_workers: int = 8, nb_retries: int = 3, timeout: float = 60.0,
+        chunk_size: int = 1024 * 1024
+        ):
+        self.nb_workers = nb_workers
+        self.nb_retries = nb_retries
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._local = local()
+        self._slots = BoundedSemaphore(nb_workers)
+
+    @property
+    def session(self) -> Session:
+        """ Getter for property session, the HTTP session of the current thread """
+        if not hasattr(self._local, 'session'):
+            self._local.session = Session()
+            self._local.session.mount('http://', HTTPAdapter(max_retries = self.nb_retries))
+            self._local.session.mount('https://', HTTPAdapter(max_retries = self.nb_retries))
+        return self._local.session
+
+    def get_json(self, url: str):
+        """ Return the JSON contents at url """
+        response = self.session.get(url, timeout = self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def is_downloaded(destination: str, size: int = None, checksum: str = None) -> bool:
+        """ Return True if destination exists and matches the expected size and checksum """
+        if not isfile(destination):
+            return False
+        if size is not None and getsize(destination) != size:
+            return False
+        if checksum is not None and hash_file(destination) != checksum:
+            return False
+
+        return size is not None or checksum is not None
+
+    def download(
+        self, url: str, destination: str, size: int = None, checksum: str = None) -> bool:
+        """ Download the file at url into destination.
+            Return True if the file was downloaded, False if it was already there.
+
+            Arguments:
+            - url, str: the url of the file
+            - destination, str: path to the downloaded file
+            - size, int: the expected size of the file in bytes (if known)
+            - checksum, str: the expected sha256 hash of the file (if known)
+
+            Raises DownloadError if the file could not be downloaded.
+        """
+        if self.is_downloaded(destination, size, checksum):
+            return False
+
+        makedirs(dirname(abspath(destination)), exist_ok = True)
+        part_file = destination + '.part'
+
+        last_error = 'interrupted transfer'
+        with self._slots:
+            for _ in range(self.nb_retries + 1):
+                try:
+                    complete = self._download_part(url, part_file)
+                except HTTPError as error: # The server answered with an error
+                    raise DownloadError(f'Could not download {url}: {error}') from error
+                except RequestException as error: # The transfer was interrupted
+                    complete = False
+                    last_error = error
+                if complete:
+                    break
+            else:
+                raise DownloadError(f'Could not download {url}: {last_error}')
+
+        # Check the downloaded file
+        if size is not None and getsize(part_file) != size:
+            downloaded_size = getsize(part_file)
+            remove(part_file)
+            raise DownloadError(f'Unexpected size for {url}: {downloaded_size} bytes.')
+        if checksum is not None and hash_file(part_file) != checksum:
+            remove(part_file)
+            raise DownloadError(f'Unexpected checksum for {url}')
+
+        replace(part_file, destination)
+        return True
+
+    def _download_part(self, url: str, part_file: str) -> bool:
+        """ Download (the rest of) a file into part_file.
+            Return True if the file is complete, False if the transfer was interrupted.
+        """
+        offset = getsize(part_file) if isfile(part_file) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset > 0 else {}
+
+        with self.session.get(url, headers = headers, stream = True,
+            timeout = self.timeout) as response:
+
+            if response.status_code == 416: # Range not satisfiable: the file is complete
+                return True
+            response.raise_for_status()
+
+            # The server sent the whole file instead of the requested range
+            if response.status_code != 206:
+                offset = 0
+
+            expected_size = response.headers.get('Content-Length')
+            expected_size = offset + int(expected_size) if expected_size is not None else None
+
+            with open(part_file, 'ab' if offset > 0 else 'wb') as file:
+                for chunk in response.iter_content(chunk_size = self.chunk_size):
+                    file.write(chunk)
+
+        return expected_size is None or getsize(part_file) == expected_size
+
+    def download_all(self, downloads: list) -> dict:
+        """ Download a list of files concurrently.
+
+            Arguments:
+            - downloads, list of dict: each dict has keys 'url' and 'destination',
+                and optionally 'size' and 'checksum' (see the download method)
+
+            Returns:
+            - dict, with destinations as keys and the results of the download method
+                (or the DownloadError raised) as values
+        """
+        results = {}
+        with ThreadPoolExecutor(max_workers = self.nb_workers) as executor:
+            futures = {
+                executor.submit(self.download, **d): d['destination'] for d in downloads
+                }
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except DownloadError as error:
+                    results[futures[future]] = error
+
+        return results
@@ -0,0 +1,193 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Hash the images of whole directories, in parallel and using a persistent index """
+
+from os import makedirs, stat, walk, replace
+from os.path import join, isfile, abspath, dirname, relpath
+from json import load, dump
+from tempfile import mkstemp
+from hashlib import sha256
+from fnmatch import fnmatch
+from concurrent.futures import ProcessPoolExecutor
+from argparse import ArgumentParser
+
+from narps_open.utils import hash_image
+from narps_open.utils.configuration import Configuration
+from narps_open.pipelines import get_implemented_pipelines
+
+class ImageHashIndex():
+    """ A persistent index of image hashes. A hash is reused as long as the size and
+        modification time of the file did not change.
+
+        Arguments:
+        - index_file, str: path to the JSON file storing the index (None for an index
+            kept in memory only)
+    """
+
+    def __init__(self, index_file: str = None):
+        self.index_file = index_file
+        self.entries = {}
+        if index_file is not None and isfile(index_file):
+            with open(index_file, 'r', encoding = 'utf-8') as file:
+                self.entries = load(file)
+
+    @staticmethod
+    def get_key(path: str, canonical: bool) -> str:
+        """ Return the key of the index for a file and a hash form """
+        return ('canonical:' if canonical else 'legacy:') + abspath(path)
+
+    def get(self, path: str, canonical: bool = False) -> str:
+        """ Return the hash of a file if it is indexed and unchanged, None otherwise """
+        entry = self.entries.get(self.get_key(path, canonical))
+        if entry is None:
+            return None
+
+        file_stat = stat(path)
+        if entry['size'] != file_stat.st_size or entry['mtime'] != file_stat.st_mtime_ns:
+            return None
+
+        return entry['hash']
+
+    def set(self, path: str, file_hash: str, canonical: bool = False) -> None:
+        """ Add the hash of a file to the index """
+        file_stat = stat(path)
+        self.entries[self.get_key(path, canonical)] = {
+            'size': file_stat.st_size,
+            'mtime': file_stat.st_mtime_ns,
+            'hash': file_hash
+            }
+
+    def save(self) -> None:
+        """ Write the index into index_file, atomically """
+        if self.index_file is None:
+            return
+
+        makedirs(dirname(abspath(self.index_file)), exist_ok = True)
+        file_descriptor, temporary_file = mkstemp(dir = dirname(abspath(self.index_file)))
+        with open(file_descriptor, 'w', encoding = 'utf-8') as file:
+            dump(self.entries, file)
+        replace(temporary_file, self.index_file)
+
+def hash_images(
+    files: list, nb_workers: int = 1, index: ImageHashIndex = None,
+    canonical: bool = False) -> dict:
+    """ Return the hashes of a list of nifti images (see narps_open.utils.hash_image)
+        Arguments:
+        - files, list of str: paths to the images
+        - nb_workers, int: number of processes computing hashes
+        - index, ImageHashIndex: if set, the index is used to avoid hashing unchanged files,
+            and it is updated (and saved) with the new hashes
+        - canonical, bool: if True, hash the canonical form of the images
+
+        Returns:
+        - dict, with paths of files as keys and hashes as values
+    """
+    hashes = {}
+    files_to_hash = []
+    for file in files:
+        file_hash = index.get(file, canonical) if index is not None else None
+        if file_hash is None:
+            files_to_hash.append(file)
+        else:
+            hashes[file] = file_hash
+
+    if nb_workers > 1 and len(files_to_hash) > 1:
+        with ProcessPoolExecutor(max_workers = nb_workers) as executor:
+            new_hashes = list(executor.map(
+                hash_image, files_to_hash, [canonical] * len(files_to_hash)))
+    else:
+        new_hashes = [hash_image(f, canonical) for f in files_to_hash]
+
+    for file, file_hash in zip(files_to_hash, new_hashes):
+        hashes[file] = file_hash
+        if index is not None:
+            index.set(file, file_hash, canonical)
+
+    if index is not None and files_to_hash:
+        index.save()
+
+    return hashes
+
+def get_tree_images(directory: str, exclude: list = None) -> list:
+    """ Return the sorted list of nifti images (.nii and .nii.gz files) inside a directory
+        and its sub-directories, as paths relative to the directory.
+        Arguments:
+        - directory, str: path to the directory
+        - exclude, list of str: glob patterns of relative paths to ignore
+    """
+    images = []
+    for root, _, files in walk(directory):
+        for file in files:
+            if not file.endswith(('.nii', '.nii.gz')):
+                continue
+            path = relpath(join(root, file), directory)
+            if exclude is not None and any(fnmatch(path, p) for p in exclude):
+                continue
+            images.append(path)
+
+    return sorted(images)
+
+def hash_tree(
+    directory: str, nb_workers: int = 1, index: ImageHashIndex = None,
+    canonical: bool = False, exclude: list = None) -> tuple:
+    """ Return the hashes of all nifti images inside a directory and its sub-directories
+        Arguments:
+        - directory, str: path to the directory
+        - nb_workers, int: number of processes computing hashes
+        - index, ImageHashIndex: an index of already computed hashes
+        - canonical, bool: if True, hash the canonical form of the images
+        - exclude, list of str: glob patterns of relative paths to ignore
+
+        Returns:
+        - dict, with paths of images (relative to directory) as keys and hashes as values
+        - str, the aggregate hash: the sha256 hash of the lines '<relative path>\t<hash>\n'
+            of all images, sorted by path
+    """
+    images = get_tree_images(directory, exclude)
+    hashes = hash_images([join(directory, i) for i in images], nb_workers, index, canonical)
+    hashes = {i: hashes[join(directory, i)] for i in images}
+
+    hasher = sha256()
+    for image, image_hash in hashes.items():
+        hasher.update(f'{image}\t{image_hash}\n'.encode(encoding = 'utf-8'))
+
+    return hashes, hasher.hexdigest()
+
+def main():
+    """ Entry-point for the command line tool narps_open_hash """
+
+    # Parse arguments
+    parser = ArgumentParser(description = 'Hash the images of a reproduced results directory.')
+    group = parser.add_mutually_exclusive_group(required = True)
+    group.add_argument('-t', '--team', type = str, choices = get_implemented_pipelines(),
+        help = 'the team ID, to hash its NARPS-{team}-reproduced directory')
+    group.add_argument('-d', '--directory', type = str, help = 'a directory to hash')
+    parser.add_argument('-w', '--workers', type = int,
+        default = Configuration()['runner']['nb_procs'],
+        help = 'the number of processes computing hashes')
+    parser.add_argument('-i', '--index', type = str,
+        default = join(Configuration()['directories']['cache'], 'hash_index.json'),
+        help = 'the file storing already computed hashes')
+    parser.add_argument('-c', '--canonical', action = 'store_true', default = False,
+        help = 'hash the canonical form of the images')
+    parser.add_argument('-x', '--exclude', type = str, nargs = '+', action = 'extend',
+        help = 'glob patterns of relative paths to ignore (e.g. "intermediate_results/*")')
+    arguments = parser.parse_args()
+
+    directory = arguments.directory
+    if arguments.team is not None:
+        directory = join(
+            Configuration()['directories']['reproduced_results'],
+            f'NARPS-{arguments.team}-reproduced')
+
+    hashes, aggregate_hash = hash_tree(
+        directory, arguments.workers, ImageHashIndex(arguments.index),
+        arguments.canonical, arguments.exclude)
+
+    for image, image_hash in hashes.items():
+        print(f'{image_hash}  {image}')
+    print(f'{aggregate_hash}  {directory}')
+
+if __name__ == '__main__':
+    main()
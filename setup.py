@@ -20,6 +20,7 @@ requires = [
     'nilearn>=0.10.0,<0.11',
     'nipype>=1.8.6,<1.9',
     'pandas>=1.5.2,<1.6',
+    'requests>=2.31.0,<3.0',
     'niflow-nipype1-workflows>=0.0.5,<0.1.0'
 ]
 extras_require = {
@@ -71,7 +72,10 @@ setup(
             'narps_open_runner = narps_open.runner:main',
             'narps_open_tester = narps_open.tester:main',
             'narps_open_status = narps_open.utils.status:main',
+            'narps_open_hash = narps_open.utils.hash:main',
+            'narps_open_gzip_benchmark = narps_open.utils.compression:main',
             'narps_open_correlations = narps_open.utils.correlation.__main__:main',
+            'narps_open_correlation_matrix = narps_open.utils.correlation.matrix:main',
             'narps_description = narps_open.data.description.__main__:main',
             'narps_results = narps_open.data.results.__main__:main'
         ]
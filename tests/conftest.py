@@ -8,8 +8,11 @@ pytest on (a) test file(s) in the same directory.
 
 from os import remove, mkdir
 from os.path import join, isfile
+from json import dumps
 from tempfile import mkdtemp
 from shutil import rmtree
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 from numpy import isclose
 from pytest import helpers, fixture
@@ -17,9 +20,9 @@ from pathvalidate import is_valid_filepath
 from numpy import isclose
 
 from narps_open.pipelines import Pipeline
-from narps_open.runner import PipelineRunner
-from narps_open.utils import get_subject_id
+from narps_open.runner import PipelineRunner, PipelineRunnerLevel
 from narps_open.utils.correlation import get_correlation_coefficient
+from narps_open.utils.correlation.cache import ResampledImageCache
 from narps_open.utils.configuration import Configuration
 from narps_open.data.results import ResultsCollection
 from narps_open.data.participants import get_participants_subset
@@ -34,6 +37,65 @@ def temporary_data_dir():
     yield data_dir
     rmtree(data_dir, ignore_errors = True)
 
+class LocalHTTPRequestHandler(BaseHTTPRequestHandler):
+    """ A request handler serving files from memory, as a stand-in for remote servers.
+        Class attributes are set by the local_http_server fixture:
+        - files, dict: url paths as keys, and file contents (bytes) or JSON objects as values
+        - truncate, dict: url paths as keys, and the number of bytes sent before the
+            connection is closed as values (only for the next request on this path)
+        - requests, list: (url path, range header, client address) of each request received
+    """
+    protocol_version = 'HTTP/1.1' # Allows keep-alive connections
+    files = {}
+    truncate = {}
+    requests = []
+
+    def log_message(self, *_): # Silence the server
+        pass
+
+    def do_GET(self):
+        """ Answer a GET request, handling 'Range: bytes=N-' headers """
+        range_header = self.headers.get('Range')
+        self.requests.append((self.path, range_header, self.client_address))
+        if self.path not in self.files:
+            self.send_error(404)
+            return
+
+        contents = self.files[self.path]
+        if not isinstance(contents, bytes):
+            contents = dumps(contents).encode('utf-8')
+
+        offset = int(range_header[6:-1]) if range_header is not None else 0
+        if offset >= len(contents) > 0:
+            self.send_response(416)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(206 if offset > 0 else 200)
+        self.send_header('Content-Length', str(len(contents) - offset))
+        self.end_headers()
+        if self.path in self.truncate:
+            self.wfile.write(contents[offset:offset + self.truncate.pop(self.path)])
+            self.close_connection = True
+            return
+        self.wfile.write(contents[offset:])
+
+@fixture
+def local_http_server():
+    """ A fixture running a local HTTP server (see LocalHTTPRequestHandler).
+        Yields the handler class, whose attribute base_url is the url of the server.
+    """
+    handler = type('Handler', (LocalHTTPRequestHandler,), {
+        'files': {}, 'truncate': {}, 'requests': []})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    handler.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield handler
+    server.shutdown()
+    server.server_close()
+
 @helpers.register
 def compare_float_2d_arrays(array_1, array_2):
     """ Assert array_1 and array_2 are close enough """
@@ -86,8 +148,6 @@ def test_pipeline_execution(
         results = pytest.helpers.test_pipeline('2T6S', 4)
         assert statistics.mean(results) > .003
 
-    TODO : how to keep intermediate files of the low level for the next numbers of subjects ?
-        - keep intermediate levels : boolean in PipelineRunner
     """
     # Create subdivisions of the requested subject list
     nb_subjects_per_group = Configuration()['testing']['pipelines']['nb_subjects_per_group']
@@ -108,36 +168,25 @@ def test_pipeline_execution(
         runner.subjects = subjects_list
 
         # Run as long as there are missing files after first level (with a max number of trials)
-        # TODO : this is a workaround
         for _ in range(Configuration()['runner']['nb_trials']):
 
-            # Get missing subjects
-            missing_subjects = set()
-            for file in runner.get_missing_first_level_outputs():
-                subject_id = get_subject_id(file)
-                if subject_id is not None:
-                    missing_subjects.add(subject_id)
-
-            # Leave if no missing subjects
-            if not missing_subjects:
+            # Leave if no missing outputs
+            if not runner.get_missing_outputs(PipelineRunnerLevel.FIRST):
                 break
 
-            # Start pipeline
-            runner.subjects = missing_subjects
+            # Start pipeline, only for missing outputs
             try: # This avoids errors in the workflow to make the test fail
-                runner.start(True, False)
+                runner.start(PipelineRunnerLevel.FIRST, resume = True)
             except(RuntimeError) as err:
                 print('RuntimeError: ', err)
 
     # Check missing files for the last time
-    missing_files = runner.get_missing_first_level_outputs()
-    if missing_files:
-        print('Missing files:', missing_files)
+    runner.nb_subjects = nb_subjects
+    if runner.get_missing_outputs(PipelineRunnerLevel.FIRST):
         raise Exception('There are missing files for first level analysis.')
 
     # Start pipeline for the group level only
-    runner.nb_subjects = nb_subjects
-    runner.start(False, True)
+    runner.start(PipelineRunnerLevel.GROUP)
 
     # Indices and keys to the unthresholded maps
     indices = list(range(1, 18, 2))
@@ -151,9 +200,13 @@ def test_pipeline_execution(
     results_files = [join(collection.directory, f) for f in sorted(collection.files.keys())]
     results_files = [results_files[i] for i in indices]
 
-    # Compute the correlation coefficients
+    # Compute the correlation coefficients, caching the resampled results files
+    cache = ResampledImageCache(
+        join(Configuration()['directories']['cache'], 'resampled'),
+        int(Configuration()['correlation']['resampled_cache_size_gb'] * 1024 ** 3)
+        )
     return [
-        get_correlation_coefficient(reproduced_file, results_file)
+        get_correlation_coefficient(reproduced_file, results_file, cache = cache)
         for reproduced_file, results_file in zip(reproduced_files, results_files)
         ]
 
@@ -278,6 +278,78 @@ class TestCoreCommon:
         with open(test_file_2, 'r', encoding = 'utf-8') as file:
             assert f'* out_value : {output_list_2}' in file.read()
 
+    @staticmethod
+    @mark.unit_test
+    def test_node_elements_containing():
+        """ Test the elements_containing function as a nipype.Node """
+
+        # Inputs / outputs
+        input_list = ['con_0001.nii', 'spmT_0001.nii', 'spmT_0002.nii', 'mask.nii']
+        output_list_1 = ['spmT_0001.nii', 'spmT_0002.nii']
+        output_list_2 = []
+
+        # Create a Nipype Node using elements_containing
+        test_node = Node(Function(
+            function = co.elements_containing,
+            input_names = ['input_list', 'element'],
+            output_names = ['output']
+            ), name = 'test_node')
+        test_node.inputs.input_list = input_list
+        test_node.inputs.element = 'spmT_'
+
+        # Check return value
+        assert test_node.run().outputs.output == output_list_1
+
+        # Change input and check return value
+        test_node = Node(Function(
+            function = co.elements_containing,
+            input_names = ['input_list', 'element'],
+            output_names = ['output']
+            ), name = 'test_node')
+        test_node.inputs.input_list = input_list
+        test_node.inputs.element = 'spmZ_'
+
+        assert test_node.run().outputs.output == output_list_2
+
+    @staticmethod
+    @mark.unit_test
+    def test_connect_elements_containing(temporary_data_dir):
+        """ Test the elements_containing function as evaluated in a connect """
+
+        # Inputs / outputs
+        input_list = ['con_0001.nii', 'spmT_0001.nii', 'spmT_0002.nii', 'mask.nii']
+        output_list = ['spmT_0001.nii', 'spmT_0002.nii']
+        function = lambda in_value: in_value
+
+        # Create Nodes
+        node_0 = Node(Function(
+            function = function,
+            input_names = ['in_value'],
+            output_names = ['out_value']
+            ), name = 'node_0')
+        node_0.inputs.in_value = input_list
+        node_1 = Node(Function(
+            function = function,
+            input_names = ['in_value'],
+            output_names = ['out_value']
+            ), name = 'node_1')
+
+        # Create Workflow
+        test_workflow = Workflow(
+            base_dir = temporary_data_dir,
+            name = 'test_workflow'
+            )
+        test_workflow.connect([
+            # elements_containing is evaluated as part of the connection
+            (node_0, node_1, [(('out_value', co.elements_containing, 'spmT_'), 'in_value')])
+            ])
+        test_workflow.run()
+
+        test_file = join(temporary_data_dir,
+            'test_workflow', 'node_1', '_report', 'report.rst')
+        with open(test_file, 'r', encoding = 'utf-8') as file:
+            assert f'* out_value : {output_list}' in file.read()
+
     @staticmethod
     @mark.unit_test
     def test_node_list_intersection():
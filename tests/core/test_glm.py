@@ -0,0 +1,272 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.core.glm' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_glm.py
+    pytest -q test_glm.py -k <selected_test>
+"""
+
+from os import chdir, getcwd, listdir
+from os.path import join, basename, isfile
+
+from numpy import (
+    array, arange, zeros, ones, eye, full, diag, allclose, isclose, isnan, argmax, savetxt,
+    float32, float64
+    )
+from numpy.linalg import lstsq
+from numpy.random import default_rng
+from scipy.ndimage import gaussian_filter
+from nibabel import load, Nifti1Image
+
+from pytest import mark, raises
+
+from narps_open.utils.configuration import Configuration
+from narps_open.data.events import create_bunch
+import narps_open.core.glm as glm
+
+class TestCoreGLM:
+    """ A class that contains all the unit tests for the glm module."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_hrf():
+        """ Test the get_hrf function """
+        hrf = glm.get_hrf(1.0, 16)
+        assert isclose(hrf.sum(), 1.0)
+        assert len(hrf) == 32 * 16 + 1
+        assert 4.5 < argmax(hrf) / 16 < 5.5 # Peak of the canonical HRF
+        assert hrf.min() < 0 # Undershoot
+
+    @staticmethod
+    @mark.unit_test
+    def test_orthogonalize():
+        """ Test the orthogonalize function """
+        matrix = array([[1, 1, 2], [1, 2, 1], [1, 3, 5], [1, 4, 0]], dtype = float64)
+        orthogonal = glm.orthogonalize(matrix)
+        assert allclose(orthogonal[:, 0], matrix[:, 0])
+        assert allclose(orthogonal[:, 1], matrix[:, 1] - 2.5)
+        assert allclose(orthogonal.T @ orthogonal, diag(diag(orthogonal.T @ orthogonal)))
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_condition_regressors():
+        """ Test the get_condition_regressors function """
+
+        # A long block reaches a plateau of its amplitude
+        regressors = glm.get_condition_regressors(
+            array([10.0]), array([100.0]), array([[1.0, 2.0]]), 2.0, 100)
+        assert regressors.shape == (100, 2)
+        assert allclose(regressors[:5], 0.0)
+        assert allclose(regressors[40:50], [1.0, 2.0], atol = 1e-3)
+
+        # Events outside the run are ignored
+        regressors = glm.get_condition_regressors(
+            array([500.0]), array([1.0]), array([[1.0]]), 2.0, 100)
+        assert allclose(regressors, 0.0)
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_drift_regressors():
+        """ Test the get_drift_regressors function """
+        drifts = glm.get_drift_regressors(200, 1.0, 128.0)
+        assert drifts.shape == (200, 3)
+        assert allclose(drifts.T @ drifts, eye(3))
+        assert allclose(drifts.sum(axis = 0), 0.0)
+        assert glm.get_drift_regressors(200, 1.0, None).shape == (200, 0)
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_design_matrix():
+        """ Test the get_design_matrix, concatenate_designs and get_contrast_weights
+            functions
+        """
+        info = create_bunch(
+            conditions = ['trial', 'missed'],
+            onsets = [[2.0, 20.0, 40.0], [60.0]],
+            durations = [[4.0], [2.0]],
+            modulations = [{'gain': [10.0, 20.0, 30.0]}, None])
+        design = glm.get_design_matrix(info, 1.0, 100, ones((100, 2)), 128.0)
+        assert list(design.columns) == [
+            'trial', 'trialxgain^1', 'missed', 'R1', 'R2', 'drift_1', 'constant']
+        assert design.shape == (100, 7)
+        assert allclose(design['constant'], 1.0)
+
+        # Concatenation
+        designs = [design, design.drop(columns = ['R2'])]
+        concatenated = glm.concatenate_designs(designs, ['trial', 'trialxgain^1', 'missed'])
+        assert concatenated.shape == (200, 3 + 2 * 4 - 1)
+        assert 'trial' in concatenated.columns
+        assert 'constant_run1' in concatenated.columns
+        assert allclose(concatenated['constant_run1'], [1.0] * 100 + [0.0] * 100)
+        assert allclose(concatenated['R2_run1'][100:], 0.0)
+        separate = glm.concatenate_designs(designs)
+        assert 'trial_run2' in separate.columns
+
+        # Contrasts
+        contrasts = [
+            ('trial', 'T', ['trial', 'trialxgain^1'], [1, 0]),
+            ('gain', 'T', ['trialxgain^1'], [-1])
+            ]
+        weights = glm.get_contrast_weights(contrasts, list(separate.columns))
+        assert weights.shape == (2, separate.shape[1])
+        assert weights[0, list(separate.columns).index('trial_run1')] == 1
+        assert weights[0, list(separate.columns).index('trial_run2')] == 1
+        assert weights[1].sum() == -2
+        with raises(AttributeError):
+            glm.get_contrast_weights([('c', 'F', ['trial'], [1])], list(separate.columns))
+        with raises(AttributeError):
+            glm.get_contrast_weights([('c', 'T', ['loss'], [1])], list(separate.columns))
+
+    @staticmethod
+    @mark.unit_test
+    def test_fit_glm():
+        """ Test the fit_glm function """
+        generator = default_rng(0)
+        design = zeros((300, 3))
+        design[:, 0] = generator.normal(0, 1, 300)
+        design[:, 1] = arange(300) / 300
+        design[:, 2] = 1.0
+        contrasts = array([[1.0, 0.0, 0.0], [0.0, 1.0, -1.0]])
+
+        # AR(1) noise
+        noise = generator.normal(0, 1, (300, 500))
+        for time in range(1, 300):
+            noise[time] += 0.5 * noise[time - 1]
+        data = design @ array([[2.0] * 500, [1.0] * 500, [5.0] * 500]) + noise
+
+        # OLS: same effects as a least squares fit
+        effects, variances, dof = glm.fit_glm(data, design, contrasts, 'ols')
+        assert dof == 297
+        assert allclose(effects, contrasts @ lstsq(design, data, rcond = None)[0])
+        assert (variances > 0).all()
+
+        # AR(1): unbiased effects, and smaller variance than OLS
+        ar1_effects, ar1_variances, _ = glm.fit_glm(
+            data, design, contrasts, 'ar1', run_lengths = [150, 150])
+        assert isclose(ar1_effects[0].mean(), 2.0, atol = 0.05)
+        assert (ar1_variances[0].mean() < variances[0].mean())
+
+        # Rank deficient design
+        effects, _, dof = glm.fit_glm(data, design[:, [0, 2, 2]], eye(3)[:1], 'ols')
+        assert dof == 298
+        assert isclose(effects.mean(), 2.0, atol = 0.05)
+
+        with raises(AttributeError):
+            glm.fit_glm(data, design, contrasts, 'ar2')
+
+    @staticmethod
+    @mark.unit_test
+    def test_read_time_series(temporary_data_dir):
+        """ Test the read_time_series function """
+        data = default_rng(0).normal(0, 1, (6, 5, 12, 4)).astype(float32)
+        for run_id in range(2):
+            Nifti1Image(data + run_id, diag([2.0, 2.0, 3.0, 1.0])).to_filename(
+                join(temporary_data_dir, f'run_{run_id}.nii.gz'))
+        func_files = [join(temporary_data_dir, f'run_{i}.nii.gz') for i in range(2)]
+        out_file = join(temporary_data_dir, 'time_series.dat')
+
+        cache_directory = Configuration()['directories']['cache']
+        Configuration()['directories']['cache'] = join(temporary_data_dir, 'cache')
+        try:
+            time_series = glm.read_time_series(func_files, out_file)
+            assert time_series.shape == (6, 5, 12, 8)
+            assert time_series.dtype == float32
+            assert allclose(time_series[..., :4], data)
+            assert allclose(time_series[..., 4:], data + 1)
+
+            # Runs are decompressed once, and links to the decompressed files are removed
+            assert len(listdir(join(temporary_data_dir, 'cache', 'decompressed'))) == 2
+            assert sorted(listdir(temporary_data_dir)) == [
+                'cache', 'run_0.nii.gz', 'run_1.nii.gz', 'time_series.dat']
+
+            # Volumes are smoothed once, as whole volumes
+            sigmas = 6.0 * glm.FWHM_TO_SIGMA / array([2.0, 2.0, 3.0])
+            time_series = glm.read_time_series(func_files, out_file, 6.0)
+            for volume in range(4):
+                smoothed = gaussian_filter(data[..., volume].astype(float64), sigmas,
+                    mode = 'constant', truncate = 4.0)
+                assert allclose(time_series[..., volume], smoothed, atol = 1e-6)
+        finally:
+            Configuration()['directories']['cache'] = cache_directory
+
+    @staticmethod
+    @mark.unit_test
+    def test_first_level_glm(temporary_data_dir):
+        """ Test the first_level_glm function """
+        generator = default_rng(0)
+
+        # Create two runs, with an effect of trials in the first half of the volume
+        func_files, confounds_files, subject_info = [], [], []
+        for run_id in range(2):
+            onsets = arange(5.0, 180.0, 10.0) + generator.uniform(0, 3, 18)
+            info = create_bunch(['trial'], [onsets], [full(18, 2.0)])
+            design = glm.get_design_matrix(info, 1.0, 200)
+            data = 100.0 + generator.normal(0, 1, (4, 4, 5, 200))
+            data[:2] += 3.0 * design['trial'].to_numpy()
+            data[3, 3] = 0.0 # Out of the brain
+            func_files.append(join(temporary_data_dir, f'run_{run_id}.nii.gz'))
+            Nifti1Image(data.astype(float32), eye(4)).to_filename(func_files[-1])
+            confounds_files.append(join(temporary_data_dir, f'confounds_{run_id}.tsv'))
+            savetxt(confounds_files[-1], generator.normal(0, 1, (200, 2)), delimiter = '\t')
+            subject_info.append(info)
+
+        contrasts = [
+            ('trial', 'T', ['trial'], [1]),
+            ('negative_trial', 'T', ['trial'], [-1])
+            ]
+        current_directory = getcwd()
+        cache_directory = Configuration()['directories']['cache']
+        Configuration()['directories']['cache'] = join(temporary_data_dir, 'cache')
+        chdir(temporary_data_dir)
+        try:
+            con_images, var_images, t_images, dof = glm.first_level_glm(
+                func_files, subject_info, contrasts, 1.0, confounds_files,
+                concatenate_runs = True, chunk_size = 2)
+            assert [basename(f) for f in con_images] == ['con_0001.nii', 'con_0002.nii']
+            assert [basename(f) for f in var_images] == ['varcon_0001.nii', 'varcon_0002.nii']
+            assert [basename(f) for f in t_images] == ['spmT_0001.nii', 'spmT_0002.nii']
+            assert dof == 400 - 1 - 2 * (2 + 3 + 1) # trial, then confounds, drifts, constant
+
+            effects = load(con_images[0]).get_fdata()
+            assert isclose(effects[:2].mean(), 3.0, atol = 0.2)
+            assert isclose(effects[2:3].mean(), 0.0, atol = 0.2)
+            assert allclose(load(con_images[1]).get_fdata()[:3], -effects[:3])
+            assert isnan(effects[3, 3]).all()
+            t_values = load(t_images[0]).get_fdata()
+            assert (t_values[:2] > 5).all()
+            assert allclose(t_values[:3], effects[:3] / load(var_images[0]).get_fdata()[:3] ** 0.5,
+                rtol = 1e-4)
+            assert not isfile(join(temporary_data_dir, 'time_series.dat'))
+
+            # Results do not depend on the number of slices fitted at once
+            con_images, _, _, _ = glm.first_level_glm(
+                func_files, subject_info, contrasts[:1], 1.0, confounds_files,
+                concatenate_runs = True, chunk_size = 5)
+            assert allclose(load(con_images[0]).get_fdata(), effects, equal_nan = True)
+
+            # FSL outputs, with a mask
+            mask = zeros((4, 4, 5))
+            mask[0] = 1
+            mask_file = join(temporary_data_dir, 'mask.nii.gz')
+            Nifti1Image(mask, eye(4)).to_filename(mask_file)
+            con_images, var_images, t_images, _ = glm.first_level_glm(
+                func_files, subject_info, contrasts[:1], 1.0, mask_file = mask_file,
+                fwhm = 2.0, noise_model = 'ols', output_format = 'fsl')
+            assert [basename(f) for f in con_images] == ['cope1.nii.gz']
+            assert [basename(f) for f in var_images] == ['varcope1.nii.gz']
+            assert [basename(f) for f in t_images] == ['tstat1.nii.gz']
+            effects = load(con_images[0]).get_fdata()
+            assert (effects[1:] == 0).all()
+            assert (effects[0] != 0).all()
+
+            with raises(AttributeError):
+                glm.first_level_glm(
+                    func_files, subject_info, contrasts, 1.0, output_format = 'afni')
+        finally:
+            chdir(current_directory)
+            Configuration()['directories']['cache'] = cache_directory
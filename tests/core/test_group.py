@@ -0,0 +1,172 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.core.group' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_group.py
+    pytest -q test_group.py -k <selected_test>
+"""
+
+from os import chdir, getcwd, makedirs
+from os.path import join, basename
+
+from numpy import array, zeros, ones, eye, allclose, isnan, nan, float32
+from numpy.random import default_rng
+from scipy.stats import ttest_1samp, ttest_ind, norm, t as t_distribution
+from nibabel import load, Nifti1Image
+
+from pytest import mark, raises
+
+from narps_open.data.participants import get_participants_index
+import narps_open.core.group as gp
+
+class TestCoreGroup:
+    """ A class that contains all the unit tests for the group module."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_subject_id():
+        """ Test the get_subject_id function """
+        assert gp.get_subject_id('/out/l1_analysis/_subject_id_001/con_0001.nii') == '001'
+        assert gp.get_subject_id('/out/sub-020/cope1.nii.gz') == '020'
+        assert gp.get_subject_id('/out/con_0001.nii') is None
+
+    @staticmethod
+    @mark.unit_test
+    def test_read_subject_maps(temporary_data_dir):
+        """ Test the read_subject_maps function """
+        files = []
+        for subject_id in range(3):
+            data = ones((3, 3, 3), dtype = float32) * (subject_id + 1)
+            data[0, 0, subject_id] = 0.0 # Undefined, SPM style
+            data[1, 1, subject_id] = nan # Undefined
+            data[2, 2] = 0.0 # Out of the brain for all subjects
+            files.append(join(temporary_data_dir, f'map_{subject_id}.nii'))
+            Nifti1Image(data, eye(4)).to_filename(files[-1])
+
+        data, mask, reference_image = gp.read_subject_maps(files)
+        assert mask.shape == (3, 3, 3)
+        assert mask.sum() == 27 - 3
+        assert not mask[2, 2].any()
+        assert data.shape == (3, 24)
+        assert data.dtype == float32
+        assert isnan(data).sum() == 6
+        assert allclose(data[1][~isnan(data[1])], 2.0)
+        assert reference_image.shape == (3, 3, 3)
+
+        Nifti1Image(zeros((3, 3, 4)), eye(4)).to_filename(join(temporary_data_dir, 'bad.nii'))
+        with raises(AttributeError):
+            gp.read_subject_maps(files + [join(temporary_data_dir, 'bad.nii')])
+
+    @staticmethod
+    @mark.unit_test
+    def test_fit_group_model():
+        """ Test the fit_group_model function against scipy """
+        data = default_rng(0).normal(0.5, 1.0, (10, 40))
+        data[3, 5] = nan
+
+        # One sample t-test
+        effects, t_values, z_values, valid, dof = gp.fit_group_model(
+            data, ones((10, 1)), array([[1.0], [-1.0]]))
+        assert dof == 9
+        assert valid.sum() == 39 and not valid[5]
+        assert isnan(t_values[:, 5]).all()
+        assert allclose(effects[0, valid], data[:, valid].mean(axis = 0))
+        assert allclose(t_values[0, valid], ttest_1samp(data[:, valid], 0).statistic)
+        assert allclose(t_values[1], -t_values[0], equal_nan = True)
+        assert allclose(norm.sf(z_values[0, valid]), t_distribution.sf(t_values[0, valid], 9))
+
+        # Two sample t-test
+        design = zeros((10, 2))
+        design[:4, 0] = 1
+        design[4:, 1] = 1
+        effects, t_values, _, valid, dof = gp.fit_group_model(
+            data, design, array([[1.0, -1.0]]))
+        assert dof == 8
+        assert allclose(t_values[0, valid],
+            ttest_ind(data[:4, valid], data[4:, valid]).statistic)
+
+        # Large t values are not saturated
+        _, t_values, z_values, _, _ = gp.fit_group_model(
+            array([[10.0], [10.1], [9.9], [10.0], [10.05]]), ones((5, 1)), ones((1, 1)))
+        assert t_values[0, 0] > 100
+        assert 5 < z_values[0, 0] < t_values[0, 0]
+
+    @staticmethod
+    @mark.unit_test
+    def test_group_level_ttests(temporary_data_dir):
+        """ Test the group_level_ttests function """
+
+        # Create subject level maps of 8 subjects, 4 in each group
+        generator = default_rng(0)
+        participants_file = join(temporary_data_dir, 'participants.tsv')
+        with open(participants_file, 'w', encoding = 'utf-8') as file:
+            file.write('participant_id\tgroup\tgender\tage\n')
+            for subject_id in range(1, 9):
+                group = 'equalRange' if subject_id % 2 else 'equalIndifference'
+                file.write(f'sub-{subject_id:03d}\t{group}\tM\t25\n')
+
+        contrast_files = []
+        subject_data = {}
+        for subject_id in range(1, 9):
+            data = generator.normal(1.0, 1.0, (3, 3, 3)).astype(float32)
+            data[0, 0, 0] = 0.0 if subject_id == 2 else data[0, 0, 0]
+            subject_data[f'{subject_id:03d}'] = data
+            directory = join(temporary_data_dir, 'l1_analysis', f'_subject_id_{subject_id:03d}')
+            makedirs(directory)
+            contrast_files.append(join(directory, 'con_0001.nii'))
+            Nifti1Image(data, eye(4)).to_filename(contrast_files[-1])
+        subject_list = [f'{i:03d}' for i in range(1, 8)] # Exclude subject 008
+
+        current_directory = getcwd()
+        chdir(temporary_data_dir)
+        try:
+            equal_range_files, equal_indifference_files, group_comp_files = \
+                gp.group_level_ttests(contrast_files, subject_list, participants_file)
+            assert [basename(f) for f in equal_range_files] == [
+                'con_0001.nii', 'spmT_0001.nii', 'spmZ_0001.nii',
+                'con_0002.nii', 'spmT_0002.nii', 'spmZ_0002.nii', 'mask.nii']
+            assert [basename(f) for f in group_comp_files] == [
+                'con_0001.nii', 'spmT_0001.nii', 'spmZ_0001.nii', 'mask.nii']
+            assert equal_indifference_files[0] == join(
+                temporary_data_dir, 'equalIndifference', 'con_0001.nii')
+
+            equal_range = array([subject_data[s] for s in ['001', '003', '005', '007']])
+            equal_indifference = array([subject_data[s] for s in ['002', '004', '006']])
+            t_values = load(equal_range_files[1]).get_fdata()
+            assert allclose(t_values, ttest_1samp(equal_range, 0).statistic, atol = 1e-4)
+            assert allclose(load(equal_range_files[4]).get_fdata(), -t_values, atol = 1e-4)
+            assert b'SPM{T_[3.0]}' in load(equal_range_files[1]).header['descrip'].tobytes()
+
+            # Voxel undefined for subject 002 is not estimated with equalIndifference
+            t_values = load(equal_indifference_files[1]).get_fdata()
+            assert isnan(t_values[0, 0, 0])
+            assert load(equal_indifference_files[-1]).get_fdata()[0, 0, 0] == 0
+            assert allclose(t_values[1:], ttest_1samp(equal_indifference, 0).statistic[1:],
+                atol = 1e-4)
+
+            # groupComp : equalRange - equalIndifference by default
+            t_values = load(group_comp_files[1]).get_fdata()
+            assert allclose(t_values[1:],
+                ttest_ind(equal_range, equal_indifference).statistic[1:], atol = 1e-4)
+
+            # FSL outputs, with other weights and a serialized participants index
+            _, _, group_comp_files = gp.group_level_ttests(
+                contrast_files, subject_list,
+                get_participants_index(participants_file).to_dict(),
+                group_comparison_weights = [-1, 1], output_format = 'fsl')
+            assert [basename(f) for f in group_comp_files] == [
+                'cope1.nii.gz', 'tstat1.nii.gz', 'zstat1.nii.gz', 'mask.nii.gz']
+            fsl_t_values = load(group_comp_files[1]).get_fdata()
+            assert fsl_t_values[0, 0, 0] == 0
+            assert allclose(fsl_t_values[1:], -t_values[1:], atol = 1e-4)
+
+            with raises(AttributeError):
+                gp.group_level_ttests(
+                    contrast_files, subject_list, participants_file, output_format = 'afni')
+        finally:
+            chdir(current_directory)
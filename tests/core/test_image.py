@@ -11,11 +11,14 @@ Usage:
     pytest -q test_image.py -k <selected_test>
 """
 
-from os.path import abspath, join
-from numpy import isclose
+from os import chdir, getcwd
+from os.path import abspath, join, basename
+from numpy import isclose, mean, std, zeros, ones, eye, uint8, float32, array_equal
 
-from pytest import mark
+from pytest import mark, raises
 from nipype import Node, Function
+from nibabel import load, Nifti1Image
+from nilearn.image import iter_img, resample_to_img
 
 from narps_open.utils.configuration import Configuration
 import narps_open.core.image as im
@@ -46,3 +49,133 @@ class TestCoreImage:
 
         # Check voxel sizes
         assert isclose(outputs.voxel_dimensions, [8.0, 8.0, 9.6]).all()
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_mask_weights(temporary_data_dir):
+        """ Test the get_mask_weights function """
+        test_data = join(Configuration()['directories']['test_data'], 'pipelines')
+        func_file = join(test_data, 'team_UK24', 'func_resampled-32.nii')
+        mask_file = join(test_data, 'team_UK24', 'mask_resampled-32.nii')
+        wc2_file = join(test_data, 'team_98BT', 'wc2sub-001_T1w-32.nii')
+
+        # Mask in the same space
+        weights, nb_voxels = im.get_mask_weights(mask_file, func_file)
+        assert nb_voxels == 150
+        assert (weights == (load(mask_file).get_fdata() > 0.0)).all()
+
+        # Mask in another space: weights are the numbers of mask voxels
+        # whose nearest neighbour is the voxel
+        weights, nb_voxels = im.get_mask_weights(wc2_file, func_file, 0.6)
+        assert nb_voxels == 150
+        assert weights.shape == (5, 6, 5)
+        assert weights.sum() <= (load(wc2_file).get_fdata() > 0.6).sum()
+        assert weights.max() > 1
+
+        # Mask voxels beyond the voxel centres of the target are ignored, as with nilearn
+        target_file = join(temporary_data_dir, 'target.nii')
+        Nifti1Image(ones((4, 4, 4), dtype = float32), eye(4)).to_filename(target_file)
+        for shift, expected_weights in [(0.3, [1, 1, 1, 0]), (-0.3, [0, 1, 1, 1])]:
+            affine = eye(4)
+            affine[0, 3] = shift
+            shifted_mask_file = join(temporary_data_dir, 'shifted_mask.nii')
+            Nifti1Image(ones((5, 1, 1), dtype = float32), affine).to_filename(shifted_mask_file)
+            weights, nb_voxels = im.get_mask_weights(shifted_mask_file, target_file)
+            assert nb_voxels == 5
+            assert weights[:, 0, 0].tolist() == expected_weights
+            assert weights.sum() == resample_to_img(
+                target_file, shifted_mask_file, interpolation = 'nearest').get_fdata().sum()
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_masked_time_series():
+        """ Test the get_masked_time_series function """
+        test_data = join(Configuration()['directories']['test_data'], 'pipelines')
+        func_file = join(test_data, 'team_98BT', 'uasub-001_task-MGT_run-01_bold_resampled-32.nii')
+        wc2_file = join(test_data, 'team_98BT', 'wc2sub-001_T1w-32.nii')
+        mask_file = join(test_data, 'team_UK24', 'mask_resampled-32.nii')
+
+        # Reference values, resampling each frame into the mask space
+        wc2 = load(wc2_file)
+        wc2_mask = wc2.get_fdata() > 0.6
+        frames = [resample_to_img(f, wc2, interpolation = 'nearest').get_fdata()
+            for f in iter_img(load(func_file))]
+
+        values = im.get_masked_time_series(func_file, wc2_file, 'image_mean', 0.6)
+        assert isclose(values, [mean(f * wc2_mask) for f in frames]).all()
+        for chunk_size in [1, 3]:
+            assert im.get_masked_time_series(
+                func_file, wc2_file, 'image_mean', 0.6, chunk_size) == values
+        values = im.get_masked_time_series(func_file, wc2_file, 'mean', 0.6)
+        assert isclose(values, [f[wc2_mask].mean() for f in frames]).all()
+        values = im.get_masked_time_series(func_file, wc2_file, 'sum', 0.6)
+        assert isclose(values, [f[wc2_mask].sum() for f in frames]).all()
+        values = im.get_masked_time_series(func_file, wc2_file, 'std', 0.6)
+        assert isclose(values, [std(f[wc2_mask]) for f in frames]).all()
+        values = im.get_masked_time_series(func_file, wc2_file, 'max', 0.6)
+        assert isclose(values, [f[wc2_mask].max() for f in frames]).all()
+
+        # Mask in the same space
+        func_data = load(func_file).get_fdata()
+        mask = load(mask_file).get_fdata() > 0.0
+        values = im.get_masked_time_series(func_file, mask_file, 'min')
+        assert isclose(values, [func_data[..., i][mask].min() for i in range(4)]).all()
+
+        # Empty mask
+        values = im.get_masked_time_series(func_file, mask_file, 'mean', 1000.0)
+        assert len(values) == 4
+        assert all(v != v for v in values) # NaN values
+
+        with raises(AttributeError):
+            im.get_masked_time_series(func_file, mask_file, 'median')
+
+    @staticmethod
+    @mark.unit_test
+    def test_combine_masks(temporary_data_dir):
+        """ Test the combine_masks function """
+
+        # Create test masks: mask i contains voxels [i:i+5, :, :] of a 10x3x2 image
+        masks = []
+        for index in range(5):
+            data = zeros((10, 3, 2), dtype = uint8 if index % 2 == 0 else float32)
+            data[index:index + 5] = 1
+            mask_file = join(temporary_data_dir, f'mask_{index}.nii.gz')
+            Nifti1Image(data, eye(4)).to_filename(mask_file)
+            masks.append(mask_file)
+
+        current_directory = getcwd()
+        chdir(temporary_data_dir)
+        try:
+            out_file = im.combine_masks(masks, 'intersection', suffix = '_maths')
+            assert out_file == join(temporary_data_dir, 'mask_0_maths.nii.gz')
+            out_image = load(out_file)
+            assert out_image.get_data_dtype() == uint8
+            assert array_equal(out_image.affine, eye(4))
+            expected = zeros((10, 3, 2), dtype = uint8)
+            expected[4] = 1
+            assert array_equal(out_image.get_fdata(), expected)
+
+            out_file = im.combine_masks(masks, 'union')
+            assert basename(out_file) == 'mask_0_combined.nii.gz'
+            expected = zeros((10, 3, 2), dtype = uint8)
+            expected[0:9] = 1
+            assert array_equal(load(out_file).get_fdata(), expected)
+
+            out_file = im.combine_masks(masks, 'count', min_count = 3)
+            expected = zeros((10, 3, 2), dtype = uint8)
+            expected[2:7] = 1
+            assert array_equal(load(out_file).get_fdata(), expected)
+
+            # A single mask, with a threshold
+            out_file = im.combine_masks(masks[1], 'intersection', mask_threshold = 1.0)
+            assert load(out_file).get_fdata().sum() == 0
+
+            # Errors
+            with raises(AttributeError):
+                im.combine_masks(masks, 'difference')
+            other_mask = join(temporary_data_dir, 'other_mask.nii.gz')
+            Nifti1Image(zeros((3, 3, 3), dtype = uint8), eye(4)).to_filename(other_mask)
+            with raises(AttributeError):
+                im.combine_masks(masks + [other_mask], 'union')
+        finally:
+            chdir(current_directory)
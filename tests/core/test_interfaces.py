@@ -11,11 +11,19 @@ Usage:
     pytest -q test_interfaces.py -k <selected_test>
 """
 
-from pytest import mark, raises
+from os import makedirs, chdir, getcwd, listdir
+from os.path import join, isfile, samefile
+from gzip import open as gzip_open
 
+from pytest import mark, raises, warns
+
+from nipype import Node
 from nipype.interfaces.base.core import Interface
+from nipype.interfaces.io import SelectFiles
 from nipype.interfaces.utility import Select, Function
+from nipype.interfaces.fsl import Randomise
 
+from narps_open.utils.configuration import Configuration
 from narps_open.core import interfaces
 
 class ValidNC(interfaces.InterfaceCreator):
@@ -84,6 +92,158 @@ class TestRemoveFileInterfaceCreator:
         assert 'file_name = <undefined>' in inputs
         assert 'function_str = def remove_file(_, file_name: str) -> None:' in inputs
 
+class TestMaskedTimeSeriesInterfaceCreator:
+    """ A class that contains all the unit tests for the MaskedTimeSeriesInterfaceCreator class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_create_interface():
+        """ Test the create_interface method """
+
+        test_interface = interfaces.MaskedTimeSeriesInterfaceCreator.create_interface()
+        assert isinstance(test_interface, Function)
+        inputs = str(test_interface.inputs)
+        assert 'in_file = <undefined>' in inputs
+        assert 'mask_file = <undefined>' in inputs
+        assert 'reduction = <undefined>' in inputs
+        assert 'mask_threshold = <undefined>' in inputs
+        assert 'function_str = def get_masked_time_series(' in inputs
+
+        test_interface = interfaces.InterfaceFactory.create('get_masked_time_series')
+        assert isinstance(test_interface, Function)
+
+class TestCombineMasksInterfaceCreator:
+    """ A class that contains all the unit tests for the CombineMasksInterfaceCreator class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_create_interface():
+        """ Test the create_interface method """
+
+        test_interface = interfaces.CombineMasksInterfaceCreator.create_interface()
+        assert isinstance(test_interface, Function)
+        inputs = str(test_interface.inputs)
+        assert 'masks = <undefined>' in inputs
+        assert 'operation = <undefined>' in inputs
+        assert 'min_count = <undefined>' in inputs
+        assert 'mask_threshold = <undefined>' in inputs
+        assert 'suffix = <undefined>' in inputs
+        assert 'function_str = def combine_masks(' in inputs
+
+        test_interface = interfaces.InterfaceFactory.create('combine_masks')
+        assert isinstance(test_interface, Function)
+
+class TestRandomiseInterfaceCreator:
+    """ A class that contains all the unit tests for the RandomiseInterfaceCreator class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_create_interface(mocker):
+        """ Test the create_interface method """
+
+        # FSL engine
+        mocker.patch.dict(Configuration()['pipelines'], {'permutation_engine': 'fsl'})
+        assert isinstance(interfaces.RandomiseInterfaceCreator.create_interface(), Randomise)
+
+        # Native engine
+        mocker.patch.dict(Configuration()['pipelines'], {'permutation_engine': 'native'})
+        test_interface = interfaces.RandomiseInterfaceCreator.create_interface()
+        assert isinstance(test_interface, Function)
+        inputs = str(test_interface.inputs)
+        for input_name in ['in_file', 'mask', 'design_mat', 'tcon', 'one_sample_group_mean',
+            'num_perm', 'tfce', 'tfce_E', 'vox_p_values', 'c_thresh']:
+            assert f'{input_name} = <undefined>' in inputs
+        assert 'function_str = def randomise(' in inputs
+        assert isinstance(interfaces.InterfaceFactory.create('randomise'), Function)
+
+        # The number of processes of the native engine is the n_procs of the node
+        mocker.patch.dict(Configuration()['pipelines'], {
+            'permutation_nb_procs': 3, 'permutation_memory_gb': 2.0})
+        test_interface = interfaces.RandomiseInterfaceCreator.create_interface()
+        assert test_interface.inputs.num_threads == 3
+        assert test_interface.inputs.memory_gb == 2.0
+        assert Node(test_interface, name = 'randomise').n_procs == 3
+
+        # Unknown engine
+        mocker.patch.dict(Configuration()['pipelines'], {'permutation_engine': 'fake'})
+        with raises(AttributeError):
+            interfaces.RandomiseInterfaceCreator.create_interface()
+
+class TestFirstLevelGLMInterfaceCreator:
+    """ A class that contains all the unit tests for the FirstLevelGLMInterfaceCreator class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_create_interface():
+        """ Test the create_interface method """
+
+        test_interface = interfaces.FirstLevelGLMInterfaceCreator.create_interface()
+        assert isinstance(test_interface, Function)
+        inputs = str(test_interface.inputs)
+        for input_name in ['func_files', 'subject_info', 'contrasts', 'tr', 'confounds_files',
+            'mask_file', 'fwhm', 'noise_model', 'concatenate_runs', 'output_format']:
+            assert f'{input_name} = <undefined>' in inputs
+        assert 'function_str = def first_level_glm(' in inputs
+
+        test_interface = interfaces.InterfaceFactory.create('first_level_glm')
+        assert isinstance(test_interface, Function)
+
+class TestGroupLevelTTestsInterfaceCreator:
+    """ A class that contains all the unit tests for the GroupLevelTTestsInterfaceCreator class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_create_interface():
+        """ Test the create_interface method """
+
+        test_interface = interfaces.GroupLevelTTestsInterfaceCreator.create_interface()
+        assert isinstance(test_interface, Function)
+        inputs = str(test_interface.inputs)
+        for input_name in ['contrast_files', 'subject_list', 'participants_file',
+            'group_comparison_weights', 'output_format']:
+            assert f'{input_name} = <undefined>' in inputs
+        assert 'function_str = def group_level_ttests(' in inputs
+
+        test_interface = interfaces.InterfaceFactory.create('group_level_ttests')
+        assert isinstance(test_interface, Function)
+
+class TestThresholdMapsInterfaceCreator:
+    """ A class that contains all the unit tests for the ThresholdMapsInterfaceCreator class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_create_interface():
+        """ Test the create_interface method """
+
+        test_interface = interfaces.ThresholdMapsInterfaceCreator.create_interface()
+        assert isinstance(test_interface, Function)
+        inputs = str(test_interface.inputs)
+        for input_name in ['stat_files', 'thresholds', 'dof']:
+            assert f'{input_name} = <undefined>' in inputs
+        assert 'function_str = def threshold_maps(' in inputs
+
+        test_interface = interfaces.InterfaceFactory.create('threshold_maps')
+        assert isinstance(test_interface, Function)
+
+class TestParticipantsIndexInterfaceCreator:
+    """ A class that contains all the unit tests for the ParticipantsIndexInterfaceCreator
+        class.
+    """
+
+    @staticmethod
+    @mark.unit_test
+    def test_create_interface():
+        """ Test the create_interface method """
+
+        test_interface = interfaces.ParticipantsIndexInterfaceCreator.create_interface()
+        assert isinstance(test_interface, Function)
+        inputs = str(test_interface.inputs)
+        assert 'participants_file = <undefined>' in inputs
+        assert 'function_str = def serialize_participants_index(' in inputs
+
+        test_interface = interfaces.InterfaceFactory.create('participants_index')
+        assert isinstance(test_interface, Function)
+
 class TestInterfaceFactory:
     """ A class that contains all the unit tests for the InterfaceFactory class."""
 
@@ -101,3 +261,133 @@ class TestInterfaceFactory:
         assert '_ = <undefined>' in inputs
         assert 'file_name = <undefined>' in inputs
         assert 'function_str = def remove_file(_, file_name: str) -> None:' in inputs
+
+class TestIndexedSelectFiles:
+    """ A class that contains all the unit tests for the IndexedSelectFiles class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_run(mocker, temporary_data_dir):
+        """ Test running the interface, compared to SelectFiles """
+
+        # Create a dataset
+        for subject in ['001', '002']:
+            for directory in [
+                join(temporary_data_dir, 'derivatives', 'fmriprep', f'sub-{subject}', 'func'),
+                join(temporary_data_dir, f'sub-{subject}', 'anat')]:
+                makedirs(directory)
+            for run in ['01', '02']:
+                open(join(temporary_data_dir, 'derivatives', 'fmriprep', f'sub-{subject}',
+                    'func', f'sub-{subject}_run-{run}_preproc.nii.gz'), 'w').close()
+            open(join(temporary_data_dir, f'sub-{subject}', 'anat', f'sub-{subject}_T1w.nii'),
+                'w').close()
+
+        templates = {
+            'func' : join('derivatives', 'fmriprep', 'sub-{subject_id}', 'func',
+                'sub-{subject_id}_run-*_preproc.nii.gz'),
+            'anat' : join('sub-{subject_id}', 'anat', 'sub-{subject_id}_T1w.nii')
+            }
+        index_file = join(temporary_data_dir, 'index', 'index.json')
+
+        for subject in ['001', '002']:
+            expected_interface = SelectFiles(templates, base_directory = temporary_data_dir)
+            expected_interface.inputs.subject_id = subject
+            test_interface = interfaces.IndexedSelectFiles(
+                templates, base_directory = temporary_data_dir, index_file = index_file)
+            test_interface.inputs.subject_id = subject
+
+            spy = mocker.spy(interfaces, 'glob')
+            assert test_interface.run().outputs.get() == expected_interface.run().outputs.get()
+            assert spy.call_count == 1 # Only for the anat template
+            mocker.stopall()
+
+        assert isfile(index_file)
+
+        # Missing files
+        test_interface = interfaces.IndexedSelectFiles(
+            templates, base_directory = temporary_data_dir, index_file = index_file)
+        test_interface.inputs.subject_id = '003'
+        with raises(IOError):
+            test_interface.run()
+
+        test_interface = interfaces.IndexedSelectFiles(
+            templates, base_directory = temporary_data_dir, index_file = index_file,
+            raise_on_empty = False, force_lists = True)
+        test_interface.inputs.subject_id = '003'
+        with warns(UserWarning):
+            outputs = test_interface.run().outputs.get()
+        assert outputs['func'] == []
+
+class TestCachedGunzip:
+    """ A class that contains all the unit tests for the CachedGunzip class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_run(temporary_data_dir):
+        """ Test running the interface """
+
+        in_file = join(temporary_data_dir, 'file.nii.gz')
+        with gzip_open(in_file, 'wb') as file:
+            file.write(b'data')
+        cache_directory = join(temporary_data_dir, 'cache')
+
+        # Run the interface from two node directories
+        out_files = []
+        current_directory = getcwd()
+        try:
+            for node_dir in ['node_1', 'node_2']:
+                makedirs(join(temporary_data_dir, node_dir))
+                chdir(join(temporary_data_dir, node_dir))
+                test_interface = interfaces.CachedGunzip(
+                    in_file = in_file, cache_directory = cache_directory)
+                out_files.append(test_interface.run().outputs.out_file)
+        finally:
+            chdir(current_directory)
+
+        assert out_files[0] == join(temporary_data_dir, 'node_1', 'file.nii')
+        assert samefile(out_files[0], out_files[1])
+        with open(out_files[1], 'rb') as file:
+            assert file.read() == b'data'
+        assert len(listdir(cache_directory)) == 1
+
+class TestParallelGzip:
+    """ A class that contains all the unit tests for the ParallelGzip and
+        ParallelGunzip classes.
+    """
+
+    @staticmethod
+    @mark.unit_test
+    def test_run(temporary_data_dir):
+        """ Test running the interfaces """
+
+        in_file = join(temporary_data_dir, 'file.nii')
+        with open(in_file, 'wb') as file:
+            file.write(b'data' * 1000)
+
+        current_directory = getcwd()
+        try:
+            chdir(temporary_data_dir)
+            test_interface = interfaces.ParallelGzip(in_file = in_file, num_threads = 2)
+            out_file = test_interface.run().outputs.out_file
+            assert out_file == in_file + '.gz'
+            with gzip_open(out_file, 'rb') as file:
+                assert file.read() == b'data' * 1000
+
+            makedirs(join(temporary_data_dir, 'decompressed'))
+            chdir(join(temporary_data_dir, 'decompressed'))
+            test_interface = interfaces.ParallelGunzip(in_file = out_file)
+            out_file = test_interface.run().outputs.out_file
+            assert out_file == join(temporary_data_dir, 'decompressed', 'file.nii')
+            with open(out_file, 'rb') as file:
+                assert file.read() == b'data' * 1000
+        finally:
+            chdir(current_directory)
+
+    @staticmethod
+    @mark.unit_test
+    def test_n_procs():
+        """ Test that the number of threads follows the n_procs of the node """
+        assert interfaces.ParallelGzip().inputs.num_threads == 1
+        assert Node(interfaces.ParallelGzip(), name = 'gzip').n_procs == 1
+        node = Node(interfaces.ParallelGzip(), name = 'gzip', n_procs = 3)
+        assert node.interface.inputs.num_threads == 3
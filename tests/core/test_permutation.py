@@ -0,0 +1,264 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.core.permutation' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_permutation.py
+    pytest -q test_permutation.py -k <selected_test>
+"""
+
+from os import chdir, getcwd
+from os.path import join, basename
+
+from numpy import (
+    array, zeros, ones, eye, allclose, isclose, array_equal, arange, sort, argsort, unique
+    )
+from numpy.random import default_rng
+from scipy.stats import ttest_1samp, ttest_ind
+from nibabel import load, Nifti1Image
+from nipype.interfaces.fsl import Randomise
+
+from pytest import mark, raises
+
+import narps_open.core.permutation as pm
+
+class TestCorePermutation:
+    """ A class that contains all the unit tests for the permutation module."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_read_vest_file(temporary_data_dir):
+        """ Test the read_vest_file function """
+        vest_file = join(temporary_data_dir, 'design.mat')
+        with open(vest_file, 'w', encoding = 'utf-8') as file:
+            file.write('/NumWaves\t2\n/NumPoints\t3\n/PPheights\t1 1\n\n/Matrix\n')
+            file.write('1 0\n0 1\n1 0\n')
+
+        assert array_equal(pm.read_vest_file(vest_file), array([[1, 0], [0, 1], [1, 0]]))
+        assert pm.is_one_sample_design(ones((4, 1)))
+        assert not pm.is_one_sample_design(eye(2))
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_permutations():
+        """ Test the get_permutations function """
+
+        # Exhaustive sign-flips
+        permutations = pm.get_permutations(4, 100, True)
+        assert permutations.shape == (16, 4)
+        assert array_equal(permutations[0], ones(4))
+        assert len(unique(permutations, axis = 0)) == 16
+
+        # Random sign-flips
+        permutations = pm.get_permutations(10, 100, True, seed = 1)
+        assert permutations.shape == (100, 10)
+        assert array_equal(permutations[0], ones(10))
+        assert array_equal(permutations, pm.get_permutations(10, 100, True, seed = 1))
+
+        # Label permutations
+        permutations = pm.get_permutations(6, 20, False)
+        assert permutations.shape == (20, 6)
+        assert array_equal(permutations[0], arange(6))
+        assert all(array_equal(sort(p), arange(6)) for p in permutations)
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_t_statistics():
+        """ Test the get_t_statistics function against scipy """
+        data = default_rng(0).normal(0.3, 1.0, (10, 50))
+
+        # One sample t-test
+        tstats = pm.get_t_statistics(
+            data, ones((10, 1)), ones((1, 1)), pm.get_permutations(10, 5, True), True)
+        assert tstats.shape == (5, 1, 50)
+        assert allclose(tstats[0, 0], ttest_1samp(data, 0).statistic)
+
+        # Two sample t-test, with two contrasts
+        design = zeros((10, 2))
+        design[:4, 0] = 1
+        design[4:, 1] = 1
+        contrasts = array([[1, -1], [-1, 1]])
+        permutations = pm.get_permutations(10, 3, False)
+        tstats = pm.get_t_statistics(data, design, contrasts, permutations, False)
+        assert tstats.shape == (3, 2, 50)
+        assert allclose(tstats[0, 0], ttest_ind(data[:4], data[4:]).statistic)
+        assert allclose(tstats[0, 1], -tstats[0, 0])
+        permuted = data[argsort(permutations[1])]
+        assert allclose(tstats[1, 0], ttest_ind(permuted[:4], permuted[4:]).statistic)
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_tfce():
+        """ Test the get_tfce function """
+        stat_map = zeros((5, 5, 5))
+        stat_map[1, 1, 1:3] = 2.0 # A cluster of 2 voxels
+        stat_map[3, 3, 3] = 1.0 # A cluster of 1 voxel
+        stat_map[4, 4, 4] = -3.0 # Negative values are ignored
+
+        tfce = pm.get_tfce(stat_map, 0.5)
+
+        # Thresholds 0.5, 1.0, 1.5, 2.0 for the first cluster (extent 2),
+        # and 0.5, 1.0 for the second one (extent 1)
+        expected_1 = sum(2 ** 0.5 * h ** 2 * 0.5 for h in [0.5, 1.0, 1.5, 2.0])
+        expected_2 = sum(1 ** 0.5 * h ** 2 * 0.5 for h in [0.5, 1.0])
+        assert isclose(tfce[1, 1, 1], expected_1)
+        assert isclose(tfce[1, 1, 2], expected_1)
+        assert isclose(tfce[3, 3, 3], expected_2)
+        assert tfce[4, 4, 4] == 0.0
+        assert tfce.sum() == 2 * tfce[1, 1, 1] + tfce[3, 3, 3]
+
+        # Connectivity
+        stat_map = zeros((3, 3, 3))
+        stat_map[0, 0, 0] = stat_map[1, 1, 0] = 1.0
+        assert isclose(pm.get_tfce(stat_map, 1.0, connectivity = 6)[0, 0, 0], 1.0)
+        assert isclose(pm.get_tfce(stat_map, 1.0, connectivity = 18)[0, 0, 0], 2 ** 0.5)
+        with raises(AttributeError):
+            pm.get_tfce(stat_map, 1.0, connectivity = 8)
+
+        assert not pm.get_tfce(zeros((3, 3, 3)), 0.0).any()
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_cluster_extents():
+        """ Test the get_cluster_extents function """
+        stat_map = zeros((4, 4, 4))
+        stat_map[0, 0, 0:3] = 3.0
+        stat_map[1, 1, 3] = 3.0 # Connected to the first cluster by a corner
+        stat_map[3, 3, 0] = 0.5
+
+        extents = pm.get_cluster_extents(stat_map, 1.0)
+        assert extents[0, 0, 0] == 4
+        assert extents[1, 1, 3] == 4
+        assert extents[3, 3, 0] == 0
+        assert pm.get_cluster_extents(stat_map, 1.0, connectivity = 6)[1, 1, 3] == 1
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_block_size():
+        """ Test the get_block_size function """
+        # 1000 voxels, 1 regressor, 1 contrast: 80 KB per permutation
+        assert pm.get_block_size(1000, 1, 1, 80000 / 1024 ** 3) == 1
+        assert pm.get_block_size(1000, 1, 1, 800000 / 1024 ** 3) == 10
+        assert pm.get_block_size(1000, 2, 2, 800000 / 1024 ** 3) == 5
+        assert pm.get_block_size(10 ** 9, 1, 1, 1.0) == 1
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_corrected_p_values():
+        """ Test the get_corrected_p_values function """
+        p_values = pm.get_corrected_p_values(
+            array([0.5, 2.0, 5.0]), array([1.0, 2.0, 3.0, 4.0]))
+        assert allclose(p_values, [1.0, 0.75, 0.0])
+
+    @staticmethod
+    @mark.unit_test
+    def test_randomise(temporary_data_dir):
+        """ Test the randomise function """
+
+        # Create test data: 8 subjects, with an effect in half of the volume
+        data = default_rng(0).normal(0.0, 1.0, (4, 4, 3, 8))
+        data[:2] += 2.0
+        mask = ones((4, 4, 3))
+        mask[3, 3] = 0
+        in_file = join(temporary_data_dir, 'in.nii.gz')
+        mask_file = join(temporary_data_dir, 'mask.nii.gz')
+        Nifti1Image(data, eye(4)).to_filename(in_file)
+        Nifti1Image(mask, eye(4)).to_filename(mask_file)
+
+        current_directory = getcwd()
+        chdir(temporary_data_dir)
+        try:
+            # One sample group mean, with exhaustive sign-flips (2 ^ 8 = 256)
+            tstat_files, corrected_files, p_files = pm.randomise(
+                in_file, mask_file, one_sample_group_mean = True, num_perm = 1000,
+                tfce = True, vox_p_values = True, c_thresh = 2.0, num_threads = 2)
+            assert [basename(f) for f in tstat_files] == ['randomise_tstat1.nii.gz']
+            assert [basename(f) for f in corrected_files] == [
+                'randomise_tfce_corrp_tstat1.nii.gz']
+            assert [basename(f) for f in p_files] == ['randomise_tfce_p_tstat1.nii.gz']
+
+            tstat = load(tstat_files[0]).get_fdata()
+            expected = ttest_1samp(data, 0, axis = 3).statistic
+            assert allclose(tstat[mask > 0], expected[mask > 0], atol = 1e-5)
+            assert (tstat[mask == 0] == 0).all()
+
+            # Exact uncorrected p-values: proportion of sign-flips with a greater t
+            flips = pm.get_permutations(8, 1000, True)
+            voxel_data = data[0, 0, 0]
+            flipped_t = ttest_1samp(flips * voxel_data, 0, axis = 1).statistic
+            expected_p = (flipped_t >= flipped_t[0] - 1e-10).mean()
+            p_value = 1.0 - load('randomise_vox_p_tstat1.nii.gz').get_fdata()[0, 0, 0]
+            assert isclose(p_value, expected_p, atol = 1e-6)
+
+            # Results do not depend on the number of workers, nor on the size of blocks
+            pm.randomise(
+                in_file, mask_file, base_name = 'single', one_sample_group_mean = True,
+                num_perm = 1000, tfce = True, vox_p_values = True, c_thresh = 2.0,
+                num_threads = 1, memory_gb = 1e-6)
+            for name in ['vox_p', 'vox_corrp', 'tfce_p', 'tfce_corrp', 'clustere_corrp']:
+                assert allclose(load(f'randomise_{name}_tstat1.nii.gz').get_fdata(),
+                    load(f'single_{name}_tstat1.nii.gz').get_fdata())
+
+            # Two sample design, using design files
+            design_file = join(temporary_data_dir, 'design.mat')
+            with open(design_file, 'w', encoding = 'utf-8') as file:
+                file.write('/NumWaves\t2\n/NumPoints\t8\n/Matrix\n')
+                file.write('1 0\n' * 3 + '0 1\n' * 5)
+            contrast_file = join(temporary_data_dir, 'design.con')
+            with open(contrast_file, 'w', encoding = 'utf-8') as file:
+                file.write('/NumWaves\t2\n/NumContrasts\t2\n/Matrix\n1 -1\n-1 1\n')
+
+            tstat_files, corrected_files, p_files = pm.randomise(
+                in_file, mask_file, design_file, contrast_file, base_name = 'two',
+                num_perm = 200, tfce = True)
+            assert [basename(f) for f in tstat_files] == [
+                'two_tstat1.nii.gz', 'two_tstat2.nii.gz']
+            assert [basename(f) for f in corrected_files] == [
+                'two_tfce_corrp_tstat1.nii.gz', 'two_tfce_corrp_tstat2.nii.gz']
+            assert p_files == []
+            tstat = load(tstat_files[0]).get_fdata()
+            expected = ttest_ind(data[..., :3], data[..., 3:], axis = 3).statistic
+            assert allclose(tstat[mask > 0], expected[mask > 0], atol = 1e-5)
+            corrected_p = load(corrected_files[0]).get_fdata()
+            assert ((corrected_p >= 0) & (corrected_p < 1)).all()
+
+            # Design not matching the data
+            with open(design_file, 'w', encoding = 'utf-8') as file:
+                file.write('/NumWaves\t2\n/NumPoints\t4\n/Matrix\n' + '1 0\n0 1\n' * 2)
+            with raises(AttributeError):
+                pm.randomise(in_file, mask_file, design_file, contrast_file)
+        finally:
+            chdir(current_directory)
+
+    @staticmethod
+    @mark.unit_test
+    def test_randomise_outputs(temporary_data_dir):
+        """ Test that the randomise function lists the same files as FSL's interface """
+
+        data = default_rng(0).normal(1.0, 1.0, (4, 4, 3, 8))
+        in_file = join(temporary_data_dir, 'in.nii.gz')
+        mask_file = join(temporary_data_dir, 'mask.nii.gz')
+        Nifti1Image(data, eye(4)).to_filename(in_file)
+        Nifti1Image(ones((4, 4, 3)), eye(4)).to_filename(mask_file)
+
+        current_directory = getcwd()
+        chdir(temporary_data_dir)
+        try:
+            # Options used by the pipelines
+            options = {'tfce': True, 'vox_p_values': True, 'c_thresh': 0.05}
+            tstat_files, corrected_files, p_files = pm.randomise(
+                in_file, mask_file, one_sample_group_mean = True, num_perm = 100, **options)
+
+            interface = Randomise(base_name = 'randomise', **options)
+            interface.inputs.output_type = 'NIFTI_GZ'
+            outputs = interface._list_outputs()
+            assert len(outputs['t_corrected_p_files']) == len(outputs['t_p_files']) == 1
+            assert sorted(tstat_files) == sorted(outputs['tstat_files'])
+            assert sorted(corrected_files) == sorted(outputs['t_corrected_p_files'])
+            assert sorted(p_files) == sorted(outputs['t_p_files'])
+        finally:
+            chdir(current_directory)
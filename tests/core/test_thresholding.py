@@ -0,0 +1,181 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.core.thresholding' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_thresholding.py
+    pytest -q test_thresholding.py -k <selected_test>
+"""
+
+from os import chdir, getcwd
+from os.path import join, basename
+
+from numpy import array, zeros, eye, allclose, isclose, isinf, nan, float32
+from scipy.stats import norm, t as t_distribution
+from nibabel import load, Nifti1Image
+
+from pytest import mark, raises
+
+import narps_open.core.thresholding as th
+
+class TestCoreThresholding:
+    """ A class that contains all the unit tests for the thresholding module."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_degrees_of_freedom():
+        """ Test the get_degrees_of_freedom function """
+        image = Nifti1Image(zeros((2, 2, 2), dtype = float32), eye(4))
+        assert th.get_degrees_of_freedom(image) is None
+        image.header['descrip'] = 'SPM{T_[45.0]} - contrast 1: gain'
+        assert th.get_degrees_of_freedom(image) == 45.0
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_stat_threshold():
+        """ Test the get_p_values and get_stat_threshold functions """
+        assert isclose(th.get_stat_threshold(0.05), norm.isf(0.05))
+        assert isclose(th.get_stat_threshold(0.001, 20), t_distribution.isf(0.001, 20))
+        assert allclose(th.get_p_values(array([0.0, 1.96])), [0.5, 0.025], atol = 1e-4)
+        assert allclose(th.get_p_values(array([3.0]), 10), t_distribution.sf(3.0, 10))
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_fdr_threshold():
+        """ Test the get_fdr_threshold function """
+
+        # Benjamini-Hochberg: largest p(k) <= k / m * q
+        p_values = array([0.01, 0.5, 0.02, 0.03, 0.9])
+        assert th.get_fdr_threshold(p_values, 0.05) == 0.03
+        assert th.get_fdr_threshold(p_values, 0.001) == 0.0
+        assert th.get_fdr_threshold(array([]), 0.05) == 0.0
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_clusters():
+        """ Test the get_clusters function """
+        supra_threshold = zeros((4, 4, 4), dtype = bool)
+        supra_threshold[0, 0, 0:2] = True
+        supra_threshold[1, 1, 2] = True # Corner neighbour of (0, 0, 1)
+        supra_threshold[3, 3, 3] = True
+
+        labels, sizes = th.get_clusters(supra_threshold, 26)
+        assert sizes[0] == 0
+        assert sorted(sizes[1:]) == [1, 3]
+        assert labels[0, 0, 0] == labels[1, 1, 2]
+        labels, sizes = th.get_clusters(supra_threshold, 18)
+        assert sorted(sizes[1:]) == [1, 1, 2]
+        labels, sizes = th.get_clusters(supra_threshold, 6)
+        assert sorted(sizes[1:]) == [1, 1, 2]
+
+        with raises(AttributeError):
+            th.get_clusters(supra_threshold, 8)
+
+    @staticmethod
+    @mark.unit_test
+    def test_threshold_stat_map():
+        """ Test the threshold_stat_map function """
+        stat_map = zeros((6, 6, 6))
+        stat_map[0, 0, 0:4] = 5.0 # A cluster of 4 voxels
+        stat_map[3, 3, 3] = 6.0 # A cluster of 1 voxel
+        stat_map[5, 5, 0:3] = 2.5 # A cluster of 3 voxels, with a low height
+        stat_map[5, 0, 5] = -8.0 # Negative effects are ignored
+        stat_map[0, 5, 5] = nan
+
+        thresholded_maps = th.threshold_stat_map(stat_map, [
+            {'height_threshold': 0.001},
+            {'height_threshold': 0.001, 'extent_threshold': 2},
+            {'height_threshold': 2.0, 'height_threshold_type': 'stat', 'extent_threshold': 3},
+            {'height_threshold': 0.05, 'correction': 'bonferroni'},
+            {'height_threshold': 0.05, 'correction': 'fdr'}
+            ], dof = 20)
+        assert len(thresholded_maps) == 5
+        assert thresholded_maps[0].dtype == float32
+
+        # Uncorrected height threshold: t(20) > 3.55
+        assert (thresholded_maps[0] > 0).sum() == 5
+        assert thresholded_maps[0][3, 3, 3] == 6.0
+        assert thresholded_maps[0][5, 0, 5] == 0.0
+
+        # Extent threshold
+        assert (thresholded_maps[1] > 0).sum() == 4
+        assert (thresholded_maps[1][0, 0, 0:4] == 5.0).all()
+        assert (thresholded_maps[2] > 0).sum() == 7
+        assert (thresholded_maps[2][5, 5, 0:3] == 2.5).all()
+
+        # Bonferroni over 9 voxels: t(20) > 4.35
+        assert (thresholded_maps[3] > 0).sum() == 5
+
+        # FDR keeps the voxels of all clusters
+        assert (thresholded_maps[4] > 0).sum() == 8
+
+        # Z maps, when no degrees of freedom are given
+        thresholded_map = th.threshold_stat_map(
+            stat_map, [{'height_threshold': 0.01}])[0]
+        assert (thresholded_map > 0).sum() == 8 # z > 2.33
+
+        with raises(AttributeError):
+            th.threshold_stat_map(stat_map, [{'height_threshold_type': 'z-value'}])
+        with raises(AttributeError):
+            th.threshold_stat_map(stat_map, [{'correction': 'fwe'}])
+        with raises(AttributeError):
+            th.threshold_stat_map(stat_map, [{'height_threshold_type': 'stat',
+                'correction': 'fdr'}])
+        with raises(AttributeError):
+            th.threshold_stat_map(stat_map, [{'extent': 10}])
+
+    @staticmethod
+    @mark.unit_test
+    def test_threshold_maps(temporary_data_dir):
+        """ Test the threshold_maps function """
+        stat_files = []
+        for contrast_id in range(2):
+            stat_map = zeros((6, 6, 6), dtype = float32)
+            stat_map[0, 0, 0:4] = 5.0
+            stat_map[3, 3, 3] = 6.0
+            image = Nifti1Image(stat_map * (contrast_id + 1), eye(4))
+            image.header['descrip'] = 'SPM{T_[20.0]} - contrast'
+            stat_files.append(join(temporary_data_dir, f'spmT_000{contrast_id + 1}.nii'))
+            image.to_filename(stat_files[-1])
+
+        current_directory = getcwd()
+        chdir(temporary_data_dir)
+        try:
+            # Default configuration
+            thresholded_maps = th.threshold_maps(stat_files)
+            assert thresholded_maps == [
+                join(temporary_data_dir, '_threshold0', 'spmT_0001_thr.nii'),
+                join(temporary_data_dir, '_threshold1', 'spmT_0002_thr.nii')]
+            assert (load(thresholded_maps[0]).get_fdata() > 0).sum() == 5
+
+            # Several configurations, and degrees of freedom read from the header
+            thresholded_maps = th.threshold_maps(stat_files[0], {
+                'unc': {'height_threshold': 0.001, 'extent_threshold': 2},
+                'fdr': {'height_threshold': 0.05, 'correction': 'fdr'},
+                'high': {'height_threshold': 1e-10}})
+            assert [basename(f) for f in thresholded_maps] == [
+                'spmT_0001_unc.nii', 'spmT_0001_fdr.nii', 'spmT_0001_high.nii']
+            assert (load(thresholded_maps[0]).get_fdata() > 0).sum() == 4
+            assert (load(thresholded_maps[1]).get_fdata() > 0).sum() == 5
+            assert not load(thresholded_maps[2]).get_fdata().any() # t(20) > 13.5
+
+            # Degrees of freedom given as argument
+            thresholded_maps = th.threshold_maps(
+                stat_files[0], {'high': {'height_threshold': 1e-9}}, dof = 1e6)
+            assert (load(thresholded_maps[0]).get_fdata() > 0).sum() == 1 # t > 6.00
+        finally:
+            chdir(current_directory)
+
+    @staticmethod
+    @mark.unit_test
+    def test_no_surviving_voxels():
+        """ Test the threshold_stat_map function when FDR keeps no voxel """
+        stat_map = zeros((3, 3, 3))
+        stat_map[1, 1, 1] = 0.1
+        assert not th.threshold_stat_map(
+            stat_map, [{'height_threshold': 0.05, 'correction': 'fdr'}])[0].any()
+        assert isinf(th.get_stat_threshold(0.0))
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.data.confounds' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_confounds.py
+    pytest -q test_confounds.py -k <selected_test>
+"""
+from os import listdir
+from os.path import join
+from shutil import copyfile
+
+from numpy import isnan
+from numpy.testing import assert_array_equal
+from pandas import read_csv
+from pytest import mark, raises
+
+from narps_open.data import confounds
+from narps_open.data.confounds import ConfoundsCache, MOTION_COLUMNS, DEFAULT_COLUMNS
+from narps_open.utils.configuration import Configuration
+
+TEST_CONFOUNDS_FILE = join(
+    Configuration()['directories']['test_data'], 'pipelines', 'confounds.tsv')
+
+class TestConfounds:
+    """ A class that contains all the unit tests for the confounds module."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_confounds_header():
+        """ Test the get_confounds_header function """
+        header = confounds.get_confounds_header(TEST_CONFOUNDS_FILE)
+        assert header[:3] == ['CSF', 'WhiteMatter', 'GlobalSignal']
+        assert header[-6:] == MOTION_COLUMNS
+        assert len(header) == 32
+
+    @staticmethod
+    @mark.unit_test
+    def test_cache(mocker, temporary_data_dir):
+        """ Test the ConfoundsCache class """
+        confounds_file = join(temporary_data_dir, 'confounds.tsv')
+        copyfile(TEST_CONFOUNDS_FILE, confounds_file)
+        reference = read_csv(TEST_CONFOUNDS_FILE, sep = '\t')
+        spy = mocker.spy(confounds, 'read_csv')
+
+        # Only requested and default columns are parsed
+        cache = ConfoundsCache(join(temporary_data_dir, 'cache'))
+        columns = cache.get_columns(confounds_file, ['aCompCor00', 'X'])
+        assert list(columns.keys()) == ['aCompCor00', 'X']
+        assert_array_equal(columns['aCompCor00'], reference['aCompCor00'])
+        assert_array_equal(columns['X'], reference['X'])
+        assert spy.call_count == 1
+        assert set(spy.call_args.kwargs['usecols']) == set(['aCompCor00'] + DEFAULT_COLUMNS)
+        with raises(ValueError):
+            columns['X'][0] = 1.0
+
+        # Other variants reuse the same parse
+        columns = cache.get_columns(confounds_file, ['FramewiseDisplacement', 'CSF'])
+        assert isnan(columns['FramewiseDisplacement'][0])
+        assert_array_equal(columns['CSF'], reference['CSF'])
+        assert spy.call_count == 1
+
+        # Columns are stored on the disk, for other processes
+        key = ConfoundsCache.get_key(confounds_file)
+        assert sorted(listdir(join(temporary_data_dir, 'cache', key))) == sorted(
+            f'{c}.npy' for c in ['aCompCor00'] + DEFAULT_COLUMNS)
+        other_cache = ConfoundsCache(join(temporary_data_dir, 'cache'))
+        columns = other_cache.get_columns(confounds_file, ['RotZ', 'aCompCor00'])
+        assert_array_equal(columns['RotZ'], reference['RotZ'])
+        assert spy.call_count == 1
+
+        # New columns are parsed
+        columns = other_cache.get_columns(confounds_file, ['Cosine00'])
+        assert spy.call_count == 2
+        assert spy.call_args.kwargs['usecols'] == ['Cosine00']
+
+        # A modified file is parsed again
+        with open(confounds_file, 'w', encoding = 'utf-8') as file:
+            file.write('X\tY\n1.0\t2.0\n3.0\tn/a\n')
+        assert_array_equal(other_cache.get_columns(confounds_file, ['X'])['X'], [1.0, 3.0])
+        assert spy.call_count == 3
+
+        # Unknown columns
+        with raises(AttributeError):
+            other_cache.get_columns(confounds_file, ['Z'])
+
+        # Cache in memory only
+        memory_cache = ConfoundsCache()
+        columns = memory_cache.get_columns(confounds_file, ['Y'])
+        assert columns['Y'][0] == 2.0
+        assert isnan(columns['Y'][1])
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_confounds():
+        """ Test the get_confounds function """
+        data_frame = confounds.get_confounds(
+            TEST_CONFOUNDS_FILE, ['CSF', 'X'], derivatives = ['X'])
+        reference = read_csv(TEST_CONFOUNDS_FILE, sep = '\t')
+
+        assert list(data_frame.columns) == ['CSF', 'X', 'X_derivative1']
+        assert_array_equal(data_frame['CSF'], reference['CSF'])
+        assert data_frame['X_derivative1'][0] == 0.0
+        assert_array_equal(data_frame['X_derivative1'][1:], reference['X'].diff()[1:])
+
+    @staticmethod
+    @mark.unit_test
+    def test_write_confounds_file(temporary_data_dir):
+        """ Test the write_confounds_file function """
+        out_file = join(temporary_data_dir, 'confounds_files', 'confounds.tsv')
+        assert confounds.write_confounds_file(
+            TEST_CONFOUNDS_FILE, out_file, MOTION_COLUMNS + ['FramewiseDisplacement']) \
+            == out_file
+
+        data_frame = read_csv(out_file, sep = '\t', header = None)
+        reference = read_csv(TEST_CONFOUNDS_FILE, sep = '\t')
+        assert data_frame.shape == (len(reference), 7)
+        assert_array_equal(data_frame[0], reference['X'])
+        assert data_frame[6][0] == 0.0 # Missing values
+        assert_array_equal(data_frame[6][1:], reference['FramewiseDisplacement'][1:])
+
+        # Integer columns are written as floats
+        confounds_file = join(temporary_data_dir, 'integer_confounds.tsv')
+        with open(confounds_file, 'w', encoding = 'utf-8') as file:
+            file.write('X\tNonSteadyStateOutlier00\n0.5\t1\n1.5\t0\n')
+        confounds.write_confounds_file(
+            confounds_file, out_file, ['NonSteadyStateOutlier00'], derivatives = ['X'])
+        with open(out_file, 'r', encoding = 'utf-8') as file:
+            assert file.read() == '1.0\t0.0\n0.0\t1.0\n'
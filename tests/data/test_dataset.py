@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.data.dataset' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_dataset.py
+    pytest -q test_dataset.py -k <selected_test>
+"""
+from os import makedirs, remove, utime
+from os.path import join, isfile, relpath
+from glob import glob
+
+from pytest import mark, fixture
+
+from narps_open.data.dataset import DatasetIndex, get_dataset_index, get_index_file
+
+@fixture
+def dataset_dir(temporary_data_dir):
+    """ A fixture to create a small BIDS dataset """
+    for subject in ['001', '002']:
+        raw_dir = join(temporary_data_dir, f'sub-{subject}', 'func')
+        derived_dir = join(temporary_data_dir, 'derivatives', 'fmriprep', f'sub-{subject}', 'func')
+        anat_dir = join(temporary_data_dir, f'sub-{subject}', 'anat')
+        for directory in [raw_dir, derived_dir, anat_dir]:
+            makedirs(directory)
+        for run in ['01', '02']:
+            open(join(raw_dir, f'sub-{subject}_task-MGT_run-{run}_events.tsv'), 'w').close()
+            open(join(derived_dir,
+                f'sub-{subject}_task-MGT_run-{run}_bold_confounds.tsv'), 'w').close()
+            open(join(derived_dir,
+                f'sub-{subject}_task-MGT_run-{run}_bold_space-MNI_preproc.nii.gz'), 'w').close()
+        open(join(anat_dir, f'sub-{subject}_T1w.nii.gz'), 'w').close()
+
+    return temporary_data_dir
+
+class TestDatasetIndex:
+    """ A class that contains all the unit tests for the DatasetIndex class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_glob(dataset_dir):
+        """ Test the glob method """
+        index = DatasetIndex(dataset_dir)
+        patterns = [
+            join('sub-001', 'func', 'sub-001_task-MGT_run-*_events.tsv'),
+            join('sub-*', 'func', '*_events.tsv'),
+            join('derivatives', 'fmriprep', 'sub-002', 'func', '*_run-0[1]_*'),
+            join('derivatives', 'fmriprep', 'sub-*', 'func', '*preproc.nii.gz'),
+            join('sub-003', 'func', '*')
+            ]
+        for pattern in patterns:
+            expected_files = sorted(glob(join(dataset_dir, pattern)))
+            assert index.glob(join(dataset_dir, pattern)) == expected_files
+            assert index.glob(pattern) == [relpath(f, dataset_dir) for f in expected_files]
+
+        assert len(index.glob(patterns[1])) == 4
+        assert index.glob(patterns[4]) == []
+
+        # Patterns not covered by the index
+        assert index.glob(join('sub-001', 'anat', '*')) is None
+        assert index.glob(join(dataset_dir, 'sub-001', 'anat', '*')) is None
+        assert index.glob('participants.tsv') is None
+
+    @staticmethod
+    @mark.unit_test
+    def test_update(mocker, dataset_dir):
+        """ Test that the index follows changes of the dataset """
+        # The index file is outside of the indexed directories
+        index_file = join(dataset_dir, 'derivatives', 'index.json')
+        index = DatasetIndex(dataset_dir, index_file)
+        pattern = join(dataset_dir, 'sub-*', 'func', '*_events.tsv')
+        assert len(index.glob(pattern)) == 4
+        assert isfile(index_file)
+
+        # Unchanged directories are not listed again, even by a new index
+        index = DatasetIndex(dataset_dir, index_file)
+        spy = mocker.spy(index, 'update_directory')
+        listdir_spy = mocker.patch('narps_open.data.dataset.listdir', side_effect = OSError)
+        assert len(index.glob(pattern)) == 4
+        assert spy.call_count == 2
+        assert listdir_spy.call_count == 0
+        mocker.stopall()
+
+        # Added, then removed files and subjects
+        new_file = join(dataset_dir, 'sub-001', 'func', 'sub-001_task-MGT_run-03_events.tsv')
+        open(new_file, 'w').close()
+        assert len(index.glob(pattern)) == 5
+        makedirs(join(dataset_dir, 'sub-003', 'func'))
+        open(join(dataset_dir, 'sub-003', 'func', 'sub-003_events.tsv'), 'w').close()
+        assert len(index.glob(pattern)) == 6
+        remove(new_file)
+        utime(join(dataset_dir, 'sub-001', 'func'), ns = (0, 0))
+        assert len(index.glob(pattern)) == 5
+        assert len(DatasetIndex(dataset_dir, index_file).glob(pattern)) == 5
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_files(dataset_dir):
+        """ Test the get_table and get_files methods """
+        index = DatasetIndex(dataset_dir)
+
+        table = index.get_table()
+        assert len(table) == 12
+        assert set(table.columns) == {
+            'sub', 'task', 'run', 'space', 'suffix', 'extension', 'derivatives', 'path'}
+
+        assert index.get_files(sub = '001', suffix = 'events') == [
+            join(dataset_dir, 'sub-001', 'func', 'sub-001_task-MGT_run-01_events.tsv'),
+            join(dataset_dir, 'sub-001', 'func', 'sub-001_task-MGT_run-02_events.tsv')
+            ]
+        assert index.get_files(derivatives = True, sub = '002', run = '02', suffix = 'preproc') \
+            == [join(dataset_dir, 'derivatives', 'fmriprep', 'sub-002', 'func',
+                'sub-002_task-MGT_run-02_bold_space-MNI_preproc.nii.gz')]
+        assert len(index.get_files(derivatives = True)) == 8
+        assert len(index.get_files(derivatives = False, extension = '.tsv')) == 4
+        assert index.get_files(wrong_entity = '001') == []
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_entities():
+        """ Test the get_entities method """
+        assert DatasetIndex.get_entities(
+            'sub-001_task-MGT_run-01_bold_space-MNI152NLin2009cAsym_preproc.nii.gz') == {
+            'sub': '001', 'task': 'MGT', 'run': '01', 'space': 'MNI152NLin2009cAsym',
+            'suffix': 'preproc', 'extension': '.nii.gz'}
+        assert DatasetIndex.get_entities('sub-001_T1w') == {
+            'sub': '001', 'suffix': 'T1w', 'extension': ''}
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_dataset_index(dataset_dir):
+        """ Test the get_dataset_index function """
+        index_file = join(dataset_dir, 'index.json')
+        index = get_dataset_index(dataset_dir, index_file)
+        assert index.dataset_dir == dataset_dir
+        assert get_dataset_index(dataset_dir, index_file) is index
+        assert get_dataset_index(dataset_dir, join(dataset_dir, 'other.json')) is not index
+        assert get_index_file(dataset_dir) != get_index_file(join(dataset_dir, 'sub-001'))
@@ -11,12 +11,14 @@ Usage:
     pytest -q test_description.py -k <selected_test>
 """
 
-from os.path import join
+from os.path import join, isfile
 
 from pytest import raises, mark
+from pandas import NA
 
 from narps_open.utils.configuration import Configuration
-from narps_open.data.description import TeamDescription
+from narps_open.utils.singleton import SingletonMeta
+from narps_open.data.description import TeamDescription, TeamDescriptionIndex
 
 class TestUtilsDescription:
     """ A class that contains all the unit tests for the description module."""
@@ -125,3 +127,130 @@ class TestUtilsDescription:
             )
         with open(test_file_path, 'r', encoding = 'utf-8') as file:
             assert str(description) == file.read()
+
+class TestUtilsDescriptionIndex:
+    """ A class that contains all the unit tests for the TeamDescriptionIndex class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_index(mocker, temporary_data_dir):
+        """ Test the TeamDescriptionIndex class """
+
+        # The index is process-wide
+        assert TeamDescriptionIndex() is TeamDescriptionIndex()
+        index = TeamDescriptionIndex()
+        assert list(index.keys()) == ['description', 'derived', 'comments']
+        assert index['description']['2T6S']['general.teamID'] == '2T6S'
+        assert 'derived.teamID' not in index['derived']['2T6S']
+        assert len(index['description']) == len(index['derived'])
+
+        # Create a new index, using a cache file in a temporary directory
+        cache_file = join(temporary_data_dir, 'index.pickle')
+        mocker.patch.object(TeamDescriptionIndex, 'cache_file', cache_file)
+        mocker.patch.dict(SingletonMeta._instances)
+        SingletonMeta._instances.pop(TeamDescriptionIndex, None)
+
+        assert TeamDescriptionIndex() == index
+        assert isfile(cache_file)
+
+        # The cache file is used while csv files are unchanged
+        SingletonMeta._instances.pop(TeamDescriptionIndex)
+        spy = mocker.spy(TeamDescriptionIndex, '_load')
+        assert TeamDescriptionIndex() == index
+        assert spy.call_count == 0
+
+        SingletonMeta._instances.pop(TeamDescriptionIndex)
+        mocker.patch.object(TeamDescriptionIndex, 'get_signature', return_value = [])
+        assert TeamDescriptionIndex() == index
+        assert spy.call_count == 1
+
+    @staticmethod
+    @mark.unit_test
+    def test_sub_dicts():
+        """ Test the get_sub_dicts method of TeamDescriptionIndex """
+        index = TeamDescriptionIndex()
+        description = TeamDescription('2T6S')
+        sub_dicts = index.get_sub_dicts('2T6S')
+
+        assert list(sub_dicts.keys()) == TeamDescriptionIndex.sub_dicts
+        assert sub_dicts['general']['teamID'] == '2T6S'
+        assert sub_dicts['derived'] == description.derived
+        assert index.get_sub_dicts('2T6S') is sub_dicts
+
+        # Sub dictionaries of TeamDescription are copies
+        description.general['teamID'] = 'XXXX'
+        assert TeamDescription('2T6S').general['teamID'] == '2T6S'
+
+    @staticmethod
+    @mark.unit_test
+    def test_data_frame():
+        """ Test the data_frame property of TeamDescriptionIndex """
+        data_frame = TeamDescriptionIndex().data_frame
+
+        assert len(data_frame) == len(TeamDescriptionIndex()['description'])
+        assert data_frame.loc['2T6S', 'general.softwares'] == 'SPM12 , \nfmriprep 1.1.4'
+        assert 'derived.n_participants' in data_frame.columns
+
+        # Numeric columns
+        assert str(data_frame['derived.func_fwhm'].dtype) == 'Int64'
+        assert data_frame.loc['2T6S', 'derived.func_fwhm'] == 8
+        assert data_frame.loc['2T6S', 'derived.con_fwhm'] is NA
+        assert data_frame['general.teamID'].dtype == object
+
+    @staticmethod
+    @mark.unit_test
+    def test_query():
+        """ Test the query method of TeamDescriptionIndex """
+        index = TeamDescriptionIndex()
+
+        # No filters
+        assert index.query().equals(index.data_frame)
+
+        # Equality ignores case and surrounding spaces
+        results = index.query([
+            'categorized_for_analysis.analysis_SW=fsl', 'preprocessing.used_fmriprep_data=Yes'])
+        assert len(results) > 0
+        assert 'O21U' in results.index
+        assert all(results['categorized_for_analysis.analysis_SW'] == 'FSL')
+        assert all(results['preprocessing.used_fmriprep_data'].str.strip() == 'Yes')
+
+        results = index.query(['categorized_for_analysis.analysis_SW!=FSL'])
+        assert 'O21U' not in results.index
+        assert '2T6S' in results.index
+
+        # Containment
+        results = index.query(['categorized_for_analysis.analysis_SW~afni'])
+        assert all(results['categorized_for_analysis.analysis_SW'].str.contains('AFNI'))
+
+        # Missing values never contain the value
+        results = index.query(['derived.con_fwhm~na'])
+        assert len(results) == 0
+        results = index.query(['derived.func_fwhm~8'])
+        assert '2T6S' in results.index
+        assert all(results['derived.func_fwhm'].notna())
+
+        # Numeric comparisons
+        results = index.query(['derived.func_fwhm>=8', 'derived.func_fwhm<9'])
+        assert all(results['derived.func_fwhm'] == 8)
+        assert '2T6S' in results.index
+        assert index.query(['derived.func_fwhm=8']).equals(results)
+
+        # Columns and sub dictionaries
+        results = index.query(['general.teamID=2T6S'], ['general.softwares', 'derived'])
+        assert list(results.index) == ['2T6S']
+        assert list(results.columns) == ['general.softwares', 'derived.n_participants',
+            'derived.excluded_participants', 'derived.func_fwhm', 'derived.con_fwhm']
+
+        # Wrong queries
+        with raises(AttributeError):
+            index.query(['general.wrong_key=FSL'])
+        with raises(AttributeError):
+            index.query(['general.teamID'])
+        with raises(AttributeError):
+            index.query(['general.teamID>2T6S'])
+        with raises(AttributeError):
+            index.query(['derived.func_fwhm>abc'])
+        with raises(AttributeError):
+            index.query(['derived.func_fwhm=abc'])
+        with raises(AttributeError):
+            index.query(columns = ['wrong_column'])
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.data.events' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_events.py
+    pytest -q test_events.py -k <selected_test>
+"""
+from os import utime
+from os.path import join
+
+from numpy import array, float64
+from numpy.testing import assert_array_equal
+from pytest import mark, raises
+
+from nipype.interfaces.base import Bunch
+
+from narps_open.data import events
+from narps_open.utils.configuration import Configuration
+
+TEST_EVENTS_FILE = join(Configuration()['directories']['test_data'], 'pipelines', 'events.tsv')
+
+class TestEvents:
+    """ A class that contains all the unit tests for the events module."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_read_events(mocker, temporary_data_dir):
+        """ Test the read_events function and the RunEvents class """
+        run_events = events.read_events(TEST_EVENTS_FILE)
+
+        assert list(run_events.keys()) == [
+            'onset', 'duration', 'gain', 'loss', 'RT', 'participant_response']
+        assert run_events.nb_events == 5
+        assert run_events['onset'].dtype == float64
+        assert_array_equal(run_events['onset'], [4.071, 11.834, 19.535, 27.535, 36.435])
+        assert_array_equal(run_events['RT'], [2.388, 2.289, 0.0, 2.08, 2.288])
+        assert run_events['participant_response'][2] == 'NoResp'
+
+        # Columns are read-only
+        with raises(ValueError):
+            run_events['gain'][0] = 0.0
+
+        # Responses
+        assert_array_equal(
+            run_events.get_response_mask('accept'), [True, True, False, False, False])
+        no_response = run_events.select(run_events.get_response_mask('NoResp'))
+        assert no_response.nb_events == 1
+        assert_array_equal(no_response['gain'], [38.0])
+
+        # The file is parsed once, while it is unchanged
+        spy = mocker.spy(events, 'loadtxt')
+        assert events.read_events(TEST_EVENTS_FILE) is run_events
+        assert spy.call_count == 0
+
+        events_file = join(temporary_data_dir, 'events.tsv')
+        with open(events_file, 'w', encoding = 'utf-8') as file:
+            file.write('onset\tduration\tgain\tloss\tRT\tparticipant_response\n')
+            file.write('1.0\t4\t10\t5\t1.5\tweakly_accept\n')
+        assert events.read_events(events_file).nb_events == 1
+        with open(events_file, 'w', encoding = 'utf-8') as file:
+            file.write('onset\tduration\tgain\tloss\tRT\tparticipant_response\n')
+        utime(events_file, ns = (0, 0))
+        assert events.read_events(events_file).nb_events == 0
+        assert spy.call_count == 2
+
+    @staticmethod
+    @mark.unit_test
+    def test_helpers():
+        """ Test the demean, binarize and to_list functions """
+        assert_array_equal(events.demean([1.0, 2.0, 6.0]), [-2.0, -1.0, 3.0])
+        assert events.demean([]).size == 0
+        assert_array_equal(
+            events.binarize(array([True, False, True]), 1.0, -1.0), [1.0, -1.0, 1.0])
+        assert_array_equal(events.binarize(array([True, False])), [1.0, 0.0])
+        values = events.to_list(array([1, 2]))
+        assert values == [1.0, 2.0]
+        assert isinstance(values[0], float)
+
+    @staticmethod
+    @mark.unit_test
+    def test_create_bunch():
+        """ Test the create_bunch function """
+        run_events = events.read_events(TEST_EVENTS_FILE)
+
+        bunch = events.create_bunch(
+            conditions = ['trial', 'missed'],
+            onsets = [run_events['onset'][:2], run_events['onset'][2:]],
+            durations = [run_events['duration'][:2], run_events['duration'][2:]],
+            modulations = [{'gain': run_events['gain'][:2]}, None],
+            regressor_names = ['rt'],
+            regressors = [run_events['RT']]
+            )
+        assert isinstance(bunch, Bunch)
+        assert bunch.conditions == ['trial', 'missed']
+        assert bunch.onsets == [[4.071, 11.834], [19.535, 27.535, 36.435]]
+        assert bunch.durations == [[4.0, 4.0], [4.0, 4.0, 4.0]]
+        assert bunch.amplitudes is None
+        assert bunch.tmod is None
+        assert bunch.pmod[0].name == ['gain']
+        assert bunch.pmod[0].poly == [1]
+        assert bunch.pmod[0].param == [[14.0, 34.0]]
+        assert bunch.pmod[1] is None
+        assert bunch.regressor_names == ['rt']
+        assert bunch.regressors == [[2.388, 2.289, 0.0, 2.08, 2.288]]
+
+        bunch = events.create_bunch(['trial'], [[1.0]], [[0.0]])
+        assert bunch.pmod is None
+        assert bunch.regressors is None
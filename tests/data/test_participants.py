@@ -10,9 +10,11 @@ Usage:
     pytest -q test_participants.py
     pytest -q test_participants.py -k <selected_test>
 """
+from os import utime
 from os.path import join
+from json import loads, dumps
 
-from pytest import mark, fixture
+from pytest import mark, fixture, raises
 
 import narps_open.data.participants as part
 from narps_open.utils.configuration import Configuration
@@ -114,3 +116,53 @@ class TestParticipants:
         assert part.get_group('') == []
         assert part.get_group('equalRange') == ['002', '004']
         assert part.get_group('equalIndifference') == ['001', '003']
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_participants_index(mocker, mock_participants_data, temporary_data_dir):
+        """ Test the get_participants_index function and the ParticipantsIndex class """
+
+        # Index of the dataset
+        index = part.get_participants_index()
+        assert index.groups['equalRange'] == ('002', '004')
+        assert index.subject_groups['003'] == 'equalIndifference'
+        assert index.get_group('equalIndifference') == ['001', '003']
+        assert index.get_group('') == []
+        with raises(TypeError):
+            index.groups['equalRange'] = ()
+
+        # The file is parsed once, while it is unchanged
+        spy = mocker.spy(part, 'read_csv')
+        assert part.get_participants_index() is index
+        assert spy.call_count == 0
+
+        # The information is a copy
+        information = part.get_participants_information()
+        information.at[1, 'group'] = 'equalIndifference'
+        assert part.get_participants_information().at[1, 'group'] == 'equalRange'
+
+        # The index is built again after the file was modified
+        participants_file = join(temporary_data_dir, 'participants.tsv')
+        information.to_csv(participants_file, sep = '\t', index = False)
+        new_index = part.get_participants_index(participants_file)
+        assert new_index.get_group('equalIndifference') == ['001', '002', '003']
+        assert part.get_participants_index(participants_file) is new_index
+
+        information.at[1, 'group'] = 'equalRange'
+        information.to_csv(participants_file, sep = '\t', index = False)
+        utime(participants_file, ns = (0, 0))
+        assert part.get_participants_index(participants_file).get_group('equalRange') \
+            == ['002', '004']
+
+        # Serialization
+        serialized_index = index.to_dict()
+        assert serialized_index == {
+            'participant_id': ['sub-001', 'sub-002', 'sub-003', 'sub-004'],
+            'group': ['equalIndifference', 'equalRange', 'equalIndifference', 'equalRange']
+            }
+        assert loads(dumps(serialized_index)) == serialized_index
+        new_index = part.ParticipantsIndex.from_dict(serialized_index)
+        assert new_index.groups == index.groups
+        assert new_index.subject_groups == index.subject_groups
+        assert part.serialize_participants_index(participants_file) \
+            == part.get_participants_index(participants_file).to_dict()
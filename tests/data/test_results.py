@@ -11,13 +11,14 @@ Usage:
     pytest -q test_results.py -k <selected_test>
 """
 
-from os.path import isdir, join
+from os.path import isdir, isfile, join
 from shutil import rmtree, copytree
 
 from checksumdir import dirhash
-from pytest import mark
+from pytest import mark, raises
 
 from narps_open.data.results import ResultsCollection, ResultsCollectionFactory
+from narps_open.utils.download import DownloadError
 from narps_open.data.results.team_2T6S import ResultsCollection2T6S
 from narps_open.utils import hash_dir_images
 from narps_open.utils.configuration import Configuration
@@ -94,6 +95,121 @@ class TestResultsCollection:
         # Remove folder
         rmtree(expected_dir)
 
+    @staticmethod
+    @mark.unit_test
+    def test_download_local(mocker, local_http_server, temporary_data_dir):
+        """ Test the download method, using a local stand-in for Neurovault """
+
+        # Serve a fake collection
+        test_directory = join(
+            Configuration()['directories']['test_data'], 'data', 'results', 'team_2T6S')
+        api_results = []
+        for hypothesis in range(1, 10):
+            with open(join(test_directory, f'hypo{hypothesis}_unthresh.nii.gz'), 'rb') as file:
+                local_http_server.files[f'/media/{hypothesis}.nii.gz'] = file.read()
+            api_results.append({
+                'name': f'hypo{hypothesis}_unthresh',
+                'file': local_http_server.base_url + f'/media/{hypothesis}.nii.gz'
+                })
+        local_http_server.files['/api/collections/15001/images/'] = {'results': api_results}
+
+        mocker.patch.object(ResultsCollection, 'get_uid', lambda _: '15001')
+        mocker.patch.object(ResultsCollection, 'api_url',
+            local_http_server.base_url + '/api/collections/{uid}/images/')
+        results_directory = Configuration()['directories']['narps_results']
+        Configuration()['directories']['narps_results'] = temporary_data_dir
+        cache_directory = Configuration()['directories']['cache']
+        Configuration()['directories']['cache'] = join(temporary_data_dir, 'cache')
+
+        try:
+            # Download the collection
+            collection = ResultsCollection('2T6S')
+            collection.download()
+            assert isfile(collection.manifest_file)
+            assert dirhash(collection.directory) == dirhash(test_directory)
+
+            # Files are not downloaded again
+            nb_requests = len(local_http_server.requests)
+            collection.download()
+            assert len(local_http_server.requests) == nb_requests
+
+            # Except if they were modified
+            with open(join(collection.directory, 'hypo1_unthresh.nii.gz'), 'wb') as file:
+                file.write(b'modified')
+            collection.download()
+            assert [r[0] for r in local_http_server.requests[nb_requests:]] == [
+                '/media/1.nii.gz']
+            assert dirhash(collection.directory) == dirhash(test_directory)
+
+            # Errors are raised once all other files are downloaded
+            rmtree(collection.directory)
+            collection.files['missing.nii.gz'] = local_http_server.base_url + '/missing.nii.gz'
+            with raises(DownloadError):
+                collection.download()
+            assert isfile(join(collection.directory, 'hypo9_unthresh.nii.gz'))
+        finally:
+            Configuration()['directories']['narps_results'] = results_directory
+            Configuration()['directories']['cache'] = cache_directory
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_file_urls(mocker, local_http_server, temporary_data_dir):
+        """ Test the get_file_urls method, using a local stand-in for Neurovault """
+
+        # Serve a fake collection, on two pages
+        base_url = local_http_server.base_url
+        local_http_server.files['/api/collections/15001/images/'] = {
+            'next': base_url + '/api/collections/15001/images/?offset=2',
+            'results': [
+                {'name': 'hypo1_unthresh', 'file': base_url + '/media/1.nii.gz'},
+                {'name': 'hypo2_unthresh', 'file': base_url + '/media/2.nii.gz'}
+                ]
+            }
+        local_http_server.files['/api/collections/15001/images/?offset=2'] = {
+            'next': None,
+            'results': [{'name': 'hypo3_unthresh', 'file': base_url + '/media/3.nii.gz'}]
+            }
+        expected_urls = {
+            f'hypo{h}_unthresh.nii.gz': base_url + f'/media/{h}.nii.gz' for h in range(1, 4)}
+
+        mocker.patch.object(ResultsCollection, 'get_uid', lambda _: '15001')
+        mocker.patch.object(ResultsCollection, 'api_url',
+            base_url + '/api/collections/{uid}/images/')
+        cache_directory = Configuration()['directories']['cache']
+        metadata_ttl_days = Configuration()['results']['metadata_ttl_days']
+        offline = Configuration()['results']['offline']
+        Configuration()['directories']['cache'] = temporary_data_dir
+
+        try:
+            # Metadata are fetched lazily, then cached
+            collection = ResultsCollection('2T6S')
+            assert local_http_server.requests == []
+            assert collection.files == expected_urls
+            assert len(local_http_server.requests) == 2
+            assert isfile(collection.metadata_file)
+            assert ResultsCollection('2T6S').files == expected_urls
+            assert len(local_http_server.requests) == 2
+
+            # Stale metadata are fetched again
+            Configuration()['results']['metadata_ttl_days'] = 0
+            assert ResultsCollection('2T6S').files == expected_urls
+            assert len(local_http_server.requests) == 4
+
+            # Stale metadata are used if Neurovault is not reachable
+            mocker.patch.object(ResultsCollection, 'api_url', 'http://127.0.0.1:1/{uid}/')
+            assert ResultsCollection('2T6S').files == expected_urls
+
+            # Offline mode
+            Configuration()['results']['offline'] = True
+            assert ResultsCollection('2T6S').files == expected_urls
+            Configuration()['directories']['cache'] = join(temporary_data_dir, 'empty')
+            with raises(FileNotFoundError):
+                ResultsCollection('2T6S').get_file_urls()
+        finally:
+            Configuration()['directories']['cache'] = cache_directory
+            Configuration()['results']['metadata_ttl_days'] = metadata_ttl_days
+            Configuration()['results']['offline'] = offline
+
 class TestResultsCollection2T6S:
     """ A class that contains all the unit tests for the ResultsCollection2T6S class."""
 
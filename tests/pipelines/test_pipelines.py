@@ -123,6 +123,10 @@ class TestPipelines:
         pipeline.fwhm = 4.0
         assert pipeline.fwhm == 4.0
 
+        assert not pipeline.fast_path
+        pipeline.fast_path = True
+        assert pipeline.fast_path
+
         assert pipeline.get_preprocessing() == 'a'
         assert pipeline.get_subject_level_analysis() == 'b'
         assert pipeline.get_group_level_analysis() == 'c'
@@ -40,6 +40,17 @@ class TestPipelinesTeam2T6S:
         for sub_workflow in group_level:
             assert isinstance(sub_workflow, Workflow)
 
+        # 3 - check the fast path
+        pipeline.fast_path = True
+        subject_level = pipeline.get_subject_level_analysis()
+        assert isinstance(subject_level, Workflow)
+        assert 'contrast_estimate' in subject_level.list_node_names()
+        assert 'l1_estimate' not in subject_level.list_node_names()
+        group_level = pipeline.get_group_level_analysis()
+        assert len(group_level) == 1
+        assert 'group_level_ttests' in group_level[0].list_node_names()
+        assert 'threshold_groupComp' in group_level[0].list_node_names()
+
     @staticmethod
     @mark.unit_test
     def test_outputs():
@@ -53,6 +64,11 @@ class TestPipelinesTeam2T6S:
         pipeline.subject_list = ['001', '002', '003', '004']
         helpers.test_pipeline_outputs(pipeline, [0, 0, 28, 63, 18])
 
+        # 3 - fast path outputs (variance maps and Z maps instead of the SPM.mat files)
+        pipeline.fast_path = True
+        pipeline.subject_list = ['001']
+        helpers.test_pipeline_outputs(pipeline, [0, 0, 9, 69, 18])
+
     @staticmethod
     @mark.pipeline_test
     def test_execution():
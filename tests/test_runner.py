@@ -23,7 +23,10 @@ from nipype import Node, Workflow
 from nipype.interfaces.utility import Function
 
 from narps_open.utils.configuration import Configuration
-from narps_open.runner import PipelineRunner, PipelineRunnerLevel
+from narps_open.runner import (
+    PipelineRunner, PipelineRunnerLevel, PipelineBatchRunner, ResourcesBudget,
+    SharedMultiProcPlugin
+    )
 from narps_open.pipelines import Pipeline
 from narps_open.pipelines.team_2T6S import PipelineTeam2T6S
 
@@ -135,6 +138,61 @@ class MockupPipeline(Pipeline):
         template = join(Configuration()['directories']['test_runs'], 'hypothesis_{id}.md')
         return [template.format(id = i) for i in range(1,18)]
 
+class MockupBatchPipeline(MockupPipeline):
+    """ A simple Pipeline class for test purposes, that can run concurrently with others """
+
+    def __init__(self, team_id: str):
+        super().__init__()
+        self.team_id = team_id
+        self.test_file = abspath(
+            join(Configuration()['directories']['test_runs'], f'test_runner_{team_id}.txt'))
+        if isfile(self.test_file):
+            remove(self.test_file)
+
+    def create_workflow(self, workflow_name: str):
+        """ Return a nipype workflow with two nodes writing in a file """
+        return super().create_workflow(f'{workflow_name}_{self.team_id}')
+
+    def get_preprocessing_outputs(self):
+        """ Return a list of the output files generated by the pipeline """
+        return [self.test_file]
+
+    def get_run_level_outputs(self):
+        """ Return a list of the output files generated by the pipeline """
+        return [self.test_file]
+
+    def get_subject_level_outputs(self):
+        """ Return a list of the output files generated by the pipeline """
+        return [self.test_file]
+
+    def get_group_level_outputs(self):
+        """ Return a list of the output files generated by the pipeline """
+        return [self.test_file]
+
+class MockupPipeliningPipeline(MockupPipeline):
+    """ A simple Pipeline class for test purposes, whose workflows depend on the subject list """
+
+    def __del__(self):
+        """ Keep the test file, as copies of this pipeline are deleted during the run """
+
+    def create_workflow(self, workflow_name: str):
+        """ Return a nipype workflow with two nodes writing in a file """
+        return super().create_workflow(f'{workflow_name}_{"_".join(self.subject_list)}')
+
+    def get_subject_level_outputs(self):
+        """ Return a list of the output files generated by the subject level analysis """
+        return [self.test_file]
+
+class MockupResumePipeline(MockupPipeline):
+    """ A simple Pipeline class for test purposes, whose workflows depend on the subject list """
+
+    def __del__(self):
+        """ Keep the test file, as copies of this pipeline are deleted during the run """
+
+    def create_workflow(self, workflow_name: str):
+        """ Return a nipype workflow with two nodes writing in a file """
+        return super().create_workflow(f'{workflow_name}_{"_".join(self.subject_list)}')
+
 class MockupWrongPipeline(Pipeline):
     """ A simple Pipeline class for test purposes """
 
@@ -351,6 +409,155 @@ class TestPipelineRunner:
                 assert file.readline() == 'MockupPipeline : '+workflow+' node_1\n'
                 assert file.readline() == 'MockupPipeline : '+workflow+' node_2\n'
 
+    @staticmethod
+    @mark.unit_test
+    def test_start_pipelining():
+        """ Test running the first levels subject by subject """
+        runner = PipelineRunner('2T6S')
+        runner._pipeline = MockupPipeliningPipeline() # hack the runner by setting a test Pipeline
+        runner.subjects = ['001', '002', '003']
+        runner.start(pipelining = True)
+
+        with open(runner.pipeline.test_file, 'r', encoding = 'utf-8') as file:
+            lines = file.readlines()
+        remove(runner.pipeline.test_file)
+
+        # Workflows of each subject are run in order
+        assert len(lines) == 20
+        for subject_id in ['001', '002', '003']:
+            assert [l for l in lines if l.endswith(f'workflow_{subject_id} node_1\n')] == [
+                f'MockupPipeline : TestPipelineRunner_{w}_workflow_{subject_id} node_1\n'
+                for w in ['preprocessing', 'run_level', 'subject_level']
+                ]
+
+        # Group level is run last, for all subjects
+        assert lines[-2:] == [
+            'MockupPipeline : TestPipelineRunner_group_level_workflow_001_002_003 node_1\n',
+            'MockupPipeline : TestPipelineRunner_group_level_workflow_001_002_003 node_2\n'
+            ]
+
+        # Group level is not run if subject level outputs are missing
+        runner = PipelineRunner('2T6S')
+        runner._pipeline = MockupPipeliningPipeline()
+        runner.subjects = ['001', '002']
+        with raises(RuntimeError):
+            runner.start(PipelineRunnerLevel.GROUP, pipelining = True)
+        assert not isfile(runner.pipeline.test_file)
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_first_levels_to_run():
+        """ Test the get_first_levels_to_run method """
+        runner = PipelineRunner('2T6S')
+        runner._pipeline = MockupPipeline() # hack the runner by setting a test Pipeline
+        runner.subjects = ['001', '002']
+        files = runner.pipeline.get_preprocessing_outputs() \
+            + runner.pipeline.get_run_level_outputs() \
+            + runner.pipeline.get_subject_level_outputs()
+        for file in files:
+            if isfile(file):
+                remove(file)
+
+        # All levels are to be run
+        assert runner.get_first_levels_to_run() == {
+            '001': PipelineRunnerLevel.FIRST,
+            '002': PipelineRunnerLevel.FIRST
+            }
+        assert runner.get_first_levels_to_run(PipelineRunnerLevel.SUBJECT) == {
+            '001': PipelineRunnerLevel.SUBJECT,
+            '002': PipelineRunnerLevel.SUBJECT
+            }
+
+        # Subject 001 is complete, subject 002 misses the subject level
+        for file in files[:-2]:
+            Path(file).touch()
+        assert runner.get_first_levels_to_run() == {'002': PipelineRunnerLevel.SUBJECT}
+        assert runner.get_first_levels_to_run(PipelineRunnerLevel.PREPROCESSING) == {}
+
+        # Once a level has missing outputs, the following ones are to be run
+        remove(runner.pipeline.get_run_level_outputs()[0])
+        assert runner.get_first_levels_to_run() == {
+            '001': PipelineRunnerLevel.RUN | PipelineRunnerLevel.SUBJECT,
+            '002': PipelineRunnerLevel.RUN | PipelineRunnerLevel.SUBJECT
+            }
+
+        for file in files:
+            if isfile(file):
+                remove(file)
+
+    @staticmethod
+    @mark.unit_test
+    def test_is_valid_output(temporary_data_dir):
+        """ Test the is_valid_output method """
+        test_data = Configuration()['directories']['test_data']
+
+        # Missing file
+        assert not PipelineRunner.is_valid_output(join(temporary_data_dir, 'missing.md'))
+
+        # Existing files
+        assert PipelineRunner.is_valid_output(
+            join(test_data, 'core', 'image', 'test_image.nii.gz'))
+        assert PipelineRunner.is_valid_output(
+            join(test_data, 'pipelines', 'team_UK24', 'mask_resampled-32.nii'))
+        text_file = join(temporary_data_dir, 'file.md')
+        Path(text_file).touch()
+        assert PipelineRunner.is_valid_output(text_file)
+
+        # Invalid images
+        invalid_file = join(temporary_data_dir, 'invalid.nii.gz')
+        Path(invalid_file).touch()
+        assert not PipelineRunner.is_valid_output(invalid_file)
+
+        truncated_file = join(temporary_data_dir, 'truncated.nii')
+        with open(join(test_data, 'pipelines', 'team_UK24', 'mask_resampled-32.nii'), 'rb') \
+            as file:
+            contents = file.read()
+        with open(truncated_file, 'wb') as file:
+            file.write(contents[:len(contents) // 2])
+        assert not PipelineRunner.is_valid_output(truncated_file)
+
+    @staticmethod
+    @mark.unit_test
+    def test_start_resume():
+        """ Test running only the workflows needed to generate missing outputs """
+        runner = PipelineRunner('2T6S')
+        runner._pipeline = MockupResumePipeline() # hack the runner by setting a test Pipeline
+        runner.subjects = ['001', '002']
+
+        # Subject 001 is complete, subject 002 misses the subject level
+        Path(runner.pipeline.get_preprocessing_outputs()[0]).touch()
+        Path(runner.pipeline.get_run_level_outputs()[0]).touch()
+        for file in runner.pipeline.get_subject_level_outputs()[:2]:
+            Path(file).touch()
+        for file in runner.pipeline.get_subject_level_outputs()[2:] \
+            + runner.pipeline.get_group_level_outputs():
+            if isfile(file):
+                remove(file)
+
+        runner.start(resume = True)
+        with open(runner.pipeline.test_file, 'r', encoding = 'utf-8') as file:
+            assert file.readlines() == [
+                'MockupPipeline : TestPipelineRunner_subject_level_workflow_002 node_1\n',
+                'MockupPipeline : TestPipelineRunner_subject_level_workflow_002 node_2\n',
+                'MockupPipeline : TestPipelineRunner_group_level_workflow_001_002 node_1\n',
+                'MockupPipeline : TestPipelineRunner_group_level_workflow_001_002 node_2\n'
+                ]
+        remove(runner.pipeline.test_file)
+
+        # Nothing is run once all outputs are there
+        for file in runner.pipeline.get_subject_level_outputs() \
+            + runner.pipeline.get_group_level_outputs():
+            Path(file).touch()
+        runner.start(resume = True)
+        runner.start(resume = True, pipelining = True)
+        assert not isfile(runner.pipeline.test_file)
+
+        for file in runner.pipeline.get_preprocessing_outputs() \
+            + runner.pipeline.get_run_level_outputs() \
+            + runner.pipeline.get_subject_level_outputs() \
+            + runner.pipeline.get_group_level_outputs():
+            remove(file)
+
     @staticmethod
     @mark.unit_test
     def test_get_workflows():
@@ -456,3 +663,139 @@ class TestPipelineRunner:
         # 2e - Check again for missing files
         missing_files = runner.get_missing_outputs(PipelineRunnerLevel.GROUP)
         assert len(missing_files) == 0
+
+class TestResourcesBudget:
+    """ A class that contains all the unit tests for the ResourcesBudget class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_allocate_release():
+        """ Test the allocate and release methods of ResourcesBudget """
+        budget = ResourcesBudget(8, 16.0)
+        assert budget.get_free_resources() == (16.0, 8)
+
+        budget.allocate('task_1', 4.0, 2)
+        budget.allocate('task_2', 2.0, 1)
+        assert budget.get_free_resources() == (10.0, 5)
+
+        budget.release('task_1')
+        assert budget.get_free_resources() == (14.0, 7)
+
+        # Releasing an unknown task has no effect
+        budget.release('task_1')
+        assert budget.get_free_resources() == (14.0, 7)
+
+        # Free resources are never negative
+        budget.allocate('task_3', 20.0, 10)
+        assert budget.get_free_resources() == (0.0, 0)
+
+    @staticmethod
+    @mark.unit_test
+    def test_try_allocate():
+        """ Test the try_allocate method of ResourcesBudget """
+        budget = ResourcesBudget(4, 8.0)
+        assert budget.try_allocate('task_1', 4.0, 3)
+        assert not budget.try_allocate('task_2', 1.0, 2)
+        assert not budget.try_allocate('task_2', 5.0, 1)
+        assert budget.get_free_resources() == (4.0, 1)
+        assert budget.try_allocate('task_2', 4.0, 1)
+        assert budget.get_free_resources() == (0.0, 0)
+
+class TestSharedMultiProcPlugin:
+    """ A class that contains all the unit tests for the SharedMultiProcPlugin class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_run_crash(temporary_data_dir):
+        """ Test that resources are released when a node crashes """
+
+        def sleep():
+            from time import sleep as time_sleep
+            time_sleep(2)
+
+        def crash():
+            raise ValueError('Crash')
+
+        workflow = Workflow(base_dir = temporary_data_dir, name = 'test_run_crash')
+        workflow.add_nodes([
+            Node(Function(function = sleep, input_names = [], output_names = []),
+                name = 'node_sleep'),
+            Node(Function(function = crash, input_names = [], output_names = []),
+                name = 'node_crash')
+            ])
+        workflow.config['execution'] = {
+            'stop_on_first_crash': 'True', 'crashdump_dir': temporary_data_dir}
+
+        budget = ResourcesBudget(4, 2.0)
+        initial_resources = budget.get_free_resources()
+        with raises(RuntimeError):
+            workflow.run(plugin = SharedMultiProcPlugin(budget))
+        assert budget.get_free_resources() == initial_resources
+
+class TestPipelineBatchRunner:
+    """ A class that contains all the unit tests for the PipelineBatchRunner class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_create():
+        """ Test the creation of a PipelineBatchRunner object """
+
+        # 1 - Instantiate a batch runner with a wrong team id
+        with raises(KeyError):
+            PipelineBatchRunner(['2T6S', 'wrong_id'])
+
+        # 2 - Instantiate a batch runner, with duplicate team ids
+        batch_runner = PipelineBatchRunner(['2T6S', 'C88N', '2T6S'], nb_procs = 4, memory_gb = 2.0)
+        assert list(batch_runner.runners.keys()) == ['2T6S', 'C88N']
+        assert batch_runner.budget.nb_procs == 4
+        assert batch_runner.budget.memory_gb == 2.0
+        for runner in batch_runner.runners.values():
+            assert runner.budget is batch_runner.budget
+
+    @staticmethod
+    @mark.unit_test
+    def test_start():
+        """ Test running several pipelines concurrently """
+        batch_runner = PipelineBatchRunner(['2T6S', 'C88N', 'J7F9'], nb_procs = 2, memory_gb = 1.0)
+        for team_id, runner in batch_runner.runners.items():
+            runner._pipeline = MockupBatchPipeline(team_id) # hack the runner
+
+        report = batch_runner.start()
+
+        # Check the report
+        assert sorted(report.keys()) == ['2T6S', 'C88N', 'J7F9']
+        for team_id in report:
+            assert report[team_id]['status'] == 'success'
+            assert report[team_id]['error'] == ''
+            assert report[team_id]['missing_outputs'] == []
+
+        # Check each pipeline ran its workflows in order
+        for team_id in ['2T6S', 'C88N', 'J7F9']:
+            with open(
+                join(Configuration()['directories']['test_runs'], f'test_runner_{team_id}.txt'),
+                'r', encoding = 'utf-8') as file:
+                for workflow in [
+                    'TestPipelineRunner_preprocessing_workflow',
+                    'TestPipelineRunner_run_level_workflow',
+                    'TestPipelineRunner_subject_level_workflow',
+                    'TestPipelineRunner_group_level_workflow']:
+                    assert file.readline() == \
+                        f'MockupPipeline : {workflow}_{team_id} node_1\n'
+                    assert file.readline() == \
+                        f'MockupPipeline : {workflow}_{team_id} node_2\n'
+
+        # All resources were released
+        assert batch_runner.budget.get_free_resources() == (1.0, 2)
+
+    @staticmethod
+    @mark.unit_test
+    def test_start_failure():
+        """ Test the report of PipelineBatchRunner when a pipeline fails """
+        batch_runner = PipelineBatchRunner(['2T6S', 'C88N'], nb_procs = 2, memory_gb = 1.0)
+        batch_runner.runners['2T6S']._pipeline = MockupBatchPipeline('2T6S')
+        batch_runner.runners['C88N']._pipeline = MockupWrongPipeline()
+
+        report = batch_runner.start(PipelineRunnerLevel.PREPROCESSING)
+        assert report['2T6S']['status'] == 'success'
+        assert report['C88N']['status'] == 'failure'
+        assert report['C88N']['error'] != ''
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.utils.cache' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_cache.py
+    pytest -q test_cache.py -k <selected_test>
+"""
+
+from os import makedirs, remove, stat
+from os.path import join, isfile, dirname
+from stat import S_IWUSR, S_IWGRP, S_IWOTH
+from hashlib import sha256
+
+from numpy import full, eye
+from nibabel import Nifti1Image, save
+from pytest import mark
+
+from narps_open.pipelines import Pipeline
+from narps_open.runner import PipelineRunner, PipelineRunnerLevel
+from narps_open.utils.cache import hash_file, get_software_versions, FirstLevelOutputsCache
+
+class MockupPipeline(Pipeline):
+    """ A simple Pipeline class for test purposes """
+
+    def __init__(self, base_dir: str):
+        super().__init__()
+        self.team_id = '2T6S'
+        self.fwhm = 8.0
+        self.contrast_list = ['0001', '0002']
+        self.directories.dataset_dir = join(base_dir, 'dataset')
+        self.directories.results_dir = join(base_dir, 'results')
+        self.directories.set_output_dir_with_team_id(self.team_id)
+        self.directories.set_working_dir_with_team_id(self.team_id)
+
+    def get_preprocessing(self):
+        """ Return a fake preprocessing workflow """
+        return None
+
+    def get_run_level_analysis(self):
+        """ Return a fake run level workflow """
+        return None
+
+    def get_subject_level_analysis(self):
+        """ Return a fake subject level workflow """
+        return None
+
+    def get_group_level_analysis(self):
+        """ Return a fake group level workflow """
+        return None
+
+    def get_subject_level_outputs(self):
+        """ Return the names of the files the subject level analysis is supposed to generate. """
+        templates = [join(
+            self.directories.output_dir,
+            'l1_analysis', '_subject_id_{subject_id}', f'con_{contrast_id}.nii')\
+            for contrast_id in self.contrast_list]
+        templates += [join(
+            self.directories.output_dir,
+            'l1_analysis', '_subject_id_{subject_id}', 'SPM.mat')]
+
+        return_list = []
+        for template in templates:
+            return_list += [template.format(subject_id = s) for s in self.subject_list]
+
+        return return_list
+
+    def get_hypotheses_outputs(self):
+        """ Return the names of the files used by the team to answer the hypotheses of NARPS. """
+        return []
+
+def write_file(path: str, contents: str) -> None:
+    """ Write contents into a file, creating parent directories if needed """
+    makedirs(dirname(path), exist_ok = True)
+    with open(path, 'w', encoding = 'utf-8') as file:
+        file.write(contents)
+
+def create_dataset(pipeline: Pipeline) -> None:
+    """ Create fake input files for subjects 001 and 002 """
+    for subject_id in ['001', '002']:
+        write_file(join(pipeline.directories.dataset_dir, f'sub-{subject_id}', 'func',
+            f'sub-{subject_id}_task-MGT_run-01_events.tsv'), f'events {subject_id}')
+        write_file(join(pipeline.directories.dataset_dir, 'derivatives', 'fmriprep',
+            f'sub-{subject_id}', 'func', f'sub-{subject_id}_task-MGT_run-01_bold_confounds.tsv'),
+            f'confounds {subject_id}')
+
+def create_outputs(pipeline: Pipeline, subject_id: str) -> list:
+    """ Create fake first level outputs for a subject """
+    outputs = FirstLevelOutputsCache.get_outputs(pipeline, subject_id)
+    for index, output in enumerate(outputs):
+        if output.endswith('.nii'):
+            makedirs(dirname(output), exist_ok = True)
+            save(Nifti1Image(full((2, 2, 2), index, dtype = 'float32'), eye(4)), output)
+        else:
+            write_file(output, f'{output} contents')
+
+    return outputs
+
+class TestCache:
+    """ A class that contains all the unit tests for the cache module."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_hash_file(temporary_data_dir):
+        """ Test the hash_file function """
+        test_file = join(temporary_data_dir, 'file.txt')
+        write_file(test_file, 'test contents')
+
+        value = sha256(b'test contents').hexdigest()
+        assert hash_file(test_file) == value
+        assert hash_file(test_file, chunk_size = 3) == value
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_software_versions():
+        """ Test the get_software_versions function """
+        versions = get_software_versions()
+        assert 'nipype' in versions
+        assert 'SPM' not in versions
+        assert 'FSL' in get_software_versions('FSL')
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_key(temporary_data_dir):
+        """ Test the get_key method """
+        cache = FirstLevelOutputsCache(join(temporary_data_dir, 'cache'))
+        pipeline = MockupPipeline(temporary_data_dir)
+        create_dataset(pipeline)
+
+        key_1 = cache.get_key(pipeline, '001')
+        assert key_1 == cache.get_key(pipeline, '001')
+        assert key_1 != cache.get_key(pipeline, '002')
+
+        # Subject list and directories are not part of the key
+        pipeline.subject_list = ['001', '002']
+        pipeline.directories.results_dir = join(temporary_data_dir, 'other_results')
+        assert key_1 == cache.get_key(pipeline, '001')
+
+        # Parameters are part of the key
+        pipeline.fwhm = 6.0
+        key_2 = cache.get_key(pipeline, '001')
+        assert key_1 != key_2
+        pipeline.contrast_list = ['0001']
+        assert key_2 != cache.get_key(pipeline, '001')
+        pipeline.fwhm = 8.0
+        pipeline.contrast_list = ['0001', '0002']
+        assert key_1 == cache.get_key(pipeline, '001')
+
+        # Input files are part of the key
+        write_file(join(pipeline.directories.dataset_dir, 'sub-001', 'func',
+            'sub-001_task-MGT_run-01_events.tsv'), 'modified events')
+        assert key_1 != cache.get_key(pipeline, '001')
+
+    @staticmethod
+    @mark.unit_test
+    def test_store_restore(temporary_data_dir):
+        """ Test the store and restore methods """
+        cache = FirstLevelOutputsCache(join(temporary_data_dir, 'cache'))
+        pipeline = MockupPipeline(temporary_data_dir)
+        create_dataset(pipeline)
+
+        # Nothing to store or restore
+        assert not cache.restore(pipeline, '001')
+        assert not cache.store(pipeline, '001')
+
+        # Store outputs
+        outputs = create_outputs(pipeline, '001')
+        assert len(outputs) == 3
+        assert cache.store(pipeline, '001')
+        assert isfile(cache.get_object_path(hash_file(outputs[0])))
+
+        # Restore outputs in another results directory
+        pipeline.directories.results_dir = join(temporary_data_dir, 'other_results')
+        pipeline.directories.set_output_dir_with_team_id(pipeline.team_id)
+        restored_outputs = FirstLevelOutputsCache.get_outputs(pipeline, '001')
+        assert not any(isfile(f) for f in restored_outputs)
+        assert cache.restore(pipeline, '001')
+        for output, restored_output in zip(outputs, restored_outputs):
+            assert isfile(restored_output)
+            assert hash_file(output) == hash_file(restored_output)
+
+        # Cached objects are read-only, and unchanged by modifications of the outputs
+        object_hash = hash_file(outputs[0])
+        object_path = cache.get_object_path(object_hash)
+        assert not stat(object_path).st_mode & (S_IWUSR | S_IWGRP | S_IWOTH)
+        with open(restored_outputs[0], 'a', encoding = 'utf-8') as file:
+            file.write('modified output')
+        with open(outputs[0], 'a', encoding = 'utf-8') as file:
+            file.write('modified output')
+        assert hash_file(object_path) == object_hash
+
+        # Outputs are not restored once parameters changed
+        for output in restored_outputs:
+            remove(output)
+        pipeline.fwhm = 5.0
+        assert not cache.restore(pipeline, '001')
+        assert not any(isfile(f) for f in restored_outputs)
+
+    @staticmethod
+    @mark.unit_test
+    def test_file_hashes(mocker, temporary_data_dir):
+        """ Test that file hashes are persisted, and reused by other cache objects """
+        cache = FirstLevelOutputsCache(join(temporary_data_dir, 'cache'))
+        pipeline = MockupPipeline(temporary_data_dir)
+        create_dataset(pipeline)
+        create_outputs(pipeline, '001')
+        key = cache.get_key(pipeline, '001')
+        assert cache.store(pipeline, '001')
+        assert isfile(join(temporary_data_dir, 'cache', 'file_hashes.json'))
+
+        # Unchanged files are not hashed again, and existing entries are not stored again
+        mocked_hash_file = mocker.patch('narps_open.utils.cache.hash_file')
+        other_cache = FirstLevelOutputsCache(join(temporary_data_dir, 'cache'))
+        assert other_cache.get_key(pipeline, '001') == key
+        assert other_cache.store(pipeline, '001')
+        mocked_hash_file.assert_not_called()
+
+        # Modified files are hashed again
+        mocked_hash_file.return_value = 'new_hash'
+        write_file(join(pipeline.directories.dataset_dir, 'sub-001', 'func',
+            'sub-001_task-MGT_run-01_events.tsv'), 'modified events')
+        assert other_cache.get_key(pipeline, '001') != key
+        mocked_hash_file.assert_called_once()
+
+    @staticmethod
+    @mark.unit_test
+    def test_runner_cache(temporary_data_dir):
+        """ Test the use of FirstLevelOutputsCache by a PipelineRunner """
+        pipeline = MockupPipeline(temporary_data_dir)
+        create_dataset(pipeline)
+        create_outputs(pipeline, '001')
+
+        runner = PipelineRunner('2T6S')
+        runner._pipeline = pipeline # hack the runner by setting a test Pipeline
+        runner.subjects = ['001', '002']
+        runner.cache = FirstLevelOutputsCache(join(temporary_data_dir, 'cache'))
+        assert runner.store_in_cache() == ['001']
+
+        # Change output directory: outputs are restored from the cache
+        pipeline.directories.results_dir = join(temporary_data_dir, 'other_results')
+        pipeline.directories.set_output_dir_with_team_id(pipeline.team_id)
+        runner.start(PipelineRunnerLevel.FIRST)
+        assert runner.get_first_levels_to_run() == {'002': PipelineRunnerLevel.SUBJECT}
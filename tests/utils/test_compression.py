@@ -0,0 +1,193 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.utils.compression' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_compression.py
+    pytest -q test_compression.py -k <selected_test>
+"""
+
+from os import remove, stat, utime, makedirs
+from os.path import join, isfile, samefile
+from gzip import open as gzip_open, compress
+from zlib import error as zlib_error
+
+from numpy.random import default_rng
+from pytest import mark, fixture, raises
+
+from narps_open.utils import compression
+from narps_open.utils.compression import (
+    DecompressedFileCache, get_decompressed_file_cache, compress_file, decompress_file, benchmark
+    )
+from narps_open.utils.configuration import Configuration
+
+@fixture
+def gzipped_files(temporary_data_dir):
+    """ A fixture to create gzipped files, of 1000 bytes each when decompressed """
+    files = []
+    for index in range(3):
+        file = join(temporary_data_dir, f'file_{index}.nii.gz')
+        with gzip_open(file, 'wb') as gzipped_file:
+            gzipped_file.write(bytes([index]) * 1000)
+        files.append(file)
+
+    return files
+
+@fixture
+def data_file(temporary_data_dir):
+    """ A fixture to create a file of 3MB, containing random and constant data """
+    file = join(temporary_data_dir, 'data.nii')
+    with open(file, 'wb') as data:
+        data.write((default_rng(0).normal(size = 1000000) * 100).astype('int16').tobytes())
+        data.write(bytes(1000000))
+
+    return file
+
+class TestCompression:
+    """ A class that contains all the unit tests for the compression functions."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_compress_file(temporary_data_dir, data_file):
+        """ Test the compress_file function """
+        with open(data_file, 'rb') as file:
+            data = file.read()
+
+        # Output files are standard gzip files, which do not depend on the number of threads
+        out_files = []
+        for nb_threads in [1, 4]:
+            out_file = join(temporary_data_dir, f'data_{nb_threads}.nii.gz')
+            assert compress_file(data_file, out_file, nb_threads, block_size = 100000) \
+                == out_file
+            with gzip_open(out_file, 'rb') as file:
+                assert file.read() == data
+            with open(out_file, 'rb') as file:
+                out_files.append(file.read())
+        assert out_files[0] == out_files[1]
+        assert len(out_files[0]) < len(compress(data, compresslevel = 1))
+
+        # Empty file
+        empty_file = join(temporary_data_dir, 'empty')
+        open(empty_file, 'wb').close()
+        compress_file(empty_file, empty_file + '.gz')
+        with gzip_open(empty_file + '.gz', 'rb') as file:
+            assert file.read() == b''
+
+    @staticmethod
+    @mark.unit_test
+    def test_decompress_file(temporary_data_dir, data_file):
+        """ Test the decompress_file function """
+        with open(data_file, 'rb') as file:
+            data = file.read()
+        in_file = join(temporary_data_dir, 'data.nii.gz')
+        out_file = join(temporary_data_dir, 'data_out.nii')
+
+        # Several members, followed by padding
+        with open(in_file, 'wb') as file:
+            file.write(compress(data[:1000]) + compress(data[1000:]) + bytes(10))
+        assert decompress_file(in_file, out_file, chunk_size = 4096) == out_file
+        with open(out_file, 'rb') as file:
+            assert file.read() == data
+
+        # Truncated and corrupted files
+        with open(in_file, 'wb') as file:
+            file.write(compress(data)[:-100])
+        with raises(EOFError):
+            decompress_file(in_file, out_file, chunk_size = 4096)
+
+        with open(in_file, 'wb') as file:
+            file.write(compress(data)[:-8] + bytes(8))
+        with raises(zlib_error):
+            decompress_file(in_file, out_file, chunk_size = 4096)
+
+        # Errors while reading
+        with raises(OSError):
+            decompress_file(temporary_data_dir, out_file)
+
+    @staticmethod
+    @mark.unit_test
+    def test_benchmark(data_file):
+        """ Test the benchmark function """
+        results = benchmark(data_file, nb_threads = 2, nb_repetitions = 1)
+        assert list(results.keys()) == [
+            'gzip_compress', 'parallel_compress', 'gzip_decompress', 'parallel_decompress']
+        assert results['gzip_decompress']['size'] == 3000000
+        assert results['parallel_decompress']['size'] == 3000000
+        assert all(r['time'] > 0.0 for r in results.values())
+
+class TestDecompressedFileCache:
+    """ A class that contains all the unit tests for the DecompressedFileCache class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_link(mocker, temporary_data_dir, gzipped_files):
+        """ Test the link method """
+        cache = DecompressedFileCache(join(temporary_data_dir, 'cache'))
+        team_dirs = [join(temporary_data_dir, 'team_1'), join(temporary_data_dir, 'team_2')]
+        for team_dir in team_dirs:
+            makedirs(team_dir)
+
+        # Decompress the file once for both teams
+        spy = mocker.spy(compression, 'decompress_file')
+        links = [cache.link(gzipped_files[0], join(d, 'file_0.nii')) for d in team_dirs]
+        assert spy.call_count == 1
+        assert samefile(links[0], links[1])
+        with open(links[1], 'rb') as file:
+            assert file.read() == bytes([0]) * 1000
+
+        # Links are read-only, and counted as references
+        entry = cache.get_decompressed_file(gzipped_files[0])
+        assert stat(links[0]).st_mode & 0o222 == 0
+        assert cache.get_reference_count(entry) == 2
+        remove(links[0])
+        assert cache.get_reference_count(entry) == 1
+
+        # Linking again replaces the destination
+        assert cache.link(gzipped_files[0], links[1]) == links[1]
+        assert cache.get_reference_count(entry) == 1
+        assert spy.call_count == 1
+
+        # A modified source file is decompressed again
+        utime(gzipped_files[0], ns = (0, 0))
+        assert cache.get_decompressed_file(gzipped_files[0]) != entry
+        assert spy.call_count == 2
+
+    @staticmethod
+    @mark.unit_test
+    def test_evict(temporary_data_dir, gzipped_files):
+        """ Test that only unreferenced entries are evicted """
+        cache = DecompressedFileCache(join(temporary_data_dir, 'cache'), max_size = 2500)
+
+        # Use the first file, then release it ; keep a reference to the second one
+        link_0 = cache.link(gzipped_files[0], join(temporary_data_dir, 'file_0.nii'))
+        entry_0 = cache.get_decompressed_file(gzipped_files[0])
+        utime(entry_0, (1, 1)) # The least recently used entry
+        remove(link_0)
+        cache.link(gzipped_files[1], join(temporary_data_dir, 'file_1.nii'))
+        entry_1 = cache.get_decompressed_file(gzipped_files[1])
+        utime(entry_1, (0, 0)) # Older, but referenced
+
+        # Adding a third entry evicts the first one
+        entry_2 = cache.get_decompressed_file(gzipped_files[2])
+        assert not isfile(entry_0)
+        assert isfile(entry_1)
+        assert isfile(entry_2)
+        assert cache.get_size() == 2000
+
+        # Entries are not evicted while referenced, even if the cache is too large
+        cache.max_size = 500
+        assert cache.evict() == [entry_2]
+        assert cache.get_entries() == [entry_1]
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_decompressed_file_cache():
+        """ Test the get_decompressed_file_cache function """
+        cache = get_decompressed_file_cache()
+        assert cache.directory == join(Configuration()['directories']['cache'], 'decompressed')
+        assert cache.max_size == Configuration()['pipelines']['decompressed_cache_size_gb'] \
+            * 1024 ** 3
@@ -12,17 +12,24 @@ Usage:
 """
 
 from os import remove
-from os.path import exists
+from os.path import exists, join
 from math import isclose
 
+
 from pytest import raises, fixture, mark
-from nibabel import Nifti1Image, save
-from numpy import nan, isnan, eye, zeros, full
+from nibabel import Nifti1Image, save, load
+from nibabel.processing import resample_from_to
+from numpy import nan, isnan, eye, zeros, full, corrcoef, arange, reshape
+from numpy.random import default_rng
+from scipy.stats import spearmanr
 
+from narps_open.utils.configuration import Configuration
 from narps_open.utils.correlation import (
     mask_using_nan,
     mask_using_zeros,
-    get_correlation_coefficient
+    get_correlation_coefficient,
+    get_streaming_correlation_coefficient,
+    PearsonAccumulator
     )
 
 @fixture
@@ -147,3 +154,83 @@ class TestUtilsCorrelation:
         # 2 - Use unknown method
         with raises(AttributeError):
             get_correlation_coefficient('tmp_image_1.nii', 'tmp_image_1.nii', 'wrong_method')
+
+    @staticmethod
+    @mark.unit_test
+    def test_pearson_accumulator():
+        """ Test the PearsonAccumulator class """
+        generator = default_rng(0)
+        data_x = generator.normal(size = 1000)
+        data_y = data_x + generator.normal(size = 1000)
+
+        accumulator = PearsonAccumulator()
+        assert isnan(accumulator.correlation)
+        for start in range(0, 1000, 64):
+            accumulator.update(data_x[start:start+64], data_y[start:start+64])
+        accumulator.update(data_x[:0], data_y[:0]) # empty chunks are ignored
+
+        assert accumulator.nb_values == 1000
+        assert isclose(accumulator.correlation, corrcoef(data_x, data_y)[0][1])
+
+    @staticmethod
+    @mark.unit_test
+    def test_streaming_correlation(temporary_data_dir):
+        """ Test the get_streaming_correlation_coefficient function """
+
+        def reference(file_1, file_2, method):
+            """ Compute the correlation coefficient, loading the whole images """
+            image_1 = mask_using_zeros(load(file_1))
+            image_2 = resample_from_to(mask_using_zeros(load(file_2)), image_1, order = 0)
+            data_1 = reshape(image_1.get_fdata(), -1)
+            data_2 = reshape(image_2.get_fdata(), -1)
+            if method == 'pearson':
+                return corrcoef(data_1, data_2)[0][1]
+            return spearmanr(data_1, data_2).correlation
+
+        # 1 - Images with the same grid
+        file_1 = join(Configuration()['directories']['test_data'],
+            'data', 'results', 'team_2T6S', 'hypo1_unthresh.nii.gz')
+        file_2 = join(Configuration()['directories']['test_data'],
+            'utils', 'hash', 'hypo2_unthresh.nii.gz')
+        for slab_size in [1, 4, 100]:
+            assert isclose(
+                get_streaming_correlation_coefficient(file_1, file_2, slab_size = slab_size),
+                reference(file_1, file_2, 'pearson'))
+            assert isclose(
+                get_streaming_correlation_coefficient(
+                    file_1, file_2, 'spearman', slab_size = slab_size),
+                reference(file_1, file_2, 'spearman'), abs_tol = 1e-4)
+
+        # 2 - Images with different grids, and NaNs
+        generator = default_rng(0)
+        affine_2 = eye(4)
+        affine_2[:3, :3] = [[2.4, -0.6, 0.0], [0.6, 2.4, 0.0], [0.0, 0.0, 3.0]]
+        affine_2[:3, 3] = [-18.0, -35.0, -12.0]
+        data_2 = generator.normal(size = (18, 22, 15))
+        data_2[0, 0, :] = nan
+        file_2 = join(temporary_data_dir, 'image_2.nii')
+        save(Nifti1Image(data_2, affine_2), file_2)
+
+        for slab_size in [1, 4, 100]:
+            assert isclose(
+                get_streaming_correlation_coefficient(file_1, file_2, slab_size = slab_size),
+                reference(file_1, file_2, 'pearson'))
+            assert isclose(
+                get_streaming_correlation_coefficient(
+                    file_2, file_1, slab_size = slab_size),
+                reference(file_2, file_1, 'pearson'))
+
+        # 3 - Ranks are exact when there are few distinct values
+        data_3 = reshape(arange(60) % 7, (3, 4, 5)).astype(float)
+        file_3 = join(temporary_data_dir, 'image_3.nii')
+        save(Nifti1Image(data_3, eye(4)), file_3)
+        data_4 = reshape(arange(60) % 5, (3, 4, 5)).astype(float)
+        file_4 = join(temporary_data_dir, 'image_4.nii')
+        save(Nifti1Image(data_4, eye(4)), file_4)
+        assert isclose(
+            get_streaming_correlation_coefficient(file_3, file_4, 'spearman', slab_size = 2),
+            reference(file_3, file_4, 'spearman'))
+
+        # 4 - Wrong method
+        with raises(AttributeError):
+            get_streaming_correlation_coefficient(file_3, file_4, 'wrong_method')
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.utils.correlation.cache' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_correlation_cache.py
+    pytest -q test_correlation_cache.py -k <selected_test>
+"""
+
+from os import utime
+from os.path import join, isfile, getsize
+from math import isclose
+
+from pytest import mark
+from nibabel import Nifti1Image, save, load
+from nibabel.processing import resample_from_to
+from numpy import eye
+from numpy.random import default_rng
+
+from narps_open.utils.configuration import Configuration
+from narps_open.utils.correlation import mask_using_zeros, get_correlation_coefficient
+from narps_open.utils.correlation.cache import ResampledImageCache
+
+def create_image(path: str, seed: int, shape: tuple = (18, 22, 15)) -> str:
+    """ Create a random image with a rotated grid """
+    affine = eye(4)
+    affine[:3, :3] = [[2.4, -0.6, 0.0], [0.6, 2.4, 0.0], [0.0, 0.0, 3.0]]
+    affine[:3, 3] = [-18.0, -35.0, -12.0]
+    save(Nifti1Image(default_rng(seed).normal(size = shape), affine), path)
+    return path
+
+TEST_FILE = join(Configuration()['directories']['test_data'],
+    'data', 'results', 'team_2T6S', 'hypo1_unthresh.nii.gz')
+
+class TestUtilsCorrelationCache:
+    """ A class that contains all the unit tests for the ResampledImageCache class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_resampled_file(mocker, temporary_data_dir):
+        """ Test the get_resampled_file method """
+        cache = ResampledImageCache(join(temporary_data_dir, 'cache'))
+        source_file = create_image(join(temporary_data_dir, 'source.nii'), 0)
+
+        # Same grid: no resampling
+        assert cache.get_resampled_file(source_file, source_file) == source_file
+        assert cache.get_entries() == []
+
+        # First call resamples the image
+        resampled_file = cache.get_resampled_file(source_file, TEST_FILE)
+        assert isfile(resampled_file)
+        assert cache.get_entries() == [resampled_file]
+        expected = resample_from_to(mask_using_zeros(load(source_file)), load(TEST_FILE), order = 0)
+        assert (load(resampled_file).get_fdata() == expected.get_fdata()).all()
+        assert (load(resampled_file).affine == load(TEST_FILE).affine).all()
+
+        # Next calls do not resample
+        spy = mocker.spy(ResampledImageCache, 'get_key')
+        mocker.patch('narps_open.utils.correlation.cache.resample_from_to',
+            side_effect = Exception('Unexpected resampling'))
+        assert cache.get_resampled_file(source_file, TEST_FILE) == resampled_file
+        assert ResampledImageCache(cache.directory).get_resampled_file(
+            source_file, TEST_FILE) == resampled_file
+        assert spy.call_count == 2
+
+        # Key depends on the source contents and the target grid
+        image = load(TEST_FILE)
+        key = cache.get_key(source_file, image.shape, image.affine)
+        assert key != cache.get_key(source_file, (10, 10, 10), image.affine)
+        assert key != cache.get_key(source_file, image.shape, eye(4))
+        create_image(source_file, 1)
+        assert key != cache.get_key(source_file, image.shape, image.affine)
+
+    @staticmethod
+    @mark.unit_test
+    def test_evict(temporary_data_dir):
+        """ Test the least recently used eviction of entries """
+        source_files = [
+            create_image(join(temporary_data_dir, f'source_{i}.nii'), i) for i in range(3)]
+
+        cache = ResampledImageCache(join(temporary_data_dir, 'cache'))
+        entries = [cache.get_resampled_file(f, TEST_FILE) for f in source_files]
+        entry_size = getsize(entries[0])
+        assert cache.get_size() == 3 * entry_size
+        assert cache.evict() == [] # No maximum size
+
+        # Set access times explicitly, to avoid relying on the file system time resolution
+        for index, entry in enumerate(entries):
+            utime(entry, (index, index))
+        utime(entries[0], (10, 10)) # entries[0] was used recently
+
+        cache.max_size = 2 * entry_size
+        assert cache.evict() == [entries[1]]
+        assert cache.get_entries() == [entries[2], entries[0]]
+
+        # Adding an entry evicts older ones, never the new one
+        cache.max_size = entry_size // 2
+        source_file = create_image(join(temporary_data_dir, 'source_3.nii'), 3)
+        entry = cache.get_resampled_file(source_file, TEST_FILE)
+        assert cache.get_entries() == [entry]
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_correlation_coefficient(temporary_data_dir):
+        """ Test the use of a ResampledImageCache by get_correlation_coefficient """
+        cache = ResampledImageCache(join(temporary_data_dir, 'cache'))
+        source_file = create_image(join(temporary_data_dir, 'source.nii'), 0)
+
+        for method in ['pearson', 'spearman']:
+            value = get_correlation_coefficient(TEST_FILE, source_file, method)
+            assert isclose(
+                get_correlation_coefficient(TEST_FILE, source_file, method, cache), value)
+            assert isclose(
+                get_correlation_coefficient(TEST_FILE, source_file, method, cache), value)
+        assert len(cache.get_entries()) == 1
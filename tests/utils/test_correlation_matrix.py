@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.utils.correlation.matrix' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_correlation_matrix.py
+    pytest -q test_correlation_matrix.py -k <selected_test>
+"""
+
+from os.path import join, isfile, basename, dirname
+from math import isclose
+
+from pytest import raises, mark
+from nibabel import Nifti1Image, save, load
+from nibabel.processing import resample_from_to
+from numpy import eye, full, isnan, corrcoef, array
+from numpy import load as load_array
+from numpy.random import default_rng
+from pandas import read_csv
+from scipy.stats import spearmanr
+
+from narps_open.utils.configuration import Configuration
+from narps_open.utils.correlation import mask_using_zeros, get_correlation_coefficient
+from narps_open.utils.correlation.matrix import (
+    get_team_results_file,
+    get_correlation_matrix,
+    write_correlation_matrix
+    )
+
+def get_test_files(temporary_data_dir):
+    """ Return a list of test images, one of them with a different grid """
+    files = [join(Configuration()['directories']['test_data'],
+        'data', 'results', 'team_2T6S', f'hypo{h}_unthresh.nii.gz') for h in [1, 2, 5]]
+
+    affine = eye(4)
+    affine[:3, :3] = [[2.4, -0.6, 0.0], [0.6, 2.4, 0.0], [0.0, 0.0, 3.0]]
+    affine[:3, 3] = [-18.0, -35.0, -12.0]
+    files.append(join(temporary_data_dir, 'image.nii'))
+    save(Nifti1Image(default_rng(0).normal(size = (18, 22, 15)), affine), files[-1])
+
+    return files
+
+class TestUtilsCorrelationMatrix:
+    """ A class that contains all the unit tests for the correlation matrix module."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_team_results_file():
+        """ Test the get_team_results_file function """
+        file = get_team_results_file('2T6S', 3)
+        assert basename(file) == 'hypo3_unthresh.nii.gz'
+        assert basename(dirname(file)) == '4881_2T6S'
+        assert file.startswith(Configuration()['directories']['narps_results'])
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_correlation_matrix(temporary_data_dir):
+        """ Test the get_correlation_matrix function """
+        files = get_test_files(temporary_data_dir)
+
+        # Reference: images resampled on the first one, then pairwise coefficients
+        reference = load(files[0])
+        data = array([
+            resample_from_to(mask_using_zeros(load(f)), reference, order = 0)\
+                .get_fdata().ravel() for f in files])
+
+        for method in ['pearson', 'spearman']:
+            matrix = get_correlation_matrix(files, method = method)
+            assert matrix.shape == (4, 4)
+            assert (matrix == matrix.T).all()
+            for index_1, data_1 in enumerate(data):
+                for index_2, data_2 in enumerate(data):
+                    if method == 'pearson':
+                        value = corrcoef(data_1, data_2)[0][1]
+                    else:
+                        value = spearmanr(data_1, data_2).correlation
+                    assert isclose(matrix[index_1][index_2], value, abs_tol = 1e-12)
+
+        # Coefficients with the first image are those of get_correlation_coefficient
+        matrix = get_correlation_matrix(files)
+        for index, file in enumerate(files):
+            assert isclose(
+                matrix[0][index], get_correlation_coefficient(files[0], file), abs_tol = 1e-12)
+
+        # Memory-mapped data
+        memmap_file = join(temporary_data_dir, 'data.npy')
+        assert (get_correlation_matrix(files, memmap_file = memmap_file) == matrix).all()
+        assert isfile(memmap_file)
+
+        # Other reference grid, constant image
+        constant_file = join(temporary_data_dir, 'constant.nii')
+        save(Nifti1Image(full((18, 22, 15), 2.0), load(files[3]).affine), constant_file)
+        matrix = get_correlation_matrix(files + [constant_file], reference_file = files[3])
+        assert matrix[3][3] == 1.0
+        assert isnan(matrix[4]).all()
+        assert isnan(matrix[:, 4]).all()
+
+        # Wrong method
+        with raises(AttributeError):
+            get_correlation_matrix(files, method = 'wrong_method')
+
+    @staticmethod
+    @mark.unit_test
+    def test_write_correlation_matrix(temporary_data_dir):
+        """ Test the write_correlation_matrix function """
+        matrix = array([[1.0, 0.5], [0.5, 1.0]])
+        labels = ['2T6S', 'C88N']
+
+        tsv_file = join(temporary_data_dir, 'matrix.tsv')
+        write_correlation_matrix(matrix, labels, tsv_file)
+        data_frame = read_csv(tsv_file, sep = '\t', index_col = 0)
+        assert list(data_frame.index) == labels
+        assert list(data_frame.columns) == labels
+        assert (data_frame.values == matrix).all()
+
+        npy_file = join(temporary_data_dir, 'matrix.npy')
+        write_correlation_matrix(matrix, labels, npy_file)
+        assert (load_array(npy_file) == matrix).all()
+
+        with raises(AttributeError):
+            write_correlation_matrix(matrix, labels, join(temporary_data_dir, 'matrix.txt'))
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.utils.download' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_download.py
+    pytest -q test_download.py -k <selected_test>
+"""
+
+from os.path import join, isfile
+from hashlib import sha256
+
+from pytest import mark, raises
+
+from narps_open.utils.download import Downloader, DownloadError
+
+CONTENTS = bytes(range(256)) * 400
+
+class TestUtilsDownload:
+    """ A class that contains all the unit tests for the Downloader class."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_download(local_http_server, temporary_data_dir):
+        """ Test the download method """
+        local_http_server.files['/file.bin'] = CONTENTS
+        url = local_http_server.base_url + '/file.bin'
+        destination = join(temporary_data_dir, 'sub_dir', 'file.bin')
+        checksum = sha256(CONTENTS).hexdigest()
+        downloader = Downloader(chunk_size = 1000)
+
+        assert downloader.download(url, destination)
+        with open(destination, 'rb') as file:
+            assert file.read() == CONTENTS
+        assert not isfile(destination + '.part')
+
+        # Files with the expected size and checksum are skipped
+        nb_requests = len(local_http_server.requests)
+        assert not downloader.download(url, destination, len(CONTENTS), checksum)
+        assert len(local_http_server.requests) == nb_requests
+
+        # Files with another size or checksum are downloaded again
+        with open(destination, 'wb') as file:
+            file.write(b'modified')
+        assert downloader.download(url, destination, len(CONTENTS), checksum)
+        with open(destination, 'rb') as file:
+            assert file.read() == CONTENTS
+        with raises(DownloadError): # Downloaded file does not match the checksum
+            downloader.download(url, destination, checksum = sha256(b'').hexdigest())
+        assert not isfile(destination + '.part')
+
+        # Errors
+        with raises(DownloadError):
+            downloader.download(local_http_server.base_url + '/missing.bin', destination)
+        with raises(DownloadError):
+            downloader.download(url, join(temporary_data_dir, 'file_2.bin'), size = 10)
+        assert not isfile(join(temporary_data_dir, 'file_2.bin'))
+
+    @staticmethod
+    @mark.unit_test
+    def test_resume(local_http_server, temporary_data_dir):
+        """ Test the resuming of interrupted downloads """
+        local_http_server.files['/file.bin'] = CONTENTS
+        url = local_http_server.base_url + '/file.bin'
+        destination = join(temporary_data_dir, 'file.bin')
+
+        # The first transfer is interrupted, then resumed with a Range request
+        local_http_server.truncate['/file.bin'] = 30000
+        assert Downloader(chunk_size = 1000).download(
+            url, destination, checksum = sha256(CONTENTS).hexdigest())
+        with open(destination, 'rb') as file:
+            assert file.read() == CONTENTS
+        assert [r[1] for r in local_http_server.requests] == [None, 'bytes=30000-']
+
+        # A partial download from a previous execution is resumed
+        with open(destination + '.part', 'wb') as file:
+            file.write(CONTENTS[:50000])
+        destination_2 = join(temporary_data_dir, 'file_2.bin')
+        with open(destination_2 + '.part', 'wb') as file:
+            file.write(CONTENTS[:50000])
+        assert Downloader().download(url, destination_2)
+        assert local_http_server.requests[-1][1] == 'bytes=50000-'
+        with open(destination_2, 'rb') as file:
+            assert file.read() == CONTENTS
+
+        # A complete partial download is only renamed
+        with open(destination_2 + '.part', 'wb') as file:
+            file.write(CONTENTS)
+        assert Downloader().download(url, destination_2)
+        assert local_http_server.requests[-1][1] == f'bytes={len(CONTENTS)}-'
+
+        # Too many interruptions
+        local_http_server.truncate['/file.bin'] = 10
+        with raises(DownloadError):
+            Downloader(nb_retries = 0).download(url, join(temporary_data_dir, 'file_3.bin'))
+
+    @staticmethod
+    @mark.unit_test
+    def test_download_all(local_http_server, temporary_data_dir):
+        """ Test the download_all method """
+        downloads = []
+        for index in range(10):
+            local_http_server.files[f'/file_{index}.bin'] = CONTENTS[index:]
+            downloads.append({
+                'url': local_http_server.base_url + f'/file_{index}.bin',
+                'destination': join(temporary_data_dir, f'file_{index}.bin')
+                })
+        downloads.append({
+            'url': local_http_server.base_url + '/missing.bin',
+            'destination': join(temporary_data_dir, 'missing.bin')
+            })
+
+        results = Downloader(nb_workers = 3).download_all(downloads)
+        assert len(results) == 11
+        assert isinstance(results[join(temporary_data_dir, 'missing.bin')], DownloadError)
+        for index in range(10):
+            assert results[join(temporary_data_dir, f'file_{index}.bin')] is True
+            with open(join(temporary_data_dir, f'file_{index}.bin'), 'rb') as file:
+                assert file.read() == CONTENTS[index:]
+
+        # Connections are reused: 3 connections for 11 requests, plus one reconnection
+        # as the server closes the connection after an error
+        assert len(local_http_server.requests) == 11
+        assert len({r[2] for r in local_http_server.requests}) <= 4
+
+    @staticmethod
+    @mark.unit_test
+    def test_get_json(local_http_server):
+        """ Test the get_json method """
+        local_http_server.files['/api/'] = {'results': [1, 2]}
+        assert Downloader().get_json(local_http_server.base_url + '/api/') == {'results': [1, 2]}
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# coding: utf-8
+
+""" Tests of the 'narps_open.utils.hash' module.
+
+Launch this test with PyTest
+
+Usage:
+======
+    pytest -q test_hash.py
+    pytest -q test_hash.py -k <selected_test>
+"""
+
+from os import makedirs
+from os.path import join, isfile
+from hashlib import sha256
+from shutil import copyfile
+
+from pytest import mark
+from numpy import eye, full
+from nibabel import Nifti1Image, save
+
+from narps_open.utils.configuration import Configuration
+from narps_open.utils import hash_image, hash_dir_images
+from narps_open.utils.hash import ImageHashIndex, hash_images, get_tree_images, hash_tree
+
+def create_tree(directory: str) -> list:
+    """ Create a directory tree containing images and other files """
+    for sub_directory in ['', 'l1_analysis', join('intermediate_results', 'preprocessing')]:
+        makedirs(join(directory, sub_directory), exist_ok = True)
+    for index, file in enumerate([
+        'hypo1.nii.gz', join('l1_analysis', 'con_0001.nii'),
+        join('intermediate_results', 'preprocessing', 'bold.nii.gz')
+        ]):
+        save(Nifti1Image(full((3, 3, 3), index, dtype = 'float32'), eye(4)), join(directory, file))
+    with open(join(directory, 'l1_analysis', 'SPM.mat'), 'w', encoding = 'utf-8') as file:
+        file.write('not an image')
+
+class TestUtilsHash:
+    """ A class that contains all the unit tests for the hash module."""
+
+    @staticmethod
+    @mark.unit_test
+    def test_image_hash_index(temporary_data_dir):
+        """ Test the ImageHashIndex class """
+        index_file = join(temporary_data_dir, 'index', 'index.json')
+        image_file = join(temporary_data_dir, 'image.nii')
+        save(Nifti1Image(full((3, 3, 3), 1.0), eye(4)), image_file)
+
+        index = ImageHashIndex(index_file)
+        assert index.get(image_file) is None
+        index.set(image_file, 'hash_value')
+        assert index.get(image_file) == 'hash_value'
+        assert index.get(image_file, canonical = True) is None
+        index.save()
+        assert isfile(index_file)
+
+        # Index is persistent
+        assert ImageHashIndex(index_file).get(image_file) == 'hash_value'
+
+        # Modified files are not in the index anymore
+        save(Nifti1Image(full((4, 4, 4), 1.0), eye(4)), image_file)
+        assert ImageHashIndex(index_file).get(image_file) is None
+
+        # Index kept in memory only
+        index = ImageHashIndex()
+        index.set(image_file, 'hash_value')
+        index.save()
+        assert index.get(image_file) == 'hash_value'
+
+    @staticmethod
+    @mark.unit_test
+    def test_hash_images(mocker, temporary_data_dir):
+        """ Test the hash_images function """
+        test_directory = join(Configuration()['directories']['test_data'], 'utils', 'hash')
+        files = []
+        for index in range(4):
+            files.append(join(temporary_data_dir, f'image_{index}.nii.gz'))
+            copyfile(join(test_directory, f'hypo{index % 2 + 1}_unthresh.nii.gz'), files[-1])
+        expected_hashes = {f: hash_image(f) for f in files}
+
+        # Sequential and parallel computations
+        assert hash_images(files) == expected_hashes
+        assert hash_images(files, nb_workers = 2) == expected_hashes
+        assert hash_images(files, canonical = True) == {
+            f: hash_image(f, canonical = True) for f in files}
+
+        # Using an index, unchanged files are not hashed again
+        index = ImageHashIndex(join(temporary_data_dir, 'index.json'))
+        assert hash_images(files, 2, index) == expected_hashes
+        spy = mocker.spy(ImageHashIndex, 'save')
+        mocker.patch('narps_open.utils.hash.hash_image',
+            side_effect = Exception('Unexpected hash computation'))
+        index = ImageHashIndex(join(temporary_data_dir, 'index.json'))
+        assert hash_images(files, 2, index) == expected_hashes
+        assert spy.call_count == 0
+
+    @staticmethod
+    @mark.unit_test
+    def test_hash_tree(temporary_data_dir):
+        """ Test the get_tree_images and hash_tree functions """
+        directory = join(temporary_data_dir, 'NARPS-2T6S-reproduced')
+        create_tree(directory)
+
+        images = [
+            'hypo1.nii.gz',
+            join('intermediate_results', 'preprocessing', 'bold.nii.gz'),
+            join('l1_analysis', 'con_0001.nii')
+            ]
+        assert get_tree_images(directory) == images
+        assert get_tree_images(directory, ['intermediate_results/*']) == [images[0], images[2]]
+
+        hashes, aggregate_hash = hash_tree(directory, 2)
+        assert hashes == {i: hash_image(join(directory, i)) for i in images}
+        hasher = sha256()
+        for image in images:
+            hasher.update(f'{image}\t{hashes[image]}\n'.encode(encoding = 'utf-8'))
+        assert aggregate_hash == hasher.hexdigest()
+
+        # Aggregate hash does not depend on the location of the tree
+        other_directory = join(temporary_data_dir, 'other')
+        create_tree(other_directory)
+        assert hash_tree(other_directory)[1] == aggregate_hash
+
+    @staticmethod
+    @mark.unit_test
+    def test_hash_dir_images(temporary_data_dir):
+        """ Test the hash_dir_images function, with parallel computation and an index """
+        test_path = join(Configuration()['directories']['test_data'], 'utils', 'hash')
+        index_file = join(temporary_data_dir, 'index.json')
+
+        value = '4242d5eb8d4c0dc70adcec11154ab029c3b1dcdfb777c5dff4ffcff1f1ff6acb'
+        assert hash_dir_images(test_path, 2, index_file) == value
+        assert isfile(index_file)
+        assert hash_dir_images(test_path, 2, index_file) == value
@@ -13,6 +13,9 @@ Usage:
 from os.path import join
 
 from pytest import mark
+from numpy import eye, int16
+from numpy.random import default_rng
+from nibabel import Nifti1Image, Nifti1Header, save, load
 
 from narps_open.utils.configuration import Configuration
 from narps_open.utils import show_download_progress, hash_image, hash_dir_images
@@ -50,6 +53,51 @@ class TestUtils:
 
         value = '755cee10777bc3b3a9707eb20a46793d282fedc07a52d6c4a9866e465fd6ccb3'
         assert hash_image(test_image_path) == value
+        assert hash_image(test_image_path, chunk_size = 10) == value
+
+        value = '2d96dcd02d3706d4a5efc827f96b950694f2376c18676331d8344452f1dbdc36'
+        assert hash_image(test_image_path, canonical = True) == value
+
+    @staticmethod
+    @mark.unit_test
+    def test_hash_image_canonical(temporary_data_dir):
+        """ Test the canonical form of the hash_image function """
+        data = default_rng(0).normal(size = (10, 12, 7, 5)).astype('float32')
+
+        # Same data stored with different byte orders and compressions
+        little_endian_file = join(temporary_data_dir, 'little_endian.nii.gz')
+        save(Nifti1Image(data, eye(4)), little_endian_file)
+        big_endian_file = join(temporary_data_dir, 'big_endian.nii')
+        save(Nifti1Image(data, eye(4), Nifti1Header(endianness = '>')), big_endian_file)
+        assert load(big_endian_file).dataobj.dtype.byteorder == '>'
+
+        value = hash_image(little_endian_file, canonical = True)
+        assert hash_image(big_endian_file, canonical = True) == value
+        assert hash_image(big_endian_file, canonical = True, chunk_size = 10) == value
+        assert hash_image(little_endian_file) != value
+
+        # Header fields not describing data are not part of the hash
+        image = Nifti1Image(data, eye(4))
+        image.header['descrip'] = b'another description'
+        other_file = join(temporary_data_dir, 'other.nii')
+        save(image, other_file)
+        assert hash_image(other_file, canonical = True) == value
+
+        # Data, affine, and scaling are part of the hash
+        data[0, 0, 0, 0] += 1.0
+        save(Nifti1Image(data, eye(4)), other_file)
+        assert hash_image(other_file, canonical = True) != value
+        save(Nifti1Image(data, 2 * eye(4)), other_file)
+        assert hash_image(other_file, canonical = True) != value
+
+        scaled_file = join(temporary_data_dir, 'scaled.nii')
+        image = Nifti1Image(data.astype(int16), eye(4))
+        image.header.set_slope_inter(1.0, 0.0)
+        save(image, scaled_file)
+        value = hash_image(scaled_file, canonical = True)
+        image.header.set_slope_inter(0.5, 2.0)
+        save(image, scaled_file)
+        assert hash_image(scaled_file, canonical = True) != value
 
     @staticmethod
     @mark.unit_test